@@ -1,5 +1,5 @@
 # -*- coding: utf-8 -*-
-import os, json, datetime, asyncio, uuid, logging, hmac, hashlib
+import os, json, datetime, asyncio, uuid, logging, hmac, hashlib, time
 from contextlib import asynccontextmanager
 try:
     from typing import Literal, List, Dict, Any, Optional
@@ -10,13 +10,22 @@ from pathlib import Path
 import httpx
 import aiohttp
 from database import db
-from logger_config import setup_logging, log_bot_event
+from bulk_delete import ClearLogsJob
+from tag_matcher import validate_regex_tag
+from logger_config import setup_logging, log_bot_event, get_events
+import metrics
+from metrics import HTTP_REQUEST_SECONDS, TELEGRAM_API_SECONDS
+from query_profiler import profiler as query_profiler, apply_profile_config
+from tracing import Tracer, span, current_trace_id, sqlite_timestamp
+from loop_monitor import watchdog as loop_watchdog
+import profiling
+from health import health_report
 from supabase_client import (
     SupabasePool, query_users_for_broadcast,
     get_marathons_list, query_users_by_audience
 )
 from fastapi import FastAPI, Request, Form, HTTPException, Depends, Query
-from fastapi.responses import HTMLResponse, RedirectResponse, JSONResponse
+from fastapi.responses import HTMLResponse, RedirectResponse, JSONResponse, Response
 from fastapi.staticfiles import StaticFiles
 from pydantic import BaseModel
 from dotenv import load_dotenv
@@ -32,6 +41,10 @@ ADMIN_TOKEN = os.getenv("ADMIN_TOKEN")
 BOT_TOKEN = os.getenv("BOT_TOKEN")
 BOT_SHARED_SECRET = os.getenv("BOT_SHARED_SECRET")
 ADMIN_URL = os.getenv("ADMIN_URL", "http://localhost:8000")
+# Служебный HTTP бота для событий (пусто - только события админки)
+BOT_DEBUG_URL = os.getenv("BOT_DEBUG_URL", "")
+# Адрес Bot API: локальный fake_telegram.py для бенчмарков и отладки
+TELEGRAM_API_URL = os.getenv("TELEGRAM_API_URL", "https://api.telegram.org").rstrip("/")
 
 if not ADMIN_TOKEN:
     print("⚠️ ADMIN_TOKEN не установлен, используется 'changeme'")
@@ -43,9 +56,15 @@ if not BOT_TOKEN:
     print("⚠️ BOT_TOKEN не установлен! Установите его в .env файле или переменной окружения")
 
 # Настраиваем красивое логирование
-setup_logging("ADMIN PANEL", "INFO")
+setup_logging("ADMIN PANEL")  # Уровень из LOG_LEVEL (по умолчанию INFO)
 logger = logging.getLogger('ADMIN')
 
+# Трассы сообщений: одобрения редкие, спаны пишутся сразу
+tracer = Tracer("admin", flush_spans=1)
+
+# Очистка логов: фоновая, пачками с ограничением времени блокировки записи
+clear_logs_job = ClearLogsJob(db)
+
 # ---- Функции для работы с Supabase через asyncpg ----
 # Старая функция удалена, теперь используем supabase_client.query_users_for_broadcast()
 
@@ -55,7 +74,8 @@ class TagConfig(BaseModel):
     tag: str
     emoji: str
     delay: int = 0
-    match_mode: Literal["equals", "prefix"] = "equals"
+    match_mode: Literal["equals", "prefix", "regex", "fuzzy"] = "equals"
+    fuzzy_distance: int = 1  # Допуск опечаток для режима fuzzy (1-2 правки)
     require_photo: bool = True  # Требовать медиафайл (фото или видео)
     reply_ok: str = "Зараховано! 🦋"
     reply_need_photo: str = "Щоб зарахувати — додай фото і повтори з хештегом."
@@ -88,7 +108,8 @@ class TagUpdate(BaseModel):
     tag: str
     emoji: str
     delay: int = 0
-    match_mode: Literal["equals", "prefix"] = "equals"
+    match_mode: Literal["equals", "prefix", "regex", "fuzzy"] = "equals"
+    fuzzy_distance: int = 1
     require_photo: bool = True
     reply_ok: str = ""
     reply_need_photo: str = ""
@@ -109,6 +130,7 @@ async def lifespan(app: FastAPI):
     """Lifespan events: startup и shutdown."""
     # Startup
     logger.info("🚀 Запуск админ-панели...")
+    loop_watchdog.start()
     try:
         await SupabasePool.initialize()
     except Exception as e:
@@ -119,6 +141,7 @@ async def lifespan(app: FastAPI):
 
     # Shutdown
     logger.info("🛑 Остановка админ-панели...")
+    await loop_watchdog.stop()
     try:
         await SupabasePool.close()
     except Exception as e:
@@ -126,6 +149,50 @@ async def lifespan(app: FastAPI):
 
 app = FastAPI(title="Moderator Bot Admin API", version="2.0", lifespan=lifespan)
 
+@app.middleware("http")
+async def observe_request(request: Request, call_next):
+    """Время обработки запроса с меткой шаблона пути (без id в метке)"""
+    start = time.perf_counter()
+    status = 500
+    try:
+        response = await call_next(request)
+        status = response.status_code
+        return response
+    finally:
+        route = request.scope.get("route")
+        HTTP_REQUEST_SECONDS.labels(route.path if route else "other", request.method, str(status)).observe(
+            time.perf_counter() - start)
+
+class TelegramMetricsTransport(httpx.AsyncHTTPTransport):
+    """Транспорт httpx, который замеряет запросы к Bot API"""
+
+    async def handle_async_request(self, request: httpx.Request) -> httpx.Response:
+        path = request.url.path
+        endpoint = "file" if path.startswith("/file/") else path.rsplit("/", 1)[-1]
+        start = time.perf_counter()
+        outcome = "error"
+        try:
+            response = await super().handle_async_request(request)
+            outcome = str(response.status_code)
+            return response
+        except Exception as e:
+            outcome = type(e).__name__
+            raise
+        finally:
+            TELEGRAM_API_SECONDS.labels(endpoint, outcome).observe(time.perf_counter() - start)
+
+def telegram_client(**kwargs) -> httpx.AsyncClient:
+    """httpx-клиент для запросов к Telegram с метриками"""
+    return httpx.AsyncClient(transport=TelegramMetricsTransport(), **kwargs)
+
+def telegram_url(method: str, bot_token: str = None) -> str:
+    """URL метода Bot API (TELEGRAM_API_URL)"""
+    return f"{TELEGRAM_API_URL}/bot{bot_token or BOT_TOKEN}/{method}"
+
+def telegram_file_url(file_path: str) -> str:
+    """URL скачивания файла, file_path - из ответа getFile"""
+    return f"{TELEGRAM_API_URL}/file/bot{BOT_TOKEN}/{file_path}"
+
 # Авторизация
 def require_admin(token: str = Form(...)):
     if token != ADMIN_TOKEN:
@@ -153,6 +220,18 @@ def get_tags(request: Request, _: bool = Depends(require_api_admin)):
     except Exception as e:
         return ApiResponse(success=False, message=str(e))
 
+def tag_text(tag: TagUpdate) -> str:
+    """Текст тега для сохранения: регулярки не приводим к нижнему регистру (\\D != \\d)"""
+    if tag.match_mode == "regex":
+        return tag.tag.strip()
+    return tag.tag.strip().lower()
+
+def validate_tag_pattern(tag: TagUpdate) -> Optional[str]:
+    """Проверить регулярное выражение до сохранения, чтобы оно не подвесило бота"""
+    if tag.match_mode != "regex":
+        return None
+    return validate_regex_tag(tag.tag.strip())
+
 @app.post("/api/tags")
 def create_tag(tag: TagUpdate, _: bool = Depends(require_api_admin)):
     """Создать новый тег"""
@@ -162,11 +241,16 @@ def create_tag(tag: TagUpdate, _: bool = Depends(require_api_admin)):
         if any(t['tag'].lower() == tag.tag.strip().lower() for t in existing_tags):
             return ApiResponse(success=False, message="Тег уже существует")
         
+        error = validate_tag_pattern(tag)
+        if error:
+            return ApiResponse(success=False, message=error)
+        
         tag_data = {
-            'tag': tag.tag.strip().lower(),
+            'tag': tag_text(tag),
             'emoji': tag.emoji.strip(),
             'delay': max(0, min(3600, tag.delay)),
             'match_mode': tag.match_mode,
+            'fuzzy_distance': max(1, min(2, tag.fuzzy_distance)),
             'require_photo': tag.require_photo,
             'reply_ok': tag.reply_ok.strip(),
             'reply_need_photo': tag.reply_need_photo.strip(),
@@ -192,11 +276,16 @@ def update_tag(tag_id: str, tag: TagUpdate, _: bool = Depends(require_api_admin)
         if not existing_tag:
             return ApiResponse(success=False, message=f"Тег с ID {tag_id} не найден")
         
+        error = validate_tag_pattern(tag)
+        if error:
+            return ApiResponse(success=False, message=error)
+        
         tag_data = {
-            'tag': tag.tag.strip().lower(),
+            'tag': tag_text(tag),
             'emoji': tag.emoji.strip(),
             'delay': max(0, min(3600, tag.delay)),
             'match_mode': tag.match_mode,
+            'fuzzy_distance': max(1, min(2, tag.fuzzy_distance)),
             'require_photo': tag.require_photo,
             'reply_ok': tag.reply_ok.strip(),
             'reply_need_photo': tag.reply_need_photo.strip(),
@@ -246,37 +335,44 @@ def get_logs(
     except Exception as e:
         return ApiResponse(success=False, message=str(e))
 
+@app.get("/api/search")
+def search(
+    q: str = Query(min_length=1, max_length=200),
+    tag: Optional[str] = Query(default=None),
+    status: Optional[str] = Query(default=None),
+    date_from: Optional[datetime.date] = Query(default=None),
+    date_to: Optional[datetime.date] = Query(default=None),
+    source: Optional[str] = Query(default=None, pattern="^(logs|moderation)$"),
+    order: str = Query(default="recent", pattern="^(recent|rank)$"),
+    limit: int = Query(default=50, ge=1, le=500),
+    offset: int = Query(default=0, ge=0, le=100000),
+    _: bool = Depends(require_api_admin)
+):
+    """Полнотекстовый поиск по логам и модерации с фильтрами и страницами"""
+    try:
+        result = db.search(q, tag=tag or None, status=status or None,
+                           date_from=date_from.isoformat() if date_from else None,
+                           date_to=date_to.isoformat() if date_to else None,
+                           source=source, order=order, limit=limit, offset=offset)
+        result.update(limit=limit, offset=offset)
+        return ApiResponse(success=True, data=result)
+    except Exception as e:
+        return ApiResponse(success=False, message=str(e))
+
 @app.delete("/api/logs")
 def clear_logs(_: bool = Depends(require_api_admin)):
-    """Очистить все логи и связанные очереди"""
+    """Очистить все логи и связанные очереди (в фоне, по частям; прогресс - GET /api/logs/clear)"""
     try:
-        with db.get_connection() as conn:
-            # Очищаем логи
-            cursor = conn.execute("DELETE FROM logs")
-            deleted_logs = cursor.rowcount
-            
-            # Очищаем очередь реакций
-            cursor = conn.execute("DELETE FROM reaction_queue")
-            deleted_reactions = cursor.rowcount
-            
-            # Очищаем завершенные элементы модерации (оставляем pending)
-            cursor = conn.execute("DELETE FROM moderation_queue WHERE status != 'pending'")
-            deleted_moderation = cursor.rowcount
-            
-            conn.commit()
-        
-        return ApiResponse(
-            success=True, 
-            message=f"Очищено: {deleted_logs} логов, {deleted_reactions} реакций, {deleted_moderation} модераций",
-            data={
-                "deleted_logs": deleted_logs,
-                "deleted_reactions": deleted_reactions,
-                "deleted_moderation": deleted_moderation
-            }
-        )
+        progress = clear_logs_job.start()
+        return ApiResponse(success=True, message="Очистка логов запущена", data=progress)
     except Exception as e:
         return ApiResponse(success=False, message=str(e))
 
+@app.get("/api/logs/clear")
+def clear_logs_status(_: bool = Depends(require_api_admin)):
+    """Прогресс фоновой очистки логов"""
+    return ApiResponse(success=True, data=clear_logs_job.status())
+
 @app.get("/api/stats")
 def get_stats(_: bool = Depends(require_api_admin)):
     """Получить статистику"""
@@ -319,7 +415,7 @@ async def set_telegram_reaction(chat_id: int, message_id: int, emoji: str) -> bo
                 logger.error("❌ BOT_TOKEN not found")
                 return False
                 
-            url = f"https://api.telegram.org/bot{bot_token}/setMessageReaction"
+            url = telegram_url("setMessageReaction", bot_token)
             data = {
                 "chat_id": chat_id,
                 "message_id": message_id,
@@ -327,7 +423,7 @@ async def set_telegram_reaction(chat_id: int, message_id: int, emoji: str) -> bo
             }
             
             # Увеличиваем timeout для стабильности
-            async with httpx.AsyncClient(timeout=httpx.Timeout(15.0)) as client:
+            async with telegram_client(timeout=httpx.Timeout(15.0)) as client:
                 response = await client.post(url, data=data)
                 result = response.json()
                 
@@ -359,14 +455,14 @@ async def set_telegram_reaction_fallback(chat_id: int, message_id: int, emoji: s
         if not bot_token:
             return False
             
-        url = f"https://api.telegram.org/bot{bot_token}/setMessageReaction"
+        url = telegram_url("setMessageReaction", bot_token)
         data = {
             "chat_id": chat_id,
             "message_id": message_id,
             "reaction": json.dumps([{"type": "emoji", "emoji": emoji}])
         }
         
-        async with httpx.AsyncClient(timeout=httpx.Timeout(10.0)) as client:
+        async with telegram_client(timeout=httpx.Timeout(10.0)) as client:
             response = await client.post(url, data=data)
             result = response.json()
             
@@ -383,7 +479,18 @@ async def set_telegram_reaction_fallback(chat_id: int, message_id: int, emoji: s
 
 @app.post("/api/moderation/{item_id}/approve")
 async def approve_moderation(item_id: str, _: bool = Depends(require_api_admin)):
-    """Одобрить элемент модерации"""
+    """Одобрить элемент модерации (продолжая трассу сообщения из бота)"""
+    item = db.get_moderation_by_id(item_id)
+    trace = tracer.resume(item.get('trace_id') if item else '')
+    if trace:
+        trace[0].add_interval("moderation_wait", sqlite_timestamp(item.get('created_at')))
+    try:
+        return await approve_moderation_item(item_id)
+    finally:
+        tracer.finish(trace)
+
+async def approve_moderation_item(item_id: str):
+    """Одобрение: статус, реакция, лог и данные на бэкенд"""
     try:
         # Получаем элемент из очереди модерации
         items = db.get_pending_moderation()
@@ -399,12 +506,19 @@ async def approve_moderation(item_id: str, _: bool = Depends(require_api_admin))
         
         # Пытаемся поставить реакцию напрямую
         logger.info(f"🎯 АДМИНКА: Попытка поставить реакцию {item['emoji']} к сообщению {item['message_id']}")
-        reaction_success = await set_telegram_reaction(
-            item['chat_id'], 
-            item['message_id'], 
-            item['emoji']
-        )
+        with span("set_reaction"):
+            reaction_success = await set_telegram_reaction(
+                item['chat_id'], 
+                item['message_id'], 
+                item['emoji']
+            )
         logger.info(f"🎯 АДМИНКА: Результат постановки реакции: {reaction_success}")
+        log_bot_event('moderation_approved', {
+            'id': item_id,
+            'tag': item.get('tag', ''),
+            'user': item.get('username', ''),
+            'reaction_set': reaction_success
+        })
         
         # Добавляем запись в логи при одобрении
         log_data = {
@@ -418,7 +532,8 @@ async def approve_moderation(item_id: str, _: bool = Depends(require_api_admin))
             'media_type': item.get('media_info', {}).get('media_type', '') if item.get('media_info') else '',
             'caption': item.get('caption', '')
         }
-        db.add_log(log_data)
+        with span("db_log"):
+            db.add_log(log_data)
         
         # Данные о реакции будут отправлены ботом при фактической установке реакции
         logger.info("📊 Данные о реакции будут отправлены ботом после установки реакции")
@@ -455,22 +570,24 @@ async def approve_moderation(item_id: str, _: bool = Depends(require_api_admin))
                     
                     logger.info(f"📊 АДМИНКА: Отправляем данные о прямой реакции на {ADMIN_URL}/api/telegram/reaction")
                     
-                    async with aiohttp.ClientSession() as session:
-                        async with session.post(
-                            f"{ADMIN_URL}/api/telegram/reaction",
-                            data=json_data,
-                            headers={
-                                "Content-Type": "application/json",
-                                "X-Signature": signature
-                            },
-                            timeout=aiohttp.ClientTimeout(total=10)
-                        ) as response:
-                            if response.status == 200:
-                                response_data = await response.json()
-                                logger.info(f"✅ АДМИНКА: Данные о прямой реакции отправлены успешно")
-                            else:
-                                response_text = await response.text()
-                                logger.warning(f"⚠️ АДМИНКА: Бэкенд вернул код {response.status}: {response_text}")
+                    with span("backend_post"):
+                        async with aiohttp.ClientSession() as session:
+                            async with session.post(
+                                f"{ADMIN_URL}/api/telegram/reaction",
+                                data=json_data,
+                                headers={
+                                    "Content-Type": "application/json",
+                                    "X-Signature": signature,
+                                    "X-Trace-Id": current_trace_id()
+                                },
+                                timeout=aiohttp.ClientTimeout(total=10)
+                            ) as response:
+                                if response.status == 200:
+                                    response_data = await response.json()
+                                    logger.info(f"✅ АДМИНКА: Данные о прямой реакции отправлены успешно")
+                                else:
+                                    response_text = await response.text()
+                                    logger.warning(f"⚠️ АДМИНКА: Бэкенд вернул код {response.status}: {response_text}")
                 else:
                     logger.warning("⚠️ АДМИНКА: BOT_SHARED_SECRET или ADMIN_URL не настроены")
             except Exception as e:
@@ -480,7 +597,8 @@ async def approve_moderation(item_id: str, _: bool = Depends(require_api_admin))
         else:
             # Добавляем в очередь реакций как фоллбэк
             logger.info("⏳ АДМИНКА: Реакция не поставлена, добавляем в очередь для бота")
-            db.add_reaction_queue(item_id, item['chat_id'], item['message_id'], item['emoji'])
+            db.add_reaction_queue(item_id, item['chat_id'], item['message_id'], item['emoji'],
+                                  trace_id=item.get('trace_id', ''))
             return ApiResponse(success=True, message="Элемент одобрен, реакция будет поставлена при следующем сообщении")
             
     except Exception as e:
@@ -499,6 +617,11 @@ async def reject_moderation(item_id: str, _: bool = Depends(require_api_admin)):
         
         success = db.update_moderation_status(item_id, "rejected")
         if success:
+            log_bot_event('moderation_rejected', {
+                'id': item_id,
+                'tag': item.get('tag', ''),
+                'user': item.get('username', '')
+            })
             # НЕ отправляем данные при отклонении - реакция не ставится
             
             # Добавляем запись в логи при отклонении (с эмодзи ❌)
@@ -529,10 +652,10 @@ async def get_media_file(file_id: str, _: bool = Depends(require_api_admin)):
         if not BOT_TOKEN:
             return {"success": False, "message": "BOT_TOKEN не настроен"}
             
-        async with httpx.AsyncClient() as client:
+        async with telegram_client() as client:
             # Получаем информацию о файле
             file_response = await client.get(
-                f"https://api.telegram.org/bot{BOT_TOKEN}/getFile",
+                telegram_url("getFile"),
                 params={"file_id": file_id}
             )
             
@@ -544,7 +667,7 @@ async def get_media_file(file_id: str, _: bool = Depends(require_api_admin)):
                 return {"success": False, "message": file_data.get("description", "Ошибка получения файла")}
                 
             file_path = file_data["result"]["file_path"]
-            file_url = f"https://api.telegram.org/file/bot{BOT_TOKEN}/{file_path}"
+            file_url = telegram_file_url(file_path)
             
             # Определяем тип медиа по расширению
             media_type = "photo"
@@ -617,14 +740,14 @@ async def remove_reaction_direct(request: ReactionRequest, _: bool = Depends(req
         if not bot_token:
             return ApiResponse(success=False, message="BOT_TOKEN not found")
             
-        url = f"https://api.telegram.org/bot{bot_token}/setMessageReaction"
+        url = telegram_url("setMessageReaction", bot_token)
         data = {
             "chat_id": request.chat_id,
             "message_id": request.message_id,
             "reaction": json.dumps([])  # Пустой массив удаляет все реакции
         }
         
-        async with httpx.AsyncClient() as client:
+        async with telegram_client() as client:
             response = await client.post(url, data=data)
             result = response.json()
             
@@ -710,6 +833,72 @@ async def preview_broadcast_users(request: Request, _: bool = Depends(require_ap
             count=0
         )
 
+def broadcast_payload(request) -> Dict[str, Any]:
+    """Тело sendMessage рассылки без chat_id: текст, parse_mode, inline кнопка"""
+    payload = {
+        "text": request.message,
+        "disable_web_page_preview": request.disable_web_page_preview
+    }
+
+    if request.parse_mode:
+        payload["parse_mode"] = request.parse_mode
+
+    # Добавляем inline кнопку если указана
+    if request.button:
+        payload["reply_markup"] = {
+            "inline_keyboard": [[{
+                "text": request.button.text,
+                "url": request.button.url
+            }]]
+        }
+    return payload
+
+async def broadcast_message(recipients: List[tuple], payload: Dict[str, Any]) -> tuple:
+    """Отправить payload получателям [(tg_user_id, username)] по очереди
+
+    Возвращает (успешно, ошибок, [{tg_user_id, username, error}]).
+    """
+    success_count = 0
+    failed_count = 0
+    failed_users = []
+    url = telegram_url("sendMessage")
+
+    async with telegram_client(timeout=httpx.Timeout(30.0)) as client:
+        for tg_user_id, username in recipients:
+            if not tg_user_id:
+                continue
+
+            try:
+                # Небольшая задержка между сообщениями для избежания rate limiting
+                await asyncio.sleep(0.05)
+
+                response = await client.post(url, json=dict(payload, chat_id=tg_user_id))
+                result_data = response.json()
+
+                if result_data.get("ok"):
+                    success_count += 1
+                    logger.debug(f"✅ Сообщение отправлено пользователю {tg_user_id}")
+                else:
+                    failed_count += 1
+                    error_desc = result_data.get("description", "Unknown error")
+                    logger.warning(f"❌ Не удалось отправить пользователю {tg_user_id}: {error_desc}")
+                    failed_users.append({
+                        "tg_user_id": tg_user_id,
+                        "username": username,
+                        "error": error_desc
+                    })
+
+            except Exception as e:
+                failed_count += 1
+                logger.error(f"❌ Ошибка отправки пользователю {tg_user_id}: {e}")
+                failed_users.append({
+                    "tg_user_id": tg_user_id,
+                    "username": username,
+                    "error": str(e)
+                })
+
+    return success_count, failed_count, failed_users
+
 @app.post("/api/broadcast/send")
 async def send_broadcast(request: BroadcastRequest, _: bool = Depends(require_api_admin)):
     """Отправить массовое сообщение пользователям"""
@@ -736,61 +925,8 @@ async def send_broadcast(request: BroadcastRequest, _: bool = Depends(require_ap
         logger.info(f"📤 Начинаем массовую рассылку для {len(users)} пользователей")
 
         # Отправляем сообщения
-        success_count = 0
-        failed_count = 0
-        failed_users = []
-
-        async with httpx.AsyncClient(timeout=httpx.Timeout(30.0)) as client:
-            for user in users:
-                tg_user_id = user.get("tg_user_id")
-
-                try:
-                    # Небольшая задержка между сообщениями для избежания rate limiting
-                    await asyncio.sleep(0.05)
-
-                    url = f"https://api.telegram.org/bot{BOT_TOKEN}/sendMessage"
-                    payload = {
-                        "chat_id": tg_user_id,
-                        "text": request.message,
-                        "disable_web_page_preview": request.disable_web_page_preview
-                    }
-
-                    if request.parse_mode:
-                        payload["parse_mode"] = request.parse_mode
-
-                    # Добавляем inline кнопку если указана
-                    if request.button:
-                        payload["reply_markup"] = {
-                            "inline_keyboard": [[{
-                                "text": request.button.text,
-                                "url": request.button.url
-                            }]]
-                        }
-
-                    response = await client.post(url, json=payload)
-                    result_data = response.json()
-
-                    if result_data.get("ok"):
-                        success_count += 1
-                        logger.debug(f"✅ Сообщение отправлено пользователю {tg_user_id}")
-                    else:
-                        failed_count += 1
-                        error_desc = result_data.get("description", "Unknown error")
-                        logger.warning(f"❌ Не удалось отправить пользователю {tg_user_id}: {error_desc}")
-                        failed_users.append({
-                            "tg_user_id": tg_user_id,
-                            "username": user.get("username", ""),
-                            "error": error_desc
-                        })
-
-                except Exception as e:
-                    failed_count += 1
-                    logger.error(f"❌ Ошибка отправки пользователю {tg_user_id}: {e}")
-                    failed_users.append({
-                        "tg_user_id": tg_user_id,
-                        "username": user.get("username", ""),
-                        "error": str(e)
-                    })
+        recipients = [(user.get("tg_user_id"), user.get("username", "")) for user in users]
+        success_count, failed_count, failed_users = await broadcast_message(recipients, broadcast_payload(request))
 
         logger.info(f"📊 Массовая рассылка завершена: успешно={success_count}, ошибок={failed_count}")
 
@@ -825,26 +961,10 @@ async def send_test_message(request: TestMessageRequest, _: bool = Depends(requi
 
         logger.info(f"📤 Отправка тестового сообщения пользователю {request.tg_user_id}")
 
-        url = f"https://api.telegram.org/bot{BOT_TOKEN}/sendMessage"
-        payload = {
-            "chat_id": request.tg_user_id,
-            "text": request.message,
-            "disable_web_page_preview": request.disable_web_page_preview
-        }
-
-        if request.parse_mode:
-            payload["parse_mode"] = request.parse_mode
-
-        # Добавляем inline кнопку если указана
-        if request.button:
-            payload["reply_markup"] = {
-                "inline_keyboard": [[{
-                    "text": request.button.text,
-                    "url": request.button.url
-                }]]
-            }
+        url = telegram_url("sendMessage")
+        payload = dict(broadcast_payload(request), chat_id=request.tg_user_id)
 
-        async with httpx.AsyncClient(timeout=httpx.Timeout(10.0)) as client:
+        async with telegram_client(timeout=httpx.Timeout(10.0)) as client:
             response = await client.post(url, json=payload)
             result_data = response.json()
 
@@ -989,58 +1109,8 @@ async def send_broadcast_filtered(
         logger.info(f"📤 Начинаем рассылку по фильтрам: {len(unique_users)} уникальных пользователей (из {len(users)} записей)")
 
         # Отправляем сообщения
-        success_count = 0
-        failed_count = 0
-        failed_users = []
-
-        async with httpx.AsyncClient(timeout=httpx.Timeout(30.0)) as client:
-            for user in unique_users:
-                tg_user_id = user.get("telegram_id")
-                if not tg_user_id:
-                    continue
-
-                try:
-                    await asyncio.sleep(0.05)  # Rate limiting
-
-                    url = f"https://api.telegram.org/bot{BOT_TOKEN}/sendMessage"
-                    payload = {
-                        "chat_id": tg_user_id,
-                        "text": request.message,
-                        "disable_web_page_preview": request.disable_web_page_preview
-                    }
-
-                    if request.parse_mode:
-                        payload["parse_mode"] = request.parse_mode
-
-                    # Добавляем inline кнопку если указана
-                    if request.button:
-                        payload["reply_markup"] = {
-                            "inline_keyboard": [[{
-                                "text": request.button.text,
-                                "url": request.button.url
-                            }]]
-                        }
-
-                    response = await client.post(url, json=payload)
-                    result_data = response.json()
-
-                    if result_data.get("ok"):
-                        success_count += 1
-                    else:
-                        failed_count += 1
-                        failed_users.append({
-                            "tg_user_id": tg_user_id,
-                            "username": user.get("telegram_username", ""),
-                            "error": result_data.get("description", "Unknown error")
-                        })
-
-                except Exception as e:
-                    failed_count += 1
-                    failed_users.append({
-                        "tg_user_id": tg_user_id,
-                        "username": user.get("telegram_username", ""),
-                        "error": str(e)
-                    })
+        recipients = [(user.get("telegram_id"), user.get("telegram_username", "")) for user in unique_users]
+        success_count, failed_count, failed_users = await broadcast_message(recipients, broadcast_payload(request))
 
         logger.info(f"📊 Рассылка завершена: успешно={success_count}, ошибок={failed_count}")
 
@@ -1060,6 +1130,208 @@ async def send_broadcast_filtered(
         return ApiResponse(success=False, message=str(e))
 
 
+# ---- Отладка ----
+
+@app.get("/metrics")
+def get_metrics(_: bool = Depends(require_api_admin)):
+    """Метрики админки в формате Prometheus (метрики бота - на его служебном HTTP)"""
+    return Response(content=metrics.render(), media_type=metrics.CONTENT_TYPE)
+
+async def bot_debug_request(method: str, path: str, params: Dict[str, Any] = None, payload: Dict[str, Any] = None,
+                            timeout: float = 3.0):
+    """Запрос к служебному HTTP бота; None, если он не настроен или недоступен"""
+    if not BOT_DEBUG_URL:
+        return None
+    try:
+        async with httpx.AsyncClient(timeout=timeout) as client:
+            response = await client.request(
+                method,
+                f"{BOT_DEBUG_URL}{path}",
+                params={k: v for k, v in (params or {}).items() if v is not None},
+                json=payload,
+                headers={"Authorization": f"Bearer {ADMIN_TOKEN}"}
+            )
+            response.raise_for_status()
+            return response.json().get("data")
+    except Exception as e:
+        logger.warning(f"⚠️ Служебный HTTP бота недоступен ({path}): {e}")
+        return None
+
+async def fetch_bot_events(params: Dict[str, Any]) -> List[Dict[str, Any]]:
+    """События из буфера процесса бота (его служебный HTTP /events)"""
+    return await bot_debug_request("GET", "/events", params) or []
+
+@app.get("/api/debug/events")
+async def get_debug_events(
+    event: Optional[str] = Query(default=None),
+    level: Optional[str] = Query(default=None),
+    since: Optional[datetime.datetime] = Query(default=None),
+    search: Optional[str] = Query(default=None),
+    source: Literal["all", "admin", "bot"] = Query(default="all"),
+    limit: int = Query(default=100, ge=1, le=1000),
+    _: bool = Depends(require_api_admin)
+):
+    """Последние события бота и админки из буферов в памяти, от новых к старым"""
+    events = []
+    if source in ("all", "admin"):
+        events.extend(get_events(event=event, level=level, since=since, search=search, limit=limit))
+    if source in ("all", "bot"):
+        events.extend(await fetch_bot_events({
+            'event': event,
+            'level': level,
+            'since': since.isoformat() if since else None,
+            'search': search,
+            'limit': limit
+        }))
+    events.sort(key=lambda item: item['ts'], reverse=True)
+    return ApiResponse(success=True, data=events[:limit])
+
+class SqlProfileConfig(BaseModel):
+    enabled: Optional[bool] = None
+    slow_ms: Optional[float] = None
+    reset: bool = False
+    source: Literal["all", "admin", "bot"] = "all"
+
+@app.get("/api/debug/sql")
+async def get_sql_profile(
+    source: Literal["all", "admin", "bot"] = Query(default="all"),
+    _: bool = Depends(require_api_admin)
+):
+    """p50/p99 запросов по методам Database и медленные запросы с планами"""
+    data = {}
+    if source in ("all", "admin"):
+        data["admin"] = query_profiler.report()
+    if source in ("all", "bot"):
+        data["bot"] = await bot_debug_request("GET", "/sql")
+    return ApiResponse(success=True, data=data)
+
+@app.post("/api/debug/sql")
+async def configure_sql_profile(config: SqlProfileConfig, _: bool = Depends(require_api_admin)):
+    """Включить/выключить профилировщик запросов, сменить порог, сбросить замеры"""
+    payload = config.model_dump(exclude={"source"})
+    data = {}
+    if config.source in ("all", "admin"):
+        apply_profile_config(query_profiler, payload)
+        data["admin"] = {"enabled": query_profiler.enabled, "slow_ms": query_profiler.slow_ms}
+    if config.source in ("all", "bot"):
+        data["bot"] = await bot_debug_request("POST", "/sql", payload=payload)
+    return ApiResponse(success=True, data=data)
+
+@app.get("/api/debug/loop")
+async def get_loop_lag(
+    source: Literal["all", "admin", "bot"] = Query(default="all"),
+    _: bool = Depends(require_api_admin)
+):
+    """p50/p99 задержки event loop и последние остановки со стеком блокирующего кода"""
+    data = {}
+    if source in ("all", "admin"):
+        data["admin"] = loop_watchdog.report()
+    if source in ("all", "bot"):
+        data["bot"] = await bot_debug_request("GET", "/loop")
+    return ApiResponse(success=True, data=data)
+
+@app.get("/api/debug/profile")
+async def get_cpu_profile(
+    seconds: float = Query(default=10, gt=0, le=profiling.MAX_PROFILE_SECONDS),
+    mode: Literal["cprofile", "sampling"] = Query(default="cprofile"),
+    top: int = Query(default=30, ge=1, le=200),
+    sort: Literal["total", "own"] = Query(default="total"),
+    source: Literal["admin", "bot"] = Query(default="admin"),
+    _: bool = Depends(require_api_admin)
+):
+    """CPU-профиль админки или бота за seconds секунд: топ функций"""
+    if source == "bot":
+        data = await bot_debug_request("GET", "/profile", {
+            'seconds': seconds, 'mode': mode, 'top': top, 'sort': sort
+        }, timeout=seconds + 10)
+        if data is None:
+            raise HTTPException(status_code=502, detail="Профиль бота не получен")
+        return ApiResponse(success=True, data=data)
+    try:
+        data = await profiling.profile_cpu(seconds, mode=mode, top=top, sort=sort)
+    except profiling.ProfileBusyError as e:
+        raise HTTPException(status_code=409, detail=str(e))
+    return ApiResponse(success=True, data=data)
+
+class MemoryProfileConfig(BaseModel):
+    action: Literal["start", "stop"] = "start"
+    frames: int = 10
+    source: Literal["admin", "bot"] = "admin"
+
+@app.get("/api/debug/memory")
+async def get_memory_profile(
+    top: int = Query(default=30, ge=1, le=200),
+    group_by: Literal["lineno", "filename", "traceback"] = Query(default="lineno"),
+    source: Literal["admin", "bot"] = Query(default="admin"),
+    _: bool = Depends(require_api_admin)
+):
+    """Снимок tracemalloc: топ мест выделения памяти и разница с прошлым снимком"""
+    if source == "bot":
+        data = await bot_debug_request("GET", "/memory", {'top': top, 'group_by': group_by}, timeout=30.0)
+        if data is None:
+            raise HTTPException(status_code=502, detail="Снимок памяти бота не получен (tracemalloc запущен?)")
+        return ApiResponse(success=True, data=data)
+    try:
+        # Снимок большой кучи - сотни миллисекунд, loop не держим
+        data = await asyncio.to_thread(profiling.memory_snapshot, top, group_by)
+    except RuntimeError as e:
+        raise HTTPException(status_code=400, detail=str(e))
+    return ApiResponse(success=True, data=data)
+
+@app.post("/api/debug/memory")
+async def configure_memory_profile(config: MemoryProfileConfig, _: bool = Depends(require_api_admin)):
+    """Включить или выключить tracemalloc"""
+    if config.source == "bot":
+        data = await bot_debug_request("POST", "/memory", payload={'action': config.action, 'frames': config.frames})
+        return ApiResponse(success=data is not None, data=data)
+    if config.action == "stop":
+        data = profiling.memory_stop()
+    else:
+        data = profiling.memory_start(config.frames)
+    return ApiResponse(success=True, data=data)
+
+@app.get("/api/debug/traces")
+def get_message_traces(
+    chat_id: Optional[int] = Query(default=None),
+    message_id: Optional[int] = Query(default=None),
+    trace_id: Optional[str] = Query(default=None),
+    limit: int = Query(default=20, ge=1, le=100),
+    _: bool = Depends(require_api_admin)
+):
+    """Трассы сообщения: спаны бота и админки со смещением от начала трассы"""
+    if not trace_id and (chat_id is None or message_id is None):
+        raise HTTPException(status_code=400, detail="Нужен trace_id или chat_id и message_id")
+    tracer.flush()
+    traces = db.get_traces(chat_id=chat_id, message_id=message_id, trace_id=trace_id, limit=limit)
+    for trace in traces:
+        origin = min([trace['started_at']] + [s['started_at'] for s in trace['spans']])
+        for item in trace['spans']:
+            item['offset_ms'] = round((item['started_at'] - origin) * 1000, 1)
+        ends = [s['started_at'] + s['duration_ms'] / 1000 for s in trace['spans']]
+        trace['total_ms'] = round((max(ends) - origin) * 1000, 1) if ends else 0.0
+    return ApiResponse(success=True, data=traces)
+
+# ---- Здоровье ----
+
+def admin_health() -> Dict[str, Any]:
+    supabase = SupabasePool.status()
+    # Без настроек Supabase рассылка просто выключена - это не отказ
+    supabase['ok'] = supabase['available'] or not supabase['configured']
+    return health_report({'supabase': supabase})
+
+@app.get("/healthz")
+def healthz():
+    """Жив ли процесс и открывается ли SQLite; в теле - все проверки конвейера"""
+    report = admin_health()
+    status_code = 503 if 'sqlite' in report['checks'] else 200
+    return JSONResponse(content=report, status_code=status_code)
+
+@app.get("/readyz")
+def readyz():
+    """200 только если все проверки в пределах порогов, иначе 503"""
+    report = admin_health()
+    return JSONResponse(content=report, status_code=200 if report['status'] == 'ok' else 503)
+
 # Редирект с корня на новую админку
 @app.get("/")
 def root_redirect():
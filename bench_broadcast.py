@@ -0,0 +1,117 @@
+#!/usr/bin/env python3
+# -*- coding: utf-8 -*-
+"""
+Бенчмарк массовой рассылки админки на fake Bot API
+
+Рассылка идет через admin.broadcast_message - тот же цикл, что у
+/api/broadcast/send и /api/broadcast/send-filtered, только получатели
+синтетические, а TELEGRAM_API_URL указывает на fake_telegram.py с лимитами
+Telegram (глобальный и на чат, retry_after) и долей заблокировавших бота.
+
+Отчет по сценариям: время рассылки, сообщений в секунду, доля ответов 429,
+число 403 и прочих ошибок.
+
+    python bench_broadcast.py
+    python bench_broadcast.py --users 100 1000 --blocked-ratio 0.05 --latency-ms 80
+    python bench_broadcast.py --global-limit 10 --json broadcast.json
+"""
+
+import argparse
+import asyncio
+import json
+import os
+import sys
+import tempfile
+import time
+
+sys.path.insert(0, os.path.dirname(os.path.abspath(__file__)))
+from fake_telegram import FakeTelegram
+
+def configure_env(fake_url: str):
+    """Окружение админки до ее импорта: admin.py читает настройки при загрузке"""
+    os.environ["BOT_TOKEN"] = "123456:BENCH"
+    os.environ["ADMIN_TOKEN"] = "bench"
+    os.environ["DATABASE_PATH"] = os.path.join(tempfile.mkdtemp(prefix="bench_broadcast_"), "bot_data.db")
+    os.environ["LOG_LEVEL"] = "WARNING"
+    os.environ["TELEGRAM_API_URL"] = fake_url
+
+async def run_scenario(admin, fake: FakeTelegram, users: int, blocked_ratio: float) -> dict:
+    fake.blocked_ratio = blocked_ratio
+    fake.reset()
+    recipients = [(1000 + n, "user{}".format(n)) for n in range(users)]
+    payload = {"text": "Бенчмарк рассылки", "disable_web_page_preview": True}
+
+    start = time.perf_counter()
+    success, failed, failed_users = await admin.broadcast_message(recipients, payload)
+    seconds = time.perf_counter() - start
+
+    errors = {}
+    for failure in failed_users:
+        kind = ("429" if "Too Many Requests" in failure["error"]
+                else "403" if "Forbidden" in failure["error"] else "other")
+        errors[kind] = errors.get(kind, 0) + 1
+    report = fake.report()
+    return {
+        'users': users,
+        'blocked_ratio': blocked_ratio,
+        'seconds': round(seconds, 3),
+        'msgs_per_sec': round(users / seconds, 1) if seconds else 0.0,
+        'success': success,
+        'failed': failed,
+        'errors': errors,
+        'send_429_rate': report['send_429_rate'],
+    }
+
+async def bench(args) -> dict:
+    fake = FakeTelegram(latency_ms=args.latency_ms, jitter_ms=args.jitter_ms, rate_429=args.rate_429,
+                        retry_after=args.retry_after, limits=True, global_limit=args.global_limit,
+                        seed=args.seed)
+    await fake.start()
+    configure_env(fake.url)
+    import admin
+
+    scenarios = []
+    try:
+        for users in args.users:
+            for blocked_ratio in sorted({0.0, args.blocked_ratio}):
+                scenarios.append(await run_scenario(admin, fake, users, blocked_ratio))
+    finally:
+        await fake.stop()
+    return {
+        'latency_ms': args.latency_ms,
+        'global_limit': args.global_limit,
+        'scenarios': scenarios,
+    }
+
+def print_report(report: dict):
+    print("📤 Рассылка через fake Bot API: задержка {} мс, глобальный лимит {}/с".format(
+        report['latency_ms'], report['global_limit']))
+    for s in report['scenarios']:
+        print("  👥 {:>6} получателей, заблокировали {:>4.0%}: {:.2f} с, {:.1f} сообщ/с, "
+              "отправлено {}, 429 {:.2%}, ошибки {}".format(
+                  s['users'], s['blocked_ratio'], s['seconds'], s['msgs_per_sec'],
+                  s['success'], s['send_429_rate'], s['errors'] or "-"))
+
+def build_parser() -> argparse.ArgumentParser:
+    parser = argparse.ArgumentParser(description="Бенчмарк массовой рассылки с fake Bot API")
+    parser.add_argument("--users", type=int, nargs="+", default=[100, 1000], help="размеры рассылки")
+    parser.add_argument("--blocked-ratio", type=float, default=0.05, help="доля заблокировавших бота")
+    parser.add_argument("--latency-ms", type=float, default=30, help="задержка ответа Bot API")
+    parser.add_argument("--jitter-ms", type=float, default=0)
+    parser.add_argument("--rate-429", type=float, default=0.0, help="доля случайных ответов 429")
+    parser.add_argument("--retry-after", type=int, default=1)
+    parser.add_argument("--global-limit", type=int, default=30, help="сообщений в секунду на бота")
+    parser.add_argument("--seed", type=int, default=42)
+    parser.add_argument("--json", help="сохранить отчет в JSON")
+    return parser
+
+def main():
+    args = build_parser().parse_args()
+    report = asyncio.run(bench(args))
+    print_report(report)
+    if args.json:
+        with open(args.json, "w", encoding="utf-8") as f:
+            json.dump(report, f, ensure_ascii=False, indent=2)
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,214 @@
+#!/usr/bin/env python3
+# -*- coding: utf-8 -*-
+"""
+Бенчмарк конкуренции за SQLite: писатели-бот против читателей-админки
+
+Бот и админка - разные процессы над одним файлом в режиме WAL. Здесь так
+же: процессы-писатели повторяют записи бота (лог, модерация, очередь
+реакций, пульс), процессы-читатели - запросы страниц админки (логи,
+статистика, модерация), а отдельный процесс время от времени удаляет
+большую пачку логов одной транзакцией, как очистка логов в админке.
+
+Отчет по ролям: операций в секунду, p50/p99/max задержки, ошибки
+database is locked после всех повторов, число повторов и время ожидания
+блокировок (метрики Database в каждом процессе).
+
+    python bench_contention.py
+    python bench_contention.py --writers 2 --readers 4 --seconds 20 --clear-rows 200000
+    python bench_contention.py --busy-timeout-ms 100 --retries 0   # без повторов, короткое ожидание
+    python bench_contention.py --clear-budget-ms 50                 # очистка пачками, как в админке
+"""
+
+import argparse
+import json
+import multiprocessing
+import os
+import random
+import sqlite3
+import sys
+import tempfile
+import time
+
+sys.path.insert(0, os.path.dirname(os.path.abspath(__file__)))
+from bench_database import seed, CHATS
+from bulk_delete import delete_in_chunks
+from database import Database, BUSY_TIMEOUT_MS, BUSY_RETRIES
+from metrics import SQLITE_BUSY_RETRIES, SQLITE_LOCK_WAIT_SECONDS
+from query_profiler import percentile
+
+def bot_operations(db: Database, rng: random.Random, n: int):
+    """Записи бота на одно сообщение с тегом"""
+    chat = -1001000000000 - n % CHATS
+    message_id = 10 ** 9 + os.getpid() * 10 ** 6 + n
+    yield 'add_log', lambda: db.add_log({'user_id': 1000 + n % 500, 'username': 'user', 'chat_id': chat,
+                                         'message_id': message_id, 'trigger': '#марафон', 'emoji': '🔥',
+                                         'caption': 'Мій #марафон'})
+    if n % 5 == 0:
+        yield 'add_moderation_item', lambda: db.add_moderation_item({
+            'chat_id': chat, 'message_id': message_id, 'user_id': 1000, 'username': 'user',
+            'tag': '#рецепт', 'emoji': '🍓', 'caption': 'Рецепт'})
+    yield 'add_reaction_queue', lambda: db.add_reaction_queue('bench', chat, message_id, '👍')
+    yield 'process_reaction_queue', lambda: [db.remove_reaction_from_queue(reaction['id'])
+                                             for reaction in db.get_reaction_queue()
+                                             if reaction['moderation_id'] == 'bench']
+    if n % 10 == 0:
+        yield 'set_meta_values', lambda: db.set_meta_values({'bot_heartbeat': int(time.time())})
+
+def admin_operations(db: Database, rng: random.Random, n: int):
+    """Запросы страниц админки: логи, статистика, модерация, поиск сообщения"""
+    yield 'get_logs', lambda: db.get_logs()
+    yield 'get_stats', lambda: db.get_stats()
+    yield 'get_pending_moderation', lambda: db.get_pending_moderation()
+    yield 'find_message_data', lambda: db.find_message_data(-1001000000000 - n % CHATS, rng.randrange(100000))
+
+def clear_operations(db: Database, rng: random.Random, n: int, rows: int, budget_ms: float):
+    """Очистка логов: одной транзакцией (прежний DELETE /api/logs) или пачками с бюджетом блокировки"""
+    if not budget_ms:
+        def clear():
+            with db.get_connection() as conn:
+                conn.execute("DELETE FROM logs WHERE id IN (SELECT id FROM logs ORDER BY id LIMIT ?)", (rows,))
+                conn.commit()
+        yield 'clear_logs', clear
+        return
+    with db.get_connection() as conn:
+        bound = (conn.execute("SELECT IFNULL(MIN(id), 0) FROM logs").fetchone()[0] or 0) + rows
+    yield 'clear_logs(chunked)', lambda: delete_in_chunks(db, 'logs', bound, budget_ms)
+
+def worker(role: str, args, seconds: float, results):
+    """Процесс одной роли: гонять операции до конца времени, вернуть замеры"""
+    db = Database(args.db_path, busy_timeout_ms=args.busy_timeout_ms, busy_retries=args.retries)
+    rng = random.Random(os.getpid())
+    latencies = {}
+    errors = {}
+    deadline = time.monotonic() + seconds
+    n = 0
+    while time.monotonic() < deadline:
+        if role == 'writer':
+            operations = bot_operations(db, rng, n)
+        elif role == 'reader':
+            operations = admin_operations(db, rng, n)
+        else:
+            operations = clear_operations(db, rng, n, args.clear_rows, args.clear_budget_ms)
+        for name, operation in operations:
+            start = time.perf_counter()
+            try:
+                operation()
+            except sqlite3.OperationalError as e:
+                errors[str(e)] = errors.get(str(e), 0) + 1
+                continue
+            latencies.setdefault(name, []).append(time.perf_counter() - start)
+        n += 1
+        if role == 'writer' and args.write_interval:
+            time.sleep(args.write_interval)
+        elif role == 'clear':
+            time.sleep(args.clear_every)
+
+    waits = SQLITE_LOCK_WAIT_SECONDS.children().values()
+    results.put({
+        'role': role,
+        'latencies': latencies,
+        'errors': errors,
+        'retries': sum(child.value for child in SQLITE_BUSY_RETRIES.children().values()),
+        'lock_wait_seconds': round(sum(child.sum for child in waits), 3),
+    })
+
+def summarize(samples: list, seconds: float) -> dict:
+    return {
+        'ops': len(samples),
+        'ops_per_sec': round(len(samples) / seconds, 1),
+        'p50_ms': round(percentile(samples, 0.5) * 1000, 3),
+        'p99_ms': round(percentile(samples, 0.99) * 1000, 3),
+        'max_ms': round(max(samples) * 1000, 3) if samples else 0.0,
+    }
+
+def run(args) -> dict:
+    if args.busy_timeout_ms is None:
+        args.busy_timeout_ms = BUSY_TIMEOUT_MS
+    if args.retries is None:
+        args.retries = BUSY_RETRIES
+    if not args.db_path:
+        args.db_path = os.path.join(tempfile.mkdtemp(prefix="bench_contention_"), "bot_data.db")
+    db = Database(args.db_path)
+    started = time.perf_counter()
+    seed(db, args.rows, random.Random(42))
+    print("🌱 Заполнено {} строк на таблицу за {:.1f} с".format(args.rows, time.perf_counter() - started))
+
+    roles = ['writer'] * args.writers + ['reader'] * args.readers + (['clear'] if args.clear_rows else [])
+    results = multiprocessing.Queue()
+    processes = [multiprocessing.Process(target=worker, args=(role, args, args.seconds, results)) for role in roles]
+    for process in processes:
+        process.start()
+    collected = [results.get() for _ in processes]
+    for process in processes:
+        process.join()
+
+    report = {'config': {
+        'rows': args.rows, 'seconds': args.seconds, 'writers': args.writers, 'readers': args.readers,
+        'clear_rows': args.clear_rows, 'clear_every': args.clear_every, 'clear_budget_ms': args.clear_budget_ms,
+        'busy_timeout_ms': args.busy_timeout_ms, 'retries': args.retries,
+    }, 'roles': {}}
+    for role in dict.fromkeys(roles):
+        parts = [r for r in collected if r['role'] == role]
+        merged = {}
+        for part in parts:
+            for name, samples in part['latencies'].items():
+                merged.setdefault(name, []).extend(samples)
+        errors = {}
+        for part in parts:
+            for message, count in part['errors'].items():
+                errors[message] = errors.get(message, 0) + count
+        report['roles'][role] = {
+            'processes': len(parts),
+            'all': summarize([s for samples in merged.values() for s in samples], args.seconds),
+            'operations': {name: summarize(samples, args.seconds) for name, samples in merged.items()},
+            'lock_errors': errors,
+            'retries': sum(part['retries'] for part in parts),
+            'lock_wait_seconds': round(sum(part['lock_wait_seconds'] for part in parts), 3),
+        }
+    return report
+
+def print_report(report: dict):
+    config = report['config']
+    print("⚔️ {} с: писателей {}, читателей {}, очистка {} строк раз в {} с; ожидание на вызов {} мс, повторов {}".format(
+        config['seconds'], config['writers'], config['readers'], config['clear_rows'], config['clear_every'],
+        config['busy_timeout_ms'], config['retries']))
+    for role, data in report['roles'].items():
+        total = data['all']
+        print("  {} {} ({} проц.): {} оп., {:.1f} оп/с, p50 {:.2f} мс, p99 {:.2f} мс, max {:.1f} мс".format(
+            {'writer': '✍️', 'reader': '👀', 'clear': '🧹'}[role], role, data['processes'], total['ops'],
+            total['ops_per_sec'], total['p50_ms'], total['p99_ms'], total['max_ms']))
+        for name, op in data['operations'].items():
+            print("      {:<24} p50 {:>8.2f} мс  p99 {:>8.2f} мс  max {:>8.1f} мс  ({})".format(
+                name, op['p50_ms'], op['p99_ms'], op['max_ms'], op['ops']))
+        print("      🔒 повторов {}, ожидание блокировок {:.2f} с, ошибок {}".format(
+            data['retries'], data['lock_wait_seconds'], sum(data['lock_errors'].values())))
+        for message, count in data['lock_errors'].items():
+            print("      🚨 {}: {}".format(message, count))
+
+def build_parser() -> argparse.ArgumentParser:
+    parser = argparse.ArgumentParser(description="Конкуренция писателей-бота и читателей-админки за SQLite")
+    parser.add_argument("--rows", type=int, default=100000, help="строк на таблицу до начала")
+    parser.add_argument("--seconds", type=float, default=10)
+    parser.add_argument("--writers", type=int, default=1, help="процессов-писателей (бот)")
+    parser.add_argument("--readers", type=int, default=2, help="процессов-читателей (админка)")
+    parser.add_argument("--write-interval", type=float, default=0.0, help="пауза писателя между сообщениями, с")
+    parser.add_argument("--clear-rows", type=int, default=50000, help="строк логов за одну очистку (0 - без нее)")
+    parser.add_argument("--clear-every", type=float, default=2.0, help="пауза между очистками, с")
+    parser.add_argument("--clear-budget-ms", type=float, default=0,
+                        help="очищать пачками с этим бюджетом блокировки (0 - одной транзакцией)")
+    parser.add_argument("--busy-timeout-ms", type=int, default=None, help="бюджет ожидания на вызов, по умолчанию SQLITE_BUSY_TIMEOUT_MS")
+    parser.add_argument("--retries", type=int, default=None, help="по умолчанию SQLITE_BUSY_RETRIES")
+    parser.add_argument("--db-path", help="файл БД (по умолчанию - новый во временной папке)")
+    parser.add_argument("--json", help="сохранить отчет в JSON")
+    return parser
+
+def main():
+    args = build_parser().parse_args()
+    report = run(args)
+    print_report(report)
+    if args.json:
+        with open(args.json, "w", encoding="utf-8") as f:
+            json.dump(report, f, ensure_ascii=False, indent=2)
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,300 @@
+#!/usr/bin/env python3
+# -*- coding: utf-8 -*-
+"""
+Микробенчмарк методов Database на 1 тыс., 100 тыс. и 1 млн строк
+
+Для каждого размера создается БД, где в logs, moderation_queue,
+media_hashes, reaction_queue и traces по столько строк (pending в
+модерации и просроченных реакций - доля, как в жизни), и каждый публичный
+метод Database вызывается много раз подряд: p50/p99/среднее на вызов.
+
+Результаты пишутся в JSON (--save) и сравниваются с прежним прогоном
+(--baseline): p50 метода хуже базового больше чем на --tolerance и
+больше --min-delta-ms - регрессия, код выхода 1.
+
+    python bench_database.py --rows 1000 100000 --save bench_db.json
+    python bench_database.py --rows 1000 100000 --baseline bench_db.json --tolerance 0.3
+    python bench_database.py --db-dir /tmp/bench_db   # заполненные БД переиспользуются
+"""
+
+import argparse
+import json
+import os
+import platform
+import random
+import sqlite3
+import sys
+import tempfile
+import time
+from datetime import datetime, timedelta
+
+sys.path.insert(0, os.path.dirname(os.path.abspath(__file__)))
+from database import Database
+from query_profiler import percentile
+
+SIZES = (1000, 100000, 1000000)
+TAGS = ['#марафон', '#рецепт', '#звіт', '#йога', '#stretch', '#run10k', '#тренування', '#прогулянка']
+CHATS = 20
+USERS = 5000
+# Статусы модерации: (доля, статус) - pending немного, остальное уже разобрано
+MODERATION_STATUSES = ((0.002, 'pending'), (0.7, 'approved'), (0.1, 'rejected'), (1.0, 'auto_approved'))
+# Доля реакций, время которых уже наступило
+DUE_REACTIONS = 0.001
+SEED_BATCH = 50000
+
+def _timestamp(now: datetime, seconds_ago: int) -> str:
+    return (now - timedelta(seconds=seconds_ago)).strftime('%Y-%m-%d %H:%M:%S')
+
+def _moderation_status(x: float) -> str:
+    for share, status in MODERATION_STATUSES:
+        if x < share:
+            return status
+    return MODERATION_STATUSES[-1][1]
+
+def seed(db: Database, rows: int, rng: random.Random):
+    """Заполнить таблицы напрямую через executemany (пачками, чтобы не держать все в памяти)"""
+    now = datetime.utcnow()
+    year = 365 * 24 * 3600
+    with db.get_connection() as conn:
+        for tag in TAGS:
+            conn.execute("INSERT OR IGNORE INTO tags (id, tag, emoji) VALUES (?, ?, ?)", (tag.strip('#'), tag, '🔥'))
+        for start in range(0, rows, SEED_BATCH):
+            batch = range(start, min(rows, start + SEED_BATCH))
+            conn.executemany("""
+                INSERT INTO logs (user_id, username, chat_id, message_id, trigger, emoji, timestamp,
+                                  thread_name, media_type, caption, status)
+                VALUES (?, ?, ?, ?, ?, ?, ?, ?, ?, ?, ?)
+            """, [(
+                1000 + n % USERS, 'user{}'.format(n % USERS), -1001000000000 - n % CHATS, n,
+                TAGS[n % len(TAGS)], '🔥', _timestamp(now, rng.randrange(year)), '', 'photo',
+                'Мій {} день {}'.format(TAGS[n % len(TAGS)], n), 'success' if n % 10 else 'duplicate'
+            ) for n in batch])
+            conn.executemany("""
+                INSERT INTO moderation_queue (id, chat_id, message_id, user_id, username, tag, emoji,
+                                              caption, media_info, status, created_at, group_id)
+                VALUES (?, ?, ?, ?, ?, ?, ?, ?, ?, ?, ?, ?)
+            """, [(
+                'm{}'.format(n), -1001000000000 - n % CHATS, rows + n, 1000 + n % USERS, 'user{}'.format(n % USERS),
+                TAGS[n % len(TAGS)], '🍓', 'Рецепт {}'.format(n), '{"type": "photo"}',
+                _moderation_status(rng.random()), _timestamp(now, rng.randrange(year)),
+                'm{}'.format(n - n % 2) if n % 5 == 0 else ''
+            ) for n in batch])
+            conn.executemany("""
+                INSERT INTO media_hashes (file_hash, file_id, file_type, user_id, chat_id, message_id)
+                VALUES (?, ?, ?, ?, ?, ?)
+            """, [('{:064x}'.format(n), 'file{}'.format(n), 'photo', 1000 + n % USERS,
+                   -1001000000000 - n % CHATS, n) for n in batch])
+            conn.executemany("""
+                INSERT INTO reaction_queue (moderation_id, chat_id, message_id, emoji, execute_at)
+                VALUES (?, ?, ?, ?, ?)
+            """, [(
+                'm{}'.format(n), -1001000000000 - n % CHATS, rows + n, '👍',
+                _timestamp(now, rng.randrange(3600)) if rng.random() < DUE_REACTIONS
+                else _timestamp(now, -rng.randrange(1, 30 * 24 * 3600))
+            ) for n in batch])
+            started = time.time() - year
+            conn.executemany("INSERT INTO traces VALUES (?, ?, ?, ?)", [
+                ('t{}'.format(n), -1001000000000 - n % CHATS, n, started + n * year / rows) for n in batch])
+            conn.executemany("""
+                INSERT INTO trace_spans (trace_id, name, source, started_at, duration_ms, status)
+                VALUES (?, ?, ?, ?, ?, ?)
+            """, [('t{}'.format(n), 'handler', 'bot', started + n * year / rows, 3.5, 'ok') for n in batch])
+        conn.execute("INSERT OR REPLACE INTO meta (key, value) VALUES ('bench_rows', ?)", (rows,))
+        conn.commit()
+        conn.execute("ANALYZE")
+
+def open_database(rows: int, db_dir: str, rng: random.Random) -> Database:
+    """БД на rows строк: из db_dir, если уже заполнена, иначе новая"""
+    path = os.path.join(db_dir, "bench_{}.db".format(rows))
+    if os.path.exists(path):
+        conn = sqlite3.connect(path)
+        try:
+            seeded = conn.execute("SELECT value FROM meta WHERE key = 'bench_rows'").fetchone()
+        except sqlite3.OperationalError:
+            seeded = None
+        finally:
+            conn.close()
+        if seeded and seeded[0] == rows:
+            return Database(path)
+        for suffix in ('', '-wal', '-shm'):
+            if os.path.exists(path + suffix):
+                os.remove(path + suffix)
+    db = Database(path)
+    started = time.perf_counter()
+    seed(db, rows, rng)
+    print("  🌱 Заполнено {} строк на таблицу за {:.1f} с".format(rows, time.perf_counter() - started))
+    return db
+
+def cases(db: Database, rows: int, rng: random.Random):
+    """(имя, вызов) для каждого публичного метода; вызов получает номер итерации
+
+    Записи добавляют немного строк сверх rows - на масштаб это не влияет.
+    Разрушающие методы (clear_reaction_queue) идут последними.
+    """
+    chat = -1001000000000
+    log = {'user_id': 1000, 'username': 'bench', 'chat_id': chat, 'message_id': 0, 'trigger': '#марафон',
+           'emoji': '🔥', 'media_type': 'photo', 'caption': 'Мій #марафон'}
+    item = {'chat_id': chat, 'message_id': 0, 'user_id': 1000, 'username': 'bench', 'tag': '#рецепт',
+            'emoji': '🍓', 'caption': 'Рецепт', 'media_info': {'type': 'photo'}}
+    tag = {'tag': '#бенч', 'emoji': '👍'}
+    edited = dict(tag, tag='#бенч_изменяемый')
+    tag_id = db.create_tag(edited)
+
+    def add_reaction(i):
+        db.add_reaction_queue('bench', chat, rows * 3 + i, '👍', 3600)
+
+    return [
+        # Теги
+        ('get_tags_version', lambda i: (db.invalidate_tags_cache(), db.get_tags_version())),
+        ('get_tags', lambda i: db.get_tags()),
+        ('get_tag_index', lambda i: db.get_tag_index()),
+        ('get_tag_by_id', lambda i: db.get_tag_by_id(tag_id)),
+        ('create_tag+delete_tag', lambda i: db.delete_tag(db.create_tag(dict(tag, tag='#бенч{}'.format(i))))),
+        ('update_tag', lambda i: db.update_tag(tag_id, dict(edited, emoji='👍' if i % 2 else '🔥'))),
+        # Логи
+        ('add_log', lambda i: db.add_log(dict(log, message_id=rows * 2 + i))),
+        ('add_logs[10]', lambda i: db.add_logs([dict(log, message_id=rows * 2 + i * 10 + j) for j in range(10)])),
+        ('get_logs', lambda i: db.get_logs()),
+        ('get_logs(tag)', lambda i: db.get_logs(tag=TAGS[i % len(TAGS)])),
+        ('get_stats', lambda i: db.get_stats()),
+        ('search', lambda i: db.search('user{}'.format(i % 100), limit=20)),
+        ('search(filters)', lambda i: db.search('марафон', tag='#марафон', source='logs', limit=20)),
+        ('get_old_logs', lambda i: db.get_old_logs('9999-01-01 00:00:00', exclude_statuses=['failed'])),
+        # Модерация: чтение pending до того, как добавления ниже увеличат очередь
+        ('get_pending_moderation', lambda i: db.get_pending_moderation()),
+        ('add_moderation_item', lambda i: db.add_moderation_item(dict(item, message_id=rows * 2 + i))),
+        ('add_moderation_items[3]', lambda i: db.add_moderation_items([dict(item, message_id=rows * 3 + i)] * 3)),
+        ('update_moderation_status', lambda i: db.update_moderation_status(
+            'm{}'.format(rng.randrange(rows)), 'approved')),
+        ('get_moderation_by_id', lambda i: db.get_moderation_by_id('m{}'.format(rng.randrange(rows)))),
+        ('get_moderation_group', lambda i: db.get_moderation_group('m{}'.format(rng.randrange(rows // 5) * 5))),
+        ('find_message_data(moderation)', lambda i: db.find_message_data(
+            chat - i % CHATS, rows + (rng.randrange(rows // CHATS) * CHATS + i % CHATS))),
+        ('find_message_data(logs)', lambda i: db.find_message_data(
+            chat - i % CHATS, rng.randrange(rows // CHATS) * CHATS + i % CHATS)),
+        ('find_message_data(miss)', lambda i: db.find_message_data(chat, -1 - i)),
+        # Хэши медиа
+        ('add_media_hash', lambda i: db.add_media_hash('bench{:059x}'.format(i), 'f', 'photo', 1000, chat, i)),
+        ('check_media_hash(hit)', lambda i: db.check_media_hash('{:064x}'.format(rng.randrange(rows)))),
+        ('check_media_hash(miss)', lambda i: db.check_media_hash('miss{:060x}'.format(i))),
+        # Очередь реакций
+        ('get_reaction_queue', lambda i: db.get_reaction_queue()),
+        ('add_reaction_queue', add_reaction),
+        ('get_pending_reactions_count', lambda i: db.get_pending_reactions_count()),
+        ('increment_reaction_attempts', lambda i: db.increment_reaction_attempts(rng.randrange(1, rows + 1))),
+        # Заполненные строки с конца: id 1..rows
+        ('remove_reaction_from_queue', lambda i: db.remove_reaction_from_queue(rows - i)),
+        # Трассы и состояние конвейера
+        ('add_trace_data', lambda i: db.add_trace_data(
+            [('b{}'.format(i), chat, i, time.time())], [('b{}'.format(i), 'handler', 'bot', time.time(), 1.0, 'ok')])),
+        ('get_traces', lambda i: db.get_traces(chat - i % CHATS, rng.randrange(rows // CHATS) * CHATS + i % CHATS)),
+        ('prune_traces', lambda i: db.prune_traces(0)),
+        ('set_meta_values', lambda i: db.set_meta_values({'bench_heartbeat': i})),
+        ('get_pipeline_state', lambda i: db.get_pipeline_state()),
+        # Последним: очищает очередь (без повторов - замер одного вызова на всей таблице)
+        ('clear_reaction_queue', lambda i: db.clear_reaction_queue()),
+    ]
+
+# Методы, которые имеет смысл вызывать только один раз
+SINGLE_SHOT = ('clear_reaction_queue',)
+
+def measure(func, min_calls: int, max_calls: int, budget: float) -> dict:
+    """Вызывать func, пока не наберется min_calls и не кончится budget секунд (но не больше max_calls)"""
+    times = []
+    deadline = time.perf_counter() + budget
+    while len(times) < max_calls and (len(times) < min_calls or time.perf_counter() < deadline):
+        start = time.perf_counter()
+        func(len(times))
+        times.append(time.perf_counter() - start)
+    return {
+        'calls': len(times),
+        'p50_ms': round(percentile(times, 0.5) * 1000, 4),
+        'p99_ms': round(percentile(times, 0.99) * 1000, 4),
+        'mean_ms': round(sum(times) / len(times) * 1000, 4),
+    }
+
+def run(args) -> dict:
+    db_dir = args.db_dir or tempfile.mkdtemp(prefix="bench_database_")
+    os.makedirs(db_dir, exist_ok=True)
+    results = {}
+    for rows in args.rows:
+        print("📦 {} строк".format(rows))
+        rng = random.Random(args.seed)
+        db = open_database(rows, db_dir, rng)
+        results[str(rows)] = {}
+        for name, func in cases(db, rows, rng):
+            if args.only and not any(part in name for part in args.only):
+                continue
+            single = name in SINGLE_SHOT
+            results[str(rows)][name] = result = measure(
+                func, 1 if single else args.min_calls, 1 if single else args.max_calls, args.budget)
+            print("  ⏱️ {:<32} p50 {:>9.3f} мс  p99 {:>9.3f} мс  ({} вызовов)".format(
+                name, result['p50_ms'], result['p99_ms'], result['calls']))
+        if not args.db_dir:
+            for suffix in ('', '-wal', '-shm'):
+                if os.path.exists(db.db_path + suffix):
+                    os.remove(db.db_path + suffix)
+    return {
+        'created_at': datetime.now().isoformat(timespec='seconds'),
+        'python': platform.python_version(),
+        'sqlite': sqlite3.sqlite_version,
+        'platform': platform.platform(),
+        'results': results,
+    }
+
+def compare(report: dict, baseline: dict, tolerance: float, min_delta_ms: float) -> list:
+    """Регрессии p50 относительно baseline по методам и размерам, которые есть в обоих прогонах"""
+    regressions = []
+    for rows, methods in report['results'].items():
+        for name, result in methods.items():
+            base = baseline.get('results', {}).get(rows, {}).get(name)
+            # Один вызов - не статистика: такие методы только показываются
+            if not base or name in SINGLE_SHOT:
+                continue
+            delta = result['p50_ms'] - base['p50_ms']
+            if delta > min_delta_ms and result['p50_ms'] > base['p50_ms'] * (1 + tolerance):
+                regressions.append({
+                    'rows': int(rows), 'method': name,
+                    'baseline_ms': base['p50_ms'], 'p50_ms': result['p50_ms'],
+                    'ratio': round(result['p50_ms'] / base['p50_ms'], 2) if base['p50_ms'] else None,
+                })
+    return regressions
+
+def build_parser() -> argparse.ArgumentParser:
+    parser = argparse.ArgumentParser(description="Микробенчмарк методов Database")
+    parser.add_argument("--rows", type=int, nargs="+", default=list(SIZES), help="размеры таблиц")
+    parser.add_argument("--only", nargs="+", help="только методы, в имени которых есть подстрока")
+    parser.add_argument("--min-calls", type=int, default=20)
+    parser.add_argument("--max-calls", type=int, default=2000)
+    parser.add_argument("--budget", type=float, default=0.5, help="секунд на метод после min-calls")
+    parser.add_argument("--db-dir", help="где хранить заполненные БД между прогонами")
+    parser.add_argument("--seed", type=int, default=42)
+    parser.add_argument("--save", help="сохранить результаты в JSON")
+    parser.add_argument("--baseline", help="JSON прежнего прогона для сравнения")
+    parser.add_argument("--tolerance", type=float, default=0.25, help="допустимое ухудшение p50 (0.25 = 25%%)")
+    parser.add_argument("--min-delta-ms", type=float, default=0.05, help="разница p50 меньше этой - шум")
+    return parser
+
+def main(argv=None) -> int:
+    args = build_parser().parse_args(argv)
+    report = run(args)
+    if args.save:
+        with open(args.save, "w", encoding="utf-8") as f:
+            json.dump(report, f, ensure_ascii=False, indent=2)
+        print("💾 Результаты: {}".format(args.save))
+    if not args.baseline:
+        return 0
+
+    with open(args.baseline, encoding="utf-8") as f:
+        baseline = json.load(f)
+    regressions = compare(report, baseline, args.tolerance, args.min_delta_ms)
+    if not regressions:
+        print("✅ Регрессий нет (допуск {:.0%})".format(args.tolerance))
+        return 0
+    print("🚨 Регрессии p50 больше {:.0%}:".format(args.tolerance))
+    for r in regressions:
+        print("  ❌ {rows} строк, {method}: {baseline_ms:.3f} -> {p50_ms:.3f} мс (x{ratio})".format(**r))
+    return 1
+
+if __name__ == "__main__":
+    sys.exit(main())
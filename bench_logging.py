@@ -0,0 +1,114 @@
+#!/usr/bin/env python3
+# -*- coding: utf-8 -*-
+"""
+Бенчмарк логирования
+Сравнивает накладные расходы логов на одно сообщение в прежней схеме
+(фильтр внутри форматтера, уровень DEBUG, f-строки) и в текущей
+(VisibilityFilter + QueueHandler, уровень INFO, ленивые %-аргументы)
+"""
+
+import argparse
+import io
+import logging
+import os
+import sys
+import time
+from datetime import datetime
+
+sys.path.insert(0, os.path.dirname(os.path.abspath(__file__)))
+import logger_config
+from logger_config import ColoredFormatter
+
+# Примерно столько вызовов делает handle_any на одно сообщение с тегом
+DEBUG_CALLS = 30
+INFO_CALLS = 8
+
+class LegacyFormatter(ColoredFormatter):
+    """Прежний форматтер: сам решает видимость, для скрытых записей тоже вызывает getMessage()"""
+
+    def format(self, record):
+        message = record.getMessage().lower()
+        if record.levelno < logging.WARNING and not any(
+                word in message for word in ('ошибка', 'error', 'реакция', 'модерация', 'тег',
+                                             'process_reaction_queue', 'getupdates', 'http/1.1 200 ok')):
+            return None
+        return super().format(record)
+
+class LegacyFilter(logging.Filter):
+    """Прежний фильтр: форматирует запись, чтобы узнать, видима ли она"""
+
+    def __init__(self, formatter):
+        super().__init__()
+        self.formatter = formatter
+
+    def filter(self, record):
+        return self.formatter.format(record) is not None
+
+class Payload:
+    """Объект с дорогим repr, как Update/Message в реальных логах"""
+
+    def __repr__(self):
+        return "Message(chat_id=-1001234567890, message_id=1001, text='Мій #марафон день 12', " \
+               "date={})".format(datetime(2025, 9, 5, 18, 30))
+
+def setup_legacy(stream):
+    root = logging.getLogger()
+    logger_config._stop_listener()
+    root.handlers.clear()
+    root.setLevel(logging.DEBUG)
+    formatter = LegacyFormatter()
+    handler = logging.StreamHandler(stream)
+    handler.setFormatter(formatter)
+    handler.addFilter(LegacyFilter(formatter))
+    root.addHandler(handler)
+
+def setup_current(stream):
+    logger_config.setup_logging("BENCH", "INFO")
+    # Вывод в память вместо stdout, чтобы мерить логирование, а не терминал
+    logger_config._listener.handlers[0].setStream(stream)
+
+def legacy_message(logger, payload):
+    for i in range(DEBUG_CALLS):
+        logger.debug(f"🔍 Шаг {i}: проверка {payload}")
+    for i in range(INFO_CALLS):
+        logger.info(f"🎯 Найден тег #марафон для пользователя user{i}")
+
+def current_message(logger, payload):
+    for i in range(DEBUG_CALLS):
+        logger.debug("🔍 Шаг %s: проверка %s", i, payload)
+    for i in range(INFO_CALLS):
+        logger.info("🎯 Найден тег %s для пользователя %s", "#марафон", "user{}".format(i))
+
+def bench(name: str, func, logger, iterations: int):
+    """Время вызовов логгера на одно сообщение в потоке обработчика"""
+    payload = Payload()
+    start = time.perf_counter()
+    for _ in range(iterations):
+        func(logger, payload)
+    duration = time.perf_counter() - start
+    print("  {:<36} {:>8.1f} мкс/сообщ".format(name, duration / iterations * 1e6))
+    return duration
+
+def main():
+    parser = argparse.ArgumentParser(description="Бенчмарк логирования")
+    parser.add_argument("--iterations", type=int, default=5000)
+    args = parser.parse_args()
+
+    logger = logging.getLogger("__main__")
+    print("🏁 Логирование ({} debug + {} info вызовов на сообщение, {} сообщений)".format(
+        DEBUG_CALLS, INFO_CALLS, args.iterations))
+
+    setup_legacy(io.StringIO())
+    legacy = bench("legacy (DEBUG, фильтр в форматтере)", legacy_message, logger, args.iterations)
+
+    setup_current(io.StringIO())
+    current = bench("QueueHandler (INFO, %-аргументы)", current_message, logger, args.iterations)
+    start = time.perf_counter()
+    logger_config._stop_listener()
+    drain = time.perf_counter() - start
+    print("  {:<36} {:>8.1f} мкс/сообщ".format("вывод в потоке QueueListener (остаток)",
+                                                drain / args.iterations * 1e6))
+    print("  📊 Ускорение в потоке обработчика: {:.1f}x".format(legacy / current))
+
+if __name__ == "__main__":
+    main()
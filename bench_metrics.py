@@ -0,0 +1,60 @@
+#!/usr/bin/env python3
+# -*- coding: utf-8 -*-
+"""
+Бенчмарк метрик
+Стоимость одного наблюдения на горячем пути (цель - меньше 1 мкс)
+"""
+
+import argparse
+import os
+import sys
+import time
+
+sys.path.insert(0, os.path.dirname(os.path.abspath(__file__)))
+from metrics import Registry, Counter, Histogram
+
+def bench(name: str, func, iterations: int) -> float:
+    """Время одного вызова за вычетом пустого цикла"""
+    start = time.perf_counter()
+    for _ in range(iterations):
+        pass
+    empty = time.perf_counter() - start
+    start = time.perf_counter()
+    for _ in range(iterations):
+        func()
+    per_call = (time.perf_counter() - start - empty) / iterations * 1e6
+    print("  {:<44} {:>6.3f} мкс".format(name, per_call))
+    return per_call
+
+def main():
+    parser = argparse.ArgumentParser(description="Бенчмарк метрик")
+    parser.add_argument("--iterations", type=int, default=1000000)
+    args = parser.parse_args()
+
+    registry = Registry()
+    histogram = Histogram("bench_seconds", "Бенчмарк", registry=registry)
+    labeled = Histogram("bench_labeled_seconds", "Бенчмарк", ("handler", "outcome"), registry=registry)
+    counter = Counter("bench_total", "Бенчмарк", ("tag",), registry=registry)
+    child = labeled.labels("handle_any", "matched")
+    for i in range(100):
+        counter.labels("#тег{}".format(i))
+
+    print("🏁 Наблюдение метрики ({} итераций)".format(args.iterations))
+    results = [
+        bench("Histogram.observe (без меток)", lambda: histogram.observe(0.0003), args.iterations),
+        bench("labels(...).observe (2 метки)", lambda: labeled.labels("handle_any", "matched").observe(0.0003),
+              args.iterations),
+        bench("заранее полученная серия .observe", lambda: child.observe(0.0003), args.iterations),
+        bench("Counter.labels(tag).inc (100 тегов)", lambda: counter.labels("#тег42").inc(), args.iterations),
+        bench("perf_counter x2 + observe", lambda: histogram.observe(time.perf_counter() - time.perf_counter()),
+              args.iterations),
+    ]
+    worst = max(results)
+    print("  {} Худший случай: {:.3f} мкс на наблюдение".format("✅" if worst < 1 else "❌", worst))
+
+    start = time.perf_counter()
+    text = registry.render()
+    print("  📄 Экспорт: {} строк за {:.2f} мс".format(text.count("\n"), (time.perf_counter() - start) * 1000))
+
+if __name__ == "__main__":
+    main()
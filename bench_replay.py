@@ -0,0 +1,402 @@
+#!/usr/bin/env python3
+# -*- coding: utf-8 -*-
+"""
+Нагрузочный прогон бота: апдейты через настоящий Application
+
+Синтетические или записанные апдейты (JSONL, по одному Update из
+getUpdates на строку) кладутся в update_queue приложения, которое собирает
+bot.build_application - те же обработчики handle_text_message/handle_any,
+очередь реакций и job_queue. Bot API и бэкенд реакций подменяет локальный
+fake_telegram.py с настраиваемой задержкой, долей ответов 429 и
+лимитами Telegram на отправку (--limits).
+
+Отчет: сообщений в секунду, p50/p99 задержки от постановки апдейта в
+очередь до конца его обработки, итоги обработчиков, вызовы Bot API и рост
+БД (строки по таблицам и размер файлов).
+
+    python bench_replay.py --messages 2000
+    python bench_replay.py --messages 1000 --rate 50 --latency-ms 80 --rate-429 0.02
+    python bench_replay.py --updates recorded.jsonl --json report.json
+
+Режим soak (--soak-minutes): многочасовой прогон с постоянной частотой
+сообщений. Раз в --sample-seconds после gc.collect() снимаются RSS и
+tracemalloc (текущий объем и места наибольшего роста с прошлого
+замера). После прогрева рост по наклону прямой, МБ в час, считается по
+всем замерам и по второй их половине. Если оба выше
+--max-growth-mb-per-hour, рост устойчивый, и код выхода 1.
+
+    python bench_replay.py --soak-minutes 240 --rate 20 --json soak.json
+"""
+
+import argparse
+import asyncio
+import gc
+import itertools
+import json
+import os
+import random
+import sys
+import tempfile
+import time
+from collections import Counter
+
+sys.path.insert(0, os.path.dirname(os.path.abspath(__file__)))
+from fake_telegram import FakeTelegram
+from query_profiler import percentile
+import profiling
+
+TABLES = ('logs', 'moderation_queue', 'reaction_queue', 'media_hashes', 'traces', 'trace_spans')
+
+# Теги прогона: реакция сразу, модерация, реакция с задержкой через очередь
+BENCH_TAGS = [
+    {'tag': '#марафон', 'emoji': '🔥', 'require_photo': False, 'reply_ok': 'Зараховано!'},
+    {'tag': '#рецепт', 'emoji': '🍓', 'moderation_enabled': True, 'reply_pending': 'Рецепт на модерації'},
+    {'tag': '#відкладено', 'emoji': '👍', 'delay': 1, 'require_photo': False},
+]
+
+# Смесь сообщений: (вес, текст, с фото)
+SCENARIOS = (
+    (50, "#марафон день {n}", False),
+    (20, "#рецепт домашня паста {n}", True),
+    (10, "#відкладено {n}", False),
+    (20, "просто повідомлення {n}", False),
+)
+
+def synthetic_update(n: int, rng: random.Random, chats: int, users: int) -> dict:
+    """Update из getUpdates: сообщение в супергруппе, хэштег в entities"""
+    _, template, photo = rng.choices(SCENARIOS, weights=[s[0] for s in SCENARIOS])[0]
+    text = template.format(n=n)
+    entities = []
+    if text.startswith('#'):
+        # Длина в UTF-16, как считает Telegram
+        entities.append({'type': 'hashtag', 'offset': 0, 'length': len(text.split()[0].encode('utf-16-le')) // 2})
+    user_id = 1000 + rng.randrange(users)
+    message = {
+        'message_id': n,
+        'date': int(time.time()),
+        'chat': {'id': -1001000000000 - rng.randrange(chats), 'type': 'supergroup', 'title': 'Bench'},
+        'from': {'id': user_id, 'is_bot': False, 'first_name': 'User', 'username': 'user{}'.format(user_id)},
+    }
+    if photo:
+        message['photo'] = [{'file_id': 'photo-{}'.format(n), 'file_unique_id': 'p{}'.format(n),
+                             'width': 1280, 'height': 960, 'file_size': 50000}]
+        message['caption'] = text
+        message['caption_entities'] = entities
+    else:
+        message['text'] = text
+        message['entities'] = entities
+    return {'update_id': n, 'message': message}
+
+def load_updates(path: str) -> list:
+    with open(path, encoding='utf-8') as f:
+        return [json.loads(line) for line in f if line.strip()]
+
+def db_state(db) -> dict:
+    """Строки по таблицам и размер файлов БД (с WAL)"""
+    size = sum(os.path.getsize(path) for path in (db.db_path, db.db_path + '-wal') if os.path.exists(path))
+    with db.get_connection() as conn:
+        rows = {table: conn.execute("SELECT COUNT(*) FROM {}".format(table)).fetchone()[0] for table in TABLES}
+    return {'bytes': size, 'rows': rows}
+
+def configure_env(args, fake_url: str):
+    """Окружение бота до его импорта: bot.py читает настройки при загрузке"""
+    os.environ["BOT_TOKEN"] = "123456:BENCH"
+    os.environ["DATABASE_PATH"] = args.db or os.path.join(tempfile.mkdtemp(prefix="bench_replay_"), "bot_data.db")
+    os.environ["BOT_DEBUG_PORT"] = "0"
+    os.environ["LOG_LEVEL"] = args.log_level
+    # Данные о реакциях уходят на fake-бэкенд, как в проде на ADMIN_URL
+    os.environ["BOT_SHARED_SECRET"] = "bench"
+    os.environ["ADMIN_URL"] = fake_url
+
+def handler_outcomes(metrics) -> dict:
+    outcomes = Counter()
+    for (handler, outcome), child in metrics.HANDLER_SECONDS.children().items():
+        outcomes["{}:{}".format(handler, outcome)] += sum(child.counts)
+    return dict(outcomes)
+
+def reaction_outcomes(metrics) -> dict:
+    outcomes = Counter()
+    for (tag, outcome), child in metrics.REACTIONS.children().items():
+        outcomes[outcome] += child.value
+    return dict(outcomes)
+
+async def replay(args) -> dict:
+    fake = FakeTelegram(latency_ms=args.latency_ms, jitter_ms=args.jitter_ms, rate_429=args.rate_429,
+                        retry_after=args.retry_after, limits=args.limits, seed=args.seed)
+    await fake.start()
+    configure_env(args, fake.url)
+
+    import bot
+    import metrics
+    from telegram import Update
+    from telegram.ext import TypeHandler
+
+    db = bot.db
+    if not db.get_tags():
+        for tag in BENCH_TAGS:
+            db.create_tag(tag)
+
+    if args.updates:
+        updates = load_updates(args.updates)
+    else:
+        rng = random.Random(args.seed)
+        updates = [synthetic_update(n, rng, args.chats, args.users) for n in range(1, args.messages + 1)]
+
+    before = db_state(db)
+    app = bot.build_application(base_url=fake.base_url, base_file_url=fake.base_file_url)
+
+    queued_at = {}
+    latencies = []
+    finished = asyncio.Event()
+
+    async def mark_done(update, context):
+        # Последняя группа: все обработчики апдейта уже отработали
+        started = queued_at.pop(update.update_id, None)
+        if started is not None:
+            latencies.append(time.perf_counter() - started)
+        if len(latencies) == len(updates):
+            finished.set()
+
+    app.add_handler(TypeHandler(Update, mark_done), group=100)
+
+    timed_out = False
+    async with app:
+        await app.start()
+        interval = 1.0 / args.rate if args.rate else 0
+        start = time.perf_counter()
+        for i, data in enumerate(updates):
+            # Свои update_id: записанные апдейты могут повторяться между файлами
+            update = Update.de_json(dict(data, update_id=i + 1), app.bot)
+            queued_at[update.update_id] = time.perf_counter()
+            await app.update_queue.put(update)
+            if interval:
+                await asyncio.sleep(max(0.0, start + (i + 1) * interval - time.perf_counter()))
+            elif i % 100 == 99:
+                # Без паузы очередь заполнилась бы раньше, чем начнется обработка
+                await asyncio.sleep(0)
+        try:
+            await asyncio.wait_for(finished.wait(), timeout=args.timeout)
+        except asyncio.TimeoutError:
+            timed_out = True
+        handled = time.perf_counter() - start
+
+        # Отложенные реакции: job_queue разбирает очередь каждые 5 секунд
+        deadline = time.monotonic() + args.drain_timeout
+        while db.get_pending_reactions_count() and time.monotonic() < deadline:
+            await asyncio.sleep(0.5)
+        drained = time.perf_counter() - start
+        await app.stop()
+
+    bot.tracer.flush()
+    after = db_state(db)
+    await fake.stop()
+
+    return {
+        'messages': len(updates),
+        'handled': len(latencies),
+        'timed_out': timed_out,
+        'seconds': round(handled, 3),
+        'msgs_per_sec': round(len(latencies) / handled, 1) if handled else 0.0,
+        'latency_ms': {
+            'p50': round(percentile(latencies, 0.5) * 1000, 2),
+            'p99': round(percentile(latencies, 0.99) * 1000, 2),
+            'max': round(max(latencies) * 1000, 2) if latencies else 0.0,
+        },
+        'queue_drained_seconds': round(drained, 3),
+        'reaction_queue_left': after['rows']['reaction_queue'],
+        'handlers': handler_outcomes(metrics),
+        'reactions': reaction_outcomes(metrics),
+        'telegram': fake.report(),
+        'db': {
+            'path': db.db_path,
+            'bytes_before': before['bytes'],
+            'bytes_after': after['bytes'],
+            'rows_added': {table: after['rows'][table] - before['rows'][table] for table in TABLES},
+        },
+    }
+
+def growth_per_hour(samples: list, key: str) -> float:
+    """Наклон прямой по замерам (метод наименьших квадратов), МБ в час"""
+    points = [(sample['minutes'] / 60, sample[key] / 1024) for sample in samples if sample[key] is not None]
+    if len(points) < 2:
+        return 0.0
+    mean_x = sum(x for x, _ in points) / len(points)
+    mean_y = sum(y for _, y in points) / len(points)
+    spread = sum((x - mean_x) ** 2 for x, _ in points)
+    if not spread:
+        return 0.0
+    return round(sum((x - mean_x) * (y - mean_y) for x, y in points) / spread, 2)
+
+def growth_verdict(samples: list, warmup_minutes: float, limit: float) -> dict:
+    """Рост RSS и tracemalloc после прогрева; устойчивый - выше limit и на всем окне, и на второй половине"""
+    steady = [sample for sample in samples if sample['minutes'] >= warmup_minutes]
+    recent = steady[len(steady) // 2:]
+    verdict = {
+        'samples': len(steady),
+        'rss_mb_per_hour': growth_per_hour(steady, 'rss_kb'),
+        'rss_recent_mb_per_hour': growth_per_hour(recent, 'rss_kb'),
+        'traced_mb_per_hour': growth_per_hour(steady, 'traced_kb'),
+        'traced_recent_mb_per_hour': growth_per_hour(recent, 'traced_kb'),
+        'limit_mb_per_hour': limit,
+    }
+    # Меньше 4 замеров после прогрева - о тренде судить рано
+    verdict['leak'] = len(steady) >= 4 and any(
+        verdict[whole] > limit and verdict[half] > limit
+        for whole, half in (('rss_mb_per_hour', 'rss_recent_mb_per_hour'),
+                            ('traced_mb_per_hour', 'traced_recent_mb_per_hour')))
+    return verdict
+
+async def soak(args) -> dict:
+    """Постоянный поток апдейтов с частотой --rate; замеры памяти раз в --sample-seconds"""
+    fake = FakeTelegram(latency_ms=args.latency_ms, jitter_ms=args.jitter_ms, rate_429=args.rate_429,
+                        retry_after=args.retry_after, limits=args.limits, record_limit=1000, seed=args.seed)
+    await fake.start()
+    configure_env(args, fake.url)
+    # Трассировка включается до импорта бота, чтобы его объекты тоже учитывались
+    profiling.memory_start(frames=args.tracemalloc_frames)
+
+    import bot
+    from telegram import Update
+    from telegram.ext import TypeHandler
+
+    db = bot.db
+    if not db.get_tags():
+        for tag in BENCH_TAGS:
+            db.create_tag(tag)
+    app = bot.build_application(base_url=fake.base_url, base_file_url=fake.base_file_url)
+
+    queued_at = {}
+    latencies = []
+
+    async def mark_done(update, context):
+        started = queued_at.pop(update.update_id, None)
+        if started is not None:
+            latencies.append(time.perf_counter() - started)
+
+    app.add_handler(TypeHandler(Update, mark_done), group=100)
+
+    rng = random.Random(args.seed)
+    samples = []
+    sent = 0
+    async with app:
+        await app.start()
+        start = time.perf_counter()
+        deadline = start + args.soak_minutes * 60
+        next_sample = start
+        # n растет бесконечно: message_id и update_id не повторяются
+        for n in itertools.count(1):
+            now = time.perf_counter()
+            if now >= next_sample:
+                gc.collect()
+                memory = profiling.memory_snapshot(top=args.top)
+                sample = {
+                    'minutes': round((now - start) / 60, 2),
+                    'rss_kb': memory['rss_kb'],
+                    'traced_kb': memory['current_kb'],
+                    'sent': sent,
+                    'handled': len(latencies),
+                    'p99_ms': round(percentile(latencies, 0.99) * 1000, 2),
+                    'in_flight': len(queued_at),
+                    'tasks': len(asyncio.all_tasks()),
+                    'reaction_queue': db.get_pending_reactions_count(),
+                    'top_growth': [row for row in (memory['diff'] or []) if row['size_diff_kb'] > 0][:args.top],
+                }
+                samples.append(sample)
+                latencies.clear()
+                sent = 0
+                print("  📈 {:>7.1f} мин: RSS {:.1f} МБ, tracemalloc {:.1f} МБ, p99 {:.1f} мс, в работе {}, задач {}".format(
+                    sample['minutes'], (sample['rss_kb'] or 0) / 1024, sample['traced_kb'] / 1024,
+                    sample['p99_ms'], sample['in_flight'], sample['tasks']))
+                for row in sample['top_growth'][:3]:
+                    print("      +{:.1f} КБ {}".format(row['size_diff_kb'], row['site']))
+                next_sample += args.sample_seconds
+            if now >= deadline:
+                break
+            update = Update.de_json(synthetic_update(n, rng, args.chats, args.users), app.bot)
+            queued_at[update.update_id] = time.perf_counter()
+            await app.update_queue.put(update)
+            sent += 1
+            await asyncio.sleep(max(0.0, start + n / args.rate - time.perf_counter()))
+        await app.stop()
+
+    bot.tracer.flush()
+    await fake.stop()
+    profiling.memory_stop()
+
+    verdict = growth_verdict(samples, args.warmup_minutes, args.max_growth_mb_per_hour)
+    return {'soak': True, 'minutes': args.soak_minutes, 'rate': args.rate,
+            'verdict': verdict, 'samples': samples, 'telegram': fake.report()}
+
+def print_soak_report(report: dict):
+    verdict = report['verdict']
+    print("🏁 Soak: {} мин при {} сообщ/с, замеров после прогрева: {}".format(
+        report['minutes'], report['rate'], verdict['samples']))
+    print("  🧠 RSS: {:+.2f} МБ/ч (вторая половина {:+.2f}), tracemalloc: {:+.2f} МБ/ч ({:+.2f}), порог {} МБ/ч".format(
+        verdict['rss_mb_per_hour'], verdict['rss_recent_mb_per_hour'], verdict['traced_mb_per_hour'],
+        verdict['traced_recent_mb_per_hour'], verdict['limit_mb_per_hour']))
+    print("  {}".format("🚨 Память растет устойчиво" if verdict['leak'] else "✅ Устойчивого роста памяти нет"))
+
+def print_report(report: dict):
+    print("🏁 Прогон: {} сообщений, обработано {}{}".format(
+        report['messages'], report['handled'], " (таймаут!)" if report['timed_out'] else ""))
+    print("  ⚡ {:.1f} сообщ/с за {:.2f} с".format(report['msgs_per_sec'], report['seconds']))
+    latency = report['latency_ms']
+    print("  ⏱️ Задержка: p50 {:.1f} мс, p99 {:.1f} мс, max {:.1f} мс".format(
+        latency['p50'], latency['p99'], latency['max']))
+    print("  🔄 Очередь реакций разобрана за {:.2f} с, осталось {}".format(
+        report['queue_drained_seconds'], report['reaction_queue_left']))
+    print("  🎯 Итоги обработчиков: {}".format(report['handlers']))
+    print("  🎯 Итоги тегов: {}".format(report['reactions']))
+    print("  📡 Bot API: {}".format(report['telegram']['calls']))
+    if report['telegram']['errors']:
+        print("  🚨 Ошибки Bot API: {}".format(report['telegram']['errors']))
+    growth = report['db']
+    print("  🗄️ БД: {:.1f} КБ -> {:.1f} КБ, строк добавлено: {}".format(
+        growth['bytes_before'] / 1024, growth['bytes_after'] / 1024, growth['rows_added']))
+
+def build_parser() -> argparse.ArgumentParser:
+    parser = argparse.ArgumentParser(description="Нагрузочный прогон бота с fake Bot API")
+    parser.add_argument("--messages", type=int, default=1000, help="синтетических сообщений")
+    parser.add_argument("--updates", help="JSONL с записанными апдейтами вместо синтетических")
+    parser.add_argument("--rate", type=float, default=0, help="сообщений в секунду (0 - без паузы)")
+    parser.add_argument("--chats", type=int, default=5)
+    parser.add_argument("--users", type=int, default=200)
+    parser.add_argument("--latency-ms", type=float, default=0, help="задержка ответа Bot API")
+    parser.add_argument("--jitter-ms", type=float, default=0, help="случайная добавка к задержке")
+    parser.add_argument("--rate-429", type=float, default=0.0, help="доля ответов 429")
+    parser.add_argument("--retry-after", type=int, default=1)
+    parser.add_argument("--limits", action="store_true", help="лимиты Telegram на отправку сообщений")
+    parser.add_argument("--db", help="файл БД (по умолчанию - новый во временной папке)")
+    parser.add_argument("--timeout", type=float, default=300, help="ожидание обработки всех апдейтов, с")
+    parser.add_argument("--drain-timeout", type=float, default=30, help="ожидание очереди реакций, с")
+    parser.add_argument("--seed", type=int, default=42)
+    parser.add_argument("--log-level", default="WARNING")
+    parser.add_argument("--json", help="сохранить отчет в JSON")
+    soak_group = parser.add_argument_group("soak")
+    soak_group.add_argument("--soak-minutes", type=float, default=0, help="длительность soak-прогона (0 - обычный)")
+    soak_group.add_argument("--sample-seconds", type=float, default=60, help="период замеров памяти")
+    soak_group.add_argument("--warmup-minutes", type=float, default=5, help="замеры прогрева не учитываются")
+    soak_group.add_argument("--max-growth-mb-per-hour", type=float, default=10)
+    soak_group.add_argument("--tracemalloc-frames", type=int, default=1, help="глубина стека мест выделения")
+    soak_group.add_argument("--top", type=int, default=10, help="мест роста tracemalloc в замере")
+    return parser
+
+def main():
+    args = build_parser().parse_args()
+    if args.soak_minutes:
+        # Без паузы soak - это стресс-тест, а не прогон при рабочей нагрузке
+        args.rate = args.rate or 20
+        report = asyncio.run(soak(args))
+        print_soak_report(report)
+        failed = report['verdict']['leak']
+    else:
+        report = asyncio.run(replay(args))
+        print_report(report)
+        failed = report['timed_out']
+    if args.json:
+        with open(args.json, "w", encoding="utf-8") as f:
+            json.dump(report, f, ensure_ascii=False, indent=2)
+    sys.exit(1 if failed else 0)
+
+if __name__ == "__main__":
+    main()
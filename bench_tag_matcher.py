@@ -0,0 +1,229 @@
+#!/usr/bin/env python3
+# -*- coding: utf-8 -*-
+"""
+Бенчмарк сопоставления тегов
+Сравнивает пропускную способность нормализации и поиска тега по индексу
+"""
+
+import argparse
+import random
+import re
+import sys
+import os
+import time
+
+sys.path.insert(0, os.path.dirname(os.path.abspath(__file__)))
+from tag_matcher import TagIndex, normalize_ukrainian_text, extract_hashtags, edit_distance, fuzzy_limit
+
+# Типичные сообщения из чата марафона
+MESSAGES = [
+    "Мій #марафон день 12, пробіг 5 км 🏃",
+    "#звіт за тиждень: 3 тренування, 2 прогулянки, відчуваю себе чудово!",
+    "Сьогодні #пʼятниця, тому легка розтяжка #stretch",
+    "Доброго ранку всім! Хто вже на пробіжці?",
+    "Ранкова #йога 20 хвилин, дуже рекомендую цей комплекс",
+    "Finished #run10k today, new personal best",
+    "#мараф0н день 3 ✅",
+    "Дякую за підтримку, дівчата ❤️ " * 10,
+]
+
+# Длинная подпись с одним хэштегом в конце
+LONG_CAPTION = "Сьогодні пробігла свою першу десятку, було важко але я впоралась! " * 30 + "#марафон"
+
+def hashtag_entities(text: str):
+    """Разметка хэштегов в единицах UTF-16, как в MessageEntity"""
+    entities = []
+    for i, ch in enumerate(text):
+        if ch == "#" and (i == 0 or text[i - 1].isspace()):
+            end = text.find(' ', i)
+            end = len(text) if end == -1 else end
+            entities.append((len(text[:i].encode('utf-16-le')) // 2, len(text[i:end].encode('utf-16-le')) // 2))
+    return entities
+
+def legacy_normalize(text: str) -> str:
+    """Прежняя реализация: три последовательных str.replace"""
+    if not text:
+        return ""
+    normalized = text.strip().lower()
+    for old, new in {'ё': 'е', 'ъ': '', 'ы': 'и'}.items():
+        normalized = normalized.replace(old, new)
+    return normalized
+
+def make_tags(count: int):
+    """Сгенерировать теги: часть глобальные, часть привязаны к тредам"""
+    threads = ['', '', 'Марафон', 'Рецепти', 'Тренування']
+    tags = [
+        {'id': 'base1', 'tag': '#марафон', 'match_mode': 'equals', 'thread_name': 'Марафон'},
+        {'id': 'base2', 'tag': '#звіт', 'match_mode': 'equals', 'thread_name': ''},
+    ]
+    for i in range(count - len(tags)):
+        tags.append({
+            'id': 'tag{}'.format(i),
+            'tag': '#тег{}'.format(i),
+            'match_mode': 'prefix' if i % 3 == 0 else 'equals',
+            'thread_name': threads[i % len(threads)],
+        })
+    return tags
+
+def make_regex_tags(count: int, shared_prefix: bool = False):
+    """Regex-теги, все глобальные, чтобы проверялись на каждом сообщении
+
+    shared_prefix - у всех выражений общий только "#": худший случай, когда
+    отбор по префиксу ничего не отсекает и работает одна большая альтернация.
+    """
+    template = r'#\d+_тег{}' if shared_prefix else r'#тег{}_\d+'
+    return [
+        {'id': 're{}'.format(i), 'tag': template.format(i), 'match_mode': 'regex', 'thread_name': ''}
+        for i in range(count)
+    ] + [{'id': 're_day', 'tag': r'#day\d+', 'match_mode': 'regex', 'thread_name': ''}]
+
+def compiled_regex_loop(tags):
+    """Наивный вариант: заранее скомпилированный re.search по каждому тегу"""
+    patterns = [(re.compile(r'(?:^|\s)(?:' + tag['tag'] + r')(?=\s|$)', re.IGNORECASE), tag) for tag in tags]
+
+    def match(text: str):
+        normalized = normalize_ukrainian_text(text)
+        for pattern, tag in patterns:
+            if pattern.search(normalized):
+                return tag
+        return None
+    return match
+
+# Настоящие теги марафона и похожие на них, но другие хэштеги из переписки
+FUZZY_TAGS = ['#марафон', '#звіт', '#йога', '#stretch', '#run10k', '#рецепт', '#тренування', '#прогулянка']
+DECOY_HASHTAGS = ['#мама', '#зір', '#йогурт', '#ранок', '#рецепти', '#трен', '#run5k', '#strength',
+                  '#марафонці', '#звук', '#прогноз', '#дякую', '#мотивація', '#друзі']
+UKRAINIAN_LETTERS = 'абвгґдеєжзиіїйклмнопрстуфхцчшщьюя'
+LATIN_LETTERS = 'abcdefghijklmnopqrstuvwxyz'
+
+def make_typo(word: str, rng) -> str:
+    """Одна случайная правка после "#": пропуск, замена или лишняя буква того же алфавита"""
+    letters = LATIN_LETTERS if word[1] in LATIN_LETTERS else UKRAINIAN_LETTERS
+    pos = rng.randint(1, len(word) - 1)
+    kind = rng.choice(('delete', 'replace', 'insert'))
+    if kind == 'delete':
+        return word[:pos] + word[pos + 1:]
+    if kind == 'replace':
+        return word[:pos] + rng.choice(letters) + word[pos + 1:]
+    return word[:pos] + rng.choice(letters) + word[pos:]
+
+def make_fuzzy_tags(count: int, rng):
+    """Настоящие теги плюс случайные слова до нужного количества"""
+    words = list(FUZZY_TAGS)
+    while len(words) < count:
+        words.append('#' + ''.join(rng.choice(UKRAINIAN_LETTERS) for _ in range(rng.randint(5, 12))))
+    return [{'id': 'fz{}'.format(i), 'tag': word, 'match_mode': 'fuzzy', 'fuzzy_distance': 2, 'thread_name': ''}
+            for i, word in enumerate(dict.fromkeys(words))]
+
+def linear_fuzzy_match(tags):
+    """Наивный вариант: расстояние до каждого тега"""
+    limits = [(normalize_ukrainian_text(t['tag']), fuzzy_limit(t['tag'], 2), t) for t in tags]
+
+    def match(text: str):
+        for word in normalize_ukrainian_text(text).split():
+            for tag_text, limit, tag in limits:
+                if edit_distance(word, tag_text, limit) <= limit:
+                    return tag
+        return None
+    return match
+
+def bench_fuzzy(args, rng):
+    """Задержка и точность режима fuzzy"""
+    tags = make_fuzzy_tags(args.fuzzy_tags, rng)
+    start = time.perf_counter()
+    fuzzy_index = TagIndex(tags)
+    build = time.perf_counter() - start
+    exact_index = TagIndex([dict(t, match_mode='equals') for t in tags])
+
+    if args.corpus:
+        with open(args.corpus, encoding='utf-8') as f:
+            clean = [line.strip() for line in f if line.strip()]
+    else:
+        clean = list(MESSAGES) + ["Сьогодні {} і гарний настрій".format(h) for h in DECOY_HASHTAGS]
+    typos = [(tag, "Мій {} сьогодні".format(make_typo(tag, rng))) for tag in FUZZY_TAGS for _ in range(25)]
+
+    iterations = max(1, args.iterations // 100)
+    print("\n🏁 Fuzzy-теги ({} тегов, построение BK-деревьев {:.1f} мс, {} итераций)".format(
+        len(tags), build * 1000, iterations))
+    naive = bench("перебор всех тегов", linear_fuzzy_match(tags), iterations)
+    def cold_match(message):
+        fuzzy_index.global_bucket._fuzzy_cache.clear()
+        return fuzzy_index.match(message)
+    tree = bench("BK-дерево (без кэша слов)", cold_match, iterations)
+    bench("BK-дерево", lambda m: fuzzy_index.match(m), iterations)
+    print("  📊 Ускорение без кэша: {:.1f}x".format(naive / tree))
+
+    found = sum(1 for tag, text in typos if getattr(fuzzy_index.match(text), 'tag', None) == tag)
+    print("  🎯 Найдено опечаток: {}/{} ({:.1%})".format(found, len(typos), found / len(typos)))
+
+    # Ложное срабатывание: fuzzy нашел тег там, где строгое сравнение - нет.
+    # На реальном корпусе (--corpus) часть из них - настоящие опечатки: смотрите примеры
+    extra = [(text, fuzzy_index.match(text).tag) for text in clean
+             if fuzzy_index.match(text) is not None and exact_index.match(text) is None]
+    print("  ⚠️  Ложные срабатывания: {}/{} ({:.1%})".format(len(extra), len(clean), len(extra) / len(clean)))
+    for text, tag in extra[:5]:
+        print("     {} <- {}".format(tag, text[:60]))
+
+def bench(name: str, func, iterations: int):
+    """Прогнать функцию по корпусу и вывести пропускную способность"""
+    start = time.perf_counter()
+    for _ in range(iterations):
+        for message in MESSAGES:
+            func(message)
+    duration = time.perf_counter() - start
+    calls = iterations * len(MESSAGES)
+    print("  {:<28} {:>10.0f} сообщ/с  {:>8.2f} мкс/сообщ".format(name, calls / duration, duration / calls * 1e6))
+    return duration
+
+def main():
+    parser = argparse.ArgumentParser(description="Бенчмарк сопоставления тегов")
+    parser.add_argument("--iterations", type=int, default=20000)
+    parser.add_argument("--tags", type=int, default=100)
+    parser.add_argument("--regex-tags", type=int, default=1000)
+    parser.add_argument("--fuzzy-tags", type=int, default=1000)
+    parser.add_argument("--corpus", help="Файл с сообщениями по одному на строку, например "
+                                         "sqlite3 bot_data.db 'SELECT caption FROM logs'")
+    args = parser.parse_args()
+
+    random.seed(42)
+
+    print("🏁 Нормализация текста ({} итераций по {} сообщений)".format(args.iterations, len(MESSAGES)))
+    legacy = bench("legacy (str.replace)", legacy_normalize, args.iterations)
+    current = bench("NFKC + str.translate", normalize_ukrainian_text, args.iterations)
+    print("  📊 Ускорение относительно legacy: {:.2f}x".format(legacy / current))
+
+    index = TagIndex(make_tags(args.tags))
+    match_iterations = max(1, args.iterations // 10)
+    print("\n🏁 Поиск тега ({} тегов, {} итераций)".format(args.tags, match_iterations))
+    bench("TagIndex.match (глобальные)", lambda m: index.match(m, ""), match_iterations)
+    bench("TagIndex.match (тред)", lambda m: index.match(m, "Марафон"), match_iterations)
+
+    entities = {message: hashtag_entities(message) for message in MESSAGES}
+    bench("TagIndex.match (entities)",
+          lambda m: index.match(m, "Марафон", hashtags=extract_hashtags(m, entities[m])), match_iterations)
+
+    caption_entities = hashtag_entities(LONG_CAPTION)
+    print("\n🏁 Длинная подпись ({} символов, один хэштег)".format(len(LONG_CAPTION)))
+    full = bench("весь текст", lambda _: index.match(LONG_CAPTION, "Марафон"), match_iterations)
+    entity = bench("entities", lambda _: index.match(
+        LONG_CAPTION, "Марафон", hashtags=extract_hashtags(LONG_CAPTION, caption_entities)), match_iterations)
+    print("  📊 Ускорение: {:.1f}x".format(full / entity))
+
+    regex_iterations = max(1, args.iterations // 100)
+    for shared_prefix in (False, True):
+        regex_tags = make_regex_tags(args.regex_tags, shared_prefix)
+        start = time.perf_counter()
+        regex_index = TagIndex(regex_tags)
+        build = time.perf_counter() - start
+        print("\n🏁 Regex-теги ({} тегов{}, построение индекса {:.1f} мс, {} итераций)".format(
+            len(regex_tags), ", общий префикс" if shared_prefix else "", build * 1000, regex_iterations))
+        naive = bench("re.search по каждому тегу", compiled_regex_loop(regex_tags), regex_iterations)
+        union = bench("TagIndex (альтернация)", lambda m: regex_index.match(m), regex_iterations)
+        bench("TagIndex (entities)",
+              lambda m: regex_index.match(m, hashtags=extract_hashtags(m, entities[m])), regex_iterations)
+        print("  📊 Ускорение: {:.1f}x".format(naive / union))
+
+    bench_fuzzy(args, random.Random(42))
+
+if __name__ == "__main__":
+    main()
@@ -9,30 +9,44 @@ import asyncio
 import hashlib
 import uuid
 import logging
-import re
 import hmac
 import json
+import signal
+import time
 import aiohttp
+from aiohttp import web
 from pathlib import Path
 from datetime import datetime
 try:
-    from typing import Dict, Any, List, Optional
+    from typing import Dict, Any, List, Optional, Tuple
 except ImportError:
     # Для старых версий Python
     pass
 
-from telegram import Update, ReactionTypeEmoji
-from telegram.ext import Application, MessageHandler, CommandHandler, filters, ContextTypes
+from telegram import Update, ReactionTypeEmoji, MessageEntity
+from telegram.ext import Application, MessageHandler, CommandHandler, TypeHandler, filters, ContextTypes
+from telegram.request import HTTPXRequest
 from dotenv import load_dotenv
 
-from database import db
-from logger_config import setup_logging, log_bot_event
+from database import db, LOG_FLUSH_SECONDS
+import retention
+from query_profiler import profiler as query_profiler, apply_profile_config
+from tracing import Tracer, span, traced, current_trace_id, sqlite_timestamp
+from loop_monitor import watchdog as loop_watchdog
+import profiling
+from health import health_report
+from tag_matcher import Tag, MessagePlan, extract_hashtags, plan_matched_tags
+from logger_config import setup_logging, log_bot_event, get_events
+import metrics
+from metrics import (
+    HANDLER_SECONDS, TAG_MATCH_SECONDS, TAG_MATCHES, REACTIONS, TELEGRAM_API_SECONDS, observe_handler
+)
 
 # Загружаем переменные окружения
 load_dotenv()
 
 # Настраиваем красивое логирование
-setup_logging("MODERATOR BOT", "DEBUG")  # Изменяем уровень на DEBUG
+setup_logging("MODERATOR BOT")  # Уровень из LOG_LEVEL (по умолчанию INFO)
 logger = logging.getLogger('BOT')
 
 BOT_TOKEN = os.getenv("BOT_TOKEN")
@@ -43,9 +57,19 @@ if not BOT_TOKEN:
 BOT_SHARED_SECRET = os.getenv("BOT_SHARED_SECRET")
 ADMIN_URL = os.getenv("ADMIN_URL", "http://localhost:8000")
 FRONTEND_URL = os.getenv("FRONTEND_URL", "http://localhost:3000")
+ADMIN_TOKEN = os.getenv("ADMIN_TOKEN")
+# Порт служебного HTTP (события и метрики для админки), 0 - выключен
+BOT_DEBUG_PORT = int(os.getenv("BOT_DEBUG_PORT", "8081"))
+# Куда SIGUSR1/SIGUSR2 пишут профили (по умолчанию - рядом с БД, на томе data)
+PROFILE_DIR = os.getenv("PROFILE_DIR") or os.path.join(os.path.dirname(db.db_path) or ".", "profiles")
+PROFILE_SECONDS = float(os.getenv("PROFILE_SECONDS", "30"))
+# Адрес Bot API: локальный fake_telegram.py для бенчмарков и отладки
+TELEGRAM_API_URL = os.getenv("TELEGRAM_API_URL", "https://api.telegram.org").rstrip("/")
 
 logger.info("🔑 BOT_TOKEN найден: {}...{}".format(BOT_TOKEN[:10], BOT_TOKEN[-4:]))
 logger.info("🔗 ADMIN_URL: {}".format(ADMIN_URL))
+if TELEGRAM_API_URL != "https://api.telegram.org":
+    logger.info("🤖 TELEGRAM_API_URL: {}".format(TELEGRAM_API_URL))
 logger.info("🌐 FRONTEND_URL: {}".format(FRONTEND_URL))
 if BOT_SHARED_SECRET:
     logger.info("🔐 BOT_SHARED_SECRET найден: {}...".format(BOT_SHARED_SECRET[:8]))
@@ -54,6 +78,16 @@ else:
     logger.warning("⚠️ BOT_SHARED_SECRET не найден - функция привязки аккаунтов недоступна")
     logger.warning("⚠️ HTTP запросы на бэкенд будут отключены")
 
+# Трассы сообщений бота (спаны пишутся в БД пачками)
+tracer = Tracer("bot")
+
+# Время последнего апдейта от Telegram: держим в памяти, в meta его пишет bot_heartbeat_job
+last_update_at = None
+
+# Режим нескольких совпадений: засчитывать все теги сообщения, а не только первый
+MULTI_TAG_MATCH = os.getenv("MULTI_TAG_MATCH", "false").lower() in ("1", "true", "yes")
+logger.info("🏷️ Режим нескольких тегов: {}".format("включен" if MULTI_TAG_MATCH else "выключен"))
+
 # Логируем дополнительную информацию о конфигурации
 logger.debug("🗂️ DATABASE_PATH: {}".format(os.getenv('DATABASE_PATH', 'По умолчанию')))
 logger.debug("🐳 Запуск в Docker: {}".format('Да' if os.path.exists('/.dockerenv') else 'Нет'))
@@ -62,26 +96,6 @@ def get_file_hash(file_content: bytes) -> str:
     """Вычислить хэш файла"""
     return hashlib.md5(file_content).hexdigest()
 
-def normalize_ukrainian_text(text: str) -> str:
-    """Нормализация украинского текста для корректного сравнения"""
-    if not text:
-        return ""
-    
-    # Убираем лишние пробелы и приводим к нижнему регистру
-    normalized = text.strip().lower()
-    
-    # Заменяем возможные проблемные символы
-    replacements = {
-        'ё': 'е',  # русская ё на украинскую е
-        'ъ': '',   # твердый знак
-        'ы': 'и',  # русская ы на украинскую и
-    }
-    
-    for old, new in replacements.items():
-        normalized = normalized.replace(old, new)
-    
-    return normalized
-
 def create_hmac_signature(data: str, secret: str) -> str:
     """Создать HMAC-SHA256 подпись"""
     return hmac.new(
@@ -90,6 +104,23 @@ def create_hmac_signature(data: str, secret: str) -> str:
         hashlib.sha256
     ).hexdigest()
 
+# Одна HTTP-сессия на процесс: пул соединений к бэкенду вместо нового
+# ClientSession (коннектор, DNS-кэш, SSL-контекст) на каждый запрос
+_http_session = None
+
+def http_session() -> aiohttp.ClientSession:
+    """Общая aiohttp-сессия бота (создается в event loop при первом запросе)"""
+    global _http_session
+    if _http_session is None or _http_session.closed:
+        _http_session = aiohttp.ClientSession()
+    return _http_session
+
+async def close_http_session():
+    global _http_session
+    if _http_session is not None:
+        await _http_session.close()
+        _http_session = None
+
 async def link_telegram_account(code: str, user_id: int, username: str, first_name: str, last_name: str) -> Dict[str, Any]:
     """Отправить запрос на привязку Telegram аккаунта"""
     if not BOT_SHARED_SECRET:
@@ -109,28 +140,28 @@ async def link_telegram_account(code: str, user_id: int, username: str, first_na
     signature = create_hmac_signature(json_data, BOT_SHARED_SECRET)
     
     # Отправляем запрос
-    logger.debug(f"🔗 Отправляем запрос привязки на {FRONTEND_URL}/api/telegram/link")
-    logger.debug(f"📝 Данные запроса: {json_data}")
-    logger.debug(f"🔐 Подпись: {signature[:16]}...")
+    logger.debug("🔗 Отправляем запрос привязки на %s/api/telegram/link", FRONTEND_URL)
+    logger.debug("📝 Данные запроса: %s", json_data)
+    logger.debug("🔐 Подпись: %s...", signature[:16])
     
     try:
-        async with aiohttp.ClientSession() as session:
-            async with session.post(
-                f"{FRONTEND_URL}/api/telegram/link",
-                data=json_data,
-                headers={
-                    "Content-Type": "application/json",
-                    "X-Signature": signature
-                },
-                timeout=aiohttp.ClientTimeout(total=10)
-            ) as response:
-                response_data = await response.json()
-                logger.debug(f"📥 Ответ сервера: status={response.status}, data={response_data}")
-                return {
-                    "success": response.status == 200,
-                    "status_code": response.status,
-                    "data": response_data
-                }
+        session = http_session()
+        async with session.post(
+            f"{FRONTEND_URL}/api/telegram/link",
+            data=json_data,
+            headers={
+                "Content-Type": "application/json",
+                "X-Signature": signature
+            },
+            timeout=aiohttp.ClientTimeout(total=10)
+        ) as response:
+            response_data = await response.json()
+            logger.debug("📥 Ответ сервера: status=%s, data=%s", response.status, response_data)
+            return {
+                "success": response.status == 200,
+                "status_code": response.status,
+                "data": response_data
+            }
     except aiohttp.ClientError as e:
         logger.error(f"❌ Ошибка HTTP запроса: {e}")
         return {"success": False, "error": f"Ошибка сети: {e}"}
@@ -138,7 +169,8 @@ async def link_telegram_account(code: str, user_id: int, username: str, first_na
         logger.error(f"❌ Неожиданная ошибка: {e}")
         return {"success": False, "error": f"Неожиданная ошибка: {e}"}
 
-async def send_reaction_data(message, matched_tag: Dict[str, Any], media_info: Dict[str, Any], thread_name: str, status: str = "approved") -> Dict[str, Any]:
+@traced("backend_post")
+async def send_reaction_data(message, matched_tag: Tag, media_info: Dict[str, Any], thread_name: str, status: str = "approved") -> Dict[str, Any]:
     """Отправить данные о реакции на бэкенд"""
     logger.info(f"🚀 send_reaction_data ВЫЗВАНА! status={status}")
     logger.info(f"🔍 BOT_SHARED_SECRET: {'✅ есть' if BOT_SHARED_SECRET else '❌ нет'}")
@@ -154,9 +186,9 @@ async def send_reaction_data(message, matched_tag: Dict[str, Any], media_info: D
         "username": message.from_user.username or "",
         "first_name": message.from_user.first_name or "",
         "last_name": message.from_user.last_name or "",
-        "tag": matched_tag['tag'],
-        "counter_name": matched_tag.get('counter_name', ''),
-        "emoji": matched_tag['emoji'],
+        "tag": matched_tag.tag,
+        "counter_name": matched_tag.counter_name,
+        "emoji": matched_tag.emoji,
         "chat_id": str(message.chat_id),
         "message_id": str(message.message_id),
         "text": message.text or "",
@@ -176,50 +208,50 @@ async def send_reaction_data(message, matched_tag: Dict[str, Any], media_info: D
     # Отправляем запрос
     url = f"{ADMIN_URL}/api/telegram/reaction"
     logger.info(f"📊 Отправляем данные о реакции на: {url}")
-    logger.debug(f"📝 Данные реакции: {json_data}")
-    logger.debug(f"🔐 Подпись: {signature[:16]}...")
-    logger.debug(f"📋 Заголовки: Content-Type=application/json, X-Signature={signature[:16]}...")
+    logger.debug("📝 Данные реакции: %s", json_data)
+    logger.debug("🔐 Подпись: %s...", signature[:16])
+    logger.debug("📋 Заголовки: Content-Type=application/json, X-Signature=%s...", signature[:16])
     
     try:
-        async with aiohttp.ClientSession() as session:
-            logger.debug(f"🌐 Создаем HTTP сессию для {url}")
-            async with session.post(
-                url,
-                data=json_data,
-                headers={
-                    "Content-Type": "application/json",
-                    "X-Signature": signature
-                },
-                timeout=aiohttp.ClientTimeout(total=10)
-            ) as response:
-                logger.debug(f"📡 HTTP запрос отправлен, ожидаем ответ...")
-                if response.status == 200:
-                    response_data = await response.json()
-                    logger.info(f"✅ УСПЕШНО ОТПРАВЛЕНО:")
-                    logger.info(f"🌐 URL: {url}")
-                    logger.info(f"👤 Пользователь: {message.from_user.id}")
-                    logger.info(f"🏷️ Тег: {matched_tag['tag']}")
-                    logger.info(f"📊 Статус: {status}")
-                    logger.debug(f"📥 Ответ бэкенда: {response_data}")
-                    return {
-                        "success": True,
-                        "status_code": response.status,
-                        "data": response_data
-                    }
-                else:
-                    response_text = await response.text()
-                    logger.error(f"❌ ОШИБКА БЭКЕНДА:")
-                    logger.error(f"🌐 URL: {url}")
-                    logger.error(f"📊 HTTP код: {response.status}")
-                    logger.error(f"📄 Ответ бэкенда: '{response_text}'")
-                    logger.error(f"📋 Заголовки ответа: {dict(response.headers)}")
-                    logger.debug(f"📝 Отправленные данные: {json_data}")
-                    logger.debug(f"🔐 Полная подпись: {signature}")
-                    return {
-                        "success": False,
-                        "status_code": response.status,
-                        "data": {}
-                    }
+        session = http_session()
+        async with session.post(
+            url,
+            data=json_data,
+            headers={
+                "Content-Type": "application/json",
+                "X-Signature": signature,
+                "X-Trace-Id": current_trace_id()
+            },
+            timeout=aiohttp.ClientTimeout(total=10)
+        ) as response:
+            logger.debug("📡 HTTP запрос отправлен, ожидаем ответ...")
+            if response.status == 200:
+                response_data = await response.json()
+                logger.info(f"✅ УСПЕШНО ОТПРАВЛЕНО:")
+                logger.info(f"🌐 URL: {url}")
+                logger.info(f"👤 Пользователь: {message.from_user.id}")
+                logger.info(f"🏷️ Тег: {matched_tag.tag}")
+                logger.info(f"📊 Статус: {status}")
+                logger.debug("📥 Ответ бэкенда: %s", response_data)
+                return {
+                    "success": True,
+                    "status_code": response.status,
+                    "data": response_data
+                }
+            else:
+                response_text = await response.text()
+                logger.error(f"❌ ОШИБКА БЭКЕНДА:")
+                logger.error(f"🌐 URL: {url}")
+                logger.error(f"📊 HTTP код: {response.status}")
+                logger.error(f"📄 Ответ бэкенда: '{response_text}'")
+                logger.error(f"📋 Заголовки ответа: {dict(response.headers)}")
+                logger.debug("📝 Отправленные данные: %s", json_data)
+                logger.debug("🔐 Полная подпись: %s", signature)
+                return {
+                    "success": False,
+                    "status_code": response.status,
+                    "data": {}
+                }
     except aiohttp.ClientError as e:
         logger.error(f"❌ Ошибка HTTP запроса при отправке реакции: {e}")
         return {"success": False, "error": f"Ошибка сети: {e}"}
@@ -227,6 +259,7 @@ async def send_reaction_data(message, matched_tag: Dict[str, Any], media_info: D
         logger.error(f"❌ Неожиданная ошибка при отправке реакции: {e}")
         return {"success": False, "error": f"Неожиданная ошибка: {e}"}
 
+@traced("media_info")
 async def get_media_info(message) -> Dict[str, Any]:
     """Получить информацию о медиафайлах в сообщении"""
     media_info = {
@@ -262,22 +295,22 @@ async def check_media_duplicates(context: ContextTypes.DEFAULT_TYPE, message, me
         logger.debug("🖼️ Нет медиафайлов для проверки дубликатов")
         return False
     
-    logger.debug(f"🔍 Проверяем дубликаты для {len(media_info['media_file_ids'])} медиафайлов")
+    logger.debug("🔍 Проверяем дубликаты для %s медиафайлов", len(media_info['media_file_ids']))
     
     for file_id in media_info["media_file_ids"]:
         try:
-            logger.debug(f"📁 Обрабатываем файл: {file_id}")
+            logger.debug("📁 Обрабатываем файл: %s", file_id)
             
             # Получаем файл и вычисляем хэш
             file = await context.bot.get_file(file_id)
             file_content = await file.download_as_bytearray()
             file_hash = get_file_hash(bytes(file_content))
             
-            logger.debug(f"🔐 Хэш файла: {file_hash}")
+            logger.debug("🔐 Хэш файла: %s", file_hash)
 
             # Проверяем, есть ли уже такой хэш (от другого пользователя)
             if db.check_media_hash(file_hash, message.from_user.id):
-                logger.info(f"🚫 Обнаружен дубликат медиафайла от другого пользователя: {file_hash}")
+                logger.info("🚫 Обнаружен дубликат медиафайла от другого пользователя: %s", file_hash)
                 return True
 
             # Добавляем/обновляем хэш
@@ -286,7 +319,7 @@ async def check_media_duplicates(context: ContextTypes.DEFAULT_TYPE, message, me
                 file_hash, file_id, file_type,
                 message.from_user.id, message.chat_id, message.message_id
             )
-            logger.debug(f"✅ {file_type} добавлен/обновлён в базу: {file_hash}")
+            logger.debug("✅ %s добавлен/обновлён в базу: %s", file_type, file_hash)
             
         except Exception as e:
             logger.error(f"❌ Ошибка обработки медиафайла {file_id}: {e}")
@@ -332,9 +365,47 @@ async def log_failed_reaction(item: Dict[str, Any], error_message: str):
     except Exception as e:
         logger.error(f"❌ Ошибка записи лога неудачной реакции: {e}")
 
+class QueuedUser:
+    """Автор сообщения из очереди реакций: поля from_user, нужные send_reaction_data"""
+    __slots__ = ('id', 'username', 'first_name', 'last_name')
+
+    def __init__(self, data: Dict[str, Any]):
+        self.id = data['user_id']
+        self.username = data.get('username', '')
+        self.first_name = data.get('first_name', '')
+        self.last_name = data.get('last_name', '')
+
+class QueuedMessage:
+    """Сообщение из строки moderation_queue вместо telegram.Message для send_reaction_data"""
+    __slots__ = ('chat_id', 'message_id', 'text', 'caption', 'from_user')
+
+    def __init__(self, data: Dict[str, Any]):
+        self.chat_id = data['chat_id']
+        self.message_id = data['message_id']
+        self.text = data.get('text', '')
+        self.caption = data.get('caption', '')
+        self.from_user = QueuedUser(data)
+
+async def bot_heartbeat_job(context: ContextTypes.DEFAULT_TYPE):
+    """Пульс бота для /readyz: только из JobQueue, значит, что периодическая задача жива
+
+    Запасной вызов process_reaction_queue из обработки сообщений пульс не
+    пишет - иначе под трафиком /readyz был бы зеленым и с мертвой задачей.
+    """
+    pulse = {'bot_heartbeat': int(time.time())}
+    if last_update_at is not None:
+        pulse['bot_last_update'] = last_update_at
+    try:
+        db.set_meta_values(pulse)
+    except Exception as e:
+        logger.error(f"❌ Ошибка записи пульса бота: {e}")
+    await process_reaction_queue(context)
+
 async def process_reaction_queue(context: ContextTypes.DEFAULT_TYPE):
     """Обработать очередь реакций с оптимизацией"""
     try:
+        # Периодическая задача заодно сбрасывает накопленные спаны
+        tracer.flush_if_due()
         queue = db.get_reaction_queue()
         
         if not queue:
@@ -344,71 +415,65 @@ async def process_reaction_queue(context: ContextTypes.DEFAULT_TYPE):
         
         # Обрабатываем максимум 5 элементов за раз для избежания блокировки
         for i, item in enumerate(queue[:5]):
+            # Продолжаем трассу сообщения, которое поставило реакцию в очередь
+            trace = tracer.resume(item.get('trace_id'))
+            if trace:
+                trace[0].add_interval("reaction_queue", sqlite_timestamp(item.get('created_at')))
             try:
                 # Добавляем небольшую задержку между реакциями
                 if i > 0:
                     await asyncio.sleep(0.2)
                 
                 # Ставим реакцию
-                await context.bot.set_message_reaction(
-                    chat_id=item['chat_id'],
-                    message_id=item['message_id'],
-                    reaction=ReactionTypeEmoji(emoji=item['emoji'])
-                )
+                with span("set_reaction"):
+                    await context.bot.set_message_reaction(
+                        chat_id=item['chat_id'],
+                        message_id=item['message_id'],
+                        reaction=ReactionTypeEmoji(emoji=item['emoji'])
+                    )
                 
                 logger.info(f"✅ Реакция из очереди: {item['emoji']} → сообщение {item['message_id']}")
                 
                 # Получаем данные модерации для отправки на бэкенд
                 if item.get('moderation_id'):
                     try:
-                        moderation_item = db.get_moderation_by_id(item['moderation_id'])
-                        if moderation_item:
+                        # Вместе с элементом берем остальные теги его сообщения (режим нескольких тегов)
+                        moderation_items = db.get_moderation_group(item['moderation_id'])
+                        if moderation_items:
+                            moderation_item = moderation_items[0]
                             # Создаем объект сообщения для отправки данных
-                            class MockMessage:
-                                def __init__(self, data):
-                                    self.chat_id = data['chat_id']
-                                    self.message_id = data['message_id']
-                                    self.text = data.get('text', '')
-                                    self.caption = data.get('caption', '')
-                                    class MockUser:
-                                        def __init__(self, user_data):
-                                            self.id = user_data['user_id']
-                                            self.username = user_data.get('username', '')
-                                            self.first_name = user_data.get('first_name', '')
-                                            self.last_name = user_data.get('last_name', '')
-                                    self.from_user = MockUser(data)
-                            
-                            mock_message = MockMessage(moderation_item)
-                            matched_tag = {
-                                'tag': moderation_item.get('tag', ''),
-                                'counter_name': moderation_item.get('counter_name', ''),
-                                'emoji': moderation_item.get('emoji', '')
-                            }
+                            mock_message = QueuedMessage(moderation_item)
                             media_info = moderation_item.get('media_info', {})
                             thread_name = moderation_item.get('thread_name', '')
                             
-                            # Отправляем данные на бэкенд
-                            logger.debug("📊 Отправляем данные о реакции из очереди на бэкенд...")
-                            result = await send_reaction_data(mock_message, matched_tag, media_info, thread_name, "approved")
-                            if result.get('success'):
-                                logger.debug(f"📊 Данные из очереди отправлены успешно")
-                            else:
-                                logger.warning(f"📊 Ошибка отправки данных из очереди: {result}")
-
-                            # Записываем в лог
-                            log_data = {
-                                'user_id': moderation_item.get('user_id', 0),
-                                'username': moderation_item.get('username', ''),
-                                'chat_id': item['chat_id'],
-                                'message_id': item['message_id'],
-                                'trigger': moderation_item.get('tag', ''),
-                                'emoji': item['emoji'],
-                                'thread_name': thread_name,
-                                'media_type': media_info.get('has_photo') and 'photo' or (media_info.get('has_video') and 'video' or ''),
-                                'caption': moderation_item.get('caption', ''),
-                                'status': 'success'
-                            }
-                            db.add_log(log_data)
+                            log_entries = []
+                            for group_item in moderation_items:
+                                matched_tag = Tag.from_row(group_item)
+                                
+                                # Отправляем данные на бэкенд
+                                logger.debug("📊 Отправляем данные о реакции из очереди на бэкенд...")
+                                result = await send_reaction_data(mock_message, matched_tag, media_info, thread_name, "approved")
+                                if result.get('success'):
+                                    logger.debug("📊 Данные из очереди отправлены успешно")
+                                else:
+                                    logger.warning(f"📊 Ошибка отправки данных из очереди: {result}")
+
+                                log_entries.append({
+                                    'user_id': group_item.get('user_id', 0),
+                                    'username': group_item.get('username', ''),
+                                    'chat_id': item['chat_id'],
+                                    'message_id': item['message_id'],
+                                    'trigger': group_item.get('tag', ''),
+                                    'emoji': item['emoji'],
+                                    'thread_name': thread_name,
+                                    'media_type': media_info.get('has_photo') and 'photo' or (media_info.get('has_video') and 'video' or ''),
+                                    'caption': group_item.get('caption', ''),
+                                    'status': 'success'
+                                })
+
+                            # Записываем в лог одной транзакцией
+                            with span("db_log"):
+                                db.add_logs(log_entries)
                             logger.debug("📝 Запись добавлена в лог")
 
                             # Отправляем reply_ok для автоматических реакций
@@ -416,12 +481,13 @@ async def process_reaction_queue(context: ContextTypes.DEFAULT_TYPE):
                                 reply_ok = moderation_item.get('reply_ok', '')
                                 if reply_ok:
                                     try:
-                                        await context.bot.send_message(
-                                            chat_id=item['chat_id'],
-                                            text=reply_ok,
-                                            reply_to_message_id=item['message_id']
-                                        )
-                                        logger.debug(f"📤 Отправлено reply_ok: {reply_ok}")
+                                        with span("reply"):
+                                            await context.bot.send_message(
+                                                chat_id=item['chat_id'],
+                                                text=reply_ok,
+                                                reply_to_message_id=item['message_id']
+                                            )
+                                        logger.debug("📤 Отправлено reply_ok: %s", reply_ok)
                                     except Exception as reply_e:
                                         logger.warning(f"⚠️ Не удалось отправить reply_ok: {reply_e}")
 
@@ -455,34 +521,19 @@ async def process_reaction_queue(context: ContextTypes.DEFAULT_TYPE):
                         # Отправляем данные на бэкенд с запасной реакцией
                         if item.get('moderation_id'):
                             try:
-                                moderation_item = db.get_moderation_by_id(item['moderation_id'])
-                                if moderation_item:
-                                    class MockMessage:
-                                        def __init__(self, data):
-                                            self.chat_id = data['chat_id']
-                                            self.message_id = data['message_id']
-                                            self.text = data.get('text', '')
-                                            self.caption = data.get('caption', '')
-                                            class MockUser:
-                                                def __init__(self, user_data):
-                                                    self.id = user_data['user_id']
-                                                    self.username = user_data.get('username', '')
-                                                    self.first_name = user_data.get('first_name', '')
-                                                    self.last_name = user_data.get('last_name', '')
-                                            self.from_user = MockUser(data)
-                                    
-                                    mock_message = MockMessage(moderation_item)
-                                    matched_tag = {
-                                        'tag': moderation_item.get('tag', ''),
-                                        'counter_name': moderation_item.get('counter_name', ''),
-                                        'emoji': "❤️"  # Используем запасную реакцию
-                                    }
+                                moderation_items = db.get_moderation_group(item['moderation_id'])
+                                if moderation_items:
+                                    moderation_item = moderation_items[0]
+                                    mock_message = QueuedMessage(moderation_item)
                                     media_info = moderation_item.get('media_info', {})
                                     thread_name = moderation_item.get('thread_name', '')
                                     
                                     logger.info("📊 НАЧИНАЕМ отправку данных о запасной реакции на бэкенд...")
-                                    result = await send_reaction_data(mock_message, matched_tag, media_info, thread_name, "approved")
-                                    logger.info(f"📊 РЕЗУЛЬТАТ отправки данных запасной реакции: {result}")
+                                    for group_item in moderation_items:
+                                        # Используем запасную реакцию
+                                        matched_tag = Tag.from_row(dict(group_item, emoji="❤️"))
+                                        result = await send_reaction_data(mock_message, matched_tag, media_info, thread_name, "approved")
+                                        logger.info(f"📊 РЕЗУЛЬТАТ отправки данных запасной реакции: {result}")
                             except Exception as backend_e:
                                 logger.error(f"❌ Ошибка отправки данных о запасной реакции: {backend_e}")
                         
@@ -505,79 +556,115 @@ async def process_reaction_queue(context: ContextTypes.DEFAULT_TYPE):
                         # Записываем в лог как неудачу
                         await log_failed_reaction(item, str(e))
                         db.remove_reaction_from_queue(item['id'])
+            finally:
+                tracer.finish(trace)
     
     except Exception as e:
         logger.error(f"❌ Ошибка обработки очереди реакций: {e}")
 
-def add_to_moderation_queue(message, matched_tag: Dict[str, Any], media_info: Dict[str, Any], thread_name: str):
-    """Добавить сообщение в очередь модерации"""
+@traced("db_moderation")
+def add_to_moderation_queue(message, tags: List[Tag], media_info: Dict[str, Any], thread_name: str,
+                            approved_tags: List[Tag] = ()) -> List[str]:
+    """Добавить сообщение в очередь модерации (по элементу на каждый тег, одной записью в БД)
+
+    tags ждут модератора (pending), approved_tags - теги отложенной реакции
+    (auto_approved). ID возвращаются в том же порядке: сначала tags.
+    """
     try:
-        item_data = {
+        username = message.from_user.username or message.from_user.first_name or 'Unknown'
+        items = [{
             'chat_id': message.chat_id,
             'message_id': message.message_id,
             'user_id': message.from_user.id,
-            'username': message.from_user.username or message.from_user.first_name or 'Unknown',
-            'tag': matched_tag['tag'],
-            'emoji': matched_tag['emoji'],
+            'username': username,
+            'tag': tag.tag,
+            'emoji': tag.emoji,
             'text': message.text or '',
             'caption': message.caption or '',
             'media_info': media_info,
             'thread_name': thread_name,
-            'counter_name': matched_tag.get('counter_name', ''),
-            'reply_ok': matched_tag.get('reply_ok', '')
-        }
+            'counter_name': tag.counter_name,
+            'reply_ok': tag.reply_ok,
+            'status': status,
+            'trace_id': current_trace_id()
+        } for tag_list, status in ((tags, 'pending'), (approved_tags, 'auto_approved')) for tag in tag_list]
         
-        item_id = db.add_moderation_item(item_data)
-        log_bot_event('moderation_added', {
-            'user': item_data['username'],
-            'tag': item_data['tag'],
-            'id': item_id
-        })
-        return item_id
+        item_ids = db.add_moderation_items(items)
+        for item_id, item in zip(item_ids, items):
+            log_bot_event('moderation_added', {
+                'user': username,
+                'tag': item['tag'],
+                'id': item_id
+            })
+        return item_ids
         
     except Exception as e:
         log_bot_event('error', {'message': f"Ошибка добавления в очередь модерации: {e}"})
-        return None
+        return []
 
-def append_log(message, matched_tag: Dict[str, Any], thread_name: str, media_info: Dict[str, Any]):
-    """Добавить запись в лог"""
+@traced("db_log")
+def append_log(message, tags: List[Tag], thread_name: str, media_info: Dict[str, Any]):
+    """Добавить записи в лог (по одной на тег, одной транзакцией)"""
     try:
-        log_data = {
+        username = message.from_user.username or message.from_user.first_name or 'Unknown'
+        media_type = 'photo' if media_info['has_photo'] else ('video' if media_info['has_video'] else '')
+        db.add_logs([{
             'user_id': message.from_user.id,
-            'username': message.from_user.username or message.from_user.first_name or 'Unknown',
+            'username': username,
             'chat_id': message.chat_id,
             'message_id': message.message_id,
-            'trigger': matched_tag['tag'],
-            'emoji': matched_tag['emoji'],
+            'trigger': tag.tag,
+            'emoji': tag.emoji,
             'thread_name': thread_name,
-            'media_type': 'photo' if media_info['has_photo'] else ('video' if media_info['has_video'] else ''),
+            'media_type': media_type,
             'caption': message.caption or ''
-        }
-        
-        db.add_log(log_data)
+        } for tag in tags])
         
     except Exception as e:
         log_bot_event('error', {'message': f"Ошибка записи лога: {e}"})
 
+async def mark_update(update: Update, context: ContextTypes.DEFAULT_TYPE):
+    """Запомнить время апдейта (группа -1, до остальных обработчиков; без записи в БД)"""
+    global last_update_at
+    last_update_at = int(time.time())
+
+@observe_handler(HANDLER_SECONDS, "handle_any")
 async def handle_any(update: Update, context: ContextTypes.DEFAULT_TYPE):
-    """Обработчик всех сообщений"""
+    """Обработчик всех сообщений: трасса на сообщение вокруг process_message"""
+    message = update.message
+    if not message:
+        return await process_message(update, context)
+    
+    received_at = time.time()
+    trace = tracer.start(message.chat_id, message.message_id, received_at)
+    if trace and message.date:
+        # Задержка доставки: от отправки сообщения до получения апдейта ботом
+        trace[0].add_interval("delivery", message.date.timestamp(), received_at)
+    try:
+        return await process_message(update, context)
+    finally:
+        tracer.finish(trace)
+
+async def process_message(update: Update, context: ContextTypes.DEFAULT_TYPE):
+    """Обработка сообщения (возвращает итог для метрик)"""
     # Обрабатываем очередь реакций при каждом сообщении (фоллбэк)
-    await process_reaction_queue(context)
+    with span("reaction_queue_fallback"):
+        await process_reaction_queue(context)
     
     message = update.message
     if not message or not message.text and not message.caption:
         logger.debug("🚫 Сообщение пропущено: нет текста или подписи")
-        return
+        return "no_text"
     
     # Логируем входящее сообщение
     user_info = f"{message.from_user.username or message.from_user.first_name} (ID: {message.from_user.id})"
     text_preview = (message.text or message.caption or "")[:100]
-    logger.info(f"📨 Входящее сообщение от {user_info}: {text_preview}")
-    logger.debug(f"📍 Чат: {message.chat_id}, Сообщение: {message.message_id}")
-    logger.debug(f"🔍 Полный текст: {message.text or message.caption or 'Нет текста'}")
+    logger.info("📨 Входящее сообщение от %s: %s", user_info, text_preview)
+    logger.debug("📍 Чат: %s, Сообщение: %s", message.chat_id, message.message_id)
+    logger.debug("🔍 Полный текст: %s", message.text or message.caption or 'Нет текста')
     
     # Логируем информацию о пользователе
-    logger.debug(f"👤 Пользователь: @{message.from_user.username or 'без_username'} | {message.from_user.first_name or ''} {message.from_user.last_name or ''}")
+    logger.debug("👤 Пользователь: @%s | %s %s", message.from_user.username or 'без_username', message.from_user.first_name or '', message.from_user.last_name or '')
     
     # Логируем тип сообщения
     if message.photo:
@@ -587,197 +674,182 @@ async def handle_any(update: Update, context: ContextTypes.DEFAULT_TYPE):
     if message.is_topic_message:
         logger.debug("🧵 Сообщение в треде")
     
-    # Получаем все теги из БД (теперь с кэшированием)
-    tags = db.get_tags()
-    if not tags:
+    # Получаем индекс тегов из БД (строится вместе с кэшем)
+    tag_index = db.get_tag_index()
+    if not tag_index.tags:
         logger.debug("🚫 Нет настроенных тегов в базе данных")
-        return
+        return "no_tags"
     
-    logger.debug(f"🏷️ Загружено {len(tags)} тегов из базы данных (кэш)")
+    logger.debug("🏷️ Загружено %s тегов из базы данных (кэш)", len(tag_index.tags))
     
     # Получаем текст сообщения
-    text = (message.text or message.caption or "").lower()
-    logger.debug(f"📝 Обрабатываем текст: {text}")
+    text = message.text or message.caption or ""
+    logger.debug("📝 Обрабатываем текст: %s", text)
     
     # Получаем название треда
     thread_name = ""
-    logger.debug(f"🧵 is_topic_message: {message.is_topic_message}")
-    logger.debug(f"🧵 reply_to_message: {message.reply_to_message is not None}")
+    logger.debug("🧵 is_topic_message: %s", message.is_topic_message)
+    logger.debug("🧵 reply_to_message: %s", message.reply_to_message is not None)
     
     if message.is_topic_message and message.reply_to_message:
         try:
             logger.debug("🧵 Пытаемся получить имя треда...")
             thread_name = message.reply_to_message.forum_topic_created.name
-            logger.debug(f"🧵 Тред получен: '{thread_name}' (тип: {type(thread_name)})")
-            logger.debug(f"🧵 Тред в байтах: {thread_name.encode('utf-8') if thread_name else 'None'}")
+            logger.debug("🧵 Тред получен: '%s' (тип: %s)", thread_name, type(thread_name))
+            logger.debug("🧵 Тред в байтах: %s", thread_name.encode('utf-8') if thread_name else 'None')
         except Exception as e:
             thread_name = "Unknown Thread"
-            logger.debug(f"🧵 Ошибка получения треда: {e}")
+            logger.debug("🧵 Ошибка получения треда: %s", e)
             logger.debug("🧵 Тред: Unknown Thread")
     
-    # Ищем подходящий тег
-    matched_tag = None
-    logger.debug(f"🔍 Начинаем поиск совпадений среди {len(tags)} тегов")
+    # Хэштеги берем из разметки Telegram, чтобы не разбирать весь текст
+    entities = message.entities if message.text else message.caption_entities
+    hashtags = extract_hashtags(text, [
+        (entity.offset, entity.length) for entity in entities or () if entity.type == MessageEntity.HASHTAG
+    ])
+    logger.debug("#️⃣ Хэштеги из entities: %s", hashtags)
     
-    for tag in tags:
-        tag_text = tag['tag'].lower()
-        logger.debug(f"🏷️ Проверяем тег '{tag_text}' (режим: {tag['match_mode']})")
-        
-        # Проверяем соответствие режима поиска
-        if tag['match_mode'] == 'equals':
-            # Режим 1: Точное совпадение - тег должен быть отдельным словом
-            pattern = r'(?:^|\s)' + re.escape(tag_text) + r'(?=\s|$)'
-            if re.search(pattern, text):
-                matched_tag = tag
-                logger.info(f"✅ Найдено совпадение: {tag_text} (точное совпадение)")
-                break
-        elif tag['match_mode'] == 'prefix':
-            # Режим 2: Префикс - ищем слова которые начинаются с тега
-            words = text.split()
-            logger.debug(f"🔍 Слова в тексте: {words}")
-            logger.debug(f"🔍 Ищем слова начинающиеся с: '{tag_text}'")
-            for word in words:
-                logger.debug(f"🔍 Проверяем слово: '{word}' начинается с '{tag_text}'? {word.startswith(tag_text)}")
-                if word.startswith(tag_text):
-                    matched_tag = tag
-                    logger.info(f"✅ Найдено совпадение: {tag_text} -> {word} (префикс)")
-                    break
-            if matched_tag:
-                break
+    # Ищем подходящие теги только среди тегов этого треда и глобальных
+    match_start = time.perf_counter()
+    with span("tag_match"):
+        if MULTI_TAG_MATCH:
+            matched_tags = tag_index.match_all(text, thread_name, hashtags=hashtags)
+        else:
+            matched_tag = tag_index.match(text, thread_name, hashtags=hashtags)
+            matched_tags = [matched_tag] if matched_tag else []
+    TAG_MATCH_SECONDS.observe(time.perf_counter() - match_start)
     
-    if not matched_tag:
-        logger.debug("🚫 Совпадений не найдено")
-        return
+    if not matched_tags:
+        logger.debug("🚫 Совпадений не найдено (тред: '%s')", thread_name)
+        return "no_match"
 
-    try:
-        logger.debug(f"✅ Тег найден: {matched_tag.get('tag', 'UNKNOWN')}")
-        logger.debug(f"🔍 Тип matched_tag: {type(matched_tag)}")
-        
-        # Безопасное логирование содержимого
-        try:
-            logger.debug(f"🔍 Содержимое matched_tag: {dict(matched_tag)}")
-        except Exception as log_e:
-            logger.debug(f"🔍 Ошибка логирования matched_tag: {log_e}")
-        
-        logger.debug("🔍 Переходим к проверке треда...")
-        
-        tag_thread_name = matched_tag.get('thread_name', '')
-        logger.debug(f"🔍 Получили thread_name: '{tag_thread_name}'")
-        
-        # Нормализуем строки для сравнения украинских символов
-        tag_thread_normalized = normalize_ukrainian_text(tag_thread_name)
-        current_thread_normalized = normalize_ukrainian_text(thread_name)
-        logger.debug(f"🧵 Нормализованное сравнение: '{tag_thread_normalized}' vs '{current_thread_normalized}'")
-        
-        logger.debug(f"🧵 Проверяем тред: настроен='{tag_thread_name}', текущий='{thread_name}'")
+    for matched_tag in matched_tags:
+        TAG_MATCHES.labels(matched_tag.tag).inc()
+        logger.info("🎯 Тег сработал: %s (%s) | Пользователь: %s", matched_tag.tag, matched_tag.match_mode, user_info)
 
-        # Проверяем название треда если указано (используем нормализованные строки)
-        if tag_thread_normalized and current_thread_normalized != tag_thread_normalized:
-            logger.debug(f"🚫 Тред не совпадает: ожидается '{tag_thread_normalized}', получен '{current_thread_normalized}'")
-            return
-        
-        logger.debug("✅ Проверка треда пройдена")
-        
-    except Exception as e:
-        logger.error(f"❌ Ошибка при проверке тега/треда: {e}")
-        logger.error(f"❌ Тип ошибки: {type(e).__name__}")
-        try:
-            logger.error(f"❌ matched_tag: {dict(matched_tag) if matched_tag else 'None'}")
-        except:
-            logger.error(f"❌ matched_tag (raw): {matched_tag}")
-        return
-    
-    logger.info(f"🎯 Тег сработал: {matched_tag['tag']} | Пользователь: {user_info}")
-
-    # Логируем настройки тега
-    logger.debug(f"⚙️ Настройки тега:")
-    logger.debug(f"   🔥 Эмодзи: {matched_tag['emoji']}")
-    logger.debug(f"   📊 Счетчик: {matched_tag.get('counter_name', 'Не указан')}")
-    logger.debug(f"   ⏱️ Задержка: {matched_tag.get('delay', 0)}с")
-    logger.debug(f"   🔍 Модерация: {'Включена' if matched_tag.get('moderation_enabled') else 'Отключена'}")
-    logger.debug(f"   🖼️ Требует медиа: {'Да' if matched_tag.get('require_photo') else 'Нет'}")
-    if matched_tag.get('thread_name'):
-        logger.debug(f"   🧵 Только в треде: {matched_tag['thread_name']}")
+        # Логируем настройки тега (аргументы не вычисляем без DEBUG)
+        if logger.isEnabledFor(logging.DEBUG):
+            logger.debug("⚙️ Настройки тега:")
+            logger.debug("   🔥 Эмодзи: %s", matched_tag.emoji)
+            logger.debug("   📊 Счетчик: %s", matched_tag.counter_name or 'Не указан')
+            logger.debug("   ⏱️ Задержка: %sс", matched_tag.delay)
+            logger.debug("   🔍 Модерация: %s", 'Включена' if matched_tag.moderation_enabled else 'Отключена')
+            logger.debug("   🖼️ Требует медиа: %s", 'Да' if matched_tag.require_photo else 'Нет')
+            if matched_tag.thread_name:
+                logger.debug("   🧵 Только в треде: %s", matched_tag.thread_name)
     
     # Получаем информацию о медиафайлах
     media_info = await get_media_info(message)
-    logger.debug(f"🖼️ Медиа: фото={media_info['has_photo']}, видео={media_info['has_video']}")
+    logger.debug("🖼️ Медиа: фото=%s, видео=%s", media_info['has_photo'], media_info['has_video'])
     if media_info['media_file_ids']:
-        logger.debug(f"📁 ID файлов: {media_info['media_file_ids']}")
+        logger.debug("📁 ID файлов: %s", media_info['media_file_ids'])
     
     # Проверяем требование медиафайла
-    if matched_tag['require_photo'] and not (media_info['has_photo'] or media_info['has_video']):
-        logger.info(f"🚫 Требуется медиафайл, но его нет")
-        if matched_tag['reply_need_photo']:
-            await message.reply_text(matched_tag['reply_need_photo'])
-            logger.debug(f"📤 Отправлено сообщение: {matched_tag['reply_need_photo']}")
-        return
+    has_media = media_info['has_photo'] or media_info['has_video']
+    accepted_tags = [tag for tag in matched_tags if has_media or not tag.require_photo]
+    if not accepted_tags:
+        logger.info("🚫 Требуется медиафайл, но его нет")
+        for tag in matched_tags:
+            REACTIONS.labels(tag.tag, "need_photo").inc()
+        if matched_tags[0].reply_need_photo:
+            with span("reply"):
+                await message.reply_text(matched_tags[0].reply_need_photo)
+            logger.debug("📤 Отправлено сообщение: %s", matched_tags[0].reply_need_photo)
+        return "need_photo"
     
-    # Проверяем режим модерации
-    if matched_tag['moderation_enabled']:
+    # Все теги сообщения - одним планом: одна реакция и одна запись в БД
+    plan = plan_matched_tags(accepted_tags)
+    reaction_outcome, moderation_outcome = await handle_message_plan(message, plan, media_info, thread_name, user_info)
+    for tag in plan.reaction_tags:
+        REACTIONS.labels(tag.tag, reaction_outcome).inc()
+    for tag in plan.moderation_tags:
+        REACTIONS.labels(tag.tag, moderation_outcome).inc()
+    return "matched"
+
+async def handle_message_plan(message, plan: MessagePlan, media_info: Dict[str, Any], thread_name: str,
+                              user_info: str) -> Tuple[str, str]:
+    """Обработать сообщение по плану: одна реакция, одна запись в очередь модерации и один ответ
+
+    Возвращает итоги для метрик: (теги с реакцией - reaction, queued или error;
+    теги на модерации - moderation или error).
+    """
+    reaction_outcome = moderation_outcome = ""
+    delayed = bool(plan.reaction_tags) and plan.delay > 0
+    reaction_names = ', '.join(tag.tag for tag in plan.reaction_tags)
+
+    # Теги на модерации (pending) и теги отложенной реакции (auto_approved) - одной записью
+    item_ids = []
+    if plan.moderation_tags or delayed:
+        approved_tags = plan.reaction_tags if delayed else ()
         # При модерации НЕ проверяем дубликаты - модератор сам решит
-        logger.info(f"⏳ Добавляем в очередь модерации: {matched_tag['tag']}")
-        # Добавляем в очередь модерации
-        item_id = add_to_moderation_queue(message, matched_tag, media_info, thread_name)
-        logger.debug(f"📝 Создан элемент модерации ID: {item_id}")
-        
-        # Данные будут отправлены только при фактической установке реакции (после одобрения)
-        logger.info("📊 Сообщение добавлено в модерацию - данные будут отправлены после одобрения")
-        
-        # Отправляем сообщение о постановке в очередь
-        if matched_tag['reply_pending']:
-            await message.reply_text(matched_tag['reply_pending'])
-            logger.debug(f"📤 Отправлено сообщение о модерации: {matched_tag['reply_pending']}")
-        
-        return
+        logger.info("⏳ Добавляем в очередь модерации: %s", ', '.join(
+            tag.tag for tag in plan.moderation_tags + approved_tags))
+        item_ids = add_to_moderation_queue(message, plan.moderation_tags, media_info, thread_name, approved_tags)
+        logger.debug("📝 Созданы элементы модерации ID: %s", item_ids)
+        if plan.moderation_tags:
+            # Данные будут отправлены только при фактической установке реакции (после одобрения)
+            logger.info("📊 Сообщение добавлено в модерацию - данные будут отправлены после одобрения")
+            moderation_outcome = "moderation" if item_ids else "error"
 
-    # Обычный режим - ставим реакцию через очередь
-    delay = matched_tag['delay']
-    logger.info(f"🔥 Автоматическая реакция: {matched_tag['emoji']} | Задержка: {delay}с")
+    if not plan.reaction_tags:
+        # Реакции нет - отвечаем о постановке в очередь
+        primary_tag = plan.moderation_tags[0]
+        if item_ids and primary_tag.reply_pending:
+            with span("reply"):
+                await message.reply_text(primary_tag.reply_pending)
+            logger.debug("📤 Отправлено сообщение о модерации: %s", primary_tag.reply_pending)
+        return reaction_outcome, moderation_outcome
 
-    # Если задержка = 0, ставим реакцию сразу
-    if delay == 0:
-        try:
-            logger.info(f"🎯 ПОПЫТКА поставить реакцию: {matched_tag['emoji']} | Пользователь: {user_info}")
-            await message.set_reaction(ReactionTypeEmoji(emoji=matched_tag['emoji']))
-            logger.info(f"✅ Реакция УСПЕШНО поставлена: {matched_tag['emoji']} | Пользователь: {user_info}")
-
-            log_bot_event('reaction_set', {
-                'emoji': matched_tag['emoji'],
-                'user': message.from_user.username or message.from_user.first_name,
-                'tag': matched_tag['tag']
-            })
+    # Обычный режим - одна реакция на сообщение (эмодзи и ответ первого тега без модерации)
+    primary_tag = plan.reaction_tags[0]
+    logger.info("🔥 Автоматическая реакция: %s | Задержка: %sс | Теги: %s", plan.emoji, plan.delay, reaction_names)
 
-            # Отправляем данные о реакции на бэкенд
-            logger.info("📊 НАЧИНАЕМ отправку данных о реакции на бэкенд...")
-            result = await send_reaction_data(message, matched_tag, media_info, thread_name)
-            logger.info(f"📊 РЕЗУЛЬТАТ отправки данных: {result}")
+    if delayed:
+        # Реакция в очереди на все теги: остальные найдутся по group_id
+        logger.info("⏳ Добавляем в очередь с задержкой %sс", plan.delay)
+        if not item_ids:
+            return "error", moderation_outcome
+        reaction_item_id = item_ids[len(plan.moderation_tags)]
+        with span("db_reaction_queue"):
+            db.add_reaction_queue(reaction_item_id, message.chat_id, message.message_id, plan.emoji, plan.delay,
+                                  trace_id=current_trace_id())
+        logger.info("📝 Добавлено в очередь реакций, ID: %s, выполнение через %sс", reaction_item_id, plan.delay)
+        return "queued", moderation_outcome
 
-            # Отправляем сообщение об успехе
-            if matched_tag['reply_ok']:
-                await message.reply_text(matched_tag['reply_ok'])
-                logger.debug(f"📤 Отправлено сообщение об успехе: {matched_tag['reply_ok']}")
+    # Задержка = 0 - ставим реакцию сразу
+    try:
+        logger.info("🎯 ПОПЫТКА поставить реакцию: %s | Пользователь: %s", plan.emoji, user_info)
+        with span("set_reaction"):
+            await message.set_reaction(ReactionTypeEmoji(emoji=plan.emoji))
+        logger.info("✅ Реакция УСПЕШНО поставлена: %s | Пользователь: %s", plan.emoji, user_info)
 
-            # Записываем в лог
-            append_log(message, matched_tag, thread_name, media_info)
-            logger.debug("📝 Запись добавлена в локальный лог")
+        log_bot_event('reaction_set', {
+            'emoji': plan.emoji,
+            'user': message.from_user.username or message.from_user.first_name,
+            'tag': reaction_names
+        })
 
-        except Exception as e:
-            logger.error(f"❌ Ошибка постановки реакции: {e}")
-            log_bot_event('error', {'message': f"Ошибка постановки реакции: {e}"})
-        return
+        # Отправляем данные о реакции на бэкенд (по счетчику на каждый тег)
+        logger.info("📊 НАЧИНАЕМ отправку данных о реакции на бэкенд...")
+        for tag in plan.reaction_tags:
+            result = await send_reaction_data(message, tag, media_info, thread_name)
+            logger.info("📊 РЕЗУЛЬТАТ отправки данных (%s): %s", tag.tag, result)
 
-    # Если есть задержка - добавляем в очередь
-    logger.info(f"⏳ Добавляем в очередь с задержкой {delay}с")
+        # Отправляем сообщение об успехе
+        if primary_tag.reply_ok:
+            with span("reply"):
+                await message.reply_text(primary_tag.reply_ok)
+            logger.debug("📤 Отправлено сообщение об успехе: %s", primary_tag.reply_ok)
 
-    # Создаём запись в moderation_queue для хранения данных
-    item_id = add_to_moderation_queue(message, matched_tag, media_info, thread_name)
-    # Сразу помечаем как auto_approved
-    db.update_moderation_status(item_id, "auto_approved")
+        # Записываем в лог
+        append_log(message, plan.reaction_tags, thread_name, media_info)
+        logger.debug("📝 Запись добавлена в локальный лог")
 
-    # Добавляем в очередь реакций с задержкой
-    db.add_reaction_queue(item_id, message.chat_id, message.message_id, matched_tag['emoji'], delay)
-    logger.info(f"📝 Добавлено в очередь реакций, ID: {item_id}, выполнение через {delay}с")
+    except Exception as e:
+        logger.error(f"❌ Ошибка постановки реакции: {e}")
+        log_bot_event('error', {'message': f"Ошибка постановки реакции: {e}"})
+        return "error", moderation_outcome
+    return "reaction", moderation_outcome
 
 async def start_command(update: Update, context: ContextTypes.DEFAULT_TYPE):
     """Обработчик команды /start"""
@@ -869,6 +941,7 @@ async def handle_backend_response(update: Update, result: Dict[str, Any]):
         await update.message.reply_text("🚫 Сталася помилка. Спробуй ще раз")
         logger.error(f"❌ Неожиданный ответ бэкенда: status={status_code}, data={data}")
 
+@observe_handler(HANDLER_SECONDS, "handle_text_message")
 async def handle_text_message(update: Update, context: ContextTypes.DEFAULT_TYPE):
     """Обработчик текстовых сообщений (включая коды привязки)"""
     message = update.message
@@ -928,7 +1001,7 @@ async def handle_text_message(update: Update, context: ContextTypes.DEFAULT_TYPE
             return
     
     # Если это не код привязки, передаем в обычный обработчик
-    logger.debug(f"📝 Обычное текстовое сообщение от {user_info}, передаем в handle_any")
+    logger.debug("📝 Обычное текстовое сообщение от %s, передаем в handle_any", user_info)
     await handle_any(update, context)
 
 async def test_command(update: Update, context: ContextTypes.DEFAULT_TYPE):
@@ -956,24 +1029,226 @@ async def error_handler(update: object, context: ContextTypes.DEFAULT_TYPE) -> N
         'update_type': type(update).__name__ if update else 'Unknown'
     })
 
-def main():
-    """Основная функция"""
-    logger.info("🚀 Запуск бота с SQLite базой данных...")
-    logger.info(f"📁 Путь к базе данных: {db.db_path}")
+# ---- Метрики ----
+
+class InstrumentedRequest(HTTPXRequest):
+    """HTTPXRequest, который замеряет каждый запрос к Bot API"""
+
+    async def do_request(self, url: str, method: str, *args, **kwargs):
+        # Для скачивания файлов в URL путь к файлу - в метку идет только "file"
+        endpoint = "file" if "/file/bot" in url else url.rsplit("/", 1)[-1]
+        start = time.perf_counter()
+        outcome = "error"
+        try:
+            code, payload = await super().do_request(url, method, *args, **kwargs)
+            outcome = str(code)
+            return code, payload
+        except Exception as e:
+            outcome = type(e).__name__
+            raise
+        finally:
+            TELEGRAM_API_SECONDS.labels(endpoint, outcome).observe(time.perf_counter() - start)
+
+# Глубина очереди считается при чтении /metrics, а не на каждом сообщении
+metrics.Gauge("reaction_queue_depth", "Элементов в очереди реакций", callback=db.get_pending_reactions_count)
+
+# ---- Служебный HTTP для админки ----
+
+def is_admin_request(request: web.Request) -> bool:
+    return bool(ADMIN_TOKEN) and request.headers.get("Authorization", "") == "Bearer {}".format(ADMIN_TOKEN)
+
+async def metrics_handler(request: web.Request) -> web.Response:
+    """GET /metrics - метрики бота в формате Prometheus"""
+    if not is_admin_request(request):
+        return web.Response(status=401, text="Unauthorized")
+    return web.Response(body=metrics.render().encode("utf-8"), headers={"Content-Type": metrics.CONTENT_TYPE})
+
+async def debug_events_handler(request: web.Request) -> web.Response:
+    """GET /events - последние события бота из буфера (для /api/debug/events)"""
+    if not is_admin_request(request):
+        return web.json_response({"success": False, "message": "Unauthorized"}, status=401)
     
-    # Инициализируем базу данных
+    params = request.query
+    since = params.get("since")
     try:
-        db.init_database()
-        logger.info("✅ База данных успешно инициализирована")
+        events = get_events(
+            event=params.get("event"),
+            level=params.get("level"),
+            since=datetime.fromisoformat(since) if since else None,
+            after=int(params.get("after", 0)),
+            search=params.get("search"),
+            limit=min(int(params.get("limit", 100)), 1000)
+        )
+    except ValueError as e:
+        return web.json_response({"success": False, "message": str(e)}, status=400)
+    return web.json_response({"success": True, "data": events})
+
+async def sql_profile_handler(request: web.Request) -> web.Response:
+    """GET /sql - отчет профилировщика запросов, POST /sql - его настройки"""
+    if not is_admin_request(request):
+        return web.json_response({"success": False, "message": "Unauthorized"}, status=401)
+    if request.method == "POST":
+        apply_profile_config(query_profiler, await request.json())
+        return web.json_response({"success": True, "data": {
+            "enabled": query_profiler.enabled, "slow_ms": query_profiler.slow_ms
+        }})
+    return web.json_response({"success": True, "data": query_profiler.report()})
+
+async def loop_lag_handler(request: web.Request) -> web.Response:
+    """GET /loop - задержка event loop бота и последние остановки со стеками"""
+    if not is_admin_request(request):
+        return web.json_response({"success": False, "message": "Unauthorized"}, status=401)
+    return web.json_response({"success": True, "data": loop_watchdog.report()})
+
+async def cpu_profile_handler(request: web.Request) -> web.Response:
+    """GET /profile - CPU-профиль бота за seconds секунд (для /api/debug/profile)"""
+    if not is_admin_request(request):
+        return web.json_response({"success": False, "message": "Unauthorized"}, status=401)
+    params = request.query
+    try:
+        report = await profiling.profile_cpu(
+            float(params.get("seconds", 10)),
+            mode=params.get("mode", "cprofile"),
+            top=int(params.get("top", 30)),
+            sort=params.get("sort", "total")
+        )
+    except profiling.ProfileBusyError as e:
+        return web.json_response({"success": False, "message": str(e)}, status=409)
+    except ValueError as e:
+        return web.json_response({"success": False, "message": str(e)}, status=400)
+    return web.json_response({"success": True, "data": report})
+
+async def memory_profile_handler(request: web.Request) -> web.Response:
+    """GET /memory - снимок tracemalloc с разницей, POST /memory - start/stop"""
+    if not is_admin_request(request):
+        return web.json_response({"success": False, "message": "Unauthorized"}, status=401)
+    try:
+        if request.method == "POST":
+            payload = await request.json()
+            if payload.get("action") == "stop":
+                data = profiling.memory_stop()
+            else:
+                data = profiling.memory_start(payload.get("frames", 10))
+        else:
+            data = await asyncio.to_thread(
+                profiling.memory_snapshot, int(request.query.get("top", 30)), request.query.get("group_by", "lineno"))
+    except (RuntimeError, ValueError) as e:
+        return web.json_response({"success": False, "message": str(e)}, status=400)
+    return web.json_response({"success": True, "data": data})
+
+async def write_cpu_profile():
+    """SIGUSR1: CPU-профиль на PROFILE_SECONDS в PROFILE_DIR"""
+    logger.info("🔬 CPU-профиль бота на %s с...", PROFILE_SECONDS)
+    try:
+        report = await profiling.profile_cpu(PROFILE_SECONDS)
+        path = await asyncio.to_thread(profiling.write_report, PROFILE_DIR, "cpu", report)
+        logger.info("🔬 CPU-профиль записан: %s", path)
     except Exception as e:
-        logger.error(f"❌ Ошибка инициализации базы данных: {e}")
-        exit(1)
-    
-    # Создаем приложение
-    app = Application.builder().token(BOT_TOKEN).build()
+        logger.warning("⚠️ CPU-профиль не снят: %s", e)
+
+def write_memory_profile():
+    """SIGUSR2: первый сигнал включает tracemalloc, следующие пишут снимок с разницей"""
+    try:
+        if not profiling.memory_status()['tracing']:
+            profiling.memory_start()
+            profiling.memory_snapshot()
+            logger.info("🔬 tracemalloc включен, следующий SIGUSR2 запишет разницу")
+            return
+        path = profiling.write_report(PROFILE_DIR, "memory", profiling.memory_snapshot())
+        logger.info("🔬 Снимок памяти записан: %s", path)
+    except Exception as e:
+        logger.warning("⚠️ Снимок памяти не снят: %s", e)
+
+# Ссылки на задачи профиля по сигналу, чтобы их не собрал GC
+_profile_tasks = set()
+
+def start_cpu_profile_task():
+    task = asyncio.ensure_future(write_cpu_profile())
+    _profile_tasks.add(task)
+    task.add_done_callback(_profile_tasks.discard)
+
+def install_profile_signals():
+    loop = asyncio.get_running_loop()
+    try:
+        loop.add_signal_handler(signal.SIGUSR1, start_cpu_profile_task)
+        loop.add_signal_handler(signal.SIGUSR2, write_memory_profile)
+    except (NotImplementedError, AttributeError):
+        # Windows: сигналов нет, остается служебный HTTP
+        return
+    logger.debug("🔬 Профили по сигналам: SIGUSR1 - CPU, SIGUSR2 - память -> %s", PROFILE_DIR)
+
+async def health_handler(request: web.Request) -> web.Response:
+    """GET /healthz - жив ли бот, GET /readyz - 503, если конвейер отстает (без токена)"""
+    report = await asyncio.to_thread(health_report)
+    if request.path == "/readyz":
+        failed = report['status'] != 'ok'
+    else:
+        failed = 'sqlite' in report['checks']
+    return web.json_response(report, status=503 if failed else 200)
+
+async def start_debug_server(app: Application) -> None:
+    """Запуск сторожа event loop, сигналов профилирования и служебного HTTP (post_init)"""
+    loop_watchdog.start()
+    install_profile_signals()
+    if not BOT_DEBUG_PORT:
+        return
+    web_app = web.Application()
+    web_app.router.add_get("/events", debug_events_handler)
+    web_app.router.add_get("/metrics", metrics_handler)
+    web_app.router.add_route("*", "/sql", sql_profile_handler)
+    web_app.router.add_get("/loop", loop_lag_handler)
+    web_app.router.add_get("/healthz", health_handler)
+    web_app.router.add_get("/readyz", health_handler)
+    web_app.router.add_get("/profile", cpu_profile_handler)
+    web_app.router.add_route("*", "/memory", memory_profile_handler)
+    runner = web.AppRunner(web_app, access_log=None)
+    await runner.setup()
+    await web.TCPSite(runner, "0.0.0.0", BOT_DEBUG_PORT).start()
+    app.bot_data["debug_runner"] = runner
+    logger.info("🩺 Служебный HTTP бота слушает порт %s", BOT_DEBUG_PORT)
+
+async def flush_log_buffer(context: ContextTypes.DEFAULT_TYPE):
+    """Записать отложенные логи, если самая старая строка ждет дольше LOG_FLUSH_SECONDS"""
+    db.flush_logs_if_due()
+
+async def apply_log_retention(context: ContextTypes.DEFAULT_TYPE):
+    """Перенести старые логи в архив по LOG_RETENTION (несколько небольших пачек за раз)"""
+    try:
+        await asyncio.to_thread(retention.run_retention, db)
+    except Exception as e:
+        logger.warning("⚠️ Не удалось перенести логи в архив: %s", e)
+
+async def stop_debug_server(app: Application) -> None:
+    """Остановка служебного HTTP и сторожа, запись оставшихся логов и спанов (post_shutdown)"""
+    db.flush_logs()
+    tracer.flush()
+    await close_http_session()
+    await loop_watchdog.stop()
+    runner = app.bot_data.pop("debug_runner", None)
+    if runner:
+        await runner.cleanup()
+
+def build_application(base_url: str = None, base_file_url: str = None) -> Application:
+    """Application со всеми обработчиками и очередью реакций
+
+    base_url/base_file_url - другой адрес Bot API (bench_replay.py
+    подставляет локальный fake_telegram.py), по умолчанию - из TELEGRAM_API_URL.
+    """
+    base_url = base_url or TELEGRAM_API_URL + "/bot"
+    base_file_url = base_file_url or TELEGRAM_API_URL + "/file/bot"
+    builder = (
+        Application.builder()
+        .token(BOT_TOKEN)
+        .request(InstrumentedRequest(connection_pool_size=256))
+        .get_updates_request(InstrumentedRequest())
+        .post_init(start_debug_server)
+        .post_shutdown(stop_debug_server)
+    )
+    app = builder.base_url(base_url).base_file_url(base_file_url).build()
     logger.debug("🔧 Telegram Application создан")
     
     # Добавляем обработчики
+    app.add_handler(TypeHandler(Update, mark_update), group=-1)
     app.add_handler(CommandHandler("start", start_command))
     app.add_handler(CommandHandler("test", test_command))
     app.add_handler(MessageHandler(filters.TEXT & ~filters.COMMAND, handle_text_message))
@@ -988,13 +1263,37 @@ def main():
     try:
         job_queue = app.job_queue
         if job_queue:
-            job_queue.run_repeating(process_reaction_queue, interval=5, first=1)
+            job_queue.run_repeating(bot_heartbeat_job, interval=5, first=1)
             logger.info("✅ Периодическая обработка очереди реакций настроена (каждые 5 секунд)")
+            # Логи реакций пишутся пачками; без JobQueue буфер не включается
+            db.enable_log_buffer()
+            if LOG_FLUSH_SECONDS > 0:
+                job_queue.run_repeating(flush_log_buffer, interval=LOG_FLUSH_SECONDS, first=LOG_FLUSH_SECONDS)
+            if retention.RETENTION_INTERVAL_SECONDS > 0:
+                job_queue.run_repeating(apply_log_retention, interval=retention.RETENTION_INTERVAL_SECONDS,
+                                        first=retention.RETENTION_INTERVAL_SECONDS)
         else:
             logger.warning("⚠️ JobQueue недоступен, используется фоллбэк")
     except Exception as e:
         logger.warning(f"⚠️ JobQueue недоступен ({e}), используется фоллбэк при каждом сообщении")
     
+    return app
+
+def main():
+    """Основная функция"""
+    logger.info("🚀 Запуск бота с SQLite базой данных...")
+    logger.info(f"📁 Путь к базе данных: {db.db_path}")
+    
+    # Инициализируем базу данных
+    try:
+        db.init_database()
+        logger.info("✅ База данных успешно инициализирована")
+    except Exception as e:
+        logger.error(f"❌ Ошибка инициализации базы данных: {e}")
+        exit(1)
+    
+    app = build_application()
+    
     logger.info("✅ Бот запущен и готов к работе!")
     logger.info("🔍 Ожидаем входящие сообщения...")
     
@@ -0,0 +1,153 @@
+#!/usr/bin/env python3
+# -*- coding: utf-8 -*-
+"""
+Очистка логов по частям в фоне (DELETE /api/logs в админке)
+
+Вместо одной транзакции на все таблицы строки удаляются пачками, каждая
+пачка - своя короткая транзакция. Между ними бот успевает записать свои
+логи и реакции. Размер пачки подстраивается под CLEAR_LOCK_BUDGET_MS:
+растет, пока удаление быстрее четверти бюджета, и уменьшается, если
+дольше половины. Если пачка все же держит блокировку записи дольше
+бюджета, SQLite прерывает ее и откатывает, а пачка делится пополам.
+
+Очищается то, что было в таблицах к началу очистки (граница по rowid).
+Строки, добавленные во время очистки, остаются.
+"""
+
+import functools
+import logging
+import os
+import threading
+import time
+try:
+    from typing import Dict, Any, Optional
+except ImportError:
+    # Для старых версий Python
+    pass
+
+from database import Database, CLEAR_TABLES
+
+logger = logging.getLogger(__name__)
+
+CLEAR_LOCK_BUDGET_MS = float(os.getenv("CLEAR_LOCK_BUDGET_MS", "50"))
+CLEAR_CHUNK_ROWS = int(os.getenv("CLEAR_CHUNK_ROWS", "1000"))
+CLEAR_MAX_CHUNK_ROWS = 50000
+# Пауза между пачками: окно для записей бота
+CLEAR_PAUSE_MS = float(os.getenv("CLEAR_PAUSE_MS", "10"))
+
+# Ключи итогов в ответе API (как у прежней очистки одной транзакцией)
+RESULT_KEYS = {'logs': 'deleted_logs', 'reaction_queue': 'deleted_reactions', 'moderation_queue': 'deleted_moderation'}
+
+class ClearLogsJob:
+    """Фоновая очистка таблиц CLEAR_TABLES; одна одновременно"""
+
+    def __init__(self, db: Database, budget_ms: float = None, chunk_rows: int = None, pause_ms: float = None):
+        self.db = db
+        self.budget_ms = CLEAR_LOCK_BUDGET_MS if budget_ms is None else budget_ms
+        self.chunk_rows = chunk_rows or CLEAR_CHUNK_ROWS
+        self.pause_ms = CLEAR_PAUSE_MS if pause_ms is None else pause_ms
+        self._lock = threading.Lock()
+        self._thread = None
+        self._progress = {'state': 'idle'}
+
+    @property
+    def running(self) -> bool:
+        return self._thread is not None and self._thread.is_alive()
+
+    def start(self) -> Dict[str, Any]:
+        """Запустить очистку в фоне (или вернуть состояние уже идущей)"""
+        with self._lock:
+            if not self.running:
+                self._progress = {
+                    'state': 'running',
+                    'started_at': time.time(),
+                    'finished_at': None,
+                    'tables': {},
+                    'chunks': 0,
+                    'interrupted_chunks': 0,
+                    'max_lock_ms': 0.0,
+                    'budget_ms': self.budget_ms,
+                    'error': None,
+                }
+                self._thread = threading.Thread(target=self.run, name="clear-logs", daemon=True)
+                self._thread.start()
+        return self.status()
+
+    def status(self) -> Dict[str, Any]:
+        """Снимок прогресса: по таблицам удалено/всего, пачки, самая долгая блокировка"""
+        with self._lock:
+            progress = dict(self._progress)
+            progress['tables'] = {table: dict(counts) for table, counts in progress.get('tables', {}).items()}
+        for table, key in RESULT_KEYS.items():
+            progress[key] = progress['tables'].get(table, {}).get('deleted', 0)
+        return progress
+
+    def wait(self, timeout: float = None) -> Dict[str, Any]:
+        if self._thread:
+            self._thread.join(timeout)
+        return self.status()
+
+    def run(self):
+        """Очистить все таблицы по очереди (в потоке start или напрямую)"""
+        try:
+            bounds = {table: self.db.get_max_rowid(table) for table in CLEAR_TABLES}
+            with self._lock:
+                self._progress['tables'] = {table: {'deleted': 0, 'max_rowid': bound}
+                                            for table, bound in bounds.items()}
+            for table, bound in bounds.items():
+                if bound:
+                    delete_in_chunks(self.db, table, bound, self.budget_ms, self.chunk_rows, self.pause_ms,
+                                     on_chunk=functools.partial(self._record_chunk, table))
+            with self._lock:
+                self._progress['state'] = 'done'
+            logger.info("🧹 Очистка логов завершена: %s", {
+                table: counts['deleted'] for table, counts in self._progress['tables'].items()})
+        except Exception as e:
+            with self._lock:
+                self._progress['state'] = 'failed'
+                self._progress['error'] = str(e)
+            logger.error("❌ Ошибка очистки логов: %s", e)
+        finally:
+            with self._lock:
+                self._progress['finished_at'] = time.time()
+
+    def _record_chunk(self, table: str, deleted: Optional[int], held_ms: float):
+        with self._lock:
+            progress = self._progress
+            progress['max_lock_ms'] = round(max(progress['max_lock_ms'], held_ms), 2)
+            if deleted is None:
+                progress['interrupted_chunks'] += 1
+            else:
+                progress['chunks'] += 1
+                progress['tables'][table]['deleted'] += deleted
+
+def delete_in_chunks(db: Database, table: str, max_rowid: int, budget_ms: float = None, chunk_rows: int = None,
+                     pause_ms: float = None, on_chunk=None) -> int:
+    """Удалить строки таблицы с rowid <= max_rowid пачками; вернуть число удаленных
+
+    on_chunk(deleted, held_ms) вызывается после каждой пачки (deleted None -
+    пачка прервана по бюджету и откатилась).
+    """
+    budget_ms = CLEAR_LOCK_BUDGET_MS if budget_ms is None else budget_ms
+    chunk = chunk_rows or CLEAR_CHUNK_ROWS
+    pause_ms = CLEAR_PAUSE_MS if pause_ms is None else pause_ms
+    total = 0
+    while True:
+        deleted, held_ms = db.delete_chunk(table, max_rowid, chunk, budget_ms)
+        if on_chunk:
+            on_chunk(deleted, held_ms)
+        if deleted is None:
+            if chunk == 1:
+                raise RuntimeError("{}: даже одна строка не удаляется за {} мс".format(table, budget_ms))
+            chunk = max(1, chunk // 2)
+            continue
+        total += deleted
+        if deleted < chunk:
+            return total
+        if budget_ms:
+            if held_ms < budget_ms / 4:
+                chunk = min(chunk * 2, CLEAR_MAX_CHUNK_ROWS)
+            elif held_ms > budget_ms / 2:
+                chunk = max(1, chunk // 2)
+        if pause_ms:
+            time.sleep(pause_ms / 1000)
@@ -10,6 +10,10 @@ import json
 import uuid
 import os
 import time
+import random
+import threading
+import functools
+import contextvars
 from datetime import datetime
 try:
     from typing import List, Dict, Any, Optional
@@ -19,32 +23,101 @@ except ImportError:
 from pathlib import Path
 import logging
 
+from tag_matcher import TagIndex
+from metrics import SQLITE_SECONDS, SQLITE_LOCK_WAIT_SECONDS, SQLITE_BUSY_RETRIES, SQLITE_BUSY_ERRORS
+from query_profiler import profiler, current_method, ProfilingConnection
+
 # Настройка логирования
 logging.basicConfig(level=logging.INFO)
 logger = logging.getLogger(__name__)
 
+# Бот и админка пишут в один файл: сколько всего один вызов Database может
+# ждать чужую блокировку записи (все попытки и паузы вместе), и сколько раз
+# повторить вызов после database is locked с паузой BACKOFF * 2^попытка (со
+# случайной добавкой). Каждая попытка ждет внутри SQLite (busy_timeout) свою
+# долю: TIMEOUT / (RETRIES + 1) - бот не замирает дольше TIMEOUT целиком
+BUSY_TIMEOUT_MS = int(os.getenv("SQLITE_BUSY_TIMEOUT_MS", "5000"))
+BUSY_RETRIES = int(os.getenv("SQLITE_BUSY_RETRIES", "3"))
+BUSY_BACKOFF_MS = float(os.getenv("SQLITE_BUSY_BACKOFF_MS", "50"))
+
+# Отложенная запись логов (включает бот через enable_log_buffer): пачка
+# пишется одной транзакцией, когда набралось LOG_BATCH_SIZE строк или прошло
+# LOG_FLUSH_SECONDS с первой строки в буфере
+LOG_BATCH_SIZE = int(os.getenv("LOG_BATCH_SIZE", "100"))
+LOG_FLUSH_SECONDS = float(os.getenv("LOG_FLUSH_SECONDS", "1.0"))
+# Больше строк буфер не держит, даже если запись не удается (старые теряются)
+LOG_BUFFER_LIMIT = 10000
+
+# Что удаляет очистка логов (DELETE /api/logs, bulk_delete.py): таблица -> условие
+CLEAR_TABLES = {
+    'logs_rollup': '',
+    'logs': '',
+    'reaction_queue': '',
+    'moderation_queue': "status != 'pending'",
+}
+
+# Вызов Database внутри другого (add_log -> add_logs): повторяет только внешний
+_in_call = contextvars.ContextVar('db_in_call', default=False)
+
+def is_busy_error(error: Exception) -> bool:
+    """database is locked / database table is locked / SQLITE_BUSY"""
+    return isinstance(error, sqlite3.OperationalError) and (
+        'locked' in str(error) or 'busy' in str(error))
+
+class ClosingConnection(sqlite3.Connection):
+    """Соединение, которое закрывается при выходе из with
+
+    Встроенный with у sqlite3 только завершает транзакцию, а соединение
+    (файловые дескрипторы и кэш страниц) живет, пока его не соберет GC.
+    """
+
+    def __exit__(self, *exc_info):
+        try:
+            return super().__exit__(*exc_info)
+        finally:
+            self.close()
+
+class ProfilingClosingConnection(ClosingConnection, ProfilingConnection):
+    """То же с записью запросов на профилировщик"""
+
 class Database:
-    def __init__(self, db_path: str = None):
+    def __init__(self, db_path: str = None, busy_timeout_ms: int = None, busy_retries: int = None):
         # Используем переменную окружения DATABASE_PATH или значение по умолчанию
         if db_path is None:
             db_path = os.getenv("DATABASE_PATH", "bot_data.db")
         
         self.db_path = db_path
+        self.busy_retries = BUSY_RETRIES if busy_retries is None else busy_retries
+        # Бюджет ожидания на вызов и доля одной попытки (timeout соединения)
+        self.busy_budget = (BUSY_TIMEOUT_MS if busy_timeout_ms is None else busy_timeout_ms) / 1000
+        self.busy_timeout = self.busy_budget / (self.busy_retries + 1)
         
         # Создаем директорию если её нет
         db_dir = Path(self.db_path).parent
         db_dir.mkdir(parents=True, exist_ok=True)
         
-        # Кэш для тегов
+        # Кэш для тегов: перечитывается, только когда меняется tags_version
         self._tags_cache = None
-        self._tags_cache_time = 0
-        self._cache_ttl = 60  # 60 секунд TTL для кэша
+        self._tag_index = None
+        self._tags_version = None
+        self._tags_version_checked = 0
+        self._version_check_interval = 1.0  # Проверка версии не чаще раза в секунду
+        # Постоянное соединение только для чтения версии (без 5 PRAGMA на каждый вызов)
+        self._version_conn = None
+        self._version_lock = threading.Lock()
+        # Буфер отложенной записи логов (0 - запись сразу)
+        self._log_batch_size = 0
+        self._log_flush_interval = LOG_FLUSH_SECONDS
+        self._log_buffer = []
+        self._log_buffered_at = 0.0
+        self._log_lock = threading.Lock()
         
         self.init_database()
     
     def get_connection(self):
-        """Получить соединение с БД с оптимизациями"""
-        conn = sqlite3.connect(self.db_path)
+        """Получить соединение с БД с оптимизациями (закрывается в конце with)"""
+        conn = sqlite3.connect(self.db_path, timeout=self.busy_timeout,
+                               factory=ProfilingClosingConnection if profiler.enabled else ClosingConnection)
         conn.row_factory = sqlite3.Row  # Возвращать результаты как словари
         
         # Включаем WAL mode для лучшей параллельности (критическая оптимизация)
@@ -62,6 +135,14 @@ class Database:
     
     def init_database(self):
         """Инициализация базы данных и создание таблиц"""
+        # Новая БД создается с auto_vacuum=INCREMENTAL (до WAL и первой таблицы):
+        # место после удаления архивированных логов возвращается частями.
+        # Существующую переводит только полный VACUUM (python retention.py --vacuum)
+        conn = sqlite3.connect(self.db_path, timeout=self.busy_timeout)
+        try:
+            conn.execute("PRAGMA auto_vacuum=INCREMENTAL")
+        finally:
+            conn.close()
         with self.get_connection() as conn:
             # Таблица тегов
             conn.execute("""
@@ -71,6 +152,7 @@ class Database:
                     emoji TEXT NOT NULL,
                     delay INTEGER DEFAULT 0,
                     match_mode TEXT DEFAULT 'equals',
+                    fuzzy_distance INTEGER DEFAULT 1,
                     require_photo BOOLEAN DEFAULT TRUE,
                     reply_ok TEXT DEFAULT '',
                     reply_need_photo TEXT DEFAULT '',
@@ -161,7 +243,13 @@ class Database:
             # Индексы для производительности
             conn.execute("CREATE INDEX IF NOT EXISTS idx_logs_timestamp ON logs(timestamp)")
             conn.execute("CREATE INDEX IF NOT EXISTS idx_logs_trigger ON logs(trigger)")
-            conn.execute("CREATE INDEX IF NOT EXISTS idx_moderation_status ON moderation_queue(status)")
+            # (status, created_at): фильтр по статусу и самый старый pending без прохода по таблице
+            conn.execute("DROP INDEX IF EXISTS idx_moderation_status")
+            conn.execute("CREATE INDEX IF NOT EXISTS idx_moderation_status_created ON moderation_queue(status, created_at)")
+            conn.execute("CREATE INDEX IF NOT EXISTS idx_reaction_queue_execute ON reaction_queue(execute_at)")
+            # Поиск данных сообщения (find_message_data) без прохода по таблицам
+            conn.execute("CREATE INDEX IF NOT EXISTS idx_moderation_message ON moderation_queue(chat_id, message_id)")
+            conn.execute("CREATE INDEX IF NOT EXISTS idx_logs_message ON logs(chat_id, message_id)")
             conn.execute("CREATE INDEX IF NOT EXISTS idx_media_hash ON media_hashes(file_hash)")
             
             # Миграция: добавляем поле counter_name если его нет
@@ -199,33 +287,170 @@ class Database:
                 logger.info("✅ Добавлено поле reply_ok в таблицу moderation_queue")
             except sqlite3.OperationalError:
                 pass
+
+            # Миграция: допуск опечаток для режима fuzzy
+            try:
+                conn.execute("ALTER TABLE tags ADD COLUMN fuzzy_distance INTEGER DEFAULT 1")
+                logger.info("✅ Добавлено поле fuzzy_distance в таблицу tags")
+            except sqlite3.OperationalError:
+                pass
+
+            # Миграция: группа тегов одного сообщения (режим нескольких совпадений)
+            try:
+                conn.execute("ALTER TABLE moderation_queue ADD COLUMN group_id TEXT DEFAULT ''")
+                logger.info("✅ Добавлено поле group_id в таблицу moderation_queue")
+            except sqlite3.OperationalError:
+                pass
+            conn.execute("CREATE INDEX IF NOT EXISTS idx_moderation_group ON moderation_queue(group_id)")
+
+            # Миграция: трасса сообщения переходит из бота в очереди и админку
+            for table in ('moderation_queue', 'reaction_queue'):
+                try:
+                    conn.execute("ALTER TABLE {} ADD COLUMN trace_id TEXT DEFAULT ''".format(table))
+                    logger.info("✅ Добавлено поле trace_id в таблицу %s", table)
+                except sqlite3.OperationalError:
+                    pass
+
+            # Трассы сообщений: одна строка на сообщение и узкие строки спанов
+            conn.execute("""
+                CREATE TABLE IF NOT EXISTS traces (
+                    trace_id TEXT PRIMARY KEY,
+                    chat_id INTEGER NOT NULL,
+                    message_id INTEGER NOT NULL,
+                    started_at REAL NOT NULL
+                )
+            """)
+            conn.execute("""
+                CREATE TABLE IF NOT EXISTS trace_spans (
+                    trace_id TEXT NOT NULL,
+                    name TEXT NOT NULL,
+                    source TEXT NOT NULL,
+                    started_at REAL NOT NULL,
+                    duration_ms REAL NOT NULL,
+                    status TEXT DEFAULT 'ok'
+                )
+            """)
+            conn.execute("CREATE INDEX IF NOT EXISTS idx_traces_message ON traces(chat_id, message_id)")
+            conn.execute("CREATE INDEX IF NOT EXISTS idx_traces_started ON traces(started_at)")
+            conn.execute("CREATE INDEX IF NOT EXISTS idx_trace_spans_trace ON trace_spans(trace_id)")
+
+            # Счетчики логов, перенесенных в архив (retention.py): статистика
+            # складывает их с живыми строками logs
+            conn.execute("""
+                CREATE TABLE IF NOT EXISTS logs_rollup (
+                    day TEXT NOT NULL,
+                    trigger TEXT NOT NULL,
+                    status TEXT NOT NULL,
+                    count INTEGER NOT NULL DEFAULT 0,
+                    PRIMARY KEY (day, trigger, status)
+                )
+            """)
+
+            # Полнотекстовый поиск (FTS5, внешнее содержимое): индекс подписей и
+            # имен без копии текста, синхронизируется триггерами
+            for fts_table, table, rowid, columns, update_of in (
+                ('logs_fts', 'logs', 'id', ('caption', 'username'), 'caption, username'),
+                ('moderation_fts', 'moderation_queue', 'rowid', ('text', 'caption'), 'text, caption'),
+            ):
+                exists = conn.execute("SELECT 1 FROM sqlite_master WHERE name = ?", (fts_table,)).fetchone()
+                cols = ", ".join(columns)
+                new_cols = ", ".join("new." + column for column in columns)
+                old_cols = ", ".join("old." + column for column in columns)
+                conn.execute(f"""
+                    CREATE VIRTUAL TABLE IF NOT EXISTS {fts_table} USING fts5(
+                        {cols}, content='{table}', content_rowid='{rowid}',
+                        tokenize='unicode61 remove_diacritics 2'
+                    )
+                """)
+                conn.execute(f"""
+                    CREATE TRIGGER IF NOT EXISTS {fts_table}_insert AFTER INSERT ON {table} BEGIN
+                        INSERT INTO {fts_table} (rowid, {cols}) VALUES (new.{rowid}, {new_cols});
+                    END
+                """)
+                conn.execute(f"""
+                    CREATE TRIGGER IF NOT EXISTS {fts_table}_delete AFTER DELETE ON {table} BEGIN
+                        INSERT INTO {fts_table} ({fts_table}, rowid, {cols}) VALUES ('delete', old.{rowid}, {old_cols});
+                    END
+                """)
+                conn.execute(f"""
+                    CREATE TRIGGER IF NOT EXISTS {fts_table}_update AFTER UPDATE OF {update_of} ON {table} BEGIN
+                        INSERT INTO {fts_table} ({fts_table}, rowid, {cols}) VALUES ('delete', old.{rowid}, {old_cols});
+                        INSERT INTO {fts_table} (rowid, {cols}) VALUES (new.{rowid}, {new_cols});
+                    END
+                """)
+                if not exists:
+                    # Существующая БД: проиндексировать строки, записанные до поиска
+                    conn.execute(f"INSERT INTO {fts_table} ({fts_table}) VALUES ('rebuild')")
+                    logger.info("✅ Построен индекс поиска %s", fts_table)
+
+            # Версия тегов: триггеры увеличивают ее при любом изменении таблицы tags,
+            # в том числе из другого процесса (админка и бот - разные контейнеры)
+            conn.execute("""
+                CREATE TABLE IF NOT EXISTS meta (
+                    key TEXT PRIMARY KEY,
+                    value INTEGER NOT NULL DEFAULT 0
+                )
+            """)
+            conn.execute("INSERT OR IGNORE INTO meta (key, value) VALUES ('tags_version', 0)")
+            for event in ('INSERT', 'UPDATE', 'DELETE'):
+                conn.execute(f"""
+                    CREATE TRIGGER IF NOT EXISTS tags_version_{event.lower()} AFTER {event} ON tags
+                    BEGIN
+                        UPDATE meta SET value = value + 1 WHERE key = 'tags_version';
+                    END
+                """)
             
             conn.commit()
             logger.info("✅ База данных инициализирована")
 
     # === ТЕГИ ===
+    def get_tags_version(self) -> int:
+        """Текущая версия тегов (увеличивается триггерами при каждом изменении)"""
+        with self._version_lock:
+            if self._version_conn is None:
+                self._version_conn = sqlite3.connect(self.db_path, timeout=self.busy_timeout, check_same_thread=False)
+            row = self._version_conn.execute("SELECT value FROM meta WHERE key = 'tags_version'").fetchone()
+            return row[0] if row else 0
+    
     def get_tags(self) -> List[Dict[str, Any]]:
-        """Получить все теги с кэшированием"""
-        now = time.time()
+        """Получить все теги с кэшированием
+        
+        Кэш сбрасывается сразу при изменении тегов в этом процессе, а изменения
+        из другого процесса замечаются по tags_version не позже чем через секунду.
+        """
+        now = time.monotonic()
         
         # Проверяем кэш
-        if (self._tags_cache is not None and 
-            now - self._tags_cache_time < self._cache_ttl):
-            return self._tags_cache
+        if self._tags_cache is not None:
+            if now - self._tags_version_checked < self._version_check_interval:
+                return self._tags_cache
+            self._tags_version_checked = now
+            if self.get_tags_version() == self._tags_version:
+                return self._tags_cache
         
-        # Обновляем кэш
+        # Обновляем кэш. Версию читаем до тегов: если теги изменятся между
+        # запросами, следующая проверка просто перечитает их еще раз
+        version = self.get_tags_version()
         with self.get_connection() as conn:
             cursor = conn.execute("SELECT * FROM tags ORDER BY created_at")
             self._tags_cache = [dict(row) for row in cursor.fetchall()]
-            self._tags_cache_time = now
-            logger.debug(f"🔄 Tags cache updated: {len(self._tags_cache)} tags")
+            self._tag_index = TagIndex(self._tags_cache)
+            self._tags_version = version
+            self._tags_version_checked = now
+            logger.debug("🔄 Tags cache updated: %d tags (version %d)", len(self._tags_cache), version)
             
         return self._tags_cache
     
+    def get_tag_index(self) -> TagIndex:
+        """Получить индекс тегов по тредам (строится вместе с кэшем)"""
+        self.get_tags()
+        return self._tag_index
+    
     def invalidate_tags_cache(self):
         """Сбросить кэш тегов"""
         self._tags_cache = None
-        self._tags_cache_time = 0
+        self._tag_index = None
+        self._tags_version = None
         logger.debug("🗑️ Tags cache invalidated")
     
     def get_tag_by_id(self, tag_id: str) -> Optional[Dict[str, Any]]:
@@ -240,13 +465,14 @@ class Database:
         tag_id = str(uuid.uuid4())[:8]
         with self.get_connection() as conn:
             conn.execute("""
-                INSERT INTO tags (id, tag, emoji, delay, match_mode, require_photo, 
+                INSERT INTO tags (id, tag, emoji, delay, match_mode, fuzzy_distance, require_photo, 
                                 reply_ok, reply_need_photo, thread_name, reply_duplicate,
                                 moderation_enabled, reply_pending, counter_name)
-                VALUES (?, ?, ?, ?, ?, ?, ?, ?, ?, ?, ?, ?, ?)
+                VALUES (?, ?, ?, ?, ?, ?, ?, ?, ?, ?, ?, ?, ?, ?)
             """, (
                 tag_id, tag_data['tag'], tag_data['emoji'], tag_data.get('delay', 0),
-                tag_data.get('match_mode', 'equals'), tag_data.get('require_photo', True),
+                tag_data.get('match_mode', 'equals'), tag_data.get('fuzzy_distance', 1),
+                tag_data.get('require_photo', True),
                 tag_data.get('reply_ok', ''), tag_data.get('reply_need_photo', ''),
                 tag_data.get('thread_name', ''), tag_data.get('reply_duplicate', ''),
                 tag_data.get('moderation_enabled', False), tag_data.get('reply_pending', ''),
@@ -263,13 +489,14 @@ class Database:
         with self.get_connection() as conn:
             cursor = conn.execute("""
                 UPDATE tags SET 
-                    tag = ?, emoji = ?, delay = ?, match_mode = ?, require_photo = ?,
+                    tag = ?, emoji = ?, delay = ?, match_mode = ?, fuzzy_distance = ?, require_photo = ?,
                     reply_ok = ?, reply_need_photo = ?, thread_name = ?, reply_duplicate = ?,
                     moderation_enabled = ?, reply_pending = ?, counter_name = ?, updated_at = CURRENT_TIMESTAMP
                 WHERE id = ?
             """, (
                 tag_data['tag'], tag_data['emoji'], tag_data.get('delay', 0),
-                tag_data.get('match_mode', 'equals'), tag_data.get('require_photo', True),
+                tag_data.get('match_mode', 'equals'), tag_data.get('fuzzy_distance', 1),
+                tag_data.get('require_photo', True),
                 tag_data.get('reply_ok', ''), tag_data.get('reply_need_photo', ''),
                 tag_data.get('thread_name', ''), tag_data.get('reply_duplicate', ''),
                 tag_data.get('moderation_enabled', False), tag_data.get('reply_pending', ''),
@@ -300,22 +527,86 @@ class Database:
     # === ЛОГИ ===
     def add_log(self, log_data: Dict[str, Any]):
         """Добавить запись в лог"""
+        self.add_logs([log_data])
+    
+    def add_logs(self, logs: List[Dict[str, Any]]):
+        """Добавить несколько записей в лог одной транзакцией (или в буфер, если он включен)"""
+        if not self._log_batch_size:
+            self._insert_logs([self._log_row(log_data) for log_data in logs])
+            return
+        with self._log_lock:
+            if not self._log_buffer:
+                self._log_buffered_at = time.monotonic()
+            self._log_buffer.extend(self._log_row(log_data) for log_data in logs)
+            due = len(self._log_buffer) >= self._log_batch_size
+        if due:
+            self.flush_logs()
+        else:
+            self.flush_logs_if_due()
+
+    @staticmethod
+    def _log_row(log_data: Dict[str, Any]) -> tuple:
+        # Время ставится при добавлении, а не при записи пачки
+        return (
+            log_data['user_id'], log_data.get('username', ''),
+            log_data['chat_id'], log_data['message_id'],
+            log_data['trigger'], log_data['emoji'],
+            log_data.get('thread_name', ''), log_data.get('media_type', ''),
+            log_data.get('caption', ''), log_data.get('status', 'success'),
+            datetime.utcnow().strftime('%Y-%m-%d %H:%M:%S')
+        )
+
+    def _insert_logs(self, rows: List[tuple]):
         with self.get_connection() as conn:
-            conn.execute("""
+            conn.executemany("""
                 INSERT INTO logs (user_id, username, chat_id, message_id, trigger, emoji,
-                                thread_name, media_type, caption, status)
-                VALUES (?, ?, ?, ?, ?, ?, ?, ?, ?, ?)
-            """, (
-                log_data['user_id'], log_data.get('username', ''),
-                log_data['chat_id'], log_data['message_id'],
-                log_data['trigger'], log_data['emoji'],
-                log_data.get('thread_name', ''), log_data.get('media_type', ''),
-                log_data.get('caption', ''), log_data.get('status', 'success')
-            ))
+                                thread_name, media_type, caption, status, timestamp)
+                VALUES (?, ?, ?, ?, ?, ?, ?, ?, ?, ?, ?)
+            """, rows)
             conn.commit()
+
+    def enable_log_buffer(self, batch_size: int = None, flush_interval: float = None):
+        """Включить отложенную запись логов (batch_size 0 - выключить, остаток записывается)"""
+        self._log_batch_size = LOG_BATCH_SIZE if batch_size is None else batch_size
+        self._log_flush_interval = LOG_FLUSH_SECONDS if flush_interval is None else flush_interval
+        if not self._log_batch_size:
+            self.flush_logs()
+
+    def flush_logs(self) -> int:
+        """Записать буфер логов одной транзакцией; вернуть число записанных строк
+
+        Если запись не удалась (например, БД заблокирована дольше всех
+        повторов), строки возвращаются в начало буфера до следующей попытки.
+        """
+        with self._log_lock:
+            rows, self._log_buffer = self._log_buffer, []
+        if not rows:
+            return 0
+        try:
+            # Повторы здесь, а не во внешнем вызове: ошибка записи пачки не
+            # должна достаться add_log из чужого сообщения
+            _retry_busy('flush_logs', self.busy_retries, lambda: self._insert_logs(rows), self.busy_budget)
+            return len(rows)
+        except Exception as e:
+            with self._log_lock:
+                self._log_buffer[:0] = rows
+                dropped = len(self._log_buffer) - LOG_BUFFER_LIMIT
+                if dropped > 0:
+                    del self._log_buffer[:dropped]
+            logger.warning("⚠️ Не удалось записать %d строк лога: %s%s", len(rows), e,
+                           " (потеряно {})".format(dropped) if dropped > 0 else "")
+            return 0
+
+    def flush_logs_if_due(self) -> int:
+        """Записать буфер, если первая строка в нем ждет дольше интервала"""
+        if self._log_buffer and time.monotonic() - self._log_buffered_at >= self._log_flush_interval:
+            return self.flush_logs()
+        return 0
     
     def get_logs(self, tag: Optional[str] = None, limit: int = 200) -> List[Dict[str, Any]]:
-        """Получить логи с фильтрацией"""
+        """Получить логи с фильтрацией (буфер отложенной записи сначала записывается)"""
+        if self._log_buffer:
+            self.flush_logs()
         with self.get_connection() as conn:
             if tag:
                 cursor = conn.execute("""
@@ -330,15 +621,22 @@ class Database:
     
     def get_stats(self) -> Dict[str, Any]:
         """Получить статистику"""
+        if self._log_buffer:
+            self.flush_logs()
         with self.get_connection() as conn:
-            # Общая статистика
-            total_logs = conn.execute("SELECT COUNT(*) FROM logs").fetchone()[0]
+            # Общая статистика (живые логи плюс счетчики архивированных)
+            total_logs = conn.execute("""
+                SELECT (SELECT COUNT(*) FROM logs) + (SELECT IFNULL(SUM(count), 0) FROM logs_rollup)
+            """).fetchone()[0]
             total_tags = conn.execute("SELECT COUNT(*) FROM tags").fetchone()[0]
             
             # Статистика по тегам
             tag_stats = conn.execute("""
-                SELECT trigger, COUNT(*) as count 
-                FROM logs 
+                SELECT trigger, SUM(count) as count FROM (
+                    SELECT trigger, COUNT(*) as count FROM logs GROUP BY trigger
+                    UNION ALL
+                    SELECT trigger, SUM(count) FROM logs_rollup GROUP BY trigger
+                )
                 GROUP BY trigger 
                 ORDER BY count DESC 
                 LIMIT 10
@@ -366,26 +664,131 @@ class Database:
                 }
             }
 
+    def get_old_logs(self, before: str, statuses: Optional[List[str]] = None,
+                     exclude_statuses: Optional[List[str]] = None, limit: int = 500) -> List[Dict[str, Any]]:
+        """Самые старые логи с timestamp раньше before (UTC, 'YYYY-MM-DD HH:MM:SS')
+
+        statuses - только эти статусы, exclude_statuses - все, кроме этих
+        (политика '*' в retention.py). Отбор идет по индексу времени.
+        """
+        query = "SELECT * FROM logs WHERE timestamp < ?"
+        params = [before]
+        if statuses:
+            query += " AND status IN ({})".format(", ".join("?" * len(statuses)))
+            params.extend(statuses)
+        if exclude_statuses:
+            query += " AND status NOT IN ({})".format(", ".join("?" * len(exclude_statuses)))
+            params.extend(exclude_statuses)
+        query += " ORDER BY timestamp LIMIT ?"
+        params.append(limit)
+        with self.get_connection() as conn:
+            return [dict(row) for row in conn.execute(query, params).fetchall()]
+
+    def rollup_logs(self, ids: List[int]) -> int:
+        """Удалить логи (уже записанные в архив), прибавив их к logs_rollup
+
+        Счетчики и удаление - одна транзакция, поэтому get_stats не меняется.
+        """
+        ids_json = json.dumps(ids)
+        with self.get_connection() as conn:
+            conn.execute("""
+                INSERT INTO logs_rollup (day, trigger, status, count)
+                SELECT date(timestamp), trigger, IFNULL(status, 'success'), COUNT(*)
+                FROM logs WHERE id IN (SELECT value FROM json_each(?))
+                GROUP BY 1, 2, 3
+                ON CONFLICT (day, trigger, status) DO UPDATE SET count = count + excluded.count
+            """, (ids_json,))
+            cursor = conn.execute("DELETE FROM logs WHERE id IN (SELECT value FROM json_each(?))", (ids_json,))
+            conn.commit()
+            return cursor.rowcount
+
+    def incremental_vacuum(self, pages: int) -> int:
+        """Вернуть ОС до pages свободных страниц; вернуть число оставшихся
+
+        Работает только при auto_vacuum=INCREMENTAL, иначе ничего не делает.
+        """
+        with self.get_connection() as conn:
+            free = conn.execute("PRAGMA freelist_count").fetchone()[0]
+            if free and pages > 0:
+                # sqlite3 делает один шаг прагмы, а шаг освобождает одну страницу:
+                # поэтому цикл, одной транзакцией
+                conn.execute("BEGIN IMMEDIATE")
+                for _ in range(min(pages, free)):
+                    conn.execute("PRAGMA incremental_vacuum(1)")
+                conn.commit()
+                free = conn.execute("PRAGMA freelist_count").fetchone()[0]
+            return free
+
+    def get_max_rowid(self, table: str) -> int:
+        """Последний rowid таблицы из CLEAR_TABLES (граница очистки: новые строки не трогаются)"""
+        if table not in CLEAR_TABLES:
+            raise ValueError("Таблица не очищается: {}".format(table))
+        with self.get_connection() as conn:
+            return conn.execute("SELECT IFNULL(MAX(rowid), 0) FROM {}".format(table)).fetchone()[0]
+
+    def delete_chunk(self, table: str, max_rowid: int, limit: int, budget_ms: float = 0) -> tuple:
+        """Удалить до limit строк таблицы из CLEAR_TABLES с rowid <= max_rowid
+
+        Одна транзакция: BEGIN IMMEDIATE (ожидание чужой блокировки не
+        считается), DELETE, COMMIT. Если DELETE держит блокировку записи
+        дольше budget_ms, он прерывается и откатывается. Возвращает
+        (удалено строк или None при прерывании, мс с блокировкой).
+        """
+        if table not in CLEAR_TABLES:
+            raise ValueError("Таблица не очищается: {}".format(table))
+        condition = CLEAR_TABLES[table]
+        query = "DELETE FROM {0} WHERE rowid IN (SELECT rowid FROM {0} WHERE rowid <= ?{1} LIMIT ?)".format(
+            table, " AND " + condition if condition else "")
+        with self.get_connection() as conn:
+            conn.execute("BEGIN IMMEDIATE")
+            start = time.perf_counter()
+            if budget_ms:
+                deadline = start + budget_ms / 1000
+                conn.set_progress_handler(lambda: time.perf_counter() > deadline, 1000)
+            try:
+                cursor = conn.execute(query, (max_rowid, limit))
+            except sqlite3.OperationalError as e:
+                if 'interrupted' not in str(e):
+                    raise
+                conn.rollback()
+                return None, (time.perf_counter() - start) * 1000
+            finally:
+                conn.set_progress_handler(None, 0)
+            conn.commit()
+            return cursor.rowcount, (time.perf_counter() - start) * 1000
+
     # === МОДЕРАЦИЯ ===
     def add_moderation_item(self, item_data: Dict[str, Any]) -> str:
         """Добавить элемент в очередь модерации"""
-        item_id = str(uuid.uuid4())[:8]
+        return self.add_moderation_items([item_data])[0]
+    
+    def add_moderation_items(self, items: List[Dict[str, Any]], status: str = 'pending') -> List[str]:
+        """Добавить несколько элементов одной транзакцией
+
+        Если элементов больше одного, они получают общий group_id (ID первого),
+        чтобы одна реакция закрыла счетчики всех тегов сообщения. status
+        элемента (если задан) заменяет общий.
+        """
+        item_ids = [str(uuid.uuid4())[:8] for _ in items]
+        group_id = item_ids[0] if len(items) > 1 else ''
         with self.get_connection() as conn:
-            conn.execute("""
+            conn.executemany("""
                 INSERT INTO moderation_queue (id, chat_id, message_id, user_id, username,
-                                            tag, emoji, text, caption, media_info, thread_name, counter_name, reply_ok)
-                VALUES (?, ?, ?, ?, ?, ?, ?, ?, ?, ?, ?, ?, ?)
-            """, (
+                                            tag, emoji, text, caption, media_info, thread_name, counter_name, reply_ok,
+                                            status, group_id, trace_id)
+                VALUES (?, ?, ?, ?, ?, ?, ?, ?, ?, ?, ?, ?, ?, ?, ?, ?)
+            """, [(
                 item_id, item_data['chat_id'], item_data['message_id'],
                 item_data['user_id'], item_data.get('username', ''),
                 item_data['tag'], item_data['emoji'],
                 item_data.get('text', ''), item_data.get('caption', ''),
                 json.dumps(item_data.get('media_info', {})),
                 item_data.get('thread_name', ''), item_data.get('counter_name', ''),
-                item_data.get('reply_ok', '')
-            ))
+                item_data.get('reply_ok', ''), item_data.get('status', status), group_id,
+                item_data.get('trace_id', '')
+            ) for item_id, item_data in zip(item_ids, items)])
             conn.commit()
-        return item_id
+        return item_ids
     
     def get_pending_moderation(self) -> List[Dict[str, Any]]:
         """Получить элементы ожидающие модерации"""
@@ -427,8 +830,35 @@ class Database:
                 return item
             return None
     
+    def get_moderation_group(self, item_id: str) -> List[Dict[str, Any]]:
+        """Получить элемент модерации вместе с остальными тегами его сообщения
+
+        Группа учитывается только для автоматических реакций: элементы,
+        ожидающие модератора, одобряются по одному.
+        """
+        item = self.get_moderation_by_id(item_id)
+        if not item:
+            return []
+        if not item.get('group_id') or item['status'] != 'auto_approved':
+            return [item]
+        
+        with self.get_connection() as conn:
+            cursor = conn.execute("""
+                SELECT * FROM moderation_queue 
+                WHERE group_id = ? AND status = 'auto_approved'
+                ORDER BY rowid
+            """, (item['group_id'],))
+            items = []
+            for row in cursor.fetchall():
+                group_item = dict(row)
+                group_item['media_info'] = json.loads(group_item['media_info'] or '{}')
+                items.append(group_item)
+            return items
+    
     def find_message_data(self, chat_id: int, message_id: int) -> Dict[str, Any]:
         """Найти данные о сообщении по chat_id и message_id"""
+        if self._log_buffer:
+            self.flush_logs()
         with self.get_connection() as conn:
             # Сначала ищем в очереди модерации
             cursor = conn.execute("""
@@ -496,13 +926,14 @@ class Database:
             return cursor.fetchone() is not None
 
     # === ОЧЕРЕДЬ РЕАКЦИЙ ===
-    def add_reaction_queue(self, moderation_id: str, chat_id: int, message_id: int, emoji: str, delay_seconds: int = 0):
+    def add_reaction_queue(self, moderation_id: str, chat_id: int, message_id: int, emoji: str, delay_seconds: int = 0,
+                           trace_id: str = ''):
         """Добавить в очередь реакций с задержкой"""
         with self.get_connection() as conn:
             conn.execute("""
-                INSERT INTO reaction_queue (moderation_id, chat_id, message_id, emoji, execute_at)
-                VALUES (?, ?, ?, ?, datetime('now', '+' || ? || ' seconds'))
-            """, (moderation_id, chat_id, message_id, emoji, delay_seconds))
+                INSERT INTO reaction_queue (moderation_id, chat_id, message_id, emoji, execute_at, trace_id)
+                VALUES (?, ?, ?, ?, datetime('now', '+' || ? || ' seconds'), ?)
+            """, (moderation_id, chat_id, message_id, emoji, delay_seconds, trace_id))
             conn.commit()
 
     def get_reaction_queue(self) -> List[Dict[str, Any]]:
@@ -548,5 +979,233 @@ class Database:
             row = cursor.fetchone()
             return row[0] if row else 0
 
+    # === ТРАССЫ ===
+    def add_trace_data(self, traces: List[tuple], spans: List[tuple]):
+        """Записать трассы (trace_id, chat_id, message_id, started_at) и спаны одной транзакцией"""
+        with self.get_connection() as conn:
+            conn.executemany("INSERT OR IGNORE INTO traces VALUES (?, ?, ?, ?)", traces)
+            conn.executemany("""
+                INSERT INTO trace_spans (trace_id, name, source, started_at, duration_ms, status)
+                VALUES (?, ?, ?, ?, ?, ?)
+            """, spans)
+            conn.commit()
+
+    def get_traces(self, chat_id: int = None, message_id: int = None, trace_id: str = None,
+                   limit: int = 20) -> List[Dict[str, Any]]:
+        """Трассы сообщения (или одна по trace_id) со спанами по времени начала"""
+        with self.get_connection() as conn:
+            if trace_id:
+                rows = conn.execute("SELECT * FROM traces WHERE trace_id = ?", (trace_id,)).fetchall()
+            else:
+                rows = conn.execute("""
+                    SELECT * FROM traces WHERE chat_id = ? AND message_id = ?
+                    ORDER BY started_at DESC LIMIT ?
+                """, (chat_id, message_id, limit)).fetchall()
+            traces = []
+            for row in rows:
+                trace = dict(row)
+                trace['spans'] = [dict(span) for span in conn.execute("""
+                    SELECT name, source, started_at, duration_ms, status FROM trace_spans
+                    WHERE trace_id = ? ORDER BY started_at
+                """, (trace['trace_id'],)).fetchall()]
+                traces.append(trace)
+            return traces
+
+    def prune_traces(self, before: float) -> int:
+        """Удалить трассы, начатые раньше before (unix time)"""
+        with self.get_connection() as conn:
+            conn.execute("""
+                DELETE FROM trace_spans WHERE trace_id IN (SELECT trace_id FROM traces WHERE started_at < ?)
+            """, (before,))
+            cursor = conn.execute("DELETE FROM traces WHERE started_at < ?", (before,))
+            conn.commit()
+            return cursor.rowcount
+
+    # === ПОИСК ===
+    def search(self, query: str, tag: Optional[str] = None, status: Optional[str] = None,
+               date_from: Optional[str] = None, date_to: Optional[str] = None, source: Optional[str] = None,
+               order: str = 'recent', limit: int = 50, offset: int = 0) -> Dict[str, Any]:
+        """Полнотекстовый поиск по логам (подпись, имя) и модерации (текст, подпись)
+
+        query - слова через пробел, все должны встретиться (по префиксу:
+        'марафон' находит 'марафону'). tag/status - точное совпадение,
+        date_from/date_to - 'YYYY-MM-DD' включительно (UTC), source -
+        'logs' или 'moderation' (по умолчанию оба). order - 'recent' (новые
+        первыми) или 'rank' (релевантность bm25). Возвращает {'items',
+        'has_more'}; в snippet найденные слова в [квадратных скобках].
+        """
+        if self._log_buffer:
+            self.flush_logs()
+        match = fts_query(query)
+        if not match:
+            return {'items': [], 'has_more': False}
+        parts = []
+        params = []
+        for name, fts_table, table, alias, columns, time_column, tag_column, rowid in (
+            ('logs', 'logs_fts', 'logs', 'l',
+             "l.id AS id, l.trigger AS tag, l.status, '' AS text, l.caption, l.media_type, l.thread_name",
+             'timestamp', 'trigger', 'id'),
+            ('moderation', 'moderation_fts', 'moderation_queue', 'm',
+             "m.id AS id, m.tag AS tag, m.status, m.text, m.caption, '' AS media_type, m.thread_name",
+             'created_at', 'tag', 'rowid'),
+        ):
+            if source and source != name:
+                continue
+            sql = f"""
+                SELECT '{name}' AS source, {columns}, {alias}.chat_id, {alias}.message_id, {alias}.user_id,
+                       {alias}.username, {alias}.emoji, {alias}.{time_column} AS timestamp,
+                       snippet({fts_table}, -1, '[', ']', '…', 12) AS snippet, bm25({fts_table}) AS rank
+                FROM {fts_table} JOIN {table} {alias} ON {alias}.{rowid} = {fts_table}.rowid
+                WHERE {fts_table} MATCH ?"""
+            params.append(match)
+            if tag:
+                sql += f" AND {alias}.{tag_column} = ?"
+                params.append(tag)
+            if status:
+                sql += f" AND {alias}.status = ?"
+                params.append(status)
+            if date_from:
+                sql += f" AND {alias}.{time_column} >= ?"
+                params.append(date_from)
+            if date_to:
+                sql += f" AND {alias}.{time_column} < date(?, '+1 day')"
+                params.append(date_to)
+            parts.append(sql)
+        if not parts:
+            raise ValueError("Неизвестный источник поиска: {}".format(source))
+        order_by = "rank, timestamp DESC" if order == 'rank' else "timestamp DESC, rank"
+        sql = "SELECT * FROM ({}) ORDER BY {} LIMIT ? OFFSET ?".format(" UNION ALL ".join(parts), order_by)
+        params.extend([limit + 1, offset])
+        with self.get_connection() as conn:
+            rows = [dict(row) for row in conn.execute(sql, params).fetchall()]
+        for row in rows:
+            row.pop('rank')
+        return {'items': rows[:limit], 'has_more': len(rows) > limit}
+
+    # === СОСТОЯНИЕ КОНВЕЙЕРА ===
+    def set_meta_values(self, values: Dict[str, int]):
+        """Записать значения в meta (пульс бота, время последнего апдейта)"""
+        with self.get_connection() as conn:
+            conn.executemany("INSERT OR REPLACE INTO meta (key, value) VALUES (?, ?)", list(values.items()))
+            conn.commit()
+
+    def get_pipeline_state(self) -> Dict[str, Any]:
+        """Самая ранняя просроченная реакция, самый старый pending и значения meta
+
+        Каждый запрос - MIN по индексу или поиск по ключу, время не зависит
+        от размера таблиц (для /healthz и /readyz).
+        """
+        with self.get_connection() as conn:
+            oldest_reaction = conn.execute("""
+                SELECT MIN(execute_at) FROM reaction_queue WHERE execute_at <= datetime('now')
+            """).fetchone()[0]
+            oldest_moderation = conn.execute("""
+                SELECT MIN(created_at) FROM moderation_queue WHERE status = 'pending'
+            """).fetchone()[0]
+            meta = dict(conn.execute("""
+                SELECT key, value FROM meta WHERE key IN ('bot_heartbeat', 'bot_last_update')
+            """).fetchall())
+            now = conn.execute("SELECT datetime('now')").fetchone()[0]
+            return {
+                'now': now,
+                'oldest_overdue_reaction': oldest_reaction,
+                'oldest_pending_moderation': oldest_moderation,
+                'bot_heartbeat': meta.get('bot_heartbeat'),
+                'bot_last_update': meta.get('bot_last_update'),
+            }
+
+def fts_query(text: str) -> str:
+    """Ввод пользователя -> запрос FTS5: каждое слово в кавычках и по префиксу
+
+    Кавычки и операторы FTS5 (AND, NEAR, -, *) из ввода не работают как
+    синтаксис, поэтому запрос не падает с ошибкой разбора.
+    """
+    words = [word.replace('"', '') for word in (text or '').split()]
+    return " ".join('"{}"*'.format(word) for word in words if word.strip('#@*'))
+
+def _retry_busy(method: str, retries: int, call, budget: float = None):
+    """Вызвать call(); после database is locked повторить с экспоненциальной паузой
+
+    budget - секунд ожидания на все попытки и паузы вместе (каждая попытка
+    ждет внутри SQLite не дольше budget / (retries + 1)): повтор, который
+    с паузой перед ним не укладывается в бюджет, не делается. Паузы -
+    блокирующий sleep, а бот вызывает Database из цикла событий. Время
+    неудачных попыток и пауз пишется в sqlite_lock_wait_seconds, повторы и
+    отказы - в свои счетчики.
+    """
+    waited = 0.0
+    deadline = None
+    if budget is not None:
+        share = budget / (retries + 1)
+        deadline = time.perf_counter() + budget
+    for attempt in range(retries + 1):
+        start = time.perf_counter()
+        try:
+            result = call()
+        except sqlite3.OperationalError as e:
+            if not is_busy_error(e):
+                raise
+            waited += time.perf_counter() - start
+            pause = BUSY_BACKOFF_MS / 1000 * (2 ** attempt) * random.uniform(0.5, 1.5)
+            out_of_budget = deadline is not None and time.perf_counter() + pause + share > deadline
+            if attempt == retries or out_of_budget:
+                SQLITE_BUSY_ERRORS.labels(method).inc()
+                SQLITE_LOCK_WAIT_SECONDS.labels(method).observe(waited)
+                logger.warning("🔒 %s: %s после %d повторов (%.2f с ожидания)", method, e, attempt, waited)
+                raise
+            SQLITE_BUSY_RETRIES.labels(method).inc()
+            time.sleep(pause)
+            waited += pause
+            continue
+        if waited:
+            SQLITE_LOCK_WAIT_SECONDS.labels(method).observe(waited)
+        return result
+
+def _call_with_retry(method: str, func, args, kwargs):
+    """Метод Database с повторами после database is locked (_retry_busy)
+
+    Каждый метод - одна транзакция в with conn: при ошибке она откатывается,
+    и повтор выполняет ее заново. Вложенные вызовы не повторяются сами -
+    это делает внешний.
+    """
+    if _in_call.get():
+        return func(*args, **kwargs)
+    token = _in_call.set(True)
+    try:
+        return _retry_busy(method, args[0].busy_retries, lambda: func(*args, **kwargs), args[0].busy_budget)
+    finally:
+        _in_call.reset(token)
+
+def _timed(method: str, func):
+    """Обертка метода Database: время вызова в sqlite_call_seconds{method}
+
+    Вызов повторяется после database is locked (_call_with_retry). При
+    включенном профилировщике запросы внутри метода записываются на него.
+    """
+    histogram = SQLITE_SECONDS.labels(method)
+
+    @functools.wraps(func)
+    def wrapper(*args, **kwargs):
+        start = time.perf_counter()
+        if not profiler.enabled:
+            try:
+                return _call_with_retry(method, func, args, kwargs)
+            finally:
+                histogram.observe(time.perf_counter() - start)
+        token = current_method.set(method)
+        try:
+            return _call_with_retry(method, func, args, kwargs)
+        finally:
+            current_method.reset(token)
+            elapsed = time.perf_counter() - start
+            histogram.observe(elapsed)
+            profiler.record_method(method, elapsed)
+    return wrapper
+
+# Замеряем все публичные методы, кроме фабрики соединений
+for _name, _func in list(vars(Database).items()):
+    if callable(_func) and not _name.startswith('_') and _name != 'get_connection':
+        setattr(Database, _name, _timed(_name, _func))
+
 # Глобальный экземпляр базы данных
 db = Database()
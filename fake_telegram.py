@@ -0,0 +1,324 @@
+#!/usr/bin/env python3
+# -*- coding: utf-8 -*-
+"""
+Локальная замена Telegram Bot API для нагрузочных прогонов и бенчмарков
+
+Отвечает на методы, которые вызывают бот и админка (getMe, sendMessage,
+copyMessage, setMessageReaction, getFile) и отдает файлы по
+/file/bot<token>/<path>. Заодно принимает POST /api/telegram/reaction -
+бэкенд, куда бот отправляет данные о реакциях.
+
+Настраиваются задержка ответа, случайные 429 и лимиты как у Telegram
+(глобальный на отправку сообщений и на чат: личный - 1 в секунду, группа -
+20 в минуту) с retry_after до освобождения окна. Заблокировавшие бота
+пользователи получают 403. Все вызовы записываются; смотреть их можно
+через /_fake/calls и /_fake/stats.
+
+Отдельный сервис:
+
+    python fake_telegram.py --port 8090 --latency-ms 50 --blocked-ratio 0.05
+    TELEGRAM_API_URL=http://localhost:8090 python admin.py
+"""
+
+import argparse
+import asyncio
+import json
+import math
+import random
+import time
+from collections import Counter, deque
+try:
+    from typing import Dict, Any, Optional
+except ImportError:
+    # Для старых версий Python
+    pass
+
+from aiohttp import web
+
+# Содержимое файла по умолчанию для getFile + скачивания (~50 КБ, как фото)
+FILE_SIZE = 50 * 1024
+# Методы отправки сообщений, на которые действуют лимиты и блокировки
+SEND_METHODS = ('sendMessage', 'copyMessage')
+# Сколько последних вызовов хранить
+RECORD_LIMIT = 100000
+
+# Строковые параметры, которые не разбираются как JSON (текст "123" остается строкой)
+TEXT_PARAMS = ('text', 'caption', 'file_id', 'parse_mode')
+
+def _parse_value(key: str, value):
+    """python-telegram-bot шлет нестроковые параметры JSON-строками"""
+    if not isinstance(value, str) or key in TEXT_PARAMS:
+        return value
+    try:
+        return json.loads(value)
+    except ValueError:
+        return value
+
+class RateWindow:
+    """Не больше limit событий за window секунд (скользящее окно)"""
+    __slots__ = ('limit', 'window', 'events')
+
+    def __init__(self, limit: int, window: float):
+        self.limit = limit
+        self.window = window
+        self.events = deque()
+
+    def retry_after(self, now: float) -> int:
+        """0, если событие проходит (и оно учитывается), иначе секунды до свободного места"""
+        while self.events and self.events[0] <= now - self.window:
+            self.events.popleft()
+        if len(self.events) >= self.limit:
+            return max(1, math.ceil(self.events[0] + self.window - now))
+        self.events.append(now)
+        return 0
+
+class FakeTelegram:
+    """Fake Bot API на aiohttp: задержка, лимиты и 429, 403, запись вызовов"""
+
+    def __init__(self, latency_ms: float = 0, jitter_ms: float = 0, rate_429: float = 0.0,
+                 retry_after: int = 1, limits: bool = False, global_limit: int = 30,
+                 private_limit: int = 1, group_limit: int = 20, blocked=(), blocked_ratio: float = 0.0,
+                 record_limit: int = RECORD_LIMIT, seed: int = None):
+        self.latency = latency_ms / 1000
+        self.jitter = jitter_ms / 1000
+        self.rate_429 = rate_429
+        self.retry_after = retry_after
+        self.limits = limits
+        self.global_limit = global_limit
+        self.private_limit = private_limit
+        self.group_limit = group_limit
+        self.blocked = set(blocked)
+        self.blocked_ratio = blocked_ratio
+        self.record_limit = record_limit
+        self.random = random.Random(seed)
+        self._runner = None
+        self.url = None
+        self.reset()
+        self.app = web.Application()
+        self.app.router.add_route("*", "/bot{token}/{method}", self.handle_method)
+        self.app.router.add_get("/file/bot{token}/{path:.*}", self.handle_file)
+        self.app.router.add_post("/api/telegram/reaction", self.handle_backend)
+        self.app.router.add_get("/_fake/calls", self.handle_calls)
+        self.app.router.add_get("/_fake/stats", self.handle_stats)
+        self.app.router.add_post("/_fake/reset", self.handle_reset)
+
+    def reset(self):
+        """Забыть вызовы, счетчики и окна лимитов"""
+        self.calls = Counter()
+        self.errors = Counter()
+        self.received = deque(maxlen=self.record_limit)
+        self._message_id = 0
+        self._global_window = RateWindow(self.global_limit, 1.0)
+        self._chat_windows = {}
+
+    # ---- Запуск ----
+
+    async def start(self, host: str = "127.0.0.1", port: int = 0) -> str:
+        """Запустить сервер; вернуть базовый URL (порт 0 - любой свободный)"""
+        self._runner = web.AppRunner(self.app, access_log=None)
+        await self._runner.setup()
+        await web.TCPSite(self._runner, host, port).start()
+        port = self._runner.addresses[0][1]
+        self.url = "http://{}:{}".format(host, port)
+        return self.url
+
+    async def stop(self):
+        if self._runner:
+            await self._runner.cleanup()
+            self._runner = None
+
+    @property
+    def base_url(self) -> str:
+        """Для Application.builder().base_url()"""
+        return self.url + "/bot"
+
+    @property
+    def base_file_url(self) -> str:
+        return self.url + "/file/bot"
+
+    # ---- Ответы ----
+
+    async def _delay(self):
+        delay = self.latency + (self.random.uniform(0, self.jitter) if self.jitter else 0)
+        if delay > 0:
+            await asyncio.sleep(delay)
+
+    @staticmethod
+    def ok(result) -> web.Response:
+        return web.json_response({"ok": True, "result": result})
+
+    def error(self, method: str, code: int, description: str, parameters: Dict[str, Any] = None) -> web.Response:
+        self.errors[(method, code)] += 1
+        body = {"ok": False, "error_code": code, "description": description}
+        if parameters:
+            body["parameters"] = parameters
+        return web.json_response(body, status=code)
+
+    def too_many_requests(self, method: str, retry_after: int) -> web.Response:
+        return self.error(method, 429, "Too Many Requests: retry after {}".format(retry_after),
+                          {"retry_after": retry_after})
+
+    def is_blocked(self, chat_id) -> bool:
+        """Пользователь заблокировал бота: из списка или детерминированная доля личных чатов"""
+        try:
+            chat_id = int(chat_id)
+        except (TypeError, ValueError):
+            return False
+        if chat_id in self.blocked:
+            return True
+        return chat_id > 0 and self.blocked_ratio > 0 and (chat_id * 2654435761) % 10000 < self.blocked_ratio * 10000
+
+    def limit_retry_after(self, chat_id) -> int:
+        """Лимиты Telegram на отправку: глобальный и на чат; 0 - сообщение проходит"""
+        now = time.monotonic()
+        window = self._chat_windows.get(chat_id)
+        if window is None:
+            private = isinstance(chat_id, int) and chat_id > 0
+            window = self._chat_windows[chat_id] = (
+                RateWindow(self.private_limit, 1.0) if private else RateWindow(self.group_limit, 60.0))
+        # Сначала чат: отказ по чату не должен занимать место в глобальном окне
+        wait = window.retry_after(now)
+        if wait:
+            return wait
+        wait = self._global_window.retry_after(now)
+        if wait:
+            # Сообщение не отправлено - место в окне чата освобождается
+            window.events.pop()
+        return wait
+
+    def check(self, method: str, params: Dict[str, Any]) -> Optional[web.Response]:
+        """Ошибка вместо ответа метода: случайный 429, блокировка, лимиты"""
+        if self.rate_429 and self.random.random() < self.rate_429:
+            return self.too_many_requests(method, self.retry_after)
+        if method in SEND_METHODS:
+            chat_id = params.get("chat_id")
+            if self.is_blocked(chat_id):
+                return self.error(method, 403, "Forbidden: bot was blocked by the user")
+            if self.limits:
+                wait = self.limit_retry_after(chat_id)
+                if wait:
+                    return self.too_many_requests(method, wait)
+        return None
+
+    async def handle_method(self, request: web.Request) -> web.Response:
+        method = request.match_info["method"]
+        if request.content_type == "application/json":
+            params = await request.json()
+        else:
+            params = {key: _parse_value(key, value) for key, value in (await request.post()).items()}
+        params.update({key: _parse_value(key, value) for key, value in request.query.items()})
+        self.calls[method] += 1
+        await self._delay()
+        response = self.check(method, params)
+        if response is None:
+            handler = getattr(self, "api_" + method, None)
+            response = handler(params) if handler else self.error(method, 404, "Not Found: method not found")
+        self.received.append({'ts': time.time(), 'method': method, 'params': params, 'status': response.status})
+        return response
+
+    async def handle_file(self, request: web.Request) -> web.Response:
+        self.calls["file"] += 1
+        await self._delay()
+        # Содержимое зависит от пути: одинаковые file_id - одинаковые байты
+        seed = request.match_info["path"].encode("utf-8")
+        return web.Response(body=(seed * (FILE_SIZE // len(seed) + 1))[:FILE_SIZE])
+
+    async def handle_backend(self, request: web.Request) -> web.Response:
+        self.calls["backend_reaction"] += 1
+        await request.read()
+        await self._delay()
+        return web.json_response({"success": True})
+
+    # ---- Просмотр записанного ----
+
+    async def handle_calls(self, request: web.Request) -> web.Response:
+        """GET /_fake/calls?method=sendMessage&limit=100 - последние вызовы"""
+        method = request.query.get("method")
+        limit = int(request.query.get("limit", 100))
+        calls = [call for call in self.received if not method or call['method'] == method]
+        return web.json_response(calls[-limit:])
+
+    async def handle_stats(self, request: web.Request) -> web.Response:
+        return web.json_response(self.report())
+
+    async def handle_reset(self, request: web.Request) -> web.Response:
+        self.reset()
+        return web.json_response({"ok": True})
+
+    # ---- Методы Bot API ----
+
+    def next_message_id(self) -> int:
+        self._message_id += 1
+        return self._message_id
+
+    def api_getMe(self, params):
+        return self.ok({"id": 100000, "is_bot": True, "first_name": "Fake", "username": "fake_bot",
+                        "can_join_groups": True, "can_read_all_group_messages": True,
+                        "supports_inline_queries": False})
+
+    def api_sendMessage(self, params):
+        chat_id = params.get("chat_id")
+        return self.ok({
+            "message_id": self.next_message_id(),
+            "date": int(time.time()),
+            "chat": {"id": chat_id, "type": "private" if int(chat_id) > 0 else "supergroup"},
+            "from": {"id": 100000, "is_bot": True, "first_name": "Fake"},
+            "text": params.get("text", ""),
+        })
+
+    def api_copyMessage(self, params):
+        return self.ok({"message_id": self.next_message_id()})
+
+    def api_setMessageReaction(self, params):
+        return self.ok(True)
+
+    def api_getFile(self, params):
+        file_id = params.get("file_id", "")
+        return self.ok({
+            "file_id": file_id,
+            "file_unique_id": "u" + file_id[-16:],
+            "file_size": FILE_SIZE,
+            "file_path": "photos/{}.jpg".format(file_id),
+        })
+
+    def report(self) -> Dict[str, Any]:
+        """Вызовы и ошибки по методам, доля 429 среди методов отправки"""
+        sent = sum(self.calls[method] for method in SEND_METHODS)
+        limited = sum(self.errors[(method, 429)] for method in SEND_METHODS)
+        return {
+            'calls': dict(self.calls),
+            'errors': {"{} {}".format(method, code): count for (method, code), count in self.errors.items()},
+            'send_429_rate': round(limited / sent, 4) if sent else 0.0,
+        }
+
+def build_parser() -> argparse.ArgumentParser:
+    parser = argparse.ArgumentParser(description="Локальный fake Telegram Bot API")
+    parser.add_argument("--host", default="0.0.0.0")
+    parser.add_argument("--port", type=int, default=8090)
+    parser.add_argument("--latency-ms", type=float, default=0)
+    parser.add_argument("--jitter-ms", type=float, default=0)
+    parser.add_argument("--rate-429", type=float, default=0.0, help="доля случайных ответов 429")
+    parser.add_argument("--retry-after", type=int, default=1, help="retry_after случайных 429")
+    parser.add_argument("--no-limits", action="store_true", help="без лимитов Telegram на отправку")
+    parser.add_argument("--global-limit", type=int, default=30, help="сообщений в секунду на бота")
+    parser.add_argument("--private-limit", type=int, default=1, help="сообщений в секунду в личный чат")
+    parser.add_argument("--group-limit", type=int, default=20, help="сообщений в минуту в группу")
+    parser.add_argument("--blocked", default="", help="chat_id через запятую, которые получают 403")
+    parser.add_argument("--blocked-ratio", type=float, default=0.0, help="доля личных чатов с 403")
+    parser.add_argument("--seed", type=int)
+    return parser
+
+def main():
+    args = build_parser().parse_args()
+    fake = FakeTelegram(
+        latency_ms=args.latency_ms, jitter_ms=args.jitter_ms, rate_429=args.rate_429,
+        retry_after=args.retry_after, limits=not args.no_limits, global_limit=args.global_limit,
+        private_limit=args.private_limit, group_limit=args.group_limit,
+        blocked=[int(chat_id) for chat_id in args.blocked.split(",") if chat_id.strip()],
+        blocked_ratio=args.blocked_ratio, seed=args.seed
+    )
+    print("🤖 Fake Telegram Bot API: http://{}:{} (TELEGRAM_API_URL)".format(args.host, args.port))
+    web.run_app(fake.app, host=args.host, port=args.port, access_log=None, print=None)
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,70 @@
+#!/usr/bin/env python3
+# -*- coding: utf-8 -*-
+"""
+Проверки здоровья конвейера для /healthz и /readyz
+
+Процесс, который отвечает и открывает SQLite, еще не значит, что сообщения
+обрабатываются. Поэтому проверяется возраст самой старой просроченной
+реакции (зависшая process_reaction_queue), самого старого pending в
+модерации, пульс бота (process_reaction_queue пишет его в meta каждый
+проход) и время последнего апдейта от Telegram.
+
+Все значения - из Database.get_pipeline_state: MIN по индексам и поиск
+по ключу в meta, стоимость не растет с таблицами. Порог 0 - значение
+только показывается и на готовность не влияет.
+"""
+
+import os
+import time
+try:
+    from typing import Dict, Any, Optional
+except ImportError:
+    # Для старых версий Python
+    pass
+
+from database import db
+from tracing import sqlite_timestamp
+
+# Пороги, секунды
+MAX_REACTION_LAG = float(os.getenv("HEALTH_MAX_REACTION_LAG", "60"))
+MAX_HEARTBEAT_AGE = float(os.getenv("HEALTH_MAX_HEARTBEAT_AGE", "60"))
+# Модерация ждет людей, а апдейтов в тихих чатах может не быть часами
+MAX_MODERATION_AGE = float(os.getenv("HEALTH_MAX_MODERATION_AGE", "0"))
+MAX_UPDATE_AGE = float(os.getenv("HEALTH_MAX_UPDATE_AGE", "0"))
+
+def _age(since: Optional[float], now: float) -> Optional[float]:
+    return round(max(0.0, now - since), 1) if since is not None else None
+
+def age_check(age: Optional[float], limit: float, missing_ok: bool = True) -> Dict[str, Any]:
+    """Проверка возраста: ok, если значения нет (missing_ok) или оно не больше порога"""
+    if age is None:
+        ok = missing_ok
+    else:
+        ok = not limit or age <= limit
+    return {'age_seconds': age, 'limit_seconds': limit or None, 'ok': ok}
+
+def pipeline_checks() -> Dict[str, Dict[str, Any]]:
+    """Проверки очереди реакций, модерации и пульса бота по общей БД"""
+    state = db.get_pipeline_state()
+    # Время SQLite, а не процесса: CURRENT_TIMESTAMP пишется им же
+    now = sqlite_timestamp(state['now']) or time.time()
+    return {
+        'reaction_queue': age_check(_age(sqlite_timestamp(state['oldest_overdue_reaction']), now), MAX_REACTION_LAG),
+        'moderation_queue': age_check(_age(sqlite_timestamp(state['oldest_pending_moderation']), now),
+                                      MAX_MODERATION_AGE),
+        # Пульса нет, пока бот ни разу не запускался с этой версией
+        'bot_heartbeat': age_check(_age(state['bot_heartbeat'], now), MAX_HEARTBEAT_AGE, missing_ok=False),
+        'bot_last_update': age_check(_age(state['bot_last_update'], now), MAX_UPDATE_AGE),
+    }
+
+def health_report(extra: Dict[str, Dict[str, Any]] = None) -> Dict[str, Any]:
+    """Сводка: status ok/fail и все проверки; SQLite недоступна - одна неудачная проверка"""
+    try:
+        checks = pipeline_checks()
+    except Exception as e:
+        checks = {'sqlite': {'ok': False, 'error': str(e)}}
+    checks.update(extra or {})
+    return {
+        'status': 'ok' if all(check['ok'] for check in checks.values()) else 'fail',
+        'checks': checks,
+    }
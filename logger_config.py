@@ -3,10 +3,24 @@
 Конфигурация красивого логирования для бота и админки
 """
 
-import logging
+import os
 import sys
+import json
+import queue
+import atexit
+import logging
+import itertools
+import threading
+from collections import deque
+from logging.handlers import QueueHandler, QueueListener
 from datetime import datetime
-from typing import Dict, Any
+from typing import Dict, Any, List
+
+# Сколько последних событий держать в памяти для /api/debug/events
+EVENT_BUFFER_SIZE = int(os.getenv("EVENT_BUFFER_SIZE", "1000"))
+
+# Порядок уровней для фильтра level в get_events
+EVENT_LEVELS = {'debug': 10, 'info': 20, 'warning': 30, 'error': 40, 'critical': 50}
 
 class ColoredFormatter(logging.Formatter):
     """Цветной форматтер для логов"""
@@ -31,7 +45,7 @@ class ColoredFormatter(logging.Formatter):
     }
     
     def format(self, record):
-        # Получаем цвет и эмодзи для уровня
+        # Видимость уже решил VisibilityFilter - здесь только оформление
         color = self.COLORS.get(record.levelname, '')
         reset = self.COLORS['RESET']
         emoji = self.EMOJIS.get(record.levelname, '📝')
@@ -62,45 +76,200 @@ class ColoredFormatter(logging.Formatter):
             return f"{color}{emoji} {timestamp} [{logger_name}]{reset} 📡 Проверка обновлений Telegram"
         elif 'HTTP/1.1 200 OK' in message:
             return f"{color}{emoji} {timestamp} [{logger_name}]{reset} 🌐 API запрос выполнен"
-        elif record.levelname in ['ERROR', 'CRITICAL']:
-            return f"{color}{emoji} {timestamp} [{logger_name}]{reset} {message}"
-        elif record.levelname == 'WARNING':
-            return f"{color}{emoji} {timestamp} [{logger_name}]{reset} {message}"
-        else:
-            # Для обычных INFO сообщений показываем только важные
-            if any(keyword in message.lower() for keyword in ['ошибка', 'error', 'реакция', 'модерация', 'тег']):
-                return f"{color}{emoji} {timestamp} [{logger_name}]{reset} {message}"
-            else:
-                # Скрываем рутинные сообщения
-                return None
-
-def setup_logging(app_name: str = "BOT", level: str = "INFO"):
-    """Настройка красивого логирования"""
+        return f"{color}{emoji} {timestamp} [{logger_name}]{reset} {message}"
+
+class VisibilityFilter(logging.Filter):
+    """Скрывает рутинные сообщения, не форматируя их
+    
+    Предупреждения и ошибки видны всегда. Остальные - только если в шаблоне
+    сообщения есть ключевое слово или это одно из сообщений, которые
+    ColoredFormatter заменяет коротким текстом. Проверяется шаблон
+    (record.msg), а не результат подстановки аргументов.
+    """
+    
+    KEYWORDS = ('ошибка', 'error', 'реакция', 'модерация', 'тег')
+    SPECIAL = ('process_reaction_queue', 'getupdates', 'http/1.1 200 ok')
+    
+    def filter(self, record):
+        if record.levelno >= logging.WARNING:
+            return True
+        template = str(record.msg).lower()
+        if any(keyword in template for keyword in self.KEYWORDS):
+            return True
+        return any(special in template for special in self.SPECIAL)
+
+class JsonFormatter(logging.Formatter):
+    """Одна строка JSON на запись, для сбора логов машиной
+    
+    Поля event и details есть у записей из log_bot_event.
+    """
+    
+    def format(self, record):
+        data = {
+            'ts': datetime.fromtimestamp(record.created).isoformat(timespec='milliseconds'),
+            'level': record.levelname.lower(),
+            'logger': record.name,
+            'message': record.getMessage(),
+        }
+        event = getattr(record, 'event', None)
+        if event:
+            data['event'] = event
+            for key, value in (getattr(record, 'details', None) or {}).items():
+                data.setdefault(key, value)
+        if record.exc_info:
+            data['exc'] = self.formatException(record.exc_info)
+        return json.dumps(data, ensure_ascii=False, default=str)
+
+class EventBuffer:
+    """Кольцевой буфер последних событий процесса
+    
+    Хранит события log_bot_event и предупреждения/ошибки любых логгеров,
+    чтобы разбирать инцидент через админку без docker logs. Старые события
+    вытесняются при переполнении, id растет монотонно - по нему удобно
+    забирать только новые (after).
+    """
+    
+    def __init__(self, size: int = EVENT_BUFFER_SIZE):
+        self._events = deque(maxlen=size)
+        self._ids = itertools.count(1)
+        self._lock = threading.Lock()
+        self.source = "BOT"
+    
+    def add(self, event_type: str, level: str, details: Dict[str, Any], created: float = None) -> Dict[str, Any]:
+        event = dict(details)
+        event.update({
+            'ts': datetime.fromtimestamp(created) if created else datetime.now(),
+            'source': self.source,
+            'event': event_type,
+            'level': level,
+        })
+        with self._lock:
+            event['id'] = next(self._ids)
+            self._events.append(event)
+        return event
+    
+    def query(self, event: str = None, level: str = None, since: datetime = None,
+              after: int = 0, search: str = None, limit: int = 100) -> List[Dict[str, Any]]:
+        """События от новых к старым с фильтрами
+        
+        level - минимальный уровень, search - подстрока в любом поле
+        (без учета регистра), since - не раньше этого времени.
+        """
+        with self._lock:
+            snapshot = list(self._events)
+        if since and since.tzinfo:
+            # Время событий локальное и без зоны
+            since = since.astimezone().replace(tzinfo=None)
+        min_level = EVENT_LEVELS.get((level or '').lower(), 0)
+        search = (search or '').lower()
+        result = []
+        for item in reversed(snapshot):
+            if item['id'] <= after:
+                break
+            if since and item['ts'] < since:
+                continue
+            if event and item['event'] != event:
+                continue
+            if EVENT_LEVELS.get(item['level'], 0) < min_level:
+                continue
+            if search and not any(search in str(value).lower() for value in item.values()):
+                continue
+            result.append(dict(item, ts=item['ts'].isoformat(timespec='milliseconds')))
+            if len(result) >= limit:
+                break
+        return result
+    
+    def clear(self):
+        with self._lock:
+            self._events.clear()
+
+# Буфер событий этого процесса
+event_buffer = EventBuffer()
+
+class EventBufferHandler(logging.Handler):
+    """Складывает предупреждения и ошибки в буфер событий
+    
+    Записи log_bot_event пропускаются - они попадают в буфер сами,
+    со структурированными полями.
+    """
+    
+    def __init__(self):
+        super().__init__(logging.WARNING)
+    
+    def emit(self, record):
+        if getattr(record, 'event', None):
+            return
+        try:
+            event_buffer.add('log', record.levelname.lower(), {
+                'logger': record.name,
+                'message': record.getMessage(),
+            }, record.created)
+        except Exception:
+            self.handleError(record)
+
+class _LocalQueueHandler(QueueHandler):
+    """QueueHandler для очереди внутри процесса
+    
+    Стандартный prepare() форматирует запись еще в потоке, который пишет лог.
+    Здесь только подставляются аргументы (чтобы изменения объектов после
+    вызова не попали в лог), а оформление и запись в stdout делает поток
+    QueueListener - event loop не ждет вывода.
+    """
+    
+    def prepare(self, record):
+        record.msg = record.getMessage()
+        record.args = None
+        return record
+
+# Активный поток вывода логов (перезапускается при повторном setup_logging)
+_listener = None
+
+def _stop_listener():
+    global _listener
+    if _listener is not None:
+        _listener.stop()
+        _listener = None
+
+def setup_logging(app_name: str = "BOT", level: str = None, json_format: bool = None):
+    """Настройка красивого логирования
+    
+    Уровень по умолчанию берется из LOG_LEVEL (INFO). Видимость записи
+    решает фильтр до постановки в очередь, форматирование - один раз
+    в потоке QueueListener. LOG_FORMAT=json включает вывод JSON-строк
+    без скрытия рутинных сообщений.
+    """
+    global _listener
+    
+    if level is None:
+        level = os.getenv("LOG_LEVEL", "INFO")
+    if json_format is None:
+        json_format = os.getenv("LOG_FORMAT", "text").lower() == "json"
+    event_buffer.source = app_name
     
     # Создаем основной логгер
     logger = logging.getLogger()
     logger.setLevel(getattr(logging, level.upper()))
     
     # Очищаем существующие обработчики
+    _stop_listener()
     logger.handlers.clear()
     
-    # Создаем консольный обработчик
+    # Создаем консольный обработчик (работает в потоке QueueListener)
     console_handler = logging.StreamHandler(sys.stdout)
-    console_handler.setLevel(getattr(logging, level.upper()))
-    
-    # Устанавливаем цветной форматтер
-    formatter = ColoredFormatter()
-    console_handler.setFormatter(formatter)
+    console_handler.setFormatter(JsonFormatter() if json_format else ColoredFormatter())
     
-    # Добавляем фильтр для скрытия None сообщений
-    def filter_none(record):
-        formatted = formatter.format(record)
-        return formatted is not None
+    # Фильтр стоит на QueueHandler: скрытые записи даже не попадают в очередь
+    queue_handler = _LocalQueueHandler(queue.SimpleQueue())
+    queue_handler.setLevel(getattr(logging, level.upper()))
+    if not json_format:
+        queue_handler.addFilter(VisibilityFilter())
     
-    console_handler.addFilter(filter_none)
+    _listener = QueueListener(queue_handler.queue, console_handler)
+    _listener.start()
     
     # Добавляем обработчик к логгеру
-    logger.addHandler(console_handler)
+    logger.addHandler(queue_handler)
+    logger.addHandler(EventBufferHandler())
     
     # Настраиваем уровни для внешних библиотек
     logging.getLogger('httpx').setLevel(logging.WARNING)
@@ -114,22 +283,51 @@ def setup_logging(app_name: str = "BOT", level: str = "INFO"):
 🤖 {app_name} запущен
 ⏰ {datetime.now().strftime('%Y-%m-%d %H:%M:%S')}
 📊 Уровень логирования: {level.upper()}
-🎨 Цветное логирование включено
+{'🧾 Формат логов: JSON' if json_format else '🎨 Цветное логирование включено'}
 """)
 
+# Дописываем оставшиеся в очереди записи при выходе
+atexit.register(_stop_listener)
+
 def log_bot_event(event_type: str, details: Dict[str, Any]):
-    """Логирование событий бота"""
+    """Логирование событий бота
+    
+    Событие попадает в буфер событий со всеми полями details и в обычный
+    лог; в JSON-режиме поля details выводятся отдельными ключами.
+    """
     logger = logging.getLogger('BOT')
+    extra = {'event': event_type, 'details': details}
     
     if event_type == 'reaction_set':
-        logger.info(f"🎯 Реакция {details['emoji']} поставлена | Пользователь: {details['user']} | Тег: {details['tag']}")
+        level = logging.INFO
+        logger.info("🎯 Реакция %s поставлена | Пользователь: %s | Тег: %s",
+                    details['emoji'], details['user'], details['tag'], extra=extra)
     elif event_type == 'moderation_added':
-        logger.info(f"📝 Сообщение добавлено в модерацию | Пользователь: {details['user']} | Тег: {details['tag']}")
+        level = logging.INFO
+        logger.info("📝 Сообщение добавлено в модерацию | Пользователь: %s | Тег: %s",
+                    details['user'], details['tag'], extra=extra)
     elif event_type == 'moderation_approved':
-        logger.info(f"✅ Сообщение одобрено | ID: {details['id']} | Тег: {details['tag']}")
+        level = logging.INFO
+        logger.info("✅ Сообщение одобрено | ID: %s | Тег: %s", details['id'], details['tag'], extra=extra)
     elif event_type == 'moderation_rejected':
-        logger.info(f"❌ Сообщение отклонено | ID: {details['id']} | Тег: {details['tag']}")
+        level = logging.INFO
+        logger.info("❌ Сообщение отклонено | ID: %s | Тег: %s", details['id'], details['tag'], extra=extra)
     elif event_type == 'duplicate_media':
-        logger.warning(f"🔄 Дублирующееся медиа отклонено | Пользователь: {details['user']}")
+        level = logging.WARNING
+        logger.warning("🔄 Дублирующееся медиа отклонено | Пользователь: %s", details['user'], extra=extra)
+    elif event_type == 'loop_stall':
+        level = logging.WARNING
+        logger.warning("🐢 Event loop заблокирован на %s мс | Задача: %s", details['lag_ms'], details['task'], extra=extra)
     elif event_type == 'error':
-        logger.error(f"💥 Ошибка: {details['message']}")
+        level = logging.ERROR
+        logger.error("💥 Ошибка: %s", details['message'], extra=extra)
+    else:
+        level = logging.INFO
+        logger.info("📌 Событие %s: %s", event_type, details, extra=extra)
+    
+    event_buffer.add(event_type, logging.getLevelName(level).lower(), details)
+
+def get_events(event: str = None, level: str = None, since: datetime = None, after: int = 0,
+               search: str = None, limit: int = 100) -> List[Dict[str, Any]]:
+    """Последние события этого процесса (см. EventBuffer.query)"""
+    return event_buffer.query(event, level, since, after, search, limit)
@@ -0,0 +1,172 @@
+#!/usr/bin/env python3
+# -*- coding: utf-8 -*-
+"""
+Сторож event loop: задержка планирования и блокирующий код
+
+Задача в loop просыпается каждые LOOP_LAG_INTERVAL_MS и замеряет, насколько
+позже срока она проснулась - это время, на которое loop был занят чужим
+синхронным кодом (SQLite, hashlib и т.п.). Замеры идут в гистограмму
+event_loop_lag_seconds и в окно последних значений для p50/p99.
+
+Пока loop стоит, сама задача ничего увидеть не может, поэтому рядом
+работает поток: если задача не просыпалась дольше порога, он снимает стек
+потока loop (sys._current_frames) и имя текущей asyncio-задачи. Когда loop
+оживает, задержка вместе со стеком уходит в событие loop_stall.
+"""
+
+import asyncio
+import logging
+import os
+import sys
+import threading
+import time
+import traceback
+from collections import deque
+try:
+    from typing import Dict, Any
+except ImportError:
+    # Для старых версий Python
+    pass
+
+from logger_config import log_bot_event
+from metrics import Histogram, Counter
+from query_profiler import percentile
+
+logger = logging.getLogger(__name__)
+
+# Период замера, мс
+LOOP_LAG_INTERVAL_MS = float(os.getenv("LOOP_LAG_INTERVAL_MS", "100"))
+# Задержка, начиная с которой снимается стек и пишется событие, мс
+LOOP_LAG_THRESHOLD_MS = float(os.getenv("LOOP_LAG_THRESHOLD_MS", "100"))
+# Сколько последних замеров держать для перцентилей (при 100 мс - ~10 минут)
+LAG_SAMPLES = 6000
+# Сколько последних остановок хранить
+STALL_LOG_SIZE = 50
+# Сколько нижних кадров стека сохранять
+STACK_DEPTH = 30
+
+LOOP_LAG_SECONDS = Histogram(
+    "event_loop_lag_seconds", "Задержка планирования event loop",
+    buckets=(0.001, 0.0025, 0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1.0, 2.5, 5.0, 10.0))
+LOOP_STALLS = Counter(
+    "event_loop_stalls_total", "Остановки event loop дольше порога")
+
+def _task_name(task) -> str:
+    if task is None:
+        return "-"
+    coro = task.get_coro()
+    return "{} ({})".format(task.get_name(), getattr(coro, '__qualname__', type(coro).__name__))
+
+class LoopWatchdog:
+    """Замер задержки event loop и стек кода, который его держит"""
+
+    def __init__(self, interval_ms: float = LOOP_LAG_INTERVAL_MS, threshold_ms: float = LOOP_LAG_THRESHOLD_MS):
+        self.interval = interval_ms / 1000
+        self.threshold = threshold_ms / 1000
+        self.samples = deque(maxlen=LAG_SAMPLES)
+        self.stalls = deque(maxlen=STALL_LOG_SIZE)
+        self._loop = None
+        self._loop_thread_id = None
+        self._task = None
+        self._thread = None
+        self._stop = threading.Event()
+        # Когда задача должна проснуться (time.monotonic)
+        self._deadline = 0.0
+        # Стек, снятый потоком во время текущей остановки
+        self._captured = None
+        self._lock = threading.Lock()
+
+    @property
+    def running(self) -> bool:
+        return self._task is not None
+
+    def start(self):
+        """Запустить из работающего loop (post_init бота, lifespan админки)"""
+        if self._task is not None:
+            return
+        self._loop = asyncio.get_running_loop()
+        self._loop_thread_id = threading.get_ident()
+        self._deadline = time.monotonic() + self.interval
+        self._stop.clear()
+        self._task = self._loop.create_task(self._run(), name="loop-watchdog")
+        self._thread = threading.Thread(target=self._watch, name="loop-watchdog", daemon=True)
+        self._thread.start()
+        logger.info("🐢 Сторож event loop запущен: период %.0f мс, порог %.0f мс",
+                    self.interval * 1000, self.threshold * 1000)
+
+    async def stop(self):
+        if self._task is None:
+            return
+        self._stop.set()
+        self._task.cancel()
+        try:
+            await self._task
+        except asyncio.CancelledError:
+            pass
+        self._task = None
+        self._thread.join(timeout=1.0)
+        self._thread = None
+
+    async def _run(self):
+        while True:
+            await asyncio.sleep(self.interval)
+            now = time.monotonic()
+            lag = max(0.0, now - self._deadline)
+            self._deadline = now + self.interval
+            self.record(lag)
+
+    def record(self, lag: float):
+        """Замер задержки; при превышении порога - событие со снятым стеком"""
+        self.samples.append(lag)
+        LOOP_LAG_SECONDS.observe(lag)
+        with self._lock:
+            captured, self._captured = self._captured, None
+        if lag < self.threshold:
+            return
+        LOOP_STALLS.inc()
+        stall = {
+            'ts': time.time(),
+            'lag_ms': round(lag * 1000, 1),
+            'task': captured['task'] if captured else '-',
+            'stack': captured['stack'] if captured else [],
+        }
+        self.stalls.append(stall)
+        log_bot_event('loop_stall', stall)
+
+    def _watch(self):
+        """Поток: снять стек loop, пока он стоит дольше порога"""
+        poll = max(self.threshold / 2, 0.005)
+        while not self._stop.wait(poll):
+            overdue = time.monotonic() - self._deadline
+            if overdue < self.threshold:
+                continue
+            with self._lock:
+                if self._captured is not None:
+                    # Стек этой остановки уже снят
+                    continue
+            frame = sys._current_frames().get(self._loop_thread_id)
+            if frame is None:
+                continue
+            stack = [line.rstrip() for line in traceback.format_stack(frame)[-STACK_DEPTH:]]
+            task = _task_name(asyncio.current_task(self._loop))
+            del frame
+            with self._lock:
+                self._captured = {'task': task, 'stack': stack}
+
+    def report(self) -> Dict[str, Any]:
+        """p50/p90/p99/max задержки за окно замеров и последние остановки"""
+        values = list(self.samples)
+        return {
+            'running': self.running,
+            'interval_ms': self.interval * 1000,
+            'threshold_ms': self.threshold * 1000,
+            'samples': len(values),
+            'p50_ms': round(percentile(values, 0.5) * 1000, 3),
+            'p90_ms': round(percentile(values, 0.9) * 1000, 3),
+            'p99_ms': round(percentile(values, 0.99) * 1000, 3),
+            'max_ms': round(max(values) * 1000, 3) if values else 0.0,
+            'stalls': list(self.stalls)[::-1],
+        }
+
+# Сторож этого процесса
+watchdog = LoopWatchdog()
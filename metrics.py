@@ -0,0 +1,226 @@
+#!/usr/bin/env python3
+# -*- coding: utf-8 -*-
+"""
+Метрики в формате Prometheus для бота и админки
+
+Свой минимальный вариант вместо prometheus_client: наблюдение - это поиск
+корзины через bisect и два сложения, без блокировок (под GIL потеря
+инкремента возможна только при одновременной записи из двух потоков,
+для метрик это допустимо). Стоимость observe() - доли микросекунды, см.
+bench_metrics.py. Дочерние серии с метками кэшируются: на горячем пути
+labels() - один поиск в словаре.
+"""
+
+import functools
+import time
+from bisect import bisect_left
+from typing import Callable, List, Tuple
+
+# Корзины по умолчанию, секунды: от 50 мкс до 10 с
+DEFAULT_BUCKETS = (0.00005, 0.0001, 0.00025, 0.0005, 0.001, 0.0025, 0.005, 0.01,
+                   0.025, 0.05, 0.1, 0.25, 0.5, 1.0, 2.5, 5.0, 10.0)
+
+class Registry:
+    """Набор метрик процесса"""
+
+    def __init__(self):
+        self.metrics = []
+
+    def register(self, metric):
+        self.metrics.append(metric)
+        return metric
+
+    def render(self) -> str:
+        """Текстовый формат экспозиции Prometheus 0.0.4"""
+        lines = []
+        for metric in self.metrics:
+            lines.append("# HELP {} {}".format(metric.name, metric.documentation))
+            lines.append("# TYPE {} {}".format(metric.name, metric.kind))
+            lines.extend(metric.samples())
+        return "\n".join(lines) + "\n"
+
+REGISTRY = Registry()
+
+# Content-Type ответа /metrics
+CONTENT_TYPE = "text/plain; version=0.0.4; charset=utf-8"
+
+def _escape(value) -> str:
+    return str(value).replace('\\', '\\\\').replace('\n', '\\n').replace('"', '\\"')
+
+def _format_labels(names, values, extra: str = "") -> str:
+    pairs = ['{}="{}"'.format(name, _escape(value)) for name, value in zip(names, values)]
+    if extra:
+        pairs.append(extra)
+    return "{" + ",".join(pairs) + "}" if pairs else ""
+
+def _format_value(value) -> str:
+    if value == float('inf'):
+        return "+Inf"
+    return repr(float(value)) if isinstance(value, float) else str(value)
+
+class _Metric:
+    kind = "untyped"
+
+    def __init__(self, name: str, documentation: str, labelnames: Tuple[str, ...] = (), registry=REGISTRY):
+        self.name = name
+        self.documentation = documentation
+        self.labelnames = tuple(labelnames)
+        self._children = {}
+        if registry is not None:
+            registry.register(self)
+
+    def labels(self, *values):
+        """Серия для значений меток (в порядке labelnames)"""
+        child = self._children.get(values)
+        if child is None:
+            if len(values) != len(self.labelnames):
+                raise ValueError("{}: ожидались метки {}".format(self.name, self.labelnames))
+            child = self._children[values] = self._new_child()
+        return child
+
+    def children(self):
+        """Серии метрики: {значения меток: серия}"""
+        return dict(self._children)
+
+    def _default(self):
+        # Метрика без меток - одна серия
+        return self.labels()
+
+    def _new_child(self):
+        raise NotImplementedError
+
+    def samples(self) -> List[str]:
+        raise NotImplementedError
+
+class _CounterChild:
+    __slots__ = ('value',)
+
+    def __init__(self):
+        self.value = 0
+
+    def inc(self, amount=1):
+        self.value += amount
+
+class Counter(_Metric):
+    """Монотонный счетчик"""
+    kind = "counter"
+
+    def _new_child(self):
+        return _CounterChild()
+
+    def inc(self, amount=1):
+        self._default().value += amount
+
+    def samples(self):
+        return ["{}{} {}".format(self.name, _format_labels(self.labelnames, values), _format_value(child.value))
+                for values, child in list(self._children.items())]
+
+class Gauge(_Metric):
+    """Текущее значение; callback вызывается при каждом чтении /metrics"""
+    kind = "gauge"
+
+    def __init__(self, name: str, documentation: str, callback: Callable[[], float] = None, registry=REGISTRY):
+        super().__init__(name, documentation, (), registry)
+        self.value = 0
+        self.callback = callback
+
+    def set(self, value):
+        self.value = value
+
+    def samples(self):
+        value = self.value
+        if self.callback is not None:
+            try:
+                value = self.callback()
+            except Exception:
+                return []
+        return ["{} {}".format(self.name, _format_value(value))]
+
+class _HistogramChild:
+    __slots__ = ('bounds', 'counts', 'sum')
+
+    def __init__(self, bounds):
+        self.bounds = bounds
+        self.counts = [0] * (len(bounds) + 1)
+        self.sum = 0.0
+
+    def observe(self, value: float):
+        # Корзина "le" - первая граница, не меньшая значения; последняя - +Inf
+        self.counts[bisect_left(self.bounds, value)] += 1
+        self.sum += value
+
+class Histogram(_Metric):
+    """Гистограмма с накопительными корзинами при экспорте"""
+    kind = "histogram"
+
+    def __init__(self, name: str, documentation: str, labelnames: Tuple[str, ...] = (),
+                 buckets: Tuple[float, ...] = DEFAULT_BUCKETS, registry=REGISTRY):
+        self.buckets = tuple(sorted(buckets))
+        super().__init__(name, documentation, labelnames, registry)
+
+    def _new_child(self):
+        return _HistogramChild(self.buckets)
+
+    def observe(self, value: float):
+        self._default().observe(value)
+
+    def samples(self):
+        lines = []
+        for values, child in list(self._children.items()):
+            counts = list(child.counts)
+            total = 0
+            for bound, count in zip(self.buckets + (float('inf'),), counts):
+                total += count
+                lines.append("{}_bucket{} {}".format(
+                    self.name, _format_labels(self.labelnames, values, 'le="{}"'.format(_format_value(bound))), total))
+            labels = _format_labels(self.labelnames, values)
+            lines.append("{}_sum{} {}".format(self.name, labels, _format_value(child.sum)))
+            lines.append("{}_count{} {}".format(self.name, labels, total))
+        return lines
+
+def observe_handler(histogram: Histogram, handler: str):
+    """Декоратор async-обработчика: время с меткой outcome
+
+    outcome - строка, которую вернул обработчик ("ok", если ничего),
+    или "error" при исключении.
+    """
+    def decorator(func):
+        @functools.wraps(func)
+        async def wrapper(*args, **kwargs):
+            start = time.perf_counter()
+            outcome = "error"
+            try:
+                outcome = await func(*args, **kwargs) or "ok"
+            finally:
+                histogram.labels(handler, outcome).observe(time.perf_counter() - start)
+        return wrapper
+    return decorator
+
+# ---- Метрики бота и админки (каждый процесс считает свои) ----
+
+HANDLER_SECONDS = Histogram(
+    "bot_handler_seconds", "Время обработки сообщения обработчиком бота",
+    ("handler", "outcome"))
+TAG_MATCH_SECONDS = Histogram(
+    "bot_tag_match_seconds", "Время поиска тегов в сообщении")
+TAG_MATCHES = Counter(
+    "bot_tag_matches_total", "Сработавшие теги", ("tag",))
+REACTIONS = Counter(
+    "bot_reactions_total", "Итог обработки сработавших тегов", ("tag", "outcome"))
+SQLITE_SECONDS = Histogram(
+    "sqlite_call_seconds", "Время вызова метода Database", ("method",))
+SQLITE_LOCK_WAIT_SECONDS = Histogram(
+    "sqlite_lock_wait_seconds", "Время, потерянное вызовом Database на блокировках (попытки и паузы)", ("method",))
+SQLITE_BUSY_RETRIES = Counter(
+    "sqlite_busy_retries_total", "Повторы вызова Database после database is locked", ("method",))
+SQLITE_BUSY_ERRORS = Counter(
+    "sqlite_busy_errors_total", "Вызовы Database, не дождавшиеся блокировки после всех повторов", ("method",))
+LOGS_ARCHIVED = Counter(
+    "logs_archived_total", "Логи, перенесенные в архив политикой хранения", ("status",))
+TELEGRAM_API_SECONDS = Histogram(
+    "telegram_api_seconds", "Время запроса к Telegram Bot API", ("endpoint", "outcome"))
+HTTP_REQUEST_SECONDS = Histogram(
+    "admin_http_request_seconds", "Время обработки запроса админкой", ("endpoint", "method", "status"))
+
+def render() -> str:
+    return REGISTRY.render()
@@ -0,0 +1,232 @@
+#!/usr/bin/env python3
+# -*- coding: utf-8 -*-
+"""
+Профилирование по запросу: CPU (cProfile или сэмплирование) и память (tracemalloc)
+
+cProfile включается в потоке event loop на N секунд и видит все корутины
+и колбэки, которые за это время выполнял loop. Сэмплирующий профиль
+каждые SAMPLE_INTERVAL снимает стеки всех потоков (loop и пул потоков
+FastAPI для sync-эндпоинтов) и почти не замедляет процесс. Поток сэмплера
+получает GIL на переключении потоков (sys.getswitchinterval) или когда loop
+уходит в select, поэтому короткие функции между await недооцениваются -
+для них точнее cProfile.
+
+tracemalloc включается отдельно: каждый снимок возвращает топ мест
+выделения памяти и разницу с предыдущим снимком.
+
+Одновременно идет только один CPU-профиль на процесс.
+"""
+
+import asyncio
+import cProfile
+import json
+import linecache
+import os
+import pstats
+import sys
+import threading
+import time
+import tracemalloc
+from collections import Counter
+from datetime import datetime
+try:
+    from typing import List, Dict, Any, Optional
+except ImportError:
+    # Для старых версий Python
+    pass
+
+# Максимальная длительность CPU-профиля, секунды
+MAX_PROFILE_SECONDS = 120
+# Период сэмплирования, секунды
+SAMPLE_INTERVAL = 0.005
+
+class ProfileBusyError(RuntimeError):
+    """CPU-профиль этого процесса уже идет"""
+
+_cpu_lock = threading.Lock()
+# Снимок tracemalloc, с которым сравнивается следующий
+_last_snapshot = None
+
+def _function_name(filename: str, lineno: int, name: str) -> str:
+    return "{}:{}({})".format(filename, lineno, name)
+
+def _cprofile_top(profile: cProfile.Profile, top: int, sort: str) -> List[Dict[str, Any]]:
+    rows = []
+    for (filename, lineno, name), (primitive, calls, own, total, _) in pstats.Stats(profile).stats.items():
+        rows.append({
+            'function': _function_name(filename, lineno, name),
+            'calls': calls,
+            'primitive_calls': primitive,
+            'own_ms': round(own * 1000, 3),
+            'total_ms': round(total * 1000, 3),
+        })
+    rows.sort(key=lambda row: row['own_ms' if sort == 'own' else 'total_ms'], reverse=True)
+    return rows[:top]
+
+def _sample(seconds: float, interval: float, stop: threading.Event) -> Dict[str, Any]:
+    """Снимать стеки всех потоков, кроме своего; счетчики own/total по функциям"""
+    own, total = Counter(), Counter()
+    samples = 0
+    me = threading.get_ident()
+    deadline = time.monotonic() + seconds
+    while time.monotonic() < deadline and not stop.is_set():
+        for thread_id, frame in sys._current_frames().items():
+            if thread_id == me:
+                continue
+            code = frame.f_code
+            own[(code.co_filename, frame.f_lineno, code.co_name)] += 1
+            seen = set()
+            while frame is not None:
+                code = frame.f_code
+                key = (code.co_filename, code.co_firstlineno, code.co_name)
+                if key not in seen:
+                    seen.add(key)
+                    total[key] += 1
+                frame = frame.f_back
+            samples += 1
+        time.sleep(interval)
+    return {'samples': samples, 'own': own, 'total': total}
+
+def _sampling_top(result: Dict[str, Any], top: int, sort: str) -> List[Dict[str, Any]]:
+    samples = result['samples'] or 1
+    counter = result['own'] if sort == 'own' else result['total']
+    rows = []
+    for (filename, lineno, name), count in counter.most_common(top):
+        rows.append({
+            'function': _function_name(filename, lineno, name),
+            'samples': count,
+            'percent': round(count * 100.0 / samples, 2),
+        })
+    return rows
+
+async def profile_cpu(seconds: float, mode: str = "cprofile", top: int = 30, sort: str = "total") -> Dict[str, Any]:
+    """CPU-профиль процесса за seconds секунд: топ функций
+
+    mode: cprofile - точные вызовы и время в потоке loop;
+          sampling - доля сэмплов по всем потокам.
+    sort: total - с учетом вложенных вызовов, own - только собственное время.
+    """
+    if mode not in ("cprofile", "sampling"):
+        raise ValueError("mode: cprofile или sampling")
+    seconds = min(max(float(seconds), 0.1), MAX_PROFILE_SECONDS)
+    if not _cpu_lock.acquire(blocking=False):
+        raise ProfileBusyError("Профилирование уже идет")
+    try:
+        started = time.time()
+        if mode == "cprofile":
+            profile = cProfile.Profile()
+            profile.enable()
+            try:
+                await asyncio.sleep(seconds)
+            finally:
+                profile.disable()
+            functions = _cprofile_top(profile, top, sort)
+            samples = None
+        else:
+            stop = threading.Event()
+            try:
+                result = await asyncio.to_thread(_sample, seconds, SAMPLE_INTERVAL, stop)
+            finally:
+                stop.set()
+            functions = _sampling_top(result, top, sort)
+            samples = result['samples']
+        return {
+            'mode': mode,
+            'sort': sort,
+            'started_at': datetime.fromtimestamp(started).isoformat(timespec='seconds'),
+            'seconds': round(time.time() - started, 3),
+            'samples': samples,
+            'functions': functions,
+        }
+    finally:
+        _cpu_lock.release()
+
+def rss_kb() -> Optional[float]:
+    """Текущий RSS процесса (Linux, /proc); на других системах - пиковый из getrusage"""
+    try:
+        with open("/proc/self/statm") as f:
+            return round(int(f.read().split()[1]) * os.sysconf("SC_PAGE_SIZE") / 1024, 1)
+    except (OSError, ValueError, IndexError):
+        pass
+    try:
+        import resource
+        peak = resource.getrusage(resource.RUSAGE_SELF).ru_maxrss
+        # macOS считает в байтах, Linux - в килобайтах
+        return round(peak / 1024 if sys.platform == "darwin" else peak, 1)
+    except ImportError:
+        return None
+
+def memory_status() -> Dict[str, Any]:
+    current, peak = tracemalloc.get_traced_memory()
+    return {
+        'rss_kb': rss_kb(),
+        'tracing': tracemalloc.is_tracing(),
+        'frames': tracemalloc.get_traceback_limit(),
+        'current_kb': round(current / 1024, 1),
+        'peak_kb': round(peak / 1024, 1),
+        'baseline': _last_snapshot is not None,
+    }
+
+def memory_start(frames: int = 10) -> Dict[str, Any]:
+    """Включить tracemalloc (frames - глубина стека места выделения)"""
+    global _last_snapshot
+    if not tracemalloc.is_tracing():
+        tracemalloc.start(max(1, min(int(frames), 50)))
+        _last_snapshot = None
+    return memory_status()
+
+def memory_stop() -> Dict[str, Any]:
+    """Выключить tracemalloc и забыть снимок"""
+    global _last_snapshot
+    tracemalloc.stop()
+    _last_snapshot = None
+    return memory_status()
+
+def _site(traceback: tracemalloc.Traceback) -> str:
+    frame = traceback[0]
+    line = linecache.getline(frame.filename, frame.lineno).strip()
+    return "{}:{}{}".format(frame.filename, frame.lineno, " " + line if line else "")
+
+def memory_snapshot(top: int = 30, group_by: str = "lineno") -> Dict[str, Any]:
+    """Топ мест выделения памяти и разница с предыдущим снимком
+
+    Снимок становится базой для следующего вызова. group_by: lineno
+    (строка), filename или traceback (весь стек места выделения).
+    """
+    global _last_snapshot
+    if not tracemalloc.is_tracing():
+        raise RuntimeError("tracemalloc не запущен")
+    if group_by not in ("lineno", "filename", "traceback"):
+        raise ValueError("group_by: lineno, filename или traceback")
+    snapshot = tracemalloc.take_snapshot().filter_traces((
+        tracemalloc.Filter(False, tracemalloc.__file__),
+        tracemalloc.Filter(False, "<frozen importlib._bootstrap>"),
+        tracemalloc.Filter(False, "<unknown>"),
+    ))
+
+    allocations = []
+    for stat in snapshot.statistics(group_by)[:top]:
+        entry = {'site': _site(stat.traceback), 'size_kb': round(stat.size / 1024, 1), 'count': stat.count}
+        if group_by == "traceback":
+            entry['traceback'] = stat.traceback.format()
+        allocations.append(entry)
+
+    diff = None
+    if _last_snapshot is not None:
+        diff = [{
+            'site': _site(stat.traceback),
+            'size_kb': round(stat.size / 1024, 1),
+            'size_diff_kb': round(stat.size_diff / 1024, 1),
+            'count_diff': stat.count_diff,
+        } for stat in snapshot.compare_to(_last_snapshot, group_by)[:top]]
+    _last_snapshot = snapshot
+
+    return dict(memory_status(), top=allocations, diff=diff)
+
+def write_report(directory: str, kind: str, report: Dict[str, Any]) -> str:
+    """Сохранить отчет в JSON-файл (для триггера по сигналу в боте)"""
+    os.makedirs(directory, exist_ok=True)
+    path = os.path.join(directory, "{}_{}.json".format(kind, datetime.now().strftime('%Y%m%d_%H%M%S')))
+    with open(path, "w", encoding="utf-8") as f:
+        json.dump(report, f, ensure_ascii=False, indent=2)
+    return path
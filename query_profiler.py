@@ -0,0 +1,186 @@
+#!/usr/bin/env python3
+# -*- coding: utf-8 -*-
+"""
+Профилировщик запросов SQLite
+
+Выключен по умолчанию: SQLITE_PROFILE=1 или POST /api/debug/sql.
+Когда включен, Database открывает соединения ProfilingConnection: время
+каждого execute/executemany записывается на метод Database, из которого
+он вызван, а для запросов медленнее SQLITE_SLOW_MS сохраняется
+EXPLAIN QUERY PLAN. Выключенный профилировщик стоит одну проверку флага.
+
+Время запроса - это execute(): для SELECT без сортировки часть строк
+читается позже, в fetch*, поэтому полное время метода считается отдельно.
+"""
+
+import contextvars
+import os
+import re
+import sqlite3
+import threading
+import time
+from collections import deque
+try:
+    from typing import List, Dict, Any
+except ImportError:
+    # Для старых версий Python
+    pass
+
+# Порог медленного запроса, мс
+SLOW_QUERY_MS = float(os.getenv("SQLITE_SLOW_MS", "50"))
+# Сколько последних замеров держать на метод и на запрос
+SAMPLES_PER_SERIES = 1000
+# Сколько последних медленных запросов хранить
+SLOW_LOG_SIZE = 200
+
+# Метод Database, внутри которого выполняется запрос
+current_method = contextvars.ContextVar('db_method', default='-')
+
+# Строка плана "SCAN logs", "SCAN logs USING INDEX ..." и т.п.
+_SCAN = re.compile(r'^SCAN (?:TABLE )?(\w+)(?: AS \w+)?(?: USING (COVERING )?INDEX \w+)?$')
+
+def percentile(values: List[float], q: float) -> float:
+    """Перцентиль по ближайшему рангу"""
+    if not values:
+        return 0.0
+    ordered = sorted(values)
+    return ordered[min(len(ordered) - 1, int(round(q * (len(ordered) - 1))))]
+
+def normalize_sql(sql: str) -> str:
+    return ' '.join(sql.split())
+
+def _summary(samples) -> Dict[str, Any]:
+    values = list(samples)
+    return {
+        'calls': len(values),
+        'p50_ms': round(percentile(values, 0.5) * 1000, 3),
+        'p99_ms': round(percentile(values, 0.99) * 1000, 3),
+        'max_ms': round(max(values) * 1000, 3) if values else 0.0,
+    }
+
+class QueryProfiler:
+    """Замеры запросов и методов Database в памяти процесса"""
+
+    def __init__(self):
+        self.enabled = os.getenv("SQLITE_PROFILE", "").lower() in ("1", "true", "yes")
+        self.slow_ms = SLOW_QUERY_MS
+        self._lock = threading.Lock()
+        self.reset()
+
+    def reset(self):
+        with self._lock:
+            self._methods = {}
+            self._statements = {}
+            # Планы кэшируются по тексту запроса: план от параметров почти не зависит
+            self.plans = {}
+            self.slow = deque(maxlen=SLOW_LOG_SIZE)
+
+    def configure(self, enabled: bool = None, slow_ms: float = None):
+        if enabled is not None:
+            self.enabled = enabled
+        if slow_ms is not None:
+            self.slow_ms = slow_ms
+
+    def record_method(self, method: str, seconds: float):
+        with self._lock:
+            samples = self._methods.get(method)
+            if samples is None:
+                samples = self._methods[method] = deque(maxlen=SAMPLES_PER_SERIES)
+            samples.append(seconds)
+
+    def record_statement(self, conn: sqlite3.Connection, sql: str, parameters, seconds: float):
+        method = current_method.get()
+        text = normalize_sql(sql)
+        with self._lock:
+            samples = self._statements.get((method, text))
+            if samples is None:
+                samples = self._statements[(method, text)] = deque(maxlen=SAMPLES_PER_SERIES)
+            samples.append(seconds)
+        if seconds * 1000 >= self.slow_ms:
+            self.slow.append({
+                'ts': time.time(),
+                'method': method,
+                'sql': text,
+                'ms': round(seconds * 1000, 3),
+                'plan': self.explain(conn, text, parameters),
+            })
+
+    def explain(self, conn: sqlite3.Connection, sql: str, parameters=()) -> List[str]:
+        """EXPLAIN QUERY PLAN для запроса (из кэша, если уже был)"""
+        plan = self.plans.get(sql)
+        if plan is not None:
+            return plan
+        if sql.split(' ', 1)[0].upper() not in ('SELECT', 'INSERT', 'UPDATE', 'DELETE', 'WITH', 'REPLACE'):
+            return []
+        try:
+            # Базовый execute, чтобы сам EXPLAIN не попал в замеры
+            rows = sqlite3.Connection.execute(conn, "EXPLAIN QUERY PLAN " + sql, parameters).fetchall()
+            plan = [row[3] for row in rows]
+        except sqlite3.Error as e:
+            plan = ["EXPLAIN не удался: {}".format(e)]
+        self.plans[sql] = plan
+        return plan
+
+    def full_scans(self, tables=('logs', 'moderation_queue')) -> Dict[str, List[str]]:
+        """Запросы с WHERE, план которых проходит таблицу целиком: {sql: [таблицы]}
+
+        SCAN по таблице без условия - это осознанный проход (COUNT(*),
+        последние N по индексу времени). С условием SCAN, даже по индексу
+        для сортировки, означает, что для условия индекса нет.
+        """
+        result = {}
+        for sql, plan in list(self.plans.items()):
+            if ' WHERE ' not in sql.upper():
+                continue
+            scanned = [m.group(1) for m in (_SCAN.match(step.strip()) for step in plan)
+                       if m and m.group(1) in tables]
+            if scanned:
+                result[sql] = scanned
+        return result
+
+    def report(self) -> Dict[str, Any]:
+        """p50/p99 по методам и их запросам плюс журнал медленных запросов"""
+        with self._lock:
+            methods = {name: _summary(samples) for name, samples in self._methods.items()}
+            statements = [(method, sql, _summary(samples)) for (method, sql), samples in self._statements.items()]
+            slow = list(self.slow)
+        for method, sql, summary in statements:
+            entry = methods.setdefault(method, {'calls': 0, 'p50_ms': 0.0, 'p99_ms': 0.0, 'max_ms': 0.0})
+            entry.setdefault('statements', []).append(dict(summary, sql=sql))
+        for entry in methods.values():
+            entry.setdefault('statements', []).sort(key=lambda s: s['p99_ms'], reverse=True)
+        return {
+            'enabled': self.enabled,
+            'slow_ms': self.slow_ms,
+            'methods': dict(sorted(methods.items(), key=lambda item: item[1]['p99_ms'], reverse=True)),
+            'slow': slow[::-1],
+        }
+
+# Профилировщик этого процесса
+profiler = QueryProfiler()
+
+def apply_profile_config(target: QueryProfiler, config: Dict[str, Any]):
+    """Настройки из запроса админки: enabled, slow_ms, reset"""
+    if config.get('reset'):
+        target.reset()
+    target.configure(config.get('enabled'), config.get('slow_ms'))
+
+class ProfilingConnection(sqlite3.Connection):
+    """Соединение, которое отдает время каждого запроса профилировщику"""
+
+    def execute(self, sql, parameters=()):
+        start = time.perf_counter()
+        try:
+            return super().execute(sql, parameters)
+        finally:
+            profiler.record_statement(self, sql, parameters, time.perf_counter() - start)
+
+    def executemany(self, sql, seq_of_parameters):
+        seq_of_parameters = list(seq_of_parameters)
+        start = time.perf_counter()
+        try:
+            return super().executemany(sql, seq_of_parameters)
+        finally:
+            # План строится по первому набору параметров
+            profiler.record_statement(self, sql, seq_of_parameters[0] if seq_of_parameters else (),
+                                      time.perf_counter() - start)
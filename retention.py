@@ -0,0 +1,181 @@
+#!/usr/bin/env python3
+# -*- coding: utf-8 -*-
+"""
+Хранение логов: старые строки logs переносятся в сжатый архив
+
+Политика - срок хранения в днях по статусу лога, '*' - для остальных
+статусов, 0 - хранить всегда:
+
+    LOG_RETENTION=failed=30,*=365
+
+Бот раз в RETENTION_INTERVAL_SECONDS переносит не больше
+RETENTION_MAX_BATCHES пачек по RETENTION_BATCH_SIZE строк: каждая
+пачка дописывается в LOG_ARCHIVE_DIR/logs-ГГГГ-ММ.jsonl.gz (месяц лога,
+одна строка JSON на лог), файл сбрасывается на диск, и только потом
+строки удаляются из БД короткой транзакцией вместе с прибавкой к
+logs_rollup - общая статистика и статистика по тегам не меняются.
+После удаления освобожденные страницы отдаются ОС по частям
+(PRAGMA incremental_vacuum).
+
+Если процесс упадет между записью архива и удалением, пачка попадет в
+архив второй раз; у каждой строки есть id, дубли легко отбросить.
+
+    python retention.py             # один проход с настройками из окружения
+    python retention.py --dry-run   # сколько строк попало бы в архив
+    python retention.py --vacuum    # перевести существующую БД на incremental vacuum (полный VACUUM, бот остановлен)
+"""
+
+import argparse
+import gzip
+import json
+import logging
+import os
+import time
+from datetime import datetime, timedelta
+try:
+    from typing import Dict, List, Any
+except ImportError:
+    # Для старых версий Python
+    pass
+
+from database import Database
+from metrics import LOGS_ARCHIVED
+
+logger = logging.getLogger(__name__)
+
+LOG_RETENTION = os.getenv("LOG_RETENTION", "failed=30,*=365")
+LOG_ARCHIVE_DIR = os.getenv("LOG_ARCHIVE_DIR", "")
+RETENTION_BATCH_SIZE = int(os.getenv("RETENTION_BATCH_SIZE", "500"))
+RETENTION_MAX_BATCHES = int(os.getenv("RETENTION_MAX_BATCHES", "10"))
+RETENTION_INTERVAL_SECONDS = float(os.getenv("RETENTION_INTERVAL_SECONDS", "60"))
+# Страниц (обычно по 4 КБ) на одну отдачу места ОС
+RETENTION_VACUUM_PAGES = int(os.getenv("RETENTION_VACUUM_PAGES", "1000"))
+
+def parse_policies(spec: str) -> Dict[str, float]:
+    """'failed=30,*=365' -> {'failed': 30.0, '*': 365.0}"""
+    policies = {}
+    for part in spec.split(","):
+        part = part.strip()
+        if not part:
+            continue
+        status, _, days = part.partition("=")
+        if not days:
+            raise ValueError("Политика хранения без срока: {!r}".format(part))
+        policies[status.strip()] = float(days)
+    return policies
+
+def cutoff(days: float, now: float = None) -> str:
+    """Граница в формате logs.timestamp (UTC): строки старше days дней"""
+    moment = datetime.utcfromtimestamp(time.time() if now is None else now) - timedelta(days=days)
+    return moment.strftime('%Y-%m-%d %H:%M:%S')
+
+def archive_dir_for(db: Database) -> str:
+    return LOG_ARCHIVE_DIR or os.path.join(os.path.dirname(os.path.abspath(db.db_path)), "archive")
+
+def write_archive(archive_dir: str, rows: List[Dict[str, Any]]) -> List[str]:
+    """Дописать строки в архивы их месяцев и сбросить на диск; вернуть пути
+
+    Каждый вызов добавляет к файлу отдельный gzip-член: gzip.open и
+    zcat читают такой файл целиком.
+    """
+    os.makedirs(archive_dir, exist_ok=True)
+    by_month = {}
+    for row in rows:
+        by_month.setdefault(str(row['timestamp'])[:7], []).append(row)
+    paths = []
+    for month, month_rows in sorted(by_month.items()):
+        path = os.path.join(archive_dir, "logs-{}.jsonl.gz".format(month))
+        with open(path, "ab") as raw:
+            with gzip.GzipFile(fileobj=raw, mode="wb") as f:
+                for row in month_rows:
+                    f.write(json.dumps(row, ensure_ascii=False).encode("utf-8") + b"\n")
+            raw.flush()
+            os.fsync(raw.fileno())
+        paths.append(path)
+    return paths
+
+def read_archive(path: str) -> List[Dict[str, Any]]:
+    """Строки архива (для проверки и восстановления)"""
+    with gzip.open(path, "rt", encoding="utf-8") as f:
+        return [json.loads(line) for line in f if line.strip()]
+
+def run_retention(db: Database, policies: Dict[str, float] = None, archive_dir: str = None,
+                  batch_size: int = None, max_batches: int = None, vacuum_pages: int = None,
+                  now: float = None, dry_run: bool = False) -> Dict[str, Any]:
+    """Один проход политики: перенести в архив до max_batches пачек
+
+    Возвращает {'archived': {статус политики: строк}, 'files': [...],
+    'free_pages': страниц после vacuum}. Если старых строк больше, чем
+    помещается в проход, остаток уйдет в следующих.
+    """
+    policies = parse_policies(LOG_RETENTION) if policies is None else policies
+    archive_dir = archive_dir or archive_dir_for(db)
+    batch_size = batch_size or RETENTION_BATCH_SIZE
+    batches_left = RETENTION_MAX_BATCHES if max_batches is None else max_batches
+    vacuum_pages = RETENTION_VACUUM_PAGES if vacuum_pages is None else vacuum_pages
+
+    archived = {}
+    files = set()
+    explicit = [status for status in policies if status != '*']
+    for status, days in policies.items():
+        if days <= 0:
+            continue
+        before = cutoff(days, now)
+        if status == '*':
+            selection = {'exclude_statuses': explicit}
+        else:
+            selection = {'statuses': [status]}
+        while batches_left > 0:
+            rows = db.get_old_logs(before, limit=batch_size, **selection)
+            if not rows:
+                break
+            batches_left -= 1
+            if dry_run:
+                # Без удаления следующая пачка была бы той же: оценка по первой
+                archived[status] = len(rows)
+                break
+            files.update(write_archive(archive_dir, rows))
+            deleted = db.rollup_logs([row['id'] for row in rows])
+            archived[status] = archived.get(status, 0) + deleted
+            LOGS_ARCHIVED.labels(status).inc(deleted)
+
+    free_pages = 0
+    if archived and not dry_run and vacuum_pages:
+        free_pages = db.incremental_vacuum(vacuum_pages)
+    if archived and not dry_run:
+        logger.info("🗄️ В архив перенесено логов: %s (%s)", archived, ", ".join(sorted(files)))
+    return {'archived': archived, 'files': sorted(files), 'free_pages': free_pages}
+
+def convert_to_incremental_vacuum(db: Database):
+    """Включить auto_vacuum=INCREMENTAL в существующей БД (полный VACUUM)
+
+    VACUUM переписывает весь файл под блокировкой записи - запускать при
+    остановленных боте и админке.
+    """
+    with db.get_connection() as conn:
+        conn.execute("PRAGMA auto_vacuum=INCREMENTAL")
+        conn.execute("VACUUM")
+        return conn.execute("PRAGMA auto_vacuum").fetchone()[0]
+
+def main():
+    parser = argparse.ArgumentParser(description="Перенос старых логов в архив по политике хранения")
+    parser.add_argument("--db-path", help="файл БД (по умолчанию DATABASE_PATH)")
+    parser.add_argument("--policy", default=LOG_RETENTION, help="например failed=30,*=365")
+    parser.add_argument("--archive-dir", help="по умолчанию LOG_ARCHIVE_DIR или archive рядом с БД")
+    parser.add_argument("--max-batches", type=int, default=1000000, help="пачек за запуск")
+    parser.add_argument("--dry-run", action="store_true", help="только посчитать первую пачку каждой политики")
+    parser.add_argument("--vacuum", action="store_true", help="перевести БД на incremental vacuum")
+    args = parser.parse_args()
+
+    logging.basicConfig(level=logging.INFO)
+    db = Database(args.db_path)
+    if args.vacuum:
+        mode = convert_to_incremental_vacuum(db)
+        print("🧽 auto_vacuum = {} (2 - INCREMENTAL)".format(mode))
+        return
+    result = run_retention(db, parse_policies(args.policy), args.archive_dir,
+                           max_batches=args.max_batches, dry_run=args.dry_run)
+    print(json.dumps(result, ensure_ascii=False, indent=2))
+
+if __name__ == "__main__":
+    main()
@@ -2,6 +2,12 @@
 # -*- coding: utf-8 -*-
 """
 Запуск всех тестов для проверки работоспособности бота
+
+    python run_tests.py
+    python run_tests.py --bench [аргументы bench_database.py]
+
+--bench запускает микробенчмарк Database вместо тестов, например
+--bench --rows 1000 100000 --baseline bench_db.json --tolerance 0.3
 """
 
 import subprocess
@@ -44,6 +50,14 @@ def run_test(test_name, test_file):
         print("💥 Ошибка запуска теста: {}".format(e))
         return False
 
+def run_benchmarks(bench_args):
+    """Микробенчмарк Database: код выхода 1 при регрессии относительно --baseline"""
+    print("📏 ЗАПУСК БЕНЧМАРКА DATABASE")
+    print("=" * 60)
+    result = subprocess.run([sys.executable, "bench_database.py"] + bench_args,
+                            cwd=os.path.dirname(os.path.abspath(__file__)))
+    return result.returncode == 0
+
 def main():
     """Главная функция"""
     print("🚀 ЗАПУСК КОМПЛЕКСНОГО ТЕСТИРОВАНИЯ БОТА")
@@ -106,7 +120,10 @@ def main():
 
 if __name__ == "__main__":
     try:
-        success = main()
+        if "--bench" in sys.argv[1:]:
+            success = run_benchmarks([arg for arg in sys.argv[1:] if arg != "--bench"])
+        else:
+            success = main()
         sys.exit(0 if success else 1)
     except KeyboardInterrupt:
         print("\n⏹️ Тестирование прервано пользователем")
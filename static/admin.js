@@ -208,7 +208,7 @@ function renderTags() {
                 </div>
                 <div class="tag-field">
                     <label>Режим</label>
-                    <div class="value">${matchMode === 'prefix' ? 'Префикс' : 'Строгий'}</div>
+                    <div class="value">${matchMode === 'prefix' ? 'Префикс' : matchMode === 'regex' ? 'Regex' : matchMode === 'fuzzy' ? 'С опечатками' : 'Строгий'}</div>
                 </div>
                 <div class="tag-field">
                     <label>Медиа</label>
@@ -307,6 +307,7 @@ async function saveTag(event) {
         emoji: formData.get('emoji'),
         delay: parseInt(formData.get('delay')) || 0,
         match_mode: formData.get('match_mode'),
+        fuzzy_distance: parseInt(formData.get('fuzzy_distance')) || 1,
         require_photo: formData.get('require_photo') === 'true',
         reply_ok: formData.get('reply_ok') || '',
         reply_need_photo: formData.get('reply_need_photo') || '',
@@ -364,6 +365,7 @@ function openTagModal(tagId = null) {
         form.reset();
         document.getElementById('modalDelay').value = '10';
         document.getElementById('modalMatchMode').value = 'prefix';
+        document.getElementById('modalFuzzyDistance').value = '1';
         document.getElementById('modalRequirePhoto').value = 'false';
         document.getElementById('modalReplyOk').value = '';
         document.getElementById('modalReplyNeedPhoto').value = '';
@@ -384,6 +386,7 @@ function openTagModal(tagId = null) {
         
         // Настройки поведения
         document.getElementById('modalMatchMode').value = tag.match_mode || 'equals';
+        document.getElementById('modalFuzzyDistance').value = tag.fuzzy_distance || 1;
         document.getElementById('modalRequirePhoto').value = tag.require_photo !== undefined ? tag.require_photo.toString() : 'true';
         
         // Настройки сообщений
@@ -852,8 +855,12 @@ async function loadLogs() {
     try {
         const tagFilter = document.getElementById('logTagFilter')?.value || '';
         const limit = document.getElementById('logLimit')?.value || 50;
+        const search = (document.getElementById('logSearch')?.value || '').trim();
         
-        let url = `/logs?limit=${limit}`;
+        // С текстом поиска - полнотекстовый поиск по логам на сервере
+        let url = search
+            ? `/search?source=logs&q=${encodeURIComponent(search)}&limit=${limit}`
+            : `/logs?limit=${limit}`;
         if (tagFilter) {
             url += `&tag=${encodeURIComponent(tagFilter)}`;
         }
@@ -861,7 +868,10 @@ async function loadLogs() {
         const response = await apiRequest('GET', url);
         
         if (response.success) {
-            renderLogs(response.data || []);
+            const logs = search
+                ? (response.data?.items || []).map(item => ({ ...item, trigger: item.tag }))
+                : response.data;
+            renderLogs(logs || []);
             updateLogTagFilter();
         } else {
             showNotification('Ошибка загрузки логов: ' + response.message, 'error');
@@ -931,12 +941,22 @@ async function clearLogs() {
     }
     
     try {
-        const response = await apiRequest('DELETE', '/logs');
+        let response = await apiRequest('DELETE', '/logs');
         
         if (response.success) {
+            // Очистка идет в фоне по частям: ждем завершения
+            showNotification('Очистка логов запущена...', 'info');
+            while (response.success && response.data && response.data.state === 'running') {
+                await new Promise(resolve => setTimeout(resolve, 1000));
+                response = await apiRequest('GET', '/logs/clear');
+            }
             const data = response.data || {};
-            const message = `Очищено: ${data.deleted_logs || 0} логов, ${data.deleted_reactions || 0} реакций, ${data.deleted_moderation || 0} модераций`;
-            showNotification(message, 'success');
+            if (data.state === 'failed') {
+                showNotification('Ошибка очистки логов: ' + data.error, 'error');
+            } else {
+                const message = `Очищено: ${data.deleted_logs || 0} логов, ${data.deleted_reactions || 0} реакций, ${data.deleted_moderation || 0} модераций`;
+                showNotification(message, 'success');
+            }
             await loadLogs(); // Перезагружаем логи
         } else {
             showNotification('Ошибка очистки логов: ' + response.message, 'error');
@@ -73,6 +73,20 @@ class SupabasePool:
         """Проверить доступность пула подключений."""
         return cls._pool is not None
 
+    @classmethod
+    def status(cls) -> Dict[str, Any]:
+        """Состояние пула для /healthz: настроен ли, создан ли, сколько соединений свободно."""
+        configured = bool(os.getenv("DB_HOST") and os.getenv("DB_PASSWORD"))
+        if cls._pool is None:
+            return {'configured': configured, 'available': False}
+        return {
+            'configured': configured,
+            'available': True,
+            'size': cls._pool.get_size(),
+            'idle': cls._pool.get_idle_size(),
+            'max_size': cls._pool.get_max_size(),
+        }
+
 
 async def query_users_for_broadcast(
     filters: Optional[Dict[str, Any]] = None,
@@ -0,0 +1,703 @@
+#!/usr/bin/env python3
+# -*- coding: utf-8 -*-
+"""
+Сопоставление сообщений с тегами
+Индекс тегов строится один раз при обновлении кэша в Database
+"""
+
+import re
+import logging
+from dataclasses import dataclass
+import unicodedata
+try:
+    from re import _parser as _sre_parse, _constants as _sre_constants
+except ImportError:
+    # Python < 3.11
+    import sre_parse as _sre_parse
+    import sre_constants as _sre_constants
+try:
+    from typing import List, Dict, Any, Optional, Tuple
+except ImportError:
+    # Для старых версий Python
+    pass
+
+logger = logging.getLogger(__name__)
+
+# Базовая таблица замен: применяется к любому тексту после NFKC и нижнего регистра
+_BASE_TABLE = str.maketrans({
+    'ё': 'е',       # русская ё на украинскую е
+    'ъ': None,      # твердый знак
+    'ы': 'и',       # русская ы на украинскую и
+    'ʼ': "'",       # U+02BC modifier letter apostrophe (официальный украинский апостроф)
+    '’': "'",       # U+2019 right single quotation mark
+    '‘': "'",       # U+2018 left single quotation mark
+    '`': "'",
+    '′': "'",       # U+2032 prime
+    'ʹ': "'",       # U+02B9 modifier letter prime
+    '\u00ad': None,  # мягкий перенос
+    '\u200b': None,  # zero width space
+    '\u200d': None,  # zero width joiner
+    '\ufeff': None,  # BOM / zero width no-break space
+})
+
+# Апострофы, которые NFKC раскладывает в пробел + U+0301 ("п´ятниця" -> "п ́ятниця"):
+# заменяются до NFKC. Такие символы не бывают в NFKC-тексте, таблица нужна только
+# вместе с нормализацией
+_PRE_NFKC_TABLE = str.maketrans({
+    '\u00b4': "'",  # acute accent
+    '\u0384': "'",  # greek tonos
+    '\u1ffd': "'",  # greek oxia
+})
+
+# Латинские буквы, похожие на кириллические (после приведения к нижнему регистру).
+# Применяются только внутри слов, где уже есть кириллица, чтобы не ломать латинские теги
+_LOOKALIKE_TABLE = str.maketrans({
+    'a': 'а', 'b': 'в', 'c': 'с', 'e': 'е', 'h': 'н', 'i': 'і', 'k': 'к',
+    'm': 'м', 'o': 'о', 'p': 'р', 't': 'т', 'x': 'х', 'y': 'у',
+})
+
+# Символы из базовой таблицы: без них translate можно не вызывать
+_BASE_CHARS_RE = re.compile('[' + ''.join(chr(code) for code in _BASE_TABLE) + ']')
+_CYRILLIC_RE = re.compile(r'[а-яіїєґ]')
+_LOOKALIKE_RE = re.compile(r'[abcehikmoptxy0]')
+# Латинский "двойник" вплотную к кириллической букве - признак смешанного слова
+_MIXED_SCRIPT_RE = re.compile(r'[а-яіїєґ][abcehikmoptxy0]|[abcehikmoptxy0][а-яіїєґ]')
+_WORD_RE = re.compile(r'\w+')
+# Ноль между кириллическими буквами почти всегда означает букву "о"
+_ZERO_AS_O_RE = re.compile(r'(?<=[а-яіїєґ])0(?=[а-яіїєґ])')
+
+def _fold_lookalikes(match) -> str:
+    word = match.group(0)
+    if not _CYRILLIC_RE.search(word):
+        return word
+    return _ZERO_AS_O_RE.sub('о', word.translate(_LOOKALIKE_TABLE))
+
+def normalize_ukrainian_text(text: str) -> str:
+    """Нормализация украинского текста для корректного сравнения
+
+    NFKC + нижний регистр + одна таблица замен (ё/ъ/ы, варианты апострофа,
+    невидимые символы); апострофы, которые NFKC портит, заменяются до нее. Латинские буквы и ноль внутри кириллических слов
+    заменяются на похожие кириллические: "мараф0н" -> "марафон".
+    """
+    if not text:
+        return ""
+
+    if not unicodedata.is_normalized('NFKC', text):
+        text = unicodedata.normalize('NFKC', text.translate(_PRE_NFKC_TABLE))
+
+    normalized = text.strip().lower()
+
+    # translate на не-ASCII строках дорогой - вызываем только когда есть что заменять
+    if _BASE_CHARS_RE.search(normalized):
+        normalized = normalized.translate(_BASE_TABLE)
+
+    # Исправляем "двойников" только в словах со смешанным алфавитом
+    if _LOOKALIKE_RE.search(normalized) and _MIXED_SCRIPT_RE.search(normalized):
+        normalized = _WORD_RE.sub(_fold_lookalikes, normalized)
+
+    return normalized
+
+# Тег, который Telegram размечает как хэштег: "#", буквы/цифры/"_" и хотя бы одна буква.
+# Апостроф допускаем - токен хэштега продолжается до пробела (см. extract_hashtags)
+_HASHTAG_TAG_RE = re.compile(r"#\w[\w']*")
+_LETTER_RE = re.compile(r'[^\W\d_]')
+
+def is_hashtag(tag_text: str) -> bool:
+    """Можно ли найти тег только по хэштегам из entities"""
+    return _HASHTAG_TAG_RE.fullmatch(tag_text) is not None and _LETTER_RE.search(tag_text) is not None
+
+# Ограничения для режима regex
+MAX_REGEX_LENGTH = 200
+# Слова длиннее не проверяются регулярками: даже полиномиальный возврат на них заметен
+MAX_REGEX_TOKEN_LENGTH = 256
+
+_REPEATS = (_sre_constants.MAX_REPEAT, _sre_constants.MIN_REPEAT)
+def _first_chars(subpattern):
+    """Множество первых символов ветки или None, если оно не ограничено"""
+    for op, av in subpattern:
+        if op is _sre_constants.LITERAL:
+            return {av}
+        if op is _sre_constants.SUBPATTERN:
+            return _first_chars(av[-1])
+        if op in _REPEATS and av[0] > 0:
+            return _first_chars(av[2])
+        if op is _sre_constants.AT:
+            continue
+        return None
+    return None
+
+def _has_repeat(subpattern) -> bool:
+    for op, av in subpattern:
+        if op in _REPEATS and av[1] > 1:
+            return True
+        if op is _sre_constants.SUBPATTERN and _has_repeat(av[-1]):
+            return True
+        if op is _sre_constants.BRANCH and any(_has_repeat(b) for b in av[1]):
+            return True
+    return False
+
+def _overlapping_branches(subpattern) -> bool:
+    for op, av in subpattern:
+        if op is _sre_constants.SUBPATTERN and _overlapping_branches(av[-1]):
+            return True
+        if op is _sre_constants.BRANCH:
+            seen = set()
+            for branch in av[1]:
+                first = _first_chars(branch)
+                if first is None or seen & first:
+                    return True
+                seen |= first
+    return False
+
+def _find_backtracking(subpattern) -> Optional[str]:
+    """Найти конструкцию с экспоненциальным возвратом: (a+)+, (a|a)*, обратные ссылки"""
+    for op, av in subpattern:
+        if op in (_sre_constants.GROUPREF, _sre_constants.GROUPREF_EXISTS):
+            return "обратные ссылки не поддерживаются"
+        if op in _REPEATS:
+            body = av[2]
+            if av[1] > 1:
+                if _has_repeat(body):
+                    return "вложенные квантификаторы вроде (a+)+"
+                if _overlapping_branches(body):
+                    return "повторяемая альтернатива с пересекающимися ветками вроде (a|ab)*"
+            children = [body]
+        elif op is _sre_constants.SUBPATTERN:
+            children = [av[-1]]
+        elif op is _sre_constants.BRANCH:
+            children = av[1]
+        elif op in (_sre_constants.ASSERT, _sre_constants.ASSERT_NOT):
+            children = [av[1]]
+        else:
+            continue
+        for child in children:
+            problem = _find_backtracking(child)
+            if problem:
+                return problem
+    return None
+
+def validate_regex_tag(pattern: str) -> Optional[str]:
+    """Проверить регулярное выражение тега перед сохранением
+
+    Возвращает текст ошибки или None. Отклоняются некорректные выражения
+    и формы, на которых re уходит в экспоненциальный перебор.
+    """
+    if not pattern or not pattern.strip():
+        return "Пустое регулярное выражение"
+    if len(pattern) > MAX_REGEX_LENGTH:
+        return "Регулярное выражение длиннее {} символов".format(MAX_REGEX_LENGTH)
+
+    try:
+        parsed = _sre_parse.parse(pattern)
+        re.compile(pattern)
+    except re.error as e:
+        return "Некорректное регулярное выражение: {}".format(e)
+
+    problem = _find_backtracking(parsed)
+    if problem:
+        return "Опасное регулярное выражение: {}".format(problem)
+    return None
+
+def _literal_prefix(pattern: str) -> str:
+    """Буквальное начало выражения: для #тег12_\\d+ это #тег12_"""
+    prefix = []
+    for op, av in _sre_parse.parse(pattern):
+        if op is not _sre_constants.LITERAL or len(chr(av).lower()) != 1:
+            break
+        prefix.append(chr(av).lower())
+    return ''.join(prefix)
+
+def _compile_regex_tag(pattern: str):
+    """Скомпилировать regex-тег в пару (выражение, буквальный префикс)
+
+    None, если выражение не проходит проверку (например, попало в БД в обход API).
+    """
+    problem = validate_regex_tag(pattern)
+    if problem:
+        logger.warning("⚠️ Regex-тег '%s' пропущен: %s", pattern, problem)
+        return None
+    return re.compile(pattern, re.IGNORECASE), _literal_prefix(pattern)
+
+class _RegexGroup:
+    """Regex-теги с общим буквальным префиксом, объединенные в одну альтернацию
+
+    fullmatch по объединению возвращает самую раннюю подходящую альтернативу,
+    то есть самый ранний тег - один вызов re вместо цикла по тегам. Если
+    выражения нельзя объединить (совпадающие имена групп, флаги внутри),
+    остается проверка по одному.
+    """
+
+    def __init__(self):
+        self.regexes = []
+        self.union = None
+        self.names = {}
+
+    def compile(self):
+        if len(self.regexes) < 2:
+            return
+
+        names = {}
+        parts = []
+        for order, pattern, tag in self.regexes:
+            name = '_t{}'.format(order)
+            names[name] = (order, tag)
+            parts.append('(?P<{}>{})'.format(name, pattern.pattern))
+
+        try:
+            self.union = re.compile('|'.join(parts), re.IGNORECASE)
+            self.names = names
+        except re.error as e:
+            logger.debug("Regex-теги не объединены в одно выражение: %s", e)
+
+    def match(self, token: str) -> Optional[Tuple[int, 'Tag']]:
+        if self.union is not None:
+            found = self.union.fullmatch(token)
+            return self.names[found.lastgroup] if found else None
+        for order, pattern, tag in self.regexes:
+            if pattern.fullmatch(token):
+                return order, tag
+        return None
+
+def _is_space_unit(data: bytes, pos: int) -> bool:
+    return chr(data[pos] | (data[pos + 1] << 8)).isspace()
+
+def extract_hashtags(text: str, entities) -> List[str]:
+    """Слова с хэштегами по разметке Telegram
+
+    entities - пары (offset, length) в единицах UTF-16, как в MessageEntity.
+    Токен расширяется до ближайших пробелов, чтобы совпадать со словом из
+    text.split(): Telegram обрезает "#п'ятниця" до "#п" и не включает
+    знаки препинания. Остальной текст не разбирается.
+    """
+    if not entities:
+        return []
+
+    data = text.encode('utf-16-le')
+    size = len(data)
+    tokens = []
+    for offset, length in entities:
+        start = offset * 2
+        end = (offset + length) * 2
+        while start > 0 and not _is_space_unit(data, start - 2):
+            start -= 2
+        while end < size and not _is_space_unit(data, end):
+            end += 2
+        tokens.append(data[start:end].decode('utf-16-le', 'replace'))
+
+    return tokens
+
+# Сколько слов помнит кэш fuzzy-поиска одного треда
+FUZZY_CACHE_SIZE = 4096
+
+def _char_masks(word: str) -> Dict[str, int]:
+    """Битовые маски позиций каждого символа слова (для алгоритма Майерса)"""
+    masks = {}
+    for i, ch in enumerate(word):
+        masks[ch] = masks.get(ch, 0) | (1 << i)
+    return masks
+
+def _myers_distance(masks: Dict[str, int], length: int, other: str) -> int:
+    """Расстояние Левенштейна бит-параллельным алгоритмом Майерса
+
+    Один проход по other с операциями над целыми вместо таблицы
+    length x len(other) - в разы быстрее динамики на чистом Python.
+    """
+    full = (1 << length) - 1
+    last = 1 << (length - 1)
+    pv = full
+    mv = 0
+    score = length
+    for ch in other:
+        eq = masks.get(ch, 0)
+        xv = eq | mv
+        xh = ((((eq & pv) + pv) & full) ^ pv) | eq
+        ph = mv | (~(xh | pv) & full)
+        mh = pv & xh
+        if ph & last:
+            score += 1
+        elif mh & last:
+            score -= 1
+        ph = ((ph << 1) | 1) & full
+        mh = (mh << 1) & full
+        pv = mh | (~(xv | ph) & full)
+        mv = ph & xv
+    return score
+
+def edit_distance(a: str, b: str, limit: int) -> int:
+    """Расстояние Левенштейна, ограниченное сверху: если больше limit, возвращает limit + 1"""
+    if a == b:
+        return 0
+    if abs(len(a) - len(b)) > limit:
+        return limit + 1
+    if not a or not b:
+        return min(len(a) + len(b), limit + 1)
+    return min(_myers_distance(_char_masks(a), len(a), b), limit + 1)
+
+def fuzzy_limit(tag_text: str, fuzzy_distance: int) -> int:
+    """Допустимое число правок для тега
+
+    Как fuzziness AUTO в Elasticsearch: для слов до 2 символов (без "#") -
+    только точное совпадение, до 5 символов - одна правка, длиннее - две.
+    Настройка тега может только уменьшить допуск.
+    """
+    length = len(tag_text.lstrip('#'))
+    if length <= 2:
+        auto = 0
+    elif length <= 5:
+        auto = 1
+    else:
+        auto = 2
+    return max(0, min(auto, fuzzy_distance))
+
+class _BKTree:
+    """BK-дерево по расстоянию Левенштейна для fuzzy-тегов
+
+    Узел - [слово, теги с этим словом, {расстояние: дочерний узел}].
+    Поиск в радиусе r обходит только детей с ребром в [d - r, d + r],
+    поэтому не сравнивает слово со всеми тегами.
+    """
+
+    def __init__(self):
+        self.root = None
+        self.radius = 0
+
+    def add(self, key: str, order: int, limit: int, tag: 'Tag'):
+        self.radius = max(self.radius, limit)
+        item = (order, limit, tag)
+        if self.root is None:
+            self.root = [key, [item], {}]
+            return
+
+        node = self.root
+        while True:
+            distance = edit_distance(key, node[0], len(key) + len(node[0]))
+            if distance == 0:
+                node[1].append(item)
+                return
+            child = node[2].get(distance)
+            if child is None:
+                node[2][distance] = [key, [item], {}]
+                return
+            node = child
+
+    def find(self, word: str) -> List[Tuple[int, 'Tag']]:
+        """Все теги, до которых от слова не больше их допуска правок"""
+        if self.root is None or not word:
+            return []
+
+        # Маски слова считаются один раз на весь обход
+        masks = _char_masks(word)
+        length = len(word)
+        radius = self.radius
+        hits = []
+        stack = [self.root]
+        while stack:
+            key, items, children = stack.pop()
+            # Точное расстояние нужно только до d = r + самое длинное ребро
+            cap = radius + (max(children) if children else 0)
+            if abs(len(key) - length) > cap:
+                distance = cap + 1
+            else:
+                distance = _myers_distance(masks, length, key)
+            hits.extend((order, tag) for order, limit, tag in items if distance <= limit)
+            for edge, child in children.items():
+                if distance - radius <= edge <= distance + radius:
+                    stack.append(child)
+        return hits
+
+@dataclass(frozen=True, slots=True)
+class Tag:
+    """Тег из кэша: неизменяемая запись с заранее посчитанными полями
+
+    Строится один раз при обновлении кэша, в обработке сообщения - только
+    чтение атрибутов. /api/tags по-прежнему отдает строки БД как есть.
+    """
+    id: str
+    tag: str
+    emoji: str
+    delay: int = 0
+    match_mode: str = 'equals'
+    fuzzy_distance: int = 1
+    require_photo: bool = True
+    moderation_enabled: bool = False
+    thread_name: str = ''
+    counter_name: str = ''
+    reply_ok: str = ''
+    reply_need_photo: str = ''
+    reply_duplicate: str = ''
+    reply_pending: str = ''
+    # Поля для сопоставления
+    normalized: str = ''          # нормализованный тег (regex - выражение как есть)
+    normalized_thread: str = ''   # нормализованное название треда
+    pattern: Any = None           # скомпилированное выражение режима regex
+    prefix: str = ''              # буквальный префикс выражения режима regex
+    max_edits: int = 0            # допуск правок режима fuzzy
+    hashtag: bool = False         # тег можно найти только по хэштегам из entities
+
+    @classmethod
+    def from_row(cls, row: Dict[str, Any]) -> 'Tag':
+        """Запись из строки таблицы tags (или элемента модерации с полями тега)"""
+        match_mode = row.get('match_mode') or 'equals'
+        pattern, prefix, max_edits = None, '', 0
+        if match_mode == 'regex':
+            # Регулярку не нормализуем: lower() превратил бы \D в \d
+            normalized = row['tag'].strip()
+            compiled = _compile_regex_tag(normalized)
+            if compiled is not None:
+                pattern, prefix = compiled
+            hashtag = prefix.startswith('#')
+        else:
+            normalized = normalize_ukrainian_text(row['tag'])
+            hashtag = is_hashtag(normalized)
+            if match_mode == 'fuzzy':
+                max_edits = fuzzy_limit(normalized, row.get('fuzzy_distance') or 1)
+
+        return cls(
+            id=row.get('id', ''),
+            tag=row['tag'],
+            emoji=row.get('emoji', ''),
+            delay=int(row.get('delay') or 0),
+            match_mode=match_mode,
+            fuzzy_distance=int(row.get('fuzzy_distance') or 1),
+            require_photo=bool(row.get('require_photo', True)),
+            moderation_enabled=bool(row.get('moderation_enabled', False)),
+            thread_name=row.get('thread_name') or '',
+            counter_name=row.get('counter_name') or '',
+            reply_ok=row.get('reply_ok') or '',
+            reply_need_photo=row.get('reply_need_photo') or '',
+            reply_duplicate=row.get('reply_duplicate') or '',
+            reply_pending=row.get('reply_pending') or '',
+            normalized=normalized,
+            normalized_thread=normalize_ukrainian_text(row.get('thread_name') or ''),
+            pattern=pattern,
+            prefix=prefix,
+            max_edits=max_edits,
+            hashtag=hashtag,
+        )
+
+class _ThreadBucket:
+    """Структуры поиска для тегов одного треда (вместе с глобальными)"""
+
+    def __init__(self, entries: List[Tuple[int, Tag]]):
+        self.tags = [tag for _, tag in entries]
+
+        # equals: слово целиком -> самый ранний тег
+        self.exact = {}
+        # prefix: в порядке создания, чтобы первый найденный был самым ранним
+        self.prefixes = []
+        # equals с пробелами внутри можно найти только в полном тексте
+        self.phrases = []
+        # fuzzy: BK-деревья отдельно для хэштегов и обычных слов - "#" не считается опечаткой
+        self.fuzzy = {}
+        self._fuzzy_cache = {}
+        # regex: скомпилированы в TagIndex, сгруппированы по буквальному префиксу.
+        # Альтернация с именованными группами не выносит общий префикс за скобки,
+        # поэтому слово сначала отбирается по префиксу через словарь
+        self.regexes = {}
+
+        for order, tag in entries:
+            tag_text = tag.normalized
+            if tag.match_mode == 'equals':
+                if any(ch.isspace() for ch in tag_text):
+                    pattern = re.compile(r'(?:^|\s)' + re.escape(tag_text) + r'(?=\s|$)')
+                    self.phrases.append((order, pattern, tag))
+                elif tag_text not in self.exact:
+                    self.exact[tag_text] = (order, tag)
+            elif tag.match_mode == 'prefix':
+                self.prefixes.append((order, tag_text, tag))
+            elif tag.match_mode == 'fuzzy':
+                self.fuzzy.setdefault(tag_text.startswith('#'), _BKTree()).add(tag_text, order, tag.max_edits, tag)
+            elif tag.match_mode == 'regex':
+                self.regexes.setdefault(tag.prefix, _RegexGroup()).regexes.append((order, tag.pattern, tag))
+
+        for group in self.regexes.values():
+            group.compile()
+        self.regex_prefix_lengths = sorted({len(prefix) for prefix in self.regexes})
+
+        # Если все теги - хэштеги, достаточно слов из entities
+        self.hashtags_only = not self.phrases and all(tag.hashtag for _, tag in entries)
+
+    def _regex_groups(self, token: str) -> List[_RegexGroup]:
+        """Группы regex-тегов, чей префикс совпадает с началом слова"""
+        if len(token) > MAX_REGEX_TOKEN_LENGTH:
+            return []
+        groups = []
+        for length in self.regex_prefix_lengths:
+            group = self.regexes.get(token[:length])
+            if group is not None:
+                groups.append(group)
+        return groups
+
+    def _fuzzy_hits(self, token: str) -> List[Tuple[int, Tag]]:
+        """Fuzzy-теги для слова; результат кэшируется - одни и те же хэштеги повторяются"""
+        hits = self._fuzzy_cache.get(token)
+        if hits is None:
+            tree = self.fuzzy.get(token.startswith('#'))
+            hits = tree.find(token) if tree is not None else []
+            if len(self._fuzzy_cache) >= FUZZY_CACHE_SIZE:
+                self._fuzzy_cache.clear()
+            self._fuzzy_cache[token] = hits
+        return hits
+
+    def _regex_hit(self, token: str) -> Optional[Tuple[int, Tag]]:
+        """Самый ранний regex-тег, которому слово соответствует целиком"""
+        best = None
+        for group in self._regex_groups(token):
+            hit = group.match(token)
+            if hit is not None and (best is None or hit[0] < best[0]):
+                best = hit
+        return best
+
+    def match(self, tokens: List[str], text: Optional[str]) -> Optional[Tag]:
+        best_order = None
+        best = None
+
+        exact = self.exact
+        for token in tokens:
+            hit = exact.get(token)
+            if hit is not None and (best_order is None or hit[0] < best_order):
+                best_order, best = hit
+
+        for order, tag_text, tag in self.prefixes:
+            if best_order is not None and order > best_order:
+                break
+            if any(token.startswith(tag_text) for token in tokens):
+                best_order, best = order, tag
+                break
+
+        if self.regexes:
+            for token in tokens:
+                hit = self._regex_hit(token)
+                if hit is not None and (best_order is None or hit[0] < best_order):
+                    best_order, best = hit
+
+        if self.fuzzy:
+            for token in tokens:
+                for order, tag in self._fuzzy_hits(token):
+                    if best_order is None or order < best_order:
+                        best_order, best = order, tag
+
+        if text is not None:
+            for order, pattern, tag in self.phrases:
+                if best_order is not None and order > best_order:
+                    break
+                if pattern.search(text):
+                    best_order, best = order, tag
+                    break
+
+        return best
+
+    def match_all(self, tokens: List[str], text: Optional[str]) -> List[Tag]:
+        """Все подходящие теги за один проход по словам, в порядке создания"""
+        found = {}
+
+        exact = self.exact
+        prefixes = self.prefixes
+        regexes = self.regexes
+        fuzzy = self.fuzzy
+        for token in tokens:
+            hit = exact.get(token)
+            if hit is not None:
+                found[hit[0]] = hit[1]
+            for order, tag_text, tag in prefixes:
+                if order not in found and token.startswith(tag_text):
+                    found[order] = tag
+            if regexes:
+                for group in self._regex_groups(token):
+                    # Объединенное выражение отсекает слова, не подходящие ни одному тегу группы
+                    if group.match(token) is None:
+                        continue
+                    for order, pattern, tag in group.regexes:
+                        if order not in found and pattern.fullmatch(token):
+                            found[order] = tag
+            if fuzzy:
+                for order, tag in self._fuzzy_hits(token):
+                    found[order] = tag
+
+        if text is not None:
+            for order, pattern, tag in self.phrases:
+                if pattern.search(text):
+                    found[order] = tag
+
+        return [found[order] for order in sorted(found)]
+
+class TagIndex:
+    """Теги, сгруппированные по нормализованному названию треда"""
+
+    def __init__(self, tags: List[Dict[str, Any]]):
+        # Строки БД превращаются в записи Tag один раз при построении индекса
+        self.tags = [Tag.from_row(row) for row in tags]
+
+        # Regex-теги, не прошедшие проверку, в поиске не участвуют
+        entries = [(order, tag) for order, tag in enumerate(self.tags)
+                   if tag.match_mode != 'regex' or tag.pattern is not None]
+
+        # Глобальные теги (без треда) работают в любом месте чата
+        self.global_bucket = _ThreadBucket([e for e in entries if not e[1].normalized_thread])
+
+        # Для каждого треда - его теги плюс глобальные, в исходном порядке
+        self.by_thread = {}
+        for _, tag in entries:
+            thread = tag.normalized_thread
+            if thread and thread not in self.by_thread:
+                self.by_thread[thread] = _ThreadBucket([e for e in entries if e[1].normalized_thread in ('', thread)])
+
+    def _bucket(self, thread_name: str) -> _ThreadBucket:
+        return self.by_thread.get(normalize_ukrainian_text(thread_name), self.global_bucket)
+
+    def candidates(self, thread_name: str) -> List[Tag]:
+        """Теги, допустимые для указанного треда"""
+        return self._bucket(thread_name).tags
+
+    def _tokens(self, bucket: _ThreadBucket, text: str, hashtags: Optional[List[str]]) -> Tuple[List[str], Optional[str]]:
+        """Слова для поиска и (при необходимости) нормализованный полный текст"""
+        if hashtags is not None and bucket.hashtags_only and (hashtags or '#' not in text):
+            return [normalize_ukrainian_text(h) for h in hashtags], None
+
+        normalized = normalize_ukrainian_text(text)
+        return normalized.split(), normalized
+
+    def match(self, text: str, thread_name: str = "", hashtags: Optional[List[str]] = None) -> Optional[Tag]:
+        """Найти первый подходящий тег среди допустимых для треда
+
+        hashtags - слова из extract_hashtags(). Если все теги треда - хэштеги,
+        проверяются только они, иначе разбирается весь текст.
+        """
+        bucket = self._bucket(thread_name)
+        if not bucket.tags:
+            return None
+
+        tokens, normalized = self._tokens(bucket, text, hashtags)
+        logger.debug("🔍 Проверяем %d слов по %d тегам треда '%s'", len(tokens), len(bucket.tags), thread_name)
+        return bucket.match(tokens, normalized)
+
+    def match_all(self, text: str, thread_name: str = "", hashtags: Optional[List[str]] = None) -> List[Tag]:
+        """Найти все подходящие теги (режим нескольких совпадений)"""
+        bucket = self._bucket(thread_name)
+        if not bucket.tags:
+            return []
+
+        tokens, normalized = self._tokens(bucket, text, hashtags)
+        return bucket.match_all(tokens, normalized)
+
+@dataclass(frozen=True)
+class MessagePlan:
+    """План обработки сообщения со всеми совпавшими тегами
+
+    На сообщение - одна реакция: эмодзи первого тега без модерации, с самой
+    маленькой задержкой среди таких тегов. Теги с модерацией реакцию не
+    ставят, а попадают в очередь модерации элементами со статусом pending.
+    """
+    reaction_tags: Tuple[Tag, ...] = ()      # теги без модерации: реакция и счетчики
+    moderation_tags: Tuple[Tag, ...] = ()    # теги, ожидающие модератора
+    emoji: str = ''                          # эмодзи реакции ('' - реакции нет)
+    delay: int = 0                           # задержка реакции, секунд
+
+def plan_matched_tags(tags: List[Tag]) -> MessagePlan:
+    """Собрать план: одна реакция и одна пакетная запись в БД на сообщение"""
+    reaction_tags = tuple(tag for tag in tags if not tag.moderation_enabled)
+    moderation_tags = tuple(tag for tag in tags if tag.moderation_enabled)
+    if not reaction_tags:
+        return MessagePlan(moderation_tags=moderation_tags)
+    return MessagePlan(reaction_tags, moderation_tags, reaction_tags[0].emoji,
+                       min(tag.delay for tag in reaction_tags))
@@ -0,0 +1,86 @@
+#!/usr/bin/env python3
+# -*- coding: utf-8 -*-
+"""
+Тест обработки сообщений ботом (нужны зависимости бота: python-telegram-bot, aiohttp)
+"""
+
+import sys
+import os
+import asyncio
+import tempfile
+from types import SimpleNamespace
+from unittest import mock
+
+# bot.py читает настройки при импорте
+os.environ["BOT_TOKEN"] = "123456:TEST"
+os.environ["DATABASE_PATH"] = os.path.join(tempfile.mkdtemp(), "bot_data.db")
+os.environ["BOT_DEBUG_PORT"] = "0"
+os.environ.pop("BOT_SHARED_SECRET", None)
+
+sys.path.insert(0, os.path.dirname(os.path.abspath(__file__)))
+import bot
+
+def make_message(text, message_id=1):
+    """Текстовое сообщение без медиа с подменными set_reaction/reply_text"""
+    return SimpleNamespace(
+        text=text, caption=None, entities=(), caption_entities=(),
+        chat_id=-100, message_id=message_id, date=None,
+        from_user=SimpleNamespace(id=1, username='user', first_name='User', last_name=''),
+        photo=None, video=None, is_topic_message=False, reply_to_message=None,
+        set_reaction=mock.AsyncMock(), reply_text=mock.AsyncMock(),
+    )
+
+def set_tags(*tags):
+    with bot.db.get_connection() as conn:
+        conn.execute("DELETE FROM tags")
+        conn.commit()
+    for tag in tags:
+        bot.db.create_tag(dict({'require_photo': False}, **tag))
+    bot.db.invalidate_tags_cache()
+
+def test_message_does_not_write_heartbeat():
+    """Пульс пишет только задача JobQueue, а не обработка сообщения"""
+    set_tags({'tag': '#run', 'emoji': '🔥'})
+    message = make_message('#run')
+    update = SimpleNamespace(message=message)
+    with mock.patch.object(bot.db, 'set_meta_values') as set_meta_values:
+        asyncio.run(bot.mark_update(update, None))
+        asyncio.run(bot.handle_any(update, None))
+        assert not set_meta_values.called
+        message.set_reaction.assert_called_once()
+
+        asyncio.run(bot.bot_heartbeat_job(None))
+        pulse = set_meta_values.call_args[0][0]
+        assert pulse['bot_last_update'] == bot.last_update_at
+        assert pulse['bot_heartbeat'] >= bot.last_update_at
+
+def count_rows(table):
+    with bot.db.get_connection() as conn:
+        return conn.execute("SELECT COUNT(*) FROM {}".format(table)).fetchone()[0]
+
+def test_one_reaction_per_message():
+    """Теги с разными задержками дают одну реакцию: эмодзи первого, самая маленькая задержка"""
+    set_tags({'tag': '#run', 'emoji': '🔥', 'delay': 30}, {'tag': '#stretch', 'emoji': '💪', 'delay': 0})
+    message = make_message('#run #stretch', message_id=2)
+    with mock.patch.object(bot, 'MULTI_TAG_MATCH', True):
+        assert asyncio.run(bot.process_message(SimpleNamespace(message=message), None)) == "matched"
+    message.set_reaction.assert_called_once()
+    assert message.set_reaction.call_args[0][0].emoji == '🔥'
+    assert count_rows('reaction_queue') == 0
+
+    # Все задержки ненулевые - одна реакция в очереди на оба тега
+    set_tags({'tag': '#run', 'emoji': '🔥', 'delay': 60}, {'tag': '#stretch', 'emoji': '💪', 'delay': 30},
+             {'tag': '#yoga', 'emoji': '👀', 'delay': 0, 'moderation_enabled': True})
+    message = make_message('#run #stretch #yoga', message_id=3)
+    with mock.patch.object(bot, 'MULTI_TAG_MATCH', True):
+        asyncio.run(bot.process_message(SimpleNamespace(message=message), None))
+    assert not message.set_reaction.called
+    with bot.db.get_connection() as conn:
+        assert tuple(conn.execute("SELECT emoji, COUNT(*) FROM reaction_queue").fetchone()) == ('🔥', 1)
+        rows = conn.execute("SELECT tag, status FROM moderation_queue WHERE message_id = 3 ORDER BY rowid")
+        assert [tuple(row) for row in rows] == [('#yoga', 'pending'), ('#run', 'auto_approved'), ('#stretch', 'auto_approved')]
+
+if __name__ == "__main__":
+    test_message_does_not_write_heartbeat()
+    test_one_reaction_per_message()
+    print("✅ Все тесты бота прошли")
@@ -0,0 +1,79 @@
+#!/usr/bin/env python3
+# -*- coding: utf-8 -*-
+"""
+Тест фоновой очистки логов пачками с бюджетом блокировки
+"""
+
+import sys
+import os
+import tempfile
+
+sys.path.insert(0, os.path.dirname(os.path.abspath(__file__)))
+from database import Database
+from bulk_delete import ClearLogsJob, delete_in_chunks
+
+def make_db():
+    return Database(os.path.join(tempfile.mkdtemp(), 'test.db'))
+
+def make_log(message_id):
+    return {'user_id': 1, 'chat_id': -100, 'message_id': message_id, 'trigger': '#run', 'emoji': '🔥'}
+
+def make_item(message_id):
+    return {'chat_id': -100, 'message_id': message_id, 'user_id': 42, 'username': 'tester',
+            'tag': '#run', 'emoji': '🔥', 'media_info': {}}
+
+def count(db, table):
+    with db.get_connection() as conn:
+        return conn.execute("SELECT COUNT(*) FROM {}".format(table)).fetchone()[0]
+
+def test_clear_job_deletes_in_chunks():
+    """Все логи и очереди удаляются пачками, pending-модерация остается"""
+    db = make_db()
+    db.add_logs([make_log(n) for n in range(2500)])
+    db.add_reaction_queue('m1', -100, 1, '🔥')
+    db.add_moderation_items([make_item(n) for n in range(3)], status='approved')
+    pending_id = db.add_moderation_item(make_item(10))
+
+    job = ClearLogsJob(db, budget_ms=50, chunk_rows=100, pause_ms=0)
+    assert job.status()['state'] == 'idle'
+    job.start()
+    progress = job.wait(10)
+    assert progress['state'] == 'done', progress
+    assert progress['deleted_logs'] == 2500
+    assert progress['deleted_reactions'] == 1
+    assert progress['deleted_moderation'] == 3
+    assert progress['chunks'] > 1
+    assert progress['max_lock_ms'] <= 50 or progress['interrupted_chunks']
+    assert count(db, 'logs') == 0
+    assert [item['id'] for item in db.get_pending_moderation()] == [pending_id]
+
+def test_rows_added_after_start_survive():
+    """Граница по rowid: строки, записанные после начала очистки, не удаляются"""
+    db = make_db()
+    db.add_logs([make_log(n) for n in range(50)])
+    bound = db.get_max_rowid('logs')
+    db.add_logs([make_log(n) for n in range(50, 60)])
+    assert delete_in_chunks(db, 'logs', bound, budget_ms=50, chunk_rows=7, pause_ms=0) == 50
+    assert sorted(log['message_id'] for log in db.get_logs()) == list(range(50, 60))
+
+def test_chunk_over_budget_is_rolled_back_and_split():
+    """Пачка дольше бюджета прерывается и откатывается, следующая - вдвое меньше"""
+    db = make_db()
+    db.add_logs([make_log(n) for n in range(20000)])
+    bound = db.get_max_rowid('logs')
+    deleted, held_ms = db.delete_chunk('logs', bound, 20000, budget_ms=0.01)
+    assert deleted is None
+    assert count(db, 'logs') == 20000
+
+    chunks = []
+    total = delete_in_chunks(db, 'logs', bound, budget_ms=5, chunk_rows=20000, pause_ms=0,
+                             on_chunk=lambda deleted, held_ms: chunks.append(deleted))
+    assert total == 20000
+    assert chunks[0] is None
+    assert count(db, 'logs') == 0
+
+if __name__ == "__main__":
+    test_clear_job_deletes_in_chunks()
+    test_rows_added_after_start_survive()
+    test_chunk_over_budget_is_rolled_back_and_split()
+    print("✅ Все тесты очистки логов прошли")
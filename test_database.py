@@ -0,0 +1,304 @@
+#!/usr/bin/env python3
+# -*- coding: utf-8 -*-
+"""
+Тест операций базы данных на временной БД
+"""
+
+import sys
+import os
+import sqlite3
+import tempfile
+import threading
+import time
+
+sys.path.insert(0, os.path.dirname(os.path.abspath(__file__)))
+from database import Database
+from metrics import SQLITE_BUSY_RETRIES, SQLITE_BUSY_ERRORS
+
+def make_db():
+    """Чистая база во временной директории"""
+    return Database(os.path.join(tempfile.mkdtemp(), 'test.db'))
+
+def make_item(tag, message_id=1):
+    return {
+        'chat_id': -100,
+        'message_id': message_id,
+        'user_id': 42,
+        'username': 'tester',
+        'tag': tag,
+        'emoji': '🔥',
+        'media_info': {'has_photo': True},
+        'counter_name': tag,
+    }
+
+def test_moderation_group():
+    """Теги одного сообщения сохраняются одной пачкой с общим group_id"""
+    db = make_db()
+
+    item_ids = db.add_moderation_items([make_item('#run'), make_item('#stretch')], status='auto_approved')
+    assert len(item_ids) == 2
+
+    group = db.get_moderation_group(item_ids[0])
+    assert [item['tag'] for item in group] == ['#run', '#stretch']
+    assert group[0]['media_info'] == {'has_photo': True}
+
+    # Одиночный элемент - группа из одного
+    single_id = db.add_moderation_item(make_item('#walk', message_id=2))
+    assert [item['id'] for item in db.get_moderation_group(single_id)] == [single_id]
+
+def test_moderation_group_ignores_pending_items():
+    """Элементы, ожидающие модератора, не подтягиваются группой"""
+    db = make_db()
+
+    item_ids = db.add_moderation_items([make_item('#run'), make_item('#stretch')])
+    db.update_moderation_status(item_ids[0], 'approved')
+    assert [item['id'] for item in db.get_moderation_group(item_ids[0])] == [item_ids[0]]
+
+def test_moderation_items_with_own_status():
+    """Одна пачка на сообщение: теги на модерации и теги с отложенной реакцией"""
+    db = make_db()
+
+    item_ids = db.add_moderation_items([make_item('#run'), dict(make_item('#stretch'), status='auto_approved'),
+                                        dict(make_item('#walk'), status='auto_approved')])
+    assert [item['tag'] for item in db.get_pending_moderation()] == ['#run']
+    assert [item['tag'] for item in db.get_moderation_group(item_ids[1])] == ['#stretch', '#walk']
+
+def test_add_logs_batch():
+    """Несколько записей лога одной транзакцией"""
+    db = make_db()
+
+    db.add_logs([
+        {'user_id': 1, 'chat_id': -100, 'message_id': 1, 'trigger': '#run', 'emoji': '🔥'},
+        {'user_id': 1, 'chat_id': -100, 'message_id': 1, 'trigger': '#stretch', 'emoji': '🔥'},
+    ])
+    assert sorted(log['trigger'] for log in db.get_logs()) == ['#run', '#stretch']
+
+def test_fuzzy_tag_in_index():
+    """Допуск опечаток сохраняется и попадает в индекс тегов"""
+    db = make_db()
+
+    tag_id = db.create_tag({'tag': '#марафон', 'emoji': '🏃', 'match_mode': 'fuzzy', 'fuzzy_distance': 2})
+    assert db.get_tag_by_id(tag_id)['fuzzy_distance'] == 2
+    assert db.get_tag_index().match('мій #маратн').id == tag_id
+
+    db.update_tag(tag_id, {'tag': '#марафон', 'emoji': '🏃', 'match_mode': 'fuzzy', 'fuzzy_distance': 1})
+    assert db.get_tag_index().match('мій #маратн') is None
+
+def test_tags_version_cross_process():
+    """Изменение тегов из другого процесса видно после проверки версии"""
+    admin_db = make_db()
+    bot_db = Database(admin_db.db_path)
+    bot_db._version_check_interval = 0
+
+    assert bot_db.get_tags() == []
+    index = bot_db.get_tag_index()
+
+    # Без изменений кэш и индекс не перестраиваются
+    assert bot_db.get_tag_index() is index
+
+    version = bot_db.get_tags_version()
+    tag_id = admin_db.create_tag({'tag': '#звіт', 'emoji': '📝'})
+    assert bot_db.get_tags_version() == version + 1
+    assert [t['id'] for t in bot_db.get_tags()] == [tag_id]
+
+    admin_db.delete_tag(tag_id)
+    assert bot_db.get_tags() == []
+
+def test_tags_version_check_interval():
+    """Версия проверяется не чаще заданного интервала"""
+    admin_db = make_db()
+    bot_db = Database(admin_db.db_path)
+    bot_db._version_check_interval = 3600
+
+    bot_db.get_tags()
+    admin_db.create_tag({'tag': '#звіт', 'emoji': '📝'})
+    assert bot_db.get_tags() == []
+
+    bot_db._version_check_interval = 0
+    assert len(bot_db.get_tags()) == 1
+
+def count_logs(db_path):
+    """Строки logs, видимые другому процессу (мимо буфера)"""
+    conn = sqlite3.connect(db_path)
+    try:
+        return conn.execute("SELECT COUNT(*) FROM logs").fetchone()[0]
+    finally:
+        conn.close()
+
+def make_log(message_id):
+    return {'user_id': 1, 'chat_id': -100, 'message_id': message_id, 'trigger': '#run', 'emoji': '🔥'}
+
+def test_log_buffer_batches_writes():
+    """Отложенная запись: пачка уходит в БД по числу строк, чтение видит и буфер"""
+    db = make_db()
+    db.enable_log_buffer(batch_size=3, flush_interval=3600)
+
+    db.add_log(make_log(1))
+    db.add_log(make_log(2))
+    assert count_logs(db.db_path) == 0
+    db.add_log(make_log(3))
+    assert count_logs(db.db_path) == 3
+
+    # Чтение сначала записывает буфер
+    db.add_log(make_log(4))
+    assert sorted(log['message_id'] for log in db.get_logs()) == [1, 2, 3, 4]
+    db.add_log(make_log(5))
+    assert db.find_message_data(-100, 5)['tag'] == '#run'
+    db.add_log(make_log(6))
+    assert db.get_stats()['total_logs'] == 6
+
+def test_log_buffer_flush_interval():
+    """Буфер записывается, когда первая строка ждет дольше интервала"""
+    db = make_db()
+    db.enable_log_buffer(batch_size=100, flush_interval=0.05)
+    db.add_log(make_log(1))
+    assert db.flush_logs_if_due() == 0
+    time.sleep(0.06)
+    assert db.flush_logs_if_due() == 1
+    assert count_logs(db.db_path) == 1
+
+    # Выключение буфера записывает остаток
+    db.add_log(make_log(2))
+    db.enable_log_buffer(batch_size=0)
+    assert count_logs(db.db_path) == 2
+
+def test_log_buffer_keeps_rows_on_failure():
+    """Пачка, которую не удалось записать, остается в буфере до следующей попытки"""
+    db = Database(make_db().db_path, busy_timeout_ms=0, busy_retries=0)
+    db.enable_log_buffer(batch_size=100, flush_interval=3600)
+    db.add_log(make_log(1))
+    lock = hold_write_lock(db.db_path)
+    try:
+        assert db.flush_logs() == 0
+    finally:
+        lock.rollback()
+    assert db.flush_logs() == 1
+    assert count_logs(db.db_path) == 1
+
+def hold_write_lock(db_path):
+    """Чужая транзакция записи, как долгий DELETE в админке"""
+    conn = sqlite3.connect(db_path, isolation_level=None, check_same_thread=False)
+    conn.execute("BEGIN IMMEDIATE")
+    conn.execute("DELETE FROM logs")
+    return conn
+
+def test_busy_retry_waits_for_lock():
+    """database is locked: вызов повторяется с паузой и проходит, когда блокировку отпустили"""
+    # Бюджет 300 мс на 3 попытки: первая ждет 100 мс и не дожидается блокировки
+    db = Database(make_db().db_path, busy_timeout_ms=300, busy_retries=2)
+    lock = hold_write_lock(db.db_path)
+    timer = threading.Timer(0.15, lock.rollback)
+    timer.start()
+    retries = SQLITE_BUSY_RETRIES.labels('add_log').value
+
+    db.add_log({'user_id': 1, 'chat_id': -100, 'message_id': 1, 'trigger': '#run', 'emoji': '🔥'})
+    timer.join()
+    assert SQLITE_BUSY_RETRIES.labels('add_log').value > retries
+    assert len(db.get_logs()) == 1
+
+def test_busy_retry_gives_up():
+    """Блокировка не отпускается: после всех повторов ошибка видна вызывающему"""
+    db = Database(make_db().db_path, busy_timeout_ms=0, busy_retries=1)
+    lock = hold_write_lock(db.db_path)
+    outer = SQLITE_BUSY_ERRORS.labels('add_moderation_item').value
+    inner = SQLITE_BUSY_ERRORS.labels('add_moderation_items').value
+    try:
+        db.add_moderation_item(make_item('#run'))
+        assert False, "ожидалась ошибка database is locked"
+    except sqlite3.OperationalError as e:
+        assert 'locked' in str(e)
+    finally:
+        lock.rollback()
+    # Повторяет и считает только внешний вызов, вложенный add_moderation_items - нет
+    assert SQLITE_BUSY_ERRORS.labels('add_moderation_item').value == outer + 1
+    assert SQLITE_BUSY_ERRORS.labels('add_moderation_items').value == inner
+
+def test_busy_retry_stays_within_budget():
+    """Все попытки и паузы вместе не дольше SQLITE_BUSY_TIMEOUT_MS (бот не замирает на 4 таймаута)"""
+    db = Database(make_db().db_path, busy_timeout_ms=300, busy_retries=3)
+    assert abs(db.busy_timeout - 0.075) < 1e-9
+    lock = hold_write_lock(db.db_path)
+    start = time.perf_counter()
+    try:
+        db.add_log(make_log(1))
+        assert False, "ожидалась ошибка database is locked"
+    except sqlite3.OperationalError as e:
+        assert 'locked' in str(e)
+    finally:
+        lock.rollback()
+    assert time.perf_counter() - start < 0.3 + 0.05
+
+def test_search_with_filters_and_pages():
+    """Поиск по логам и модерации: префиксы, фильтры, страницы, ввод с синтаксисом FTS"""
+    db = make_db()
+    db.add_logs([dict(make_log(n), username='olena_run', caption='Мій #марафон день {}'.format(n))
+                 for n in range(5)])
+    db.add_log(dict(make_log(5), trigger='#yoga', status='failed', caption='Ранкова йога'))
+    item = dict(make_item('#рецепт', 9), caption='Рецепт для марафонців')
+    item_id = db.add_moderation_item(item)
+
+    found = db.search('марафон')
+    assert len(found['items']) == 6 and not found['has_more']
+    assert {row['source'] for row in found['items']} == {'logs', 'moderation'}
+    assert db.search('МАРАФОН день 3')['items'][0]['snippet'] == 'Мій #[марафон] [день] [3]'
+    assert [row['id'] for row in db.search('рецепт', source='moderation')['items']] == [item_id]
+    assert db.search('olena', tag='#run', status='success')['items'][0]['username'] == 'olena_run'
+    assert db.search('йога', status='failed')['items'][0]['tag'] == '#yoga'
+    assert db.search('марафон', date_from='2000-01-01', date_to='2000-12-31')['items'] == []
+
+    first = db.search('марафон', source='logs', limit=2)
+    second = db.search('марафон', source='logs', limit=2, offset=2)
+    last = db.search('марафон', source='logs', limit=2, offset=4)
+    assert first['has_more'] and second['has_more'] and not last['has_more']
+    assert len({row['id'] for page in (first, second, last) for row in page['items']}) == 5
+
+    assert db.search('"') == {'items': [], 'has_more': False}
+    assert db.search('марафон NEAR( -')['items'] == []
+
+def test_search_index_follows_changes():
+    """Триггеры: изменение и удаление строк меняют индекс, старая БД индексируется при запуске"""
+    db = make_db()
+    item_id = db.add_moderation_item(dict(make_item('#run', 1), text='перший текст'))
+    with db.get_connection() as conn:
+        conn.execute("UPDATE moderation_queue SET text = 'другий текст' WHERE id = ?", (item_id,))
+        conn.commit()
+    assert db.search('перший')['items'] == []
+    assert db.search('другий')['items'][0]['id'] == item_id
+    db.update_moderation_status(item_id, 'approved')
+    assert db.search('другий', status='approved')['items'][0]['id'] == item_id
+
+    db.add_log(dict(make_log(1), caption='видалити'))
+    with db.get_connection() as conn:
+        conn.execute("DELETE FROM logs")
+        conn.commit()
+    assert db.search('видалити')['items'] == []
+
+    # БД без индекса поиска (до обновления): строится при инициализации
+    db.add_log(dict(make_log(2), caption='стара база'))
+    with db.get_connection() as conn:
+        for table in ('logs_fts', 'moderation_fts'):
+            conn.execute("DROP TABLE {}".format(table))
+            for event in ('insert', 'delete', 'update'):
+                conn.execute("DROP TRIGGER IF EXISTS {}_{}".format(table, event))
+        conn.commit()
+    db = Database(db.db_path)
+    assert db.search('стара')['items'][0]['message_id'] == 2
+    assert db.search('другий')['items'][0]['id'] == item_id
+
+if __name__ == "__main__":
+    test_moderation_group()
+    test_moderation_group_ignores_pending_items()
+    test_moderation_items_with_own_status()
+    test_add_logs_batch()
+    test_fuzzy_tag_in_index()
+    test_tags_version_cross_process()
+    test_tags_version_check_interval()
+    test_busy_retry_waits_for_lock()
+    test_busy_retry_gives_up()
+    test_busy_retry_stays_within_budget()
+    test_log_buffer_batches_writes()
+    test_log_buffer_flush_interval()
+    test_log_buffer_keeps_rows_on_failure()
+    test_search_with_filters_and_pages()
+    test_search_index_follows_changes()
+    print("✅ Все тесты базы данных пройдены")
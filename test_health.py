@@ -0,0 +1,86 @@
+#!/usr/bin/env python3
+# -*- coding: utf-8 -*-
+"""
+Тест проверок здоровья конвейера (/healthz, /readyz)
+"""
+
+import sys
+import os
+import tempfile
+import time
+
+sys.path.insert(0, os.path.dirname(os.path.abspath(__file__)))
+from database import Database
+import health
+
+def make_db():
+    health.db = Database(os.path.join(tempfile.mkdtemp(), 'test.db'))
+    return health.db
+
+def test_fresh_bot_is_ready():
+    """Пустые очереди и свежий пульс - готов"""
+    db = make_db()
+    db.set_meta_values({'bot_heartbeat': int(time.time())})
+    report = health.health_report()
+    assert report['status'] == 'ok', report
+    assert report['checks']['reaction_queue']['age_seconds'] is None
+    assert report['checks']['bot_heartbeat']['age_seconds'] < 5
+
+def test_missing_or_stale_heartbeat_fails():
+    """Бот не писал пульс или писал давно - не готов"""
+    db = make_db()
+    assert health.health_report()['status'] == 'fail'
+    db.set_meta_values({'bot_heartbeat': int(time.time()) - 600, 'bot_last_update': int(time.time()) - 900})
+    report = health.health_report()
+    assert not report['checks']['bot_heartbeat']['ok']
+    # Время апдейта только показывается (порог 0)
+    assert report['checks']['bot_last_update']['ok']
+    assert report['checks']['bot_last_update']['age_seconds'] >= 900
+
+def test_overdue_reaction_and_pending_moderation_age():
+    """Возраст самой старой просроченной реакции и pending; отложенная реакция не считается"""
+    db = make_db()
+    db.set_meta_values({'bot_heartbeat': int(time.time())})
+    with db.get_connection() as conn:
+        conn.execute("""
+            INSERT INTO reaction_queue (chat_id, message_id, emoji, execute_at)
+            VALUES (-100, 1, '🔥', datetime('now', '-300 seconds')), (-100, 2, '🔥', datetime('now', '+600 seconds'))
+        """)
+        conn.execute("""
+            INSERT INTO moderation_queue (id, chat_id, message_id, user_id, username, tag, emoji, status, created_at)
+            VALUES ('a', -100, 3, 42, 'u', '#run', '🔥', 'pending', datetime('now', '-120 seconds')),
+                   ('b', -100, 4, 42, 'u', '#run', '🔥', 'approved', datetime('now', '-9000 seconds'))
+        """)
+        conn.commit()
+    report = health.health_report()
+    reaction = report['checks']['reaction_queue']
+    assert 299 <= reaction['age_seconds'] <= 305
+    assert not reaction['ok'] and report['status'] == 'fail'
+    assert 119 <= report['checks']['moderation_queue']['age_seconds'] <= 125
+
+def test_checks_use_indexes():
+    """Запросы проверок идут по индексам, без прохода по таблицам"""
+    db = make_db()
+    with db.get_connection() as conn:
+        for sql in ("SELECT MIN(execute_at) FROM reaction_queue WHERE execute_at <= datetime('now')",
+                    "SELECT MIN(created_at) FROM moderation_queue WHERE status = 'pending'"):
+            plan = ' '.join(row[3] for row in conn.execute("EXPLAIN QUERY PLAN " + sql))
+            assert 'COVERING INDEX' in plan, plan
+
+def test_broken_sqlite_is_reported():
+    """Недоступная БД - неудачная проверка sqlite, а не исключение"""
+    class Broken:
+        def get_pipeline_state(self):
+            raise RuntimeError("unable to open database file")
+    health.db = Broken()
+    report = health.health_report({'supabase': {'ok': True}})
+    assert report['status'] == 'fail'
+    assert 'unable to open' in report['checks']['sqlite']['error']
+
+if __name__ == "__main__":
+    test_fresh_bot_is_ready()
+    test_missing_or_stale_heartbeat_fails()
+    test_overdue_reaction_and_pending_moderation_age()
+    test_checks_use_indexes()
+    test_broken_sqlite_is_reported()
+    print("✅ Все тесты проверок здоровья пройдены")
@@ -0,0 +1,85 @@
+#!/usr/bin/env python3
+# -*- coding: utf-8 -*-
+"""
+Тест буфера событий и JSON-формата логов
+"""
+
+import sys
+import os
+import json
+import logging
+from datetime import datetime, timedelta
+
+sys.path.insert(0, os.path.dirname(os.path.abspath(__file__)))
+from logger_config import EventBuffer, EventBufferHandler, JsonFormatter, event_buffer, get_events, log_bot_event
+
+def test_event_buffer_is_bounded():
+    """Старые события вытесняются, id продолжает расти"""
+    buffer = EventBuffer(size=3)
+    for i in range(5):
+        buffer.add('reaction_set', 'info', {'n': i})
+    events = buffer.query()
+    assert [e['n'] for e in events] == [4, 3, 2]
+    assert [e['id'] for e in events] == [5, 4, 3]
+    assert [e['n'] for e in buffer.query(after=4)] == [4]
+
+def test_event_buffer_filters():
+    """Фильтры по типу, уровню, подстроке, времени и лимит"""
+    buffer = EventBuffer(size=100)
+    buffer.add('reaction_set', 'info', {'user': 'anna', 'tag': '#марафон'})
+    buffer.add('duplicate_media', 'warning', {'user': 'bob'})
+    buffer.add('error', 'error', {'message': 'database is locked'})
+
+    assert [e['event'] for e in buffer.query(event='reaction_set')] == ['reaction_set']
+    assert [e['event'] for e in buffer.query(level='warning')] == ['error', 'duplicate_media']
+    assert [e['event'] for e in buffer.query(search='МАРАФОН')] == ['reaction_set']
+    assert [e['event'] for e in buffer.query(search='locked')] == ['error']
+    assert len(buffer.query(limit=2)) == 2
+    assert buffer.query(since=datetime.now() + timedelta(seconds=5)) == []
+    assert len(buffer.query(since=datetime.now() - timedelta(seconds=5))) == 3
+
+def test_details_do_not_override_fields():
+    """Поле details с именем служебного поля не ломает событие"""
+    buffer = EventBuffer(size=10)
+    event = buffer.add('error', 'error', {'level': 'info', 'message': 'boom'})
+    assert event['level'] == 'error'
+    assert event['message'] == 'boom'
+
+def test_log_bot_event_goes_to_buffer():
+    """log_bot_event кладет событие в буфер один раз, с полями details"""
+    event_buffer.clear()
+    log_bot_event('error', {'message': 'Ошибка записи лога'})
+    logging.getLogger('test').error("ошибка вне log_bot_event")
+
+    handler = EventBufferHandler()
+    record = logging.LogRecord('BOT', logging.ERROR, __file__, 0, "💥 %s", ('x',), None)
+    record.event = 'error'
+    handler.emit(record)  # запись log_bot_event не дублируется
+    record = logging.LogRecord('test', logging.WARNING, __file__, 0, "медленно: %s", ('2s',), None)
+    handler.emit(record)
+
+    events = get_events()
+    assert [e['event'] for e in events if e['event'] == 'error'] == ['error']
+    assert events[0]['message'] == 'медленно: 2s'
+    assert events[0]['logger'] == 'test'
+
+def test_json_formatter():
+    """Одна строка JSON, поля события отдельными ключами"""
+    record = logging.LogRecord('BOT', logging.INFO, __file__, 0, "🎯 Реакция %s", ('🍓',), None)
+    record.event = 'reaction_set'
+    record.details = {'emoji': '🍓', 'message': 'не затирает сообщение'}
+    line = JsonFormatter().format(record)
+    assert '\n' not in line
+    data = json.loads(line)
+    assert data['level'] == 'info'
+    assert data['message'] == '🎯 Реакция 🍓'
+    assert data['event'] == 'reaction_set'
+    assert data['emoji'] == '🍓'
+
+if __name__ == "__main__":
+    test_event_buffer_is_bounded()
+    test_event_buffer_filters()
+    test_details_do_not_override_fields()
+    test_log_bot_event_goes_to_buffer()
+    test_json_formatter()
+    print("✅ Все тесты буфера событий пройдены")
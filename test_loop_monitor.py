@@ -0,0 +1,66 @@
+#!/usr/bin/env python3
+# -*- coding: utf-8 -*-
+"""
+Тест сторожа event loop: задержка и стек блокирующего кода
+"""
+
+import sys
+import os
+import asyncio
+import time
+
+sys.path.insert(0, os.path.dirname(os.path.abspath(__file__)))
+from loop_monitor import LoopWatchdog
+from logger_config import get_events
+
+def block_loop(seconds):
+    # Синхронный код внутри async-обработчика (как SQLite или hashlib)
+    end = time.perf_counter() + seconds
+    while time.perf_counter() < end:
+        pass
+
+async def blocking_handler():
+    await asyncio.sleep(0.05)
+    block_loop(0.3)
+
+def test_stall_captures_blocking_stack():
+    """Остановка дольше порога дает событие со стеком и именем задачи"""
+    watchdog = LoopWatchdog(interval_ms=20, threshold_ms=100)
+
+    async def main():
+        watchdog.start()
+        await asyncio.create_task(blocking_handler(), name="handler")
+        await asyncio.sleep(0.1)
+        await watchdog.stop()
+
+    asyncio.run(main())
+    report = watchdog.report()
+    assert report['samples'] > 0
+    assert report['max_ms'] >= 250
+    assert len(report['stalls']) == 1
+    stall = report['stalls'][0]
+    assert stall['lag_ms'] >= 250
+    assert 'blocking_handler' in stall['task']
+    assert any('block_loop' in line for line in stall['stack'])
+    assert any(e['lag_ms'] == stall['lag_ms'] for e in get_events(event='loop_stall'))
+
+def test_idle_loop_has_no_stalls():
+    """Свободный loop: задержка мала, событий нет"""
+    watchdog = LoopWatchdog(interval_ms=10, threshold_ms=200)
+
+    async def main():
+        watchdog.start()
+        await asyncio.sleep(0.2)
+        await watchdog.stop()
+
+    asyncio.run(main())
+    report = watchdog.report()
+    assert report['samples'] >= 5
+    assert report['p50_ms'] < 50
+    assert report['stalls'] == []
+    assert not report['running']
+
+if __name__ == "__main__":
+    test_stall_captures_blocking_stack()
+    test_idle_loop_has_no_stalls()
+    print("✅ Все тесты сторожа event loop пройдены")
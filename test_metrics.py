@@ -0,0 +1,105 @@
+#!/usr/bin/env python3
+# -*- coding: utf-8 -*-
+"""
+Тест метрик Prometheus
+"""
+
+import sys
+import os
+import ast
+import asyncio
+
+sys.path.insert(0, os.path.dirname(os.path.abspath(__file__)))
+from metrics import Registry, Counter, Gauge, Histogram, observe_handler
+
+def test_histogram_buckets():
+    """Корзины накопительные, граница включается в свою корзину"""
+    registry = Registry()
+    histogram = Histogram("test_seconds", "Тест", ("stage",), buckets=(0.1, 1.0), registry=registry)
+    for value in (0.05, 0.1, 0.5, 2.0):
+        histogram.labels("match").observe(value)
+    text = registry.render()
+    assert '# TYPE test_seconds histogram' in text
+    assert 'test_seconds_bucket{stage="match",le="0.1"} 2' in text
+    assert 'test_seconds_bucket{stage="match",le="1.0"} 3' in text
+    assert 'test_seconds_bucket{stage="match",le="+Inf"} 4' in text
+    assert 'test_seconds_count{stage="match"} 4' in text
+    assert 'test_seconds_sum{stage="match"} 2.65' in text
+
+def test_counter_and_labels():
+    """Серии кэшируются, значения меток экранируются"""
+    registry = Registry()
+    counter = Counter("test_total", "Тест", ("tag",), registry=registry)
+    assert counter.labels("#марафон") is counter.labels("#марафон")
+    counter.labels("#марафон").inc()
+    counter.labels("#марафон").inc(2)
+    counter.labels('say "hi"').inc()
+    text = registry.render()
+    assert 'test_total{tag="#марафон"} 3' in text
+    assert 'test_total{tag="say \\"hi\\""} 1' in text
+    try:
+        counter.labels("a", "b")
+        assert False, "лишняя метка должна давать ошибку"
+    except ValueError:
+        pass
+
+def test_gauge_callback():
+    """Gauge с callback читает значение при экспорте, ошибка callback не ломает /metrics"""
+    registry = Registry()
+    depth = [3]
+    Gauge("test_depth", "Тест", callback=lambda: depth[0], registry=registry)
+    Gauge("test_broken", "Тест", callback=lambda: 1 / 0, registry=registry)
+    assert 'test_depth 3' in registry.render()
+    depth[0] = 7
+    text = registry.render()
+    assert 'test_depth 7' in text
+    assert not any(line.startswith('test_broken ') for line in text.splitlines())
+
+def test_observe_handler():
+    """Итог обработчика попадает в метку outcome, исключение - как error"""
+    registry = Registry()
+    histogram = Histogram("test_handler_seconds", "Тест", ("handler", "outcome"), registry=registry)
+
+    @observe_handler(histogram, "handle")
+    async def handle(outcome):
+        if outcome == "boom":
+            raise RuntimeError(outcome)
+        return outcome
+
+    asyncio.run(handle("no_match"))
+    asyncio.run(handle(None))
+    try:
+        asyncio.run(handle("boom"))
+    except RuntimeError:
+        pass
+    text = registry.render()
+    assert 'test_handler_seconds_count{handler="handle",outcome="no_match"} 1' in text
+    assert 'test_handler_seconds_count{handler="handle",outcome="ok"} 1' in text
+    assert 'test_handler_seconds_count{handler="handle",outcome="error"} 1' in text
+
+def handler_decorators(path):
+    """Имена обработчиков и метки handler у их observe_handler (разбор исходника, без импорта)"""
+    with open(path, encoding="utf-8") as f:
+        tree = ast.parse(f.read())
+    decorated = {}
+    for node in tree.body:
+        if isinstance(node, ast.AsyncFunctionDef):
+            decorated[node.name] = [
+                d.args[1].value for d in node.decorator_list
+                if isinstance(d, ast.Call) and getattr(d.func, 'id', '') == 'observe_handler']
+    return decorated
+
+def test_bot_handlers_are_timed():
+    """handle_any обернут observe_handler, а mark_update (группа -1, каждый апдейт) - нет"""
+    decorated = handler_decorators(os.path.join(os.path.dirname(os.path.abspath(__file__)), "bot.py"))
+    assert decorated['handle_any'] == ['handle_any']
+    assert decorated['handle_text_message'] == ['handle_text_message']
+    assert decorated['mark_update'] == []
+
+if __name__ == "__main__":
+    test_histogram_buckets()
+    test_counter_and_labels()
+    test_gauge_callback()
+    test_observe_handler()
+    test_bot_handlers_are_timed()
+    print("✅ Все тесты метрик пройдены")
@@ -0,0 +1,102 @@
+#!/usr/bin/env python3
+# -*- coding: utf-8 -*-
+"""
+Тест профилирования по запросу: CPU и tracemalloc
+"""
+
+import sys
+import os
+import asyncio
+import json
+import tempfile
+import time
+
+sys.path.insert(0, os.path.dirname(os.path.abspath(__file__)))
+import profiling
+
+def busy_function():
+    # ~10 мс без отпускания GIL: сэмплер получает его только на переключении потоков
+    total = 0
+    for i in range(200000):
+        total += i * i
+    return total
+
+async def busy_loop(seconds):
+    end = time.monotonic() + seconds
+    while time.monotonic() < end:
+        busy_function()
+        await asyncio.sleep(0)
+
+def profile(mode, sort="total"):
+    async def main():
+        worker = asyncio.create_task(busy_loop(0.5))
+        report = await profiling.profile_cpu(0.3, mode=mode, sort=sort)
+        await worker
+        return report
+    return asyncio.run(main())
+
+def test_cprofile_sees_loop_work():
+    """cProfile видит функции, которые выполнял loop"""
+    report = profile("cprofile", sort="own")
+    assert report['mode'] == 'cprofile'
+    names = [row['function'] for row in report['functions'][:5]]
+    assert any('busy_function' in name for name in names), names
+    assert all(row['calls'] > 0 for row in report['functions'])
+
+def test_sampling_sees_loop_work():
+    """Сэмплирование находит горячую функцию в потоке loop"""
+    report = profile("sampling", sort="own")
+    assert report['samples'] > 10
+    top = report['functions'][0]
+    assert 'busy_function' in top['function'], report['functions'][:3]
+    assert 0 < top['percent'] <= 100
+
+def test_one_profile_at_a_time():
+    """Второй профиль, пока идет первый, отклоняется"""
+    async def main():
+        first = asyncio.create_task(profiling.profile_cpu(0.2))
+        await asyncio.sleep(0.05)
+        try:
+            await profiling.profile_cpu(0.1)
+            assert False, "ожидалась ProfileBusyError"
+        except profiling.ProfileBusyError:
+            pass
+        await first
+    asyncio.run(main())
+
+def test_memory_snapshot_diff():
+    """Второй снимок показывает место, где выросла память"""
+    profiling.memory_start(frames=5)
+    try:
+        first = profiling.memory_snapshot()
+        assert first['diff'] is None
+        leak = [bytearray(1024) for _ in range(2000)]
+        second = profiling.memory_snapshot()
+        grown = [row for row in second['diff'] if 'test_profiling.py' in row['site']]
+        assert grown and grown[0]['size_diff_kb'] >= 1500, second['diff'][:3]
+        assert second['rss_kb'] > 0
+        del leak
+    finally:
+        status = profiling.memory_stop()
+    assert not status['tracing']
+    try:
+        profiling.memory_snapshot()
+        assert False, "снимок без tracemalloc должен давать ошибку"
+    except RuntimeError:
+        pass
+
+def test_write_report():
+    """Отчет по сигналу сохраняется JSON-файлом"""
+    directory = os.path.join(tempfile.mkdtemp(), 'profiles')
+    path = profiling.write_report(directory, 'cpu', {'functions': []})
+    assert os.path.basename(path).startswith('cpu_')
+    with open(path, encoding='utf-8') as f:
+        assert json.load(f) == {'functions': []}
+
+if __name__ == "__main__":
+    test_cprofile_sees_loop_work()
+    test_sampling_sees_loop_work()
+    test_one_profile_at_a_time()
+    test_memory_snapshot_diff()
+    test_write_report()
+    print("✅ Все тесты профилирования пройдены")
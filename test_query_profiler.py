@@ -0,0 +1,134 @@
+#!/usr/bin/env python3
+# -*- coding: utf-8 -*-
+"""
+Тест профилировщика запросов: планы всех запросов Database без полного прохода
+по logs и moderation_queue
+"""
+
+import sys
+import os
+import tempfile
+
+sys.path.insert(0, os.path.dirname(os.path.abspath(__file__)))
+from database import Database
+from query_profiler import profiler, percentile
+
+# Методы без своих запросов или с отдельным соединением
+NOT_PROFILED = {'get_connection', 'init_database', 'invalidate_tags_cache', 'get_tags_version', 'get_tag_index'}
+
+def make_item(tag, message_id):
+    return {
+        'chat_id': -100, 'message_id': message_id, 'user_id': 42, 'username': 'tester',
+        'tag': tag, 'emoji': '🔥', 'media_info': {'has_photo': True}, 'counter_name': tag,
+    }
+
+def run_workload(db):
+    """Вызвать каждый публичный метод Database"""
+    tag_id = db.create_tag({'tag': '#run', 'emoji': '🔥', 'match_mode': 'equals'})
+    db.update_tag(tag_id, {'tag': '#run', 'emoji': '🏃', 'match_mode': 'prefix'})
+    db.get_tag_by_id(tag_id)
+    db.invalidate_tags_cache()
+    db.get_tags()
+    db.delete_tag(tag_id)
+
+    db.add_log({'user_id': 42, 'chat_id': -100, 'message_id': 1, 'trigger': '#run', 'emoji': '🔥'})
+    db.add_logs([{'user_id': 42, 'chat_id': -100, 'message_id': 2, 'trigger': '#run', 'emoji': '🔥'}])
+    db.get_logs()
+    db.get_logs('#run')
+    db.get_stats()
+    db.enable_log_buffer(batch_size=10, flush_interval=0)
+    db.add_log({'user_id': 42, 'chat_id': -100, 'message_id': 5, 'trigger': '#run', 'emoji': '🔥'})
+    db.flush_logs_if_due()
+    db.flush_logs()
+    db.enable_log_buffer(batch_size=0)
+    old_logs = db.get_old_logs('9999-01-01 00:00:00', statuses=['success'], limit=10)
+    db.get_old_logs('9999-01-01 00:00:00', exclude_statuses=['success'], limit=10)
+    db.rollup_logs([log['id'] for log in old_logs])
+    db.incremental_vacuum(10)
+    db.delete_chunk('logs', db.get_max_rowid('logs'), 10, budget_ms=50)
+
+    item_id = db.add_moderation_item(make_item('#run', 3))
+    group_ids = db.add_moderation_items([make_item('#run', 4), make_item('#yoga', 4)], status='auto_approved')
+    db.get_pending_moderation()
+    db.get_moderation_by_id(item_id)
+    db.get_moderation_group(group_ids[0])
+    db.update_moderation_status(item_id, 'approved')
+    db.find_message_data(-100, 4)
+    db.find_message_data(-100, 1)
+    db.find_message_data(-100, 999)
+
+    db.add_media_hash('abc', 'file1', 'photo', 42, -100, 1)
+    db.check_media_hash('abc')
+
+    db.add_reaction_queue(group_ids[0], -100, 4, '🔥')
+    queue = db.get_reaction_queue()
+    db.get_pending_reactions_count()
+    db.increment_reaction_attempts(queue[0]['id'])
+    db.remove_reaction_from_queue(queue[0]['id'])
+    db.clear_reaction_queue()
+    db.delete_chunk('moderation_queue', db.get_max_rowid('moderation_queue'), 10)
+
+    db.add_trace_data([('t1', -100, 4, 1000.0)], [('t1', 'tag_match', 'bot', 1000.0, 0.1, 'ok')])
+    db.get_traces(chat_id=-100, message_id=4)
+    db.get_traces(trace_id='t1')
+    db.prune_traces(0)
+
+    db.search('tester', tag='#run', status='pending', date_from='2000-01-01', date_to='2100-01-01')
+    db.search('run', source='logs', order='rank', limit=5, offset=5)
+
+    db.set_meta_values({'bot_heartbeat': 1000})
+    db.get_pipeline_state()
+
+def profile_workload():
+    db = Database(os.path.join(tempfile.mkdtemp(), 'test.db'))
+    state = (profiler.enabled, profiler.slow_ms)
+    profiler.reset()
+    # Порог 0: план сохраняется для каждого запроса
+    profiler.configure(enabled=True, slow_ms=0)
+    try:
+        run_workload(db)
+        return db, profiler.report()
+    finally:
+        profiler.configure(*state)
+
+def test_no_full_scans_on_large_tables():
+    """Ни один запрос с условием не проходит logs или moderation_queue целиком"""
+    db, report = profile_workload()
+    public = {name for name in dir(Database) if not name.startswith('_') and callable(getattr(Database, name))}
+    missing = public - NOT_PROFILED - set(report['methods'])
+    assert not missing, "Методы не вызваны в нагрузке: {}".format(sorted(missing))
+
+    scans = profiler.full_scans()
+    assert not scans, "Полный проход по таблице:\n" + "\n".join(
+        "{} -> {}".format(tables, sql) for sql, tables in scans.items())
+
+def test_full_scan_is_detected():
+    """Запрос по неиндексированной колонке распознается как полный проход"""
+    db = Database(os.path.join(tempfile.mkdtemp(), 'test.db'))
+    with db.get_connection() as conn:
+        profiler.explain(conn, "SELECT * FROM logs WHERE caption = ?", ('x',))
+        profiler.explain(conn, "SELECT * FROM logs WHERE emoji = ? ORDER BY timestamp DESC LIMIT 1", ('x',))
+        profiler.explain(conn, "SELECT COUNT(*) FROM logs", ())
+    scans = profiler.full_scans()
+    assert scans.get("SELECT * FROM logs WHERE caption = ?") == ['logs']
+    assert scans.get("SELECT * FROM logs WHERE emoji = ? ORDER BY timestamp DESC LIMIT 1") == ['logs']
+    assert "SELECT COUNT(*) FROM logs" not in scans
+    profiler.reset()
+
+def test_report_per_method():
+    """Отчет: p50/p99 по методам и их запросам, медленные запросы с планом"""
+    db, report = profile_workload()
+    get_logs = report['methods']['get_logs']
+    assert get_logs['calls'] == 2
+    assert get_logs['p99_ms'] >= get_logs['p50_ms'] > 0
+    assert any('FROM logs' in statement['sql'] for statement in get_logs['statements'])
+    assert report['slow'] and all('plan' in entry for entry in report['slow'])
+    assert percentile([1, 2, 3, 4, 100], 0.5) == 3
+    assert percentile([1, 2, 3, 4, 100], 0.99) == 100
+    profiler.reset()
+
+if __name__ == "__main__":
+    test_no_full_scans_on_large_tables()
+    test_full_scan_is_detected()
+    test_report_per_method()
+    print("✅ Все тесты профилировщика запросов пройдены")
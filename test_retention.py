@@ -0,0 +1,123 @@
+#!/usr/bin/env python3
+# -*- coding: utf-8 -*-
+"""
+Тест хранения логов: перенос в архив по политикам, счетчики и vacuum
+"""
+
+import sys
+import os
+import tempfile
+
+sys.path.insert(0, os.path.dirname(os.path.abspath(__file__)))
+from database import Database
+from retention import parse_policies, cutoff, run_retention, read_archive
+
+NOW = 1767225600.0  # 2026-01-01 00:00:00 UTC
+
+def make_db():
+    return Database(os.path.join(tempfile.mkdtemp(), 'test.db'))
+
+def add_logs(db, days_ago, status, count, trigger='#run'):
+    """Логи с временем days_ago дней назад от NOW"""
+    timestamp = cutoff(days_ago, NOW)
+    with db.get_connection() as conn:
+        conn.executemany("""
+            INSERT INTO logs (user_id, chat_id, message_id, trigger, emoji, status, timestamp)
+            VALUES (1, -100, ?, ?, '🔥', ?, ?)
+        """, [(n, trigger, status, timestamp) for n in range(count)])
+        conn.commit()
+
+def statuses_left(db):
+    with db.get_connection() as conn:
+        return dict(conn.execute("SELECT status, COUNT(*) FROM logs GROUP BY status").fetchall())
+
+def test_parse_policies():
+    assert parse_policies("failed=30, *=365") == {'failed': 30.0, '*': 365.0}
+    assert parse_policies("") == {}
+    try:
+        parse_policies("failed")
+        assert False, "политика без срока должна быть ошибкой"
+    except ValueError:
+        pass
+
+def test_policies_archive_by_status_and_age():
+    """Старые failed и прочие уходят в архив по своим срокам, статистика не меняется"""
+    db = make_db()
+    archive_dir = os.path.join(os.path.dirname(db.db_path), 'archive')
+    add_logs(db, 40, 'failed', 3)
+    add_logs(db, 10, 'failed', 2)
+    add_logs(db, 40, 'success', 4, trigger='#yoga')
+    add_logs(db, 400, 'success', 5)
+    stats_before = db.get_stats()
+
+    result = run_retention(db, {'failed': 30, '*': 365}, archive_dir, batch_size=2, now=NOW)
+    assert result['archived'] == {'failed': 3, '*': 5}
+    assert statuses_left(db) == {'failed': 2, 'success': 4}
+
+    stats = db.get_stats()
+    assert stats['total_logs'] == stats_before['total_logs'] == 14
+    assert stats['tag_stats'] == stats_before['tag_stats']
+
+    archived = [row for path in result['files'] for row in read_archive(path)]
+    assert len(archived) == 8
+    assert {row['status'] for row in archived} == {'failed', 'success'}
+    assert len({row['id'] for row in archived}) == 8
+
+    # Повторный проход ничего не находит
+    assert run_retention(db, {'failed': 30, '*': 365}, archive_dir, now=NOW)['archived'] == {}
+
+def test_batches_are_limited_per_pass():
+    """За проход не больше max_batches пачек, остаток - в следующих"""
+    db = make_db()
+    archive_dir = os.path.join(os.path.dirname(db.db_path), 'archive')
+    add_logs(db, 100, 'success', 10)
+    result = run_retention(db, {'*': 30}, archive_dir, batch_size=3, max_batches=2, now=NOW)
+    assert result['archived'] == {'*': 6}
+    assert run_retention(db, {'*': 30}, archive_dir, batch_size=3, max_batches=2, now=NOW)['archived'] == {'*': 4}
+    assert statuses_left(db) == {}
+    assert db.get_stats()['total_logs'] == 10
+
+    # Оба прохода дописали один месячный архив
+    assert len(read_archive(result['files'][0])) == 10
+
+def test_zero_days_keeps_status_and_dry_run():
+    db = make_db()
+    archive_dir = os.path.join(os.path.dirname(db.db_path), 'archive')
+    add_logs(db, 1000, 'failed', 2)
+    add_logs(db, 1000, 'success', 2)
+    assert run_retention(db, {'failed': 0, '*': 30}, archive_dir, dry_run=True, now=NOW)['archived'] == {'*': 2}
+    assert statuses_left(db) == {'failed': 2, 'success': 2}
+    assert not os.path.exists(archive_dir)
+
+    run_retention(db, {'failed': 0, '*': 30}, archive_dir, now=NOW)
+    assert statuses_left(db) == {'failed': 2}
+
+def test_incremental_vacuum_returns_space():
+    """Новая БД создается с auto_vacuum=INCREMENTAL, место после архивации уходит ОС"""
+    db = make_db()
+    with db.get_connection() as conn:
+        assert conn.execute("PRAGMA auto_vacuum").fetchone()[0] == 2
+    archive_dir = os.path.join(os.path.dirname(db.db_path), 'archive')
+    with db.get_connection() as conn:
+        conn.executemany("""
+            INSERT INTO logs (user_id, chat_id, message_id, trigger, emoji, caption, timestamp)
+            VALUES (1, -100, ?, '#run', '🔥', ?, ?)
+        """, [(n, 'x' * 500, cutoff(100, NOW)) for n in range(2000)])
+        conn.commit()
+        conn.execute("PRAGMA wal_checkpoint(TRUNCATE)")
+        pages_before = conn.execute("PRAGMA page_count").fetchone()[0]
+
+    result = run_retention(db, {'*': 30}, archive_dir, batch_size=500, max_batches=10,
+                           vacuum_pages=100000, now=NOW)
+    assert result['archived'] == {'*': 2000}
+    assert result['free_pages'] == 0
+    with db.get_connection() as conn:
+        assert conn.execute("PRAGMA page_count").fetchone()[0] < pages_before / 2
+
+if __name__ == "__main__":
+    test_parse_policies()
+    test_policies_archive_by_status_and_age()
+    test_batches_are_limited_per_pass()
+    test_zero_days_keeps_status_and_dry_run()
+    test_incremental_vacuum_returns_space()
+    print("✅ Все тесты хранения логов прошли")
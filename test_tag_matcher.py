@@ -0,0 +1,420 @@
+#!/usr/bin/env python3
+# -*- coding: utf-8 -*-
+"""
+Тест сопоставления сообщений с тегами
+"""
+
+import sys
+import os
+import random
+
+sys.path.insert(0, os.path.dirname(os.path.abspath(__file__)))
+from tag_matcher import (
+    Tag, TagIndex, normalize_ukrainian_text, extract_hashtags, plan_matched_tags, validate_regex_tag,
+    edit_distance, fuzzy_limit
+)
+
+# Корпус (тег, текст сообщения, должно ли сработать) для режима equals
+MATCH_CORPUS = [
+    ('#марафон', 'Мій #марафон сьогодні', True),
+    ('#марафон', 'Мій #МАРАФОН сьогодні', True),
+    ('#марафон', 'Мій #мараф0н сьогодні', True),                 # ноль вместо "о"
+    ('#марафон', 'Мій #мaрафон сьогодні', True),                 # латинская "a"
+    ('#марафон', 'Мій #MAPAФOH сьогодні', True),                 # латинские заглавные
+    ('#марафон', '#марафон2 не рахується', False),
+    ('#п\'ятниця', 'Сьогодні #пʼятниця!', False),                # знак препинания прилип
+    ('#п\'ятниця', 'Сьогодні #пʼятниця', True),                  # U+02BC
+    ('#п\'ятниця', 'Сьогодні #п’ятниця', True),                  # U+2019
+    ('#пʼятниця', "Сьогодні #п'ятниця", True),                   # тег с U+02BC
+    ('#пʼятниця', 'Сьогодні #п`ятниця', True),
+    ('#п\'ятниця', 'Сьогодні #п´ятниця', True),                  # U+00B4: NFKC дает пробел + U+0301
+    ('#п\'ятниця', 'Сьогодні #п\u1ffdятниця', True),             # U+1FFD greek oxia
+    ('#йога', 'Ранкова #и\u0306ога', True),                      # NFD: и + бреве
+    ('#yoga', 'Ранкова #ｙｏｇａ', True),                           # полноширинная латиница (NFKC)
+    ('#ёлка', 'Ставимо #елка', True),
+    ('#вправи', 'Мої #вправы', True),
+    ('#бег', 'Утренний #бег', True),
+    ('#бег', 'Утренний #бeг', True),                             # латинская "e"
+    ('#run10k', 'Finished #run10k today', True),
+    ('#run10k', 'Finished #run1Ok today', False),                 # латиница не трогается
+    ('#stretch', 'Evening #STRETCH', True),
+    ('#звіт', 'Мій #звiт за тиждень', True),                    # латинская "i"
+    ('#звіт', 'Мій #звіт\u200b за тиждень', True),              # zero width space
+    ('#день10', 'Мій #день10', True),
+    ('#день10', 'Мій #день1о', False),                          # цифры в конце не трогаются
+]
+
+def make_tag(tag, match_mode='equals', thread_name='', **extra):
+    """Тег в том виде, в котором его возвращает Database.get_tags()"""
+    data = {
+        'id': tag,
+        'tag': tag,
+        'emoji': '🔥',
+        'delay': 0,
+        'match_mode': match_mode,
+        'require_photo': 0,
+        'thread_name': thread_name,
+        'moderation_enabled': 0,
+    }
+    data.update(extra)
+    return data
+
+def test_thread_partitioning():
+    """Теги чужого треда не рассматриваются, глобальные доступны везде"""
+    index = TagIndex([
+        make_tag('#марафон', thread_name='Марафон'),
+        make_tag('#рецепт', thread_name='Рецепти'),
+        make_tag('#звіт'),
+    ])
+
+    assert [t.tag for t in index.candidates('марафон')] == ['#марафон', '#звіт']
+    assert [t.tag for t in index.candidates('')] == ['#звіт']
+    assert [t.tag for t in index.candidates('Інший тред')] == ['#звіт']
+
+def test_thread_name_is_normalized():
+    """Название треда сравнивается после нормализации"""
+    index = TagIndex([make_tag('#ёлка', thread_name='  Ёлка ')])
+
+    assert index.match('#ёлка', 'елка').tag == '#ёлка'
+    assert index.match('#ёлка', 'ЁЛКА').tag == '#ёлка'
+    assert index.match('#ёлка', '') is None
+
+def test_wrong_thread_match_does_not_abort_search():
+    """Совпадение с тегом другого треда не мешает найти следующий тег"""
+    index = TagIndex([
+        make_tag('#біг', thread_name='Марафон'),
+        make_tag('#біг', thread_name='Тренування'),
+    ])
+
+    matched = index.match('Сьогодні #біг 5 км', 'Тренування')
+    assert matched is index.tags[1]
+
+def test_match_modes():
+    """Режимы equals и prefix"""
+    index = TagIndex([
+        make_tag('#день', match_mode='prefix'),
+        make_tag('#звіт'),
+    ])
+
+    assert index.match('#день12 готово').tag == '#день'
+    assert index.match('мій #ЗВІТ').tag == '#звіт'
+    assert index.match('мій #звіт2') is None
+    assert index.match('без тегів') is None
+
+def test_normalization_corpus():
+    """Корпус реальных вариантов написания тегов"""
+    failures = []
+    for tag, text, expected in MATCH_CORPUS:
+        index = TagIndex([make_tag(tag)])
+        if (index.match(text) is not None) != expected:
+            failures.append((tag, text, expected))
+
+    assert not failures, failures
+
+def test_normalize_is_idempotent():
+    """Повторная нормализация ничего не меняет"""
+    for tag, text, _ in MATCH_CORPUS:
+        for value in (tag, text):
+            once = normalize_ukrainian_text(value)
+            assert normalize_ukrainian_text(once) == once
+
+def test_normalize_compatibility_apostrophes():
+    """Апострофы, которые NFKC раскладывает с U+0301, становятся обычным апострофом"""
+    for apostrophe in ('\u00b4', '\u0384', '\u1ffd'):
+        assert normalize_ukrainian_text('п' + apostrophe + 'ятниця') == "п'ятниця"
+
+def test_normalize_keeps_latin_words():
+    """Латинские слова не превращаются в кириллицу"""
+    assert normalize_ukrainian_text('Hello #marathon') == 'hello #marathon'
+    assert normalize_ukrainian_text('  Ёжик ') == 'ежик'
+    assert normalize_ukrainian_text('') == ''
+    assert normalize_ukrainian_text(None) == ''
+
+def hashtag_entities(text):
+    """Смещения хэштегов в единицах UTF-16, как их присылает Telegram"""
+    entities = []
+    for i, ch in enumerate(text):
+        if ch != '#' or (i > 0 and not text[i - 1].isspace()):
+            continue
+        end = i + 1
+        while end < len(text) and (text[end].isalnum() or text[end] == '_'):
+            end += 1
+        offset = len(text[:i].encode('utf-16-le')) // 2
+        entities.append((offset, len(text[i:end].encode('utf-16-le')) // 2))
+    return entities
+
+def test_extract_hashtags_utf16_offsets():
+    """Смещения считаются в UTF-16: эмодзи перед хэштегом занимают две единицы"""
+    text = "🏃🏃 Мій #марафон день 12 💪 #звіт"
+    assert extract_hashtags(text, hashtag_entities(text)) == ['#марафон', '#звіт']
+
+def test_extract_hashtags_extends_to_word_boundary():
+    """Обрезанный на апострофе хэштег расширяется до конца слова"""
+    text = "Сьогодні #п'ятниця, ура"
+    assert hashtag_entities(text) == [(9, 2)]
+    assert extract_hashtags(text, hashtag_entities(text)) == ["#п'ятниця,"]
+
+    text = "Сьогодні #пʼятниця ура"
+    assert extract_hashtags(text, hashtag_entities(text)) == ["#пʼятниця"]
+
+def test_extract_hashtags_matches_split():
+    """Токены из entities совпадают со словами text.split()"""
+    for _, text, _ in MATCH_CORPUS:
+        expected = [w for w in text.split() if w.startswith('#')]
+        assert extract_hashtags(text, hashtag_entities(text)) == expected, text
+
+def test_entity_path_matches_like_full_text():
+    """Поиск по хэштегам дает тот же результат, что и по всему тексту"""
+    for tag, text, expected in MATCH_CORPUS:
+        index = TagIndex([make_tag(tag), make_tag('#день', match_mode='prefix')])
+        hashtags = extract_hashtags(text, hashtag_entities(text))
+        assert index.match(text, hashtags=hashtags) is index.match(text), text
+
+def test_entity_path_fallbacks():
+    """Теги без "#" и сообщения без разметки проверяются по всему тексту"""
+    index = TagIndex([make_tag('звіт')])
+    assert index.match('мій звіт', hashtags=[]).tag == 'звіт'
+
+    index = TagIndex([make_tag('#звіт')])
+    assert index.match('мій #звіт', hashtags=[]).tag == '#звіт'
+    assert index.match('мій звіт', hashtags=[]) is None
+
+    index = TagIndex([make_tag('#мій звіт')])
+    assert index.match('це #мій звіт', hashtags=['#мій']).tag == '#мій звіт'
+
+def test_first_tag_wins():
+    """При нескольких совпадениях выигрывает тег, созданный раньше"""
+    index = TagIndex([make_tag('#а'), make_tag('#б')])
+
+    assert index.match('#б #а').tag == '#а'
+    assert index.match('#б #а', hashtags=['#б', '#а']).tag == '#а'
+
+    index = TagIndex([make_tag('#д', match_mode='prefix'), make_tag('#день')])
+    assert index.match('#день').tag == '#д'
+
+def test_match_all():
+    """Режим нескольких совпадений возвращает все теги в порядке создания"""
+    index = TagIndex([
+        make_tag('#stretch'),
+        make_tag('#run'),
+        make_tag('#день', match_mode='prefix'),
+        make_tag('#марафон', thread_name='Марафон'),
+    ])
+
+    text = '#run 5km, потім #stretch і #день3 #run'
+    assert [t.tag for t in index.match_all(text)] == ['#stretch', '#run', '#день']
+    assert [t.tag for t in index.match_all(text + ' #марафон', 'Марафон')] == ['#stretch', '#run', '#день', '#марафон']
+    assert index.match_all('нічого') == []
+
+def test_plan_matched_tags():
+    """Одна реакция на сообщение: эмодзи первого тега без модерации, самая маленькая задержка"""
+    tags = [Tag.from_row(row) for row in (
+        make_tag('#a', emoji='🔥', delay=30, moderation_enabled=0),
+        make_tag('#b', emoji='👀', delay=0, moderation_enabled=1),
+        make_tag('#c', emoji='💪', delay=0, moderation_enabled=0),
+        make_tag('#d', emoji='🏃', delay=60, moderation_enabled=0),
+    )]
+
+    plan = plan_matched_tags(tags)
+    assert [t.tag for t in plan.reaction_tags] == ['#a', '#c', '#d']
+    assert [t.tag for t in plan.moderation_tags] == ['#b']
+    assert (plan.emoji, plan.delay) == ('🔥', 0)
+
+    # Только теги с модерацией - реакции нет
+    plan = plan_matched_tags(tags[1:2])
+    assert plan.reaction_tags == () and plan.emoji == ''
+
+def test_tag_record():
+    """Запись Tag: значения из SQLite приведены к типам, поля для поиска посчитаны"""
+    tag = Tag.from_row(make_tag('#Ёлка', thread_name=' Марафон ', require_photo=1, moderation_enabled=0, delay=None))
+    assert tag.normalized == '#елка'
+    assert tag.normalized_thread == 'марафон'
+    assert tag.require_photo is True and tag.moderation_enabled is False and tag.delay == 0
+    assert tag.hashtag
+
+    regex = Tag.from_row(make_tag(r'#Day\D+', match_mode='regex'))
+    assert regex.normalized == r'#Day\D+' and regex.prefix == '#day' and regex.pattern is not None
+
+    assert Tag.from_row(make_tag('#марафон', match_mode='fuzzy', fuzzy_distance=2)).max_edits == 2
+
+    try:
+        tag.emoji = '🔥'
+    except AttributeError:
+        pass
+    else:
+        assert False, "Tag должен быть неизменяемым"
+    assert not hasattr(tag, '__dict__')
+
+def test_regex_mode():
+    """Режим regex: слово должно соответствовать выражению целиком"""
+    index = TagIndex([
+        make_tag(r'#day\d+', match_mode='regex'),
+        make_tag(r'#день\d{1,2}', match_mode='regex'),
+        make_tag('#звіт'),
+    ])
+
+    assert index.match('Мій #day12 готово').tag == r'#day\d+'
+    assert index.match('Мій #DAY7').tag == r'#day\d+'
+    assert index.match('Мій #day') is None
+    assert index.match('Мій #day12x') is None
+    assert index.match('#день5').tag == r'#день\d{1,2}'
+    assert index.match('#день123') is None
+    assert [t.tag for t in index.match_all('#звіт #день3 #day1')] == [r'#day\d+', r'#день\d{1,2}', '#звіт']
+
+def test_regex_first_tag_wins():
+    """Объединенное выражение и группы по префиксу сохраняют порядок создания"""
+    index = TagIndex([
+        make_tag('#а'),
+        make_tag(r'#б\w+', match_mode='regex'),
+        make_tag(r'#б\d+', match_mode='regex'),
+        make_tag(r'#\w+', match_mode='regex'),
+    ])
+    assert index.global_bucket.regexes['#б'].union is not None
+    assert index.match('#б1').tag == r'#б\w+'
+    assert index.match('#б1 #а').tag == '#а'
+    assert index.match('#в1').tag == r'#\w+'
+    assert [t.tag for t in index.match_all('#б1')] == [r'#б\w+', r'#б\d+', r'#\w+']
+
+    index = TagIndex([make_tag(r'#\w+', match_mode='regex'), make_tag(r'#б\w+', match_mode='regex')])
+    assert index.match('#б1').tag == r'#\w+'
+
+def test_regex_without_union():
+    """Несовместимые выражения проверяются по одному"""
+    index = TagIndex([
+        make_tag(r'#x(?P<n>\d+)', match_mode='regex'),
+        make_tag(r'#x(?P<n>\d+)y', match_mode='regex'),
+    ])
+    assert index.global_bucket.regexes['#x'].union is None
+    assert index.match('#x5').tag == r'#x(?P<n>\d+)'
+    assert index.match('#x5y').tag == r'#x(?P<n>\d+)y'
+
+def test_regex_entity_path():
+    """Regex-теги с обязательным "#" ищутся по хэштегам, остальные - по тексту"""
+    index = TagIndex([make_tag(r'#day\d+', match_mode='regex')])
+    assert index.global_bucket.hashtags_only
+    text = 'Finished #day3 today'
+    assert index.match(text, hashtags=extract_hashtags(text, hashtag_entities(text))).tag == r'#day\d+'
+
+    for pattern in (r'#?day\d+', r'day\d+', r'#a|b'):
+        assert not TagIndex([make_tag(pattern, match_mode='regex')]).global_bucket.hashtags_only, pattern
+
+def test_validate_regex_tag():
+    """Опасные и некорректные выражения отклоняются при сохранении"""
+    for pattern in (r'#day\d+', r'#(run|walk)\d*', r'#(?:ab|cd)+', r'#[a-z]{2,5}_\d+'):
+        assert validate_regex_tag(pattern) is None, pattern
+
+    for pattern in (r'(a+)+', r'#(\w+)*x', r'(a|ab)*', r'(\w|_x)+', r'(a)\1', r'#(', '', 'a' * 300):
+        assert validate_regex_tag(pattern) is not None, pattern
+
+def test_invalid_regex_is_skipped():
+    """Опасное выражение, попавшее в БД в обход API, не ломает индекс"""
+    index = TagIndex([make_tag(r'(a+)+$', match_mode='regex'), make_tag('#звіт')])
+    assert index.candidates('') == [index.tags[1]]
+    assert index.match('a' * 40 + '!') is None
+
+def test_edit_distance():
+    """Расстояние Левенштейна с ограничением сверху"""
+    assert edit_distance('#марафон', '#марафон', 2) == 0
+    assert edit_distance('#марафон', '#мараон', 2) == 1
+    assert edit_distance('#маратон', '#маратн', 2) == 1
+    assert edit_distance('#марафон', '#маратн', 2) == 2
+    assert edit_distance('#марафон', '#біг', 2) == 3
+    assert edit_distance('abc', 'xyz', 1) == 2
+    assert edit_distance('', 'ab', 5) == 2
+
+def reference_distance(a, b):
+    """Классическая динамика для сверки"""
+    previous = list(range(len(b) + 1))
+    for i, ca in enumerate(a, 1):
+        current = [i]
+        for j, cb in enumerate(b, 1):
+            current.append(min(previous[j - 1] + (ca != cb), previous[j] + 1, current[j - 1] + 1))
+        previous = current
+    return previous[-1]
+
+def test_edit_distance_matches_reference():
+    """Бит-параллельный алгоритм совпадает с динамикой"""
+    rng = random.Random(3)
+    for _ in range(2000):
+        a = ''.join(rng.choice('абв#') for _ in range(rng.randint(1, 12)))
+        b = ''.join(rng.choice('абв#') for _ in range(rng.randint(1, 12)))
+        assert edit_distance(a, b, 20) == reference_distance(a, b), (a, b)
+
+def test_fuzzy_limit():
+    """Допуск зависит от длины тега и не превышает настройку"""
+    assert fuzzy_limit('#ab', 2) == 0
+    assert fuzzy_limit('#біг', 2) == 1
+    assert fuzzy_limit('#марафон', 2) == 2
+    assert fuzzy_limit('#марафон', 1) == 1
+
+def test_fuzzy_mode():
+    """Режим fuzzy находит тег с опечаткой в пределах допуска"""
+    index = TagIndex([
+        make_tag('#марафон', match_mode='fuzzy', fuzzy_distance=2),
+        make_tag('#звіт', match_mode='fuzzy', fuzzy_distance=1),
+    ])
+
+    assert index.match('мій #маратн').tag == '#марафон'
+    assert index.match('мій #МАРАФОН').tag == '#марафон'
+    assert index.match('мій #звт').tag == '#звіт'
+    assert index.match('мій #зв') is None
+    assert index.match('мій #марш') is None
+    # "#" не считается опечаткой: обычное слово не превращается в хэштег
+    assert index.match('пробіг марафон') is None
+    assert index.global_bucket.hashtags_only
+
+def test_fuzzy_first_tag_wins():
+    """Из нескольких близких тегов выигрывает созданный раньше"""
+    index = TagIndex([
+        make_tag('#звіт'),
+        make_tag('#звіти', match_mode='fuzzy'),
+        make_tag('#звітт', match_mode='fuzzy'),
+    ])
+    assert index.match('#звіт').tag == '#звіт'
+    assert index.match('#звітм').tag == '#звіти'
+    assert [t.tag for t in index.match_all('#звітм')] == ['#звіти', '#звітт']
+
+def test_bk_tree_matches_brute_force():
+    """BK-дерево находит те же теги, что и полный перебор"""
+    rng = random.Random(7)
+    alphabet = 'абвгдеіо'
+    words = ['#' + ''.join(rng.choice(alphabet) for _ in range(rng.randint(3, 8))) for _ in range(300)]
+    tags = [make_tag(w, match_mode='fuzzy', fuzzy_distance=2) for w in dict.fromkeys(words)]
+    index = TagIndex(tags)
+
+    for _ in range(200):
+        word = '#' + ''.join(rng.choice(alphabet) for _ in range(rng.randint(3, 8)))
+        expected = [t['tag'] for t in tags if edit_distance(word, t['tag'], 2) <= fuzzy_limit(t['tag'], 2)]
+        assert [t.tag for t in index.match_all(word)] == expected, word
+
+if __name__ == "__main__":
+    test_thread_partitioning()
+    test_thread_name_is_normalized()
+    test_wrong_thread_match_does_not_abort_search()
+    test_match_modes()
+    test_normalization_corpus()
+    test_normalize_is_idempotent()
+    test_normalize_compatibility_apostrophes()
+    test_normalize_keeps_latin_words()
+    test_extract_hashtags_utf16_offsets()
+    test_extract_hashtags_extends_to_word_boundary()
+    test_extract_hashtags_matches_split()
+    test_entity_path_matches_like_full_text()
+    test_entity_path_fallbacks()
+    test_first_tag_wins()
+    test_match_all()
+    test_plan_matched_tags()
+    test_tag_record()
+    test_regex_mode()
+    test_regex_first_tag_wins()
+    test_regex_without_union()
+    test_regex_entity_path()
+    test_validate_regex_tag()
+    test_invalid_regex_is_skipped()
+    test_edit_distance()
+    test_edit_distance_matches_reference()
+    test_fuzzy_limit()
+    test_fuzzy_mode()
+    test_fuzzy_first_tag_wins()
+    test_bk_tree_matches_brute_force()
+    print("✅ Все тесты сопоставления тегов пройдены")
@@ -0,0 +1,123 @@
+#!/usr/bin/env python3
+# -*- coding: utf-8 -*-
+"""
+Тест трассировки сообщения через бот, очередь реакций и админку
+"""
+
+import sys
+import os
+import asyncio
+import tempfile
+import time
+
+sys.path.insert(0, os.path.dirname(os.path.abspath(__file__)))
+from database import Database
+import tracing
+from tracing import Tracer, span, traced, current_trace_id, sqlite_timestamp
+
+def make_tracer(source, **kwargs):
+    tracing.db = Database(os.path.join(tempfile.mkdtemp(), 'test.db'))
+    tracer = Tracer(source, **kwargs)
+    tracer.enabled = True
+    return tracer
+
+def test_trace_crosses_queue_and_processes():
+    """trace_id из handle_any продолжается в очереди реакций и в админке"""
+    bot_tracer = make_tracer("bot", flush_spans=1000, flush_interval=3600)
+    db = tracing.db
+
+    token = bot_tracer.start(-100, 7, received_at=time.time())
+    trace_id = current_trace_id()
+    assert trace_id
+    with span("tag_match"):
+        pass
+    db.add_reaction_queue('m1', -100, 7, '🔥', 0, trace_id=trace_id)
+    bot_tracer.finish(token)
+    assert current_trace_id() == ''
+
+    # Позже: периодическая задача бота берет элемент очереди
+    item = db.get_reaction_queue()[0]
+    assert item['trace_id'] == trace_id
+    token = bot_tracer.resume(item['trace_id'])
+    token[0].add_interval("reaction_queue", sqlite_timestamp(item['created_at']))
+    with span("set_reaction"):
+        pass
+    bot_tracer.finish(token)
+
+    # Админка - другой процесс со своим Tracer
+    admin_tracer = Tracer("admin", flush_spans=1)
+    admin_tracer.enabled = True
+    token = admin_tracer.resume(trace_id)
+    try:
+        with span("set_reaction"):
+            raise RuntimeError("429")
+    except RuntimeError:
+        pass
+    admin_tracer.finish(token)
+    bot_tracer.flush()
+
+    traces = db.get_traces(chat_id=-100, message_id=7)
+    assert [t['trace_id'] for t in traces] == [trace_id]
+    spans = [(s['source'], s['name'], s['status']) for s in traces[0]['spans']]
+    assert ('bot', 'tag_match', 'ok') in spans
+    assert ('bot', 'reaction_queue', 'ok') in spans
+    assert ('bot', 'set_reaction', 'ok') in spans
+    assert ('admin', 'set_reaction', 'error') in spans
+
+def test_nested_traces_restore_context():
+    """Трасса элемента очереди внутри обработки сообщения не теряет трассу сообщения"""
+    tracer = make_tracer("bot", flush_spans=1000, flush_interval=3600)
+    outer = tracer.start(-100, 1)
+    outer_id = current_trace_id()
+    inner = tracer.resume('queued')
+    assert current_trace_id() == 'queued'
+    tracer.finish(inner)
+    assert current_trace_id() == outer_id
+    tracer.finish(outer)
+
+def test_traced_decorator_and_no_trace():
+    """Декоратор пишет спан в текущую трассу, вне трассы ничего не делает"""
+    tracer = make_tracer("bot", flush_spans=1000, flush_interval=3600)
+
+    @traced("backend_post")
+    async def post():
+        return current_trace_id()
+
+    assert asyncio.run(post()) == ''
+    token = tracer.start(-100, 2)
+
+    async def run():
+        return await post()
+
+    # asyncio.run копирует контекст - трасса видна внутри задачи
+    assert asyncio.run(run()) == token[0].trace_id
+    assert [s[1] for s in token[0].spans] == ['backend_post']
+    tracer.finish(token)
+
+def test_prune_traces():
+    """Старые трассы удаляются вместе со спанами"""
+    tracer = make_tracer("bot")
+    db = tracing.db
+    now = time.time()
+    old, new = now - 10 * 86400, now - 60
+    db.add_trace_data([('old', -100, 1, old), ('new', -100, 2, new)],
+                      [('old', 'tag_match', 'bot', old, 0.1, 'ok'), ('new', 'tag_match', 'bot', new, 0.1, 'ok')])
+    assert db.prune_traces(now - 3 * 86400) == 1
+    assert db.get_traces(trace_id='old') == []
+    assert len(db.get_traces(trace_id='new')[0]['spans']) == 1
+
+def test_first_flush_does_not_prune():
+    """Первая запись не удаляет старые трассы: удаление - через час после создания Tracer"""
+    tracer = make_tracer("bot", flush_spans=1000, flush_interval=3600)
+    token = tracer.start(-100, 3, received_at=time.time() - 10 * 86400)
+    tracer.finish(token)
+    tracer.flush()
+    assert len(tracing.db.get_traces(chat_id=-100, message_id=3)) == 1
+
+if __name__ == "__main__":
+    test_trace_crosses_queue_and_processes()
+    test_nested_traces_restore_context()
+    test_traced_decorator_and_no_trace()
+    test_prune_traces()
+    test_first_flush_does_not_prune()
+    print("✅ Все тесты трассировки пройдены")
@@ -0,0 +1,193 @@
+#!/usr/bin/env python3
+# -*- coding: utf-8 -*-
+"""
+Трассировка сообщения: от получения апдейта до реакции и ответа бэкенда
+
+handle_any заводит trace_id на сообщение. Он сохраняется в moderation_queue
+и reaction_queue, поэтому process_reaction_queue в боте и approve_moderation
+в админке продолжают ту же трассу, а send_reaction_data передает его
+бэкенду заголовком X-Trace-Id.
+
+Спаны пишутся в SQLite узкими строками (trace_spans) пачками: бот копит
+их в памяти и сбрасывает по количеству или раз в несколько секунд из
+периодической задачи очереди реакций. Вне трассы span() ничего не делает.
+"""
+
+import contextvars
+import functools
+import inspect
+import logging
+import os
+import threading
+import time
+import uuid
+from datetime import datetime, timezone
+try:
+    from typing import Optional
+except ImportError:
+    # Для старых версий Python
+    pass
+
+from database import db
+
+logger = logging.getLogger(__name__)
+
+TRACING_ENABLED = os.getenv("TRACING", "1").lower() not in ("0", "false", "no")
+# Сколько дней хранить трассы
+TRACE_RETENTION_DAYS = float(os.getenv("TRACE_RETENTION_DAYS", "3"))
+
+# Трасса, в которой выполняется текущий код (свой у каждой asyncio-задачи)
+current_trace = contextvars.ContextVar('trace', default=None)
+
+def new_trace_id() -> str:
+    return uuid.uuid4().hex[:16]
+
+def current_trace_id() -> str:
+    trace = current_trace.get()
+    return trace.trace_id if trace else ''
+
+def sqlite_timestamp(value: str) -> Optional[float]:
+    """CURRENT_TIMESTAMP из SQLite (UTC, без зоны) -> unix time"""
+    try:
+        return datetime.strptime(value, '%Y-%m-%d %H:%M:%S').replace(tzinfo=timezone.utc).timestamp()
+    except (TypeError, ValueError):
+        return None
+
+class Trace:
+    """Спаны одной трассы в одном процессе"""
+    __slots__ = ('trace_id', 'source', 'spans', 'message')
+
+    def __init__(self, trace_id: str, source: str, message=None):
+        self.trace_id = trace_id
+        self.source = source
+        # (chat_id, message_id, время получения) - только у трассы, начатой в handle_any
+        self.message = message
+        self.spans = []
+
+    def add(self, name: str, started_at: float, duration: float, status: str = 'ok'):
+        self.spans.append((self.trace_id, name, self.source, started_at, round(duration * 1000, 3), status))
+
+    def add_interval(self, name: str, started_at: Optional[float], ended_at: float = None):
+        """Спан по известным моментам начала и конца (ожидание в очереди и т.п.)"""
+        if started_at is None:
+            return
+        ended_at = ended_at if ended_at is not None else time.time()
+        self.add(name, started_at, max(0.0, ended_at - started_at))
+
+class _Span:
+    __slots__ = ('trace', 'name', 'started_at', 'start')
+
+    def __init__(self, trace: Trace, name: str):
+        self.trace = trace
+        self.name = name
+
+    def __enter__(self):
+        self.started_at = time.time()
+        self.start = time.perf_counter()
+        return self
+
+    def __exit__(self, exc_type, exc, tb):
+        self.trace.add(self.name, self.started_at, time.perf_counter() - self.start,
+                       'error' if exc_type else 'ok')
+        return False
+
+class _NullSpan:
+    __slots__ = ()
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, exc_type, exc, tb):
+        return False
+
+_NULL_SPAN = _NullSpan()
+
+def span(name: str):
+    """with span("set_reaction"): ... - замер участка в текущей трассе"""
+    trace = current_trace.get()
+    return _Span(trace, name) if trace is not None else _NULL_SPAN
+
+def traced(name: str):
+    """Декоратор: вся функция (sync или async) - один спан"""
+    def decorator(func):
+        if inspect.iscoroutinefunction(func):
+            @functools.wraps(func)
+            async def async_wrapper(*args, **kwargs):
+                with span(name):
+                    return await func(*args, **kwargs)
+            return async_wrapper
+
+        @functools.wraps(func)
+        def wrapper(*args, **kwargs):
+            with span(name):
+                return func(*args, **kwargs)
+        return wrapper
+    return decorator
+
+class Tracer:
+    """Начало и продолжение трасс процесса, запись спанов в БД пачками"""
+
+    def __init__(self, source: str, flush_spans: int = 200, flush_interval: float = 2.0):
+        self.source = source
+        self.enabled = TRACING_ENABLED
+        self.flush_spans = flush_spans
+        self.flush_interval = flush_interval
+        self._traces = []
+        self._spans = []
+        self._last_flush = time.monotonic()
+        # Первое удаление старых трасс - через час после запуска, а не при первой записи
+        self._last_prune = time.monotonic()
+        self._lock = threading.Lock()
+
+    def start(self, chat_id: int, message_id: int, received_at: float = None):
+        """Новая трасса сообщения; вернуть токен для finish()"""
+        if not self.enabled:
+            return None
+        trace = Trace(new_trace_id(), self.source,
+                      (chat_id, message_id, received_at if received_at is not None else time.time()))
+        return trace, current_trace.set(trace)
+
+    def resume(self, trace_id: str):
+        """Продолжить трассу по сохраненному trace_id; вернуть токен для finish()"""
+        if not self.enabled or not trace_id:
+            return None
+        trace = Trace(trace_id, self.source)
+        return trace, current_trace.set(trace)
+
+    def finish(self, token):
+        """Закрыть трассу: вернуть предыдущую и поставить спаны в очередь на запись"""
+        if token is None:
+            return
+        trace, context_token = token
+        current_trace.reset(context_token)
+        with self._lock:
+            if trace.message:
+                self._traces.append((trace.trace_id,) + trace.message)
+            self._spans.extend(trace.spans)
+            due = (len(self._spans) >= self.flush_spans
+                   or time.monotonic() - self._last_flush >= self.flush_interval)
+        if due:
+            self.flush()
+
+    def flush(self):
+        """Записать накопленное в БД (и раз в час удалить старые трассы)"""
+        with self._lock:
+            traces, self._traces = self._traces, []
+            spans, self._spans = self._spans, []
+            self._last_flush = time.monotonic()
+        if traces or spans:
+            try:
+                db.add_trace_data(traces, spans)
+            except Exception as e:
+                # Трассировка не должна ломать обработку сообщений
+                logger.warning("⚠️ Не удалось записать трассы: %s", e)
+        if time.monotonic() - self._last_prune >= 3600:
+            self._last_prune = time.monotonic()
+            try:
+                db.prune_traces(time.time() - TRACE_RETENTION_DAYS * 86400)
+            except Exception as e:
+                logger.warning("⚠️ Не удалось удалить старые трассы: %s", e)
+
+    def flush_if_due(self):
+        if time.monotonic() - self._last_flush >= self.flush_interval:
+            self.flush()